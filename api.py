@@ -1,110 +1,485 @@
+import asyncio
 import os
 import uuid
-import json
 import shutil
+import tempfile
+from contextlib import asynccontextmanager
+from typing import Optional
 
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, File, UploadFile, HTTPException, Header, Depends, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 
 from helpers.db_utils import (
-    insert_application_logs,
-    get_chat_history,
+    db_pool,
+    initialize_db,
     get_all_documents,
     insert_document_record,
     delete_document_record,
+    insert_ingestion_job,
+    get_ingestion_job,
+    get_unfinished_ingestion_job_by_hash,
+    update_ingestion_job,
+    get_document_by_hash,
+    get_latest_document_by_filename,
+    get_document,
+    filter_document_ids,
 )
-from helpers.chroma_utils import index_document_to_chroma, delete_doc_from_chroma
-from helpers.constants import SYSTEM_PROMPT
+from helpers.chroma_utils import (
+    delete_doc_from_chroma,
+    get_chunk_ids,
+    get_embedding_function,
+    get_embedding_executor,
+    tenant_indexes,
+    validate_tenant,
+    flush_indexes,
+    index_lock,
+    IndexLocked,
+)
+from helpers.constants import SYSTEM_PROMPT, ALLOWED_EXTENSIONS, GLOBAL_CONFIG, DEFAULT_TENANT
+from helpers.document_utils import hash_file
+from helpers.bulk_ingest import bulk_index_documents
+from helpers.chat_log import chat_log_writer
+from helpers.session_store import ChatTurn, session_store
+from helpers.ingestion import ingestion_queue, IngestionQueueFull, UPLOADS_DIR
+from helpers.components import ComponentRegistry
 from helpers.logger import create_logger
-from schemas import QueryInput, DocumentInfo, DeleteFileRequest
-from core.run_vllm import DocQA
+from schemas import (
+    QueryInput,
+    RetrieveRequest,
+    RetrieveResult,
+    DocumentInfo,
+    DeleteFileRequest,
+    JobInfo,
+    BulkIngestReport,
+    SessionInfo,
+    ChatMessage,
+)
+from core.admission import AdmissionRejected
+from core.context import chunk_key
+from core.generations import COMPLETED, CANCELLED, DISCONNECTED
+from core.model_manager import ModelLoadError
+from core.streaming import SSEStream
 
 
 logger = create_logger(__name__)
 
-doc_qa = DocQA()
-app = FastAPI()
+STREAMING_CONFIG = GLOBAL_CONFIG.get("streaming", {})
+# Seconds clients are asked to wait before retrying while components start
+STARTUP_RETRY_AFTER = 5
+
+
+async def start_database():
+    await db_pool.open()
+    await initialize_db()
+    return db_pool
+
+
+async def stop_database(pool):
+    await pool.close()
+
+
+async def start_session_store():
+    await session_store.open()
+    await chat_log_writer.start()
+    return session_store
+
+
+async def stop_session_store(store):
+    await chat_log_writer.stop()
+    await store.close()
+
+
+async def start_embeddings():
+    return await asyncio.to_thread(get_embedding_function)
+
+
+async def stop_embeddings(_):
+    executor = get_embedding_executor()
+    if executor is not None:
+        await asyncio.to_thread(executor.shutdown)
+
+
+async def start_vectorstore():
+    try:
+        index_lock.acquire(blocking=False)
+    except IndexLocked as e:
+        logger.warning(f"{e}, waiting for it to finish")
+        await asyncio.to_thread(index_lock.acquire)
+    # The default tenant is opened eagerly, other tenants on their first request
+    return await tenant_indexes.get(DEFAULT_TENANT)
+
+
+async def stop_vectorstore(_):
+    try:
+        await flush_indexes()
+    finally:
+        index_lock.release()
+
+
+async def start_ingestion():
+    await ingestion_queue.start()
+    return ingestion_queue
+
+
+async def stop_ingestion(queue):
+    await queue.stop()
+
+
+def create_doc_qa():
+    # Imports torch, transformers and vLLM, which alone take seconds
+    from core.run_vllm import DocQA
+
+    return DocQA()
+
+
+async def start_doc_qa():
+    doc_qa = await asyncio.to_thread(create_doc_qa)
+    await doc_qa.models.start(doc_qa.preload_models)
+    return doc_qa
+
+
+async def stop_doc_qa(doc_qa):
+    if doc_qa.batcher is not None:
+        await doc_qa.batcher.stop()
+    await doc_qa.models.stop()
+
+
+components = ComponentRegistry()
+components.register("database", start_database, stop_database)
+components.register("session_store", start_session_store, stop_session_store, depends_on=("database",))
+components.register("embeddings", start_embeddings, stop_embeddings)
+components.register("vectorstore", start_vectorstore, stop_vectorstore, depends_on=("embeddings",))
+components.register("ingestion", start_ingestion, stop_ingestion, depends_on=("database", "vectorstore"))
+components.register("doc_qa", start_doc_qa, stop_doc_qa)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Components start in the background, the server accepts connections right away
+    await components.start()
+    yield
+    await components.stop()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+def requires(*names: str):
+    """Dependency answering 503 until the named components are ready"""
+    def check_ready() -> None:
+        not_ready = components.not_ready(list(names))
+        if not_ready:
+            raise HTTPException(
+                status_code=503,
+                detail={name: components.status()[name] for name in not_ready},
+                headers={"Retry-After": str(STARTUP_RETRY_AFTER)},
+            )
+    return Depends(check_ready)
+
+
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    ready = not components.not_ready()
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"ready": ready, "components": components.status()},
+    )
+
+
+def get_tenant(x_tenant_id: str = Header(DEFAULT_TENANT)) -> str:
+    """Tenant of a request, from the X-Tenant-ID header"""
+    try:
+        return validate_tenant(x_tenant_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 
-@app.post("/chat")
-async def chat(query_input: QueryInput):
+@app.post("/chat", dependencies=[requires("database", "session_store", "vectorstore", "doc_qa")])
+async def chat(query_input: QueryInput, request: Request, tenant: str = Depends(get_tenant)):
+    doc_qa = components.get("doc_qa")
     session_id = query_input.session_id
     model_name = query_input.model
     logger.info(
-        f"Session ID: {session_id}, Model: {model_name}, User Query: {query_input.question}"
+        f"Session ID: {session_id}, Tenant: {tenant}, Model: {model_name}, User Query: {query_input.question}"
     )
+    filter_file_ids = None
+    if query_input.has_document_filter():
+        filter_file_ids = await filter_document_ids(
+            tenant,
+            file_ids=query_input.file_ids,
+            filenames=query_input.filenames,
+            uploaded_after=query_input.uploaded_after,
+            uploaded_before=query_input.uploaded_before,
+        )
+        if not filter_file_ids:
+            raise HTTPException(status_code=404, detail="No documents match the given filters.")
+    if model_name not in doc_qa.models:
+        raise HTTPException(
+            status_code=404, detail=f"Model {model_name} not found. Available models: {doc_qa.models.names()}"
+        )
+    # Returned in the X-Request-ID header, for /chat/{request_id}/cancel
+    request_id = str(uuid.uuid4())
+    try:
+        result_gen, context = await doc_qa(
+            query_input.question, model_name, session_id, tenant, filter_file_ids, request_id
+        )
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)}
+        )
+    except ModelLoadError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     if not session_id:
         session_id = str(uuid.uuid4())
-        messages = []
-    else:
-        messages = await get_chat_history(session_id)
-    result_gen, docs_content = await doc_qa(
-            query_input.question, model_name, messages
-        )
+    stream = SSEStream(session_id, **STREAMING_CONFIG)
     async def generate_response():
-        previous_response = ""
-        async for req_output in result_gen:
-            full_response = req_output.outputs[0].text
-            token = full_response[len(previous_response):]
-            previous_response = full_response
-            yield f"data: {json.dumps({'token': token, 'session_id': session_id})}\n\n"
-
-        await insert_application_logs(
-            session_id=session_id,
-            user_query=query_input.question,
-            response=full_response,
-            system_prompt=SYSTEM_PROMPT,
-            retrieved_context=docs_content,
-            model=model_name,
+        frames = stream.frames(result_gen)
+        status = DISCONNECTED
+        try:
+            async for frame in frames:
+                # Stop at the next frame once the client is gone, not at the next failed write
+                if await request.is_disconnected():
+                    break
+                yield frame
+            else:
+                status = COMPLETED if stream.finished else CANCELLED
+        finally:
+            # Also runs when the client disconnects. Closing the answer stream, also when the frames never
+            # started, aborts an unfinished engine request and frees its admission slot and model at once
+            await frames.aclose()
+            await result_gen.aclose()
+            full_response = stream.text
+            await chat_log_writer.log(
+                ChatTurn(
+                    session_id=session_id,
+                    user_query=query_input.question,
+                    response=full_response,
+                    system_prompt=SYSTEM_PROMPT,
+                    model=model_name,
+                    context_chunk_ids=context.chunk_ids,
+                    status=status,
+                )
+            )
+            logger.info(f"Session ID: {session_id}, Request ID: {request_id}, AI Response ({status}): {full_response}")
+
+    return StreamingResponse(
+        generate_response(), media_type="text/event-stream", headers={"X-Request-ID": request_id}
+    )
+
+
+@app.post("/chat/{request_id}/cancel", dependencies=[requires("doc_qa")])
+async def cancel_chat(request_id: str):
+    """Stop generating an answer, the stream ends with what was generated so far."""
+    if not await components.get("doc_qa").cancel(request_id):
+        raise HTTPException(status_code=404, detail=f"No answer is being generated for request {request_id}.")
+    return {"message": f"Request {request_id} has been cancelled.", "request_id": request_id}
+
+
+@app.get("/sessions", response_model=list[SessionInfo], dependencies=[requires("database", "session_store")])
+async def list_sessions():
+    return await session_store.get_all_sessions()
+
+
+@app.get(
+    "/sessions/{session_id}",
+    response_model=list[ChatMessage],
+    dependencies=[requires("database", "session_store")],
+)
+async def get_session_history(session_id: str):
+    await chat_log_writer.wait_for_session(session_id)
+    return await session_store.get_chat_history(session_id)
+
+
+@app.delete("/sessions/{session_id}", dependencies=[requires("database", "session_store")])
+async def delete_session(session_id: str):
+    # A turn still queued would be written after the delete and bring the session back
+    await chat_log_writer.wait_for_session(session_id)
+    if not await session_store.delete_session(session_id):
+        raise HTTPException(status_code=500, detail=f"Failed to delete session {session_id}.")
+    return {"message": f"Session {session_id} has been deleted.", "session_id": session_id}
+
+
+@app.post(
+    "/retrieve",
+    response_model=list[RetrieveResult],
+    dependencies=[requires("database", "vectorstore", "doc_qa")],
+)
+async def retrieve(request: RetrieveRequest, tenant: str = Depends(get_tenant)):
+    """Best chunks for each of several questions, embedded and searched as one batch."""
+    filter_file_ids = None
+    if request.has_document_filter():
+        filter_file_ids = await filter_document_ids(
+            tenant,
+            file_ids=request.file_ids,
+            filenames=request.filenames,
+            uploaded_after=request.uploaded_after,
+            uploaded_before=request.uploaded_before,
         )
-        logger.info(f"Session ID: {session_id}, AI Response: {full_response}")
+        if not filter_file_ids:
+            raise HTTPException(status_code=404, detail="No documents match the given filters.")
+    retrieved = await components.get("doc_qa").retrieve(request.questions, tenant, filter_file_ids)
+    return [
+        {
+            "question": question,
+            "chunks": [
+                {
+                    "chunk_id": chunk_key(doc),
+                    "file_id": doc.metadata.get("file_id"),
+                    "source": doc.metadata.get("source"),
+                    "page": doc.metadata.get("page"),
+                    "text": doc.page_content,
+                    "score": score,
+                }
+                for doc, score in docs_and_scores
+            ],
+        }
+        for question, docs_and_scores in zip(request.questions, retrieved)
+    ]
+
 
-    return StreamingResponse(generate_response(), media_type="text/event-stream")
 
+def already_queued(filename: str, job: Optional[dict]) -> dict:
+    # No job when the identical one finished in the meantime
+    return {
+        "message": f"File {filename} is identical to a document being indexed, skipped.",
+        "file_id": job["file_id"] if job else None,
+        "job_id": job["id"] if job else None,
+    }
 
 
-@app.post("/upload-doc")
-async def upload_and_index_document(file: UploadFile = File(...)):
-    allowed_extensions = [".pdf", ".docx", '.md', '.csv', '.html']
+@app.post("/upload-doc", dependencies=[requires("database", "ingestion")])
+async def upload_and_index_document(file: UploadFile = File(...), tenant: str = Depends(get_tenant)):
     file_extension = os.path.splitext(file.filename)[1].lower()
 
-    if file_extension not in allowed_extensions:
+    if file_extension not in ALLOWED_EXTENSIONS:
         raise HTTPException(
             status_code=400,
-            detail=f"Unsupported file type. Allowed types are: {', '.join(allowed_extensions)}",
+            detail=f"Unsupported file type. Allowed types are: {', '.join(ALLOWED_EXTENSIONS)}",
         )
 
-    temp_file_path = f"temp_{file.filename}"
-    try:
-        with open(temp_file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+    # Kept until the job finishes so that it can be resumed after a restart
+    job_id = str(uuid.uuid4())
+    file_path = os.path.join(UPLOADS_DIR, f"{job_id}{file_extension}")
+    with open(file_path, "wb") as buffer:
+        shutil.copyfileobj(file.file, buffer)
 
-        file_id = await insert_document_record(file.filename)
-        success = await index_document_to_chroma(temp_file_path, file_id)
+    content_hash = await asyncio.to_thread(hash_file, file_path)
+    duplicate = await get_document_by_hash(content_hash, tenant)
+    if duplicate:
+        os.remove(file_path)
+        return {
+            "message": f"File {file.filename} is identical to an already indexed document, skipped.",
+            "file_id": duplicate["id"],
+            "job_id": None,
+            "chunks_reused": len(await get_chunk_ids(duplicate["id"], tenant)),
+            "chunks_embedded": 0,
+        }
 
-        if success:
-            return {
-                "message": f"File {file.filename} has been successfully uploaded and indexed.",
-                "file_id": file_id,
-            }
-        else:
+    # The hash is only recorded on the document once indexed, an identical upload may still be in the queue
+    pending = await get_unfinished_ingestion_job_by_hash(content_hash, tenant)
+    if pending:
+        os.remove(file_path)
+        return already_queued(file.filename, pending)
+
+    # A changed file with a known filename is re-indexed in place, only changed chunks get embedded
+    previous = await get_latest_document_by_filename(file.filename, tenant)
+    is_update = previous is not None
+    file_id = previous["id"] if is_update else await insert_document_record(file.filename, tenant)
+    if not await insert_ingestion_job(job_id, file_id, file.filename, file_path, content_hash, is_update, tenant=tenant):
+        # An identical upload was queued since the lookup above
+        if not is_update:
             await delete_document_record(file_id)
-            raise HTTPException(
-                status_code=500, detail=f"Failed to index {file.filename}."
-            )
-    finally:
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
+        os.remove(file_path)
+        return already_queued(file.filename, await get_unfinished_ingestion_job_by_hash(content_hash, tenant))
+    try:
+        ingestion_queue.submit(job_id)
+    except IngestionQueueFull as e:
+        await update_ingestion_job(job_id, stage="failed", error=str(e))
+        if not is_update:
+            await delete_document_record(file_id)
+        os.remove(file_path)
+        raise HTTPException(status_code=503, detail=str(e))
+
+    return {
+        "message": f"File {file.filename} has been uploaded and queued for indexing.",
+        "file_id": file_id,
+        "job_id": job_id,
+    }
+
+
+@app.post("/upload-docs", response_model=BulkIngestReport, dependencies=[requires("database", "vectorstore")])
+async def upload_and_index_documents(files: list[UploadFile] = File(...), tenant: str = Depends(get_tenant)):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        saved_files = []
+        for idx, file in enumerate(files):
+            # Prefix keeps same-named files from different folders apart
+            file_path = os.path.join(tmp_dir, f"{idx}_{os.path.basename(file.filename)}")
+            with open(file_path, "wb") as buffer:
+                shutil.copyfileobj(file.file, buffer)
+            saved_files.append((file.filename, file_path))
+
+        report = await bulk_index_documents(saved_files, tenant=tenant)
+
+    logger.info(
+        f"Bulk ingestion: {report['num_succeeded']} indexed, {report['num_failed']} failed, "
+        f"{report['docs_per_second']:.2f} docs/s, {report['chunks_per_second']:.2f} chunks/s"
+    )
+    return report
+
+
+@app.get("/jobs/{job_id}", response_model=JobInfo, dependencies=[requires("database")])
+async def get_job(job_id: str, tenant: str = Depends(get_tenant)):
+    job = await get_ingestion_job(job_id)
+    if job is None or job['tenant'] != tenant:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found.")
+    return job
+
+
+@app.get("/metrics")
+async def metrics():
+    # Components still starting report null
+    from helpers.embedding_cache import CachedEmbeddings
+
+    doc_qa = components.peek("doc_qa")
+    embedding_function = components.peek("embeddings")
+    return {
+        "retrieval": doc_qa.retriever.timings.stats() if doc_qa else None,
+        "retrieval_batching": doc_qa.batcher.stats() if doc_qa and doc_qa.batcher else None,
+        "answer_cache": doc_qa.answer_cache.stats() if doc_qa and doc_qa.answer_cache else None,
+        "prefix_cache": doc_qa.prefix_cache.stats() if doc_qa else None,
+        "admission": doc_qa.admission.stats() if doc_qa and doc_qa.admission else None,
+        "generations": doc_qa.generations.stats() if doc_qa else None,
+        "chat_log": chat_log_writer.stats(),
+        "embedding_executor": executor.stats() if (executor := get_embedding_executor()) else None,
+        "embedding_cache": (
+            embedding_function.stats() if isinstance(embedding_function, CachedEmbeddings) else None
+        ),
+    }
+
+
+@app.get("/models", dependencies=[requires("doc_qa")])
+async def list_models():
+    return components.get("doc_qa").models.info()
+
 
+@app.get("/list-docs", response_model=list[DocumentInfo], dependencies=[requires("database")])
+async def list_documents(tenant: str = Depends(get_tenant)):
+    return await get_all_documents(tenant)
 
-@app.get("/list-docs", response_model=list[DocumentInfo])
-async def list_documents():
-    return await get_all_documents()
 
+@app.post("/delete-doc", dependencies=[requires("database", "vectorstore")])
+async def delete_document(request: DeleteFileRequest, tenant: str = Depends(get_tenant)):
+    document = await get_document(request.file_id)
+    if document is None or document['tenant'] != tenant:
+        raise HTTPException(status_code=404, detail=f"Document with file_id {request.file_id} not found.")
 
-@app.post("/delete-doc")
-async def delete_document(request: DeleteFileRequest):
     # Delete from Chroma
-    chroma_delete_success = await delete_doc_from_chroma(request.file_id)
+    chroma_delete_success = await delete_doc_from_chroma(request.file_id, tenant)
 
     if chroma_delete_success:
         # If successfully deleted from Chroma, delete from our database
@@ -0,0 +1,148 @@
+"""
+Chat latency under a traffic burst, with and without admission control.
+
+Requests arrive at `--rate` per second for `--seconds` (Poisson arrivals)
+and each streams `--tokens` tokens from a simulated engine. The engine
+decodes every running request at `--step-ms` per token while at most
+`--capacity` run at once (what fits the KV cache); past that it preempts
+and recomputes sequences, so every running request slows down by
+(running / capacity) ** `--thrash`. A share `--heavy-share` of the
+requests come from one heavy session, the others each from a new session.
+Clients give up on answers not finished within `--client-timeout` seconds,
+which stops their generation.
+
+  none       every request goes straight to the engine, as /chat did
+  admission  requests go through an AdmissionController with
+             `--max-in-flight`, `--max-queue`, `--max-wait-ms` and
+             `--max-per-session`, rejected ones are counted and dropped
+
+Reports requests completed, rejected and abandoned by their clients, the
+peak of requests running in the engine, latency to the first token and to
+the last one for completed requests, and the latency of the heavy session
+against the others.
+
+    python -m benchmarks.admission_bench --rate 24 --seconds 20 --capacity 8
+"""
+import argparse
+import asyncio
+import random
+import time
+from collections import Counter
+
+import numpy as np
+
+from core.admission import AdmissionController, AdmissionLimits, AdmissionRejected
+
+
+class ThrashingEngine:
+    """Simulated engine whose decode step slows down once running requests exceed its KV cache."""
+
+    def __init__(self, capacity: int, step_ms: float, thrash: float):
+        self.capacity = capacity
+        self.step = step_ms / 1000
+        self.thrash = thrash
+        self.running = 0
+        self.peak = 0
+
+    async def generate(self, num_tokens: int):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        try:
+            for _ in range(num_tokens):
+                await asyncio.sleep(self.step * max(1.0, self.running / self.capacity) ** self.thrash)
+                yield "token"
+        finally:
+            self.running -= 1
+
+
+def percentiles(values) -> str:
+    if not len(values):
+        return f"{'-':>7} {'-':>7}"
+    values = np.asarray(values)
+    return f"{np.percentile(values, 50):7.2f} {np.percentile(values, 99):7.2f}"
+
+
+async def run(mode: str, args) -> dict:
+    engine = ThrashingEngine(args.capacity, args.step_ms, args.thrash)
+    controller = None
+    if mode == "admission":
+        controller = AdmissionController(AdmissionLimits(
+            args.max_in_flight, args.max_queue, args.max_wait_ms, args.max_per_session
+        ))
+    rng = random.Random(0)
+    results = {"ttft": [], "latency": [], "heavy": [], "light": [], "rejected": Counter(), "timeouts": 0}
+
+    async def request(idx: int, heavy: bool):
+        try:
+            await asyncio.wait_for(answer(idx, heavy), args.client_timeout)
+        except asyncio.TimeoutError:
+            results["timeouts"] += 1
+
+    async def answer(idx: int, heavy: bool):
+        start = time.perf_counter()
+        session = "heavy" if heavy else f"session-{idx}"
+        slot = None
+        if controller is not None:
+            try:
+                slot = await controller.acquire("model", session)
+            except AdmissionRejected as e:
+                results["rejected"][e.status_code] += 1
+                return
+        first = None
+        try:
+            async for _ in engine.generate(args.tokens):
+                if first is None:
+                    first = time.perf_counter() - start
+        finally:
+            if slot is not None:
+                slot.release()
+        latency = time.perf_counter() - start
+        results["ttft"].append(first)
+        results["latency"].append(latency)
+        results["heavy" if heavy else "light"].append(latency)
+
+    tasks = []
+    start = time.perf_counter()
+    idx = 0
+    while time.perf_counter() - start < args.seconds:
+        tasks.append(asyncio.create_task(request(idx, rng.random() < args.heavy_share)))
+        idx += 1
+        await asyncio.sleep(rng.expovariate(args.rate))
+    await asyncio.gather(*tasks)
+    results["requests"] = idx
+    results["seconds"] = time.perf_counter() - start
+    results["peak"] = engine.peak
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=24, help="Requests per second")
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--tokens", type=int, default=100, help="Tokens per answer")
+    parser.add_argument("--step-ms", type=float, default=5, help="Decode step while within capacity")
+    parser.add_argument("--capacity", type=int, default=8, help="Requests the KV cache holds")
+    parser.add_argument("--thrash", type=float, default=2, help="Slowdown exponent past capacity")
+    parser.add_argument("--client-timeout", type=float, default=30)
+    parser.add_argument("--heavy-share", type=float, default=0.3, help="Share of requests from one session")
+    parser.add_argument("--max-in-flight", type=int, default=8, help="As admission.max_in_flight")
+    parser.add_argument("--max-queue", type=int, default=32, help="As admission.max_queue")
+    parser.add_argument("--max-wait-ms", type=float, default=2000, help="As admission.max_wait_ms")
+    parser.add_argument("--max-per-session", type=int, default=2, help="As admission.max_per_session")
+    args = parser.parse_args()
+
+    service = args.tokens * args.step_ms / 1000
+    print(f"{args.rate:g} requests/s for {args.seconds:g}s, {args.tokens} tokens each; the engine serves "
+          f"{args.capacity / service:.1f} requests/s at capacity {args.capacity}")
+    print(f"{'mode':>9} {'done':>5} {'429':>4} {'503':>4} {'gone':>4} {'peak':>5} | {'TTFT s p50/p99':>15} | "
+          f"{'latency s p50/p99':>15} | {'heavy p50/p99':>15} | {'others p50/p99':>15} | {'done/s':>6}")
+    for mode in ("none", "admission"):
+        result = asyncio.run(run(mode, args))
+        print(f"{mode:>9} {len(result['latency']):>5} {result['rejected'][429]:>4} {result['rejected'][503]:>4} "
+              f"{result['timeouts']:>4} {result['peak']:>5} | {percentiles(result['ttft'])} | {percentiles(result['latency'])} | "
+              f"{percentiles(result['heavy'])} | {percentiles(result['light'])} | "
+              f"{len(result['latency']) / result['seconds']:>6.1f}")
+
+
+if __name__ == "__main__":
+    main()
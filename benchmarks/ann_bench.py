@@ -0,0 +1,201 @@
+"""
+Recall@k, latency and memory of the FAISS vector store configurations.
+
+Generates a synthetic corpus of `--size` clustered, bge-m3 sized (1024-d)
+vectors, computes exact nearest neighbours of `--queries` held-out queries, then
+builds a FaissVectorStore per configuration and reports, for each `nprobe`:
+
+  recall@k   overlap of the returned chunks with the exact top k
+  p50 / p95  latency of `similarity_search_by_vector_with_relevance_scores`
+  anon MB    heap memory of a process that opened the store and ran the queries
+  file MB    pages of memory-mapped index files resident after the queries
+  disk MB    size of the store directory
+
+Each build and each measurement runs in its own process so memory figures do
+not include the corpus or other indexes. Float32 vectors alone would take
+size * 1024 * 4 bytes (4.1 GB for 1M chunks).
+
+    python -m benchmarks.ann_bench --size 1000000 --configs ivf-sq8 ivf-pq64-rescore
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from helpers.faiss_store import FaissVectorStore
+
+DIMENSION = 1024
+NUM_CLUSTERS = 4096
+BATCH_SIZE = 50_000
+
+CONFIGS = {
+    "flat": {"index": "Flat"},
+    "ivf-sq8": {"index": "IVF1024,SQ8"},
+    "ivf-sq8-mmap": {"index": "IVF1024,SQ8", "mmap": True},
+    "ivf-pq64": {"index": "IVF1024,PQ64"},
+    "ivf-pq64-rescore": {"index": "IVF1024,PQ64", "rescore": 16, "mmap": True},
+    "binary-ivf-rescore": {"index": "BIVF1024", "rescore": 8, "mmap": True},
+    "hnsw-sq8": {"index": "HNSW32,SQ8"},
+}
+DEFAULT_CONFIGS = ["ivf-sq8", "ivf-sq8-mmap", "ivf-pq64", "ivf-pq64-rescore", "binary-ivf-rescore"]
+
+
+def memory_mb():
+    fields = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if name in ("RssAnon", "RssFile"):
+                fields[name] = int(value.split()[0]) / 1024
+    return fields.get("RssAnon", 0.0), fields.get("RssFile", 0.0)
+
+
+def directory_mb(path):
+    return sum(
+        os.path.getsize(os.path.join(dirpath, filename))
+        for dirpath, _, filenames in os.walk(path) for filename in filenames
+    ) / 2 ** 20
+
+
+def generate_corpus(data_dir, size, num_queries):
+    """Unit vectors around random cluster centers, like sentence embeddings of many documents."""
+    corpus_path = os.path.join(data_dir, f"corpus-{size}.f32")
+    queries_path = os.path.join(data_dir, f"queries-{size}.npy")
+    if os.path.exists(corpus_path) and os.path.exists(queries_path):
+        return corpus_path, np.load(queries_path)
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(NUM_CLUSTERS, DIMENSION)).astype(np.float32)
+
+    def sample(n):
+        vectors = centers[rng.integers(NUM_CLUSTERS, size=n)] + rng.normal(scale=1.2, size=(n, DIMENSION))
+        vectors = vectors.astype(np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    with open(corpus_path, "wb") as f:
+        for start in range(0, size, BATCH_SIZE):
+            f.write(sample(min(BATCH_SIZE, size - start)).tobytes())
+    queries = sample(num_queries)
+    np.save(queries_path, queries)
+    return corpus_path, queries
+
+
+def open_corpus(corpus_path):
+    return np.memmap(corpus_path, dtype=np.float32, mode="r").reshape(-1, DIMENSION)
+
+
+def exact_neighbours(corpus_path, queries, k):
+    import faiss
+
+    corpus = open_corpus(corpus_path)
+    best_distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+    best_ids = np.full((len(queries), k), -1, dtype=np.int64)
+    for start in range(0, len(corpus), BATCH_SIZE * 4):
+        block = np.ascontiguousarray(corpus[start:start + BATCH_SIZE * 4])
+        distances, ids = faiss.knn(queries, block, k)
+        distances = np.concatenate([best_distances, distances], axis=1)
+        ids = np.concatenate([best_ids, ids + start], axis=1)
+        order = np.argsort(distances, axis=1)[:, :k]
+        best_distances = np.take_along_axis(distances, order, axis=1)
+        best_ids = np.take_along_axis(ids, order, axis=1)
+    return best_ids
+
+
+def build_store(store_path, corpus_path, config, train_size):
+    corpus = open_corpus(corpus_path)
+    start = time.perf_counter()
+    store = FaissVectorStore(store_path, embedding_function=None, train_size=train_size, **config)
+    for batch_start in range(0, len(corpus), BATCH_SIZE):
+        vectors = np.ascontiguousarray(corpus[batch_start:batch_start + BATCH_SIZE])
+        positions = range(batch_start, batch_start + len(vectors))
+        store.add_embeddings(
+            [f"chunk-{idx}" for idx in positions],
+            vectors,
+            [str(idx) for idx in positions],
+            [{"file_id": idx // 50} for idx in positions],
+        )
+    store.flush()
+    store.close()
+    return time.perf_counter() - start
+
+
+def measure_store(store_path, config, queries, truth, k, nprobes):
+    anon_before, file_before = memory_mb()
+    store = FaissVectorStore(store_path, embedding_function=None, **config)
+    results = []
+    for nprobe in nprobes:
+        store.nprobe = nprobe
+        store.similarity_search_by_vector_with_relevance_scores(queries[0], k=k)
+        latencies, hits = [], 0
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            found = store.similarity_search_by_vector_with_relevance_scores(query, k=k)
+            latencies.append(time.perf_counter() - start)
+            hits += len({int(doc.page_content) for doc, _ in found} & set(expected.tolist()))
+        results.append({
+            "nprobe": nprobe,
+            "recall": hits / (len(queries) * k),
+            "p50_ms": float(np.percentile(latencies, 50) * 1000),
+            "p95_ms": float(np.percentile(latencies, 95) * 1000),
+        })
+    anon_after, file_after = memory_mb()
+    store.close()
+    for result in results:
+        result.update(anon_mb=anon_after - anon_before, file_mb=file_after - file_before)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=1_000_000, help="Chunks in the corpus")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--configs", nargs="+", default=DEFAULT_CONFIGS, choices=sorted(CONFIGS))
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 16, 64])
+    parser.add_argument("--train-size", type=int, default=50_000)
+    parser.add_argument("--data-dir", default=None, help="Keeps the generated corpus between runs")
+    parser.add_argument("--json", default=None, help="Also write the results to this file")
+    args = parser.parse_args()
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="ann_bench_")
+    os.makedirs(data_dir, exist_ok=True)
+    start = time.perf_counter()
+    corpus_path, queries = generate_corpus(data_dir, args.size, args.queries)
+    truth = exact_neighbours(corpus_path, queries, args.k)
+    print(f"{args.size} x {DIMENSION} corpus and exact top {args.k} ready in {time.perf_counter() - start:.0f}s, "
+          f"float32 vectors take {args.size * DIMENSION * 4 / 2 ** 20:.0f} MB")
+
+    report = []
+    context = multiprocessing.get_context("spawn")
+    print(f"{'config':>20} {'build s':>8} {'disk MB':>8} {'nprobe':>6} {'recall@' + str(args.k):>9} "
+          f"{'p50 ms':>7} {'p95 ms':>7} {'anon MB':>8} {'file MB':>8}")
+    for name in args.configs:
+        config = CONFIGS[name]
+        store_path = os.path.join(data_dir, f"store-{name}-{args.size}")
+        shutil.rmtree(store_path, ignore_errors=True)
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            build_seconds = executor.submit(build_store, store_path, corpus_path, config, args.train_size).result()
+        disk_mb = directory_mb(store_path)
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            results = executor.submit(measure_store, store_path, config, queries, truth, args.k, args.nprobe).result()
+        for result in results:
+            result.update(config=name, build_seconds=build_seconds, disk_mb=disk_mb)
+            print(f"{name:>20} {build_seconds:8.0f} {disk_mb:8.0f} {result['nprobe']:6d} {result['recall']:9.3f} "
+                  f"{result['p50_ms']:7.2f} {result['p95_ms']:7.2f} {result['anon_mb']:8.0f} {result['file_mb']:8.0f}")
+        report.extend(results)
+        shutil.rmtree(store_path, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.data_dir is None:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
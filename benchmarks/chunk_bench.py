@@ -0,0 +1,228 @@
+"""
+Throughput and chunk sizes of the StructuredChunker against the character splitter.
+
+Generates `--size-mb` MB of Markdown (headings, paragraphs, tables, code),
+HTML (sections, paragraphs, tables), CSV and plain-text pages and splits it
+with the StructuredChunker (`--chunk-tokens` tokens) and with the previous
+RecursiveCharacterTextSplitter (1000 characters). Reports MB/s, the tokenize
+share of the structured run and the token size distribution of the chunks of
+each, then checks stored `num_tokens` against encoding a sample of chunks
+whole, and times `pack_context` with and without the stored counts.
+
+Without `--tokenizer` (a tokenizer.json path or Hugging Face model id) a
+byte-level BPE tokenizer is trained on a sample of the corpus, so the
+benchmark runs offline.
+
+    python -m benchmarks.chunk_bench --size-mb 100 --tokenizer casperhansen/llama-3.3-70b-instruct-awq
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+from langchain_core.documents import Document
+
+from core.context import pack_context
+from helpers.chunking import StructuredChunker, document_blocks, document_format, load_tokenizer
+
+VOCABULARY_SIZE = 30000
+FILE_MB = 2
+
+
+class Corpus:
+    def __init__(self, seed: int = 0):
+        self.rng = random.Random(seed)
+        letters = "abcdefghijklmnopqrstuvwxyz"
+        words = {"".join(self.rng.choice(letters) for _ in range(self.rng.randint(2, 11)))
+                 for _ in range(VOCABULARY_SIZE)}
+        self.words = sorted(words)
+        # Zipf-distributed word frequencies, like natural text
+        weights = 1 / np.arange(1, len(self.words) + 1)
+        self.cumulative = np.cumsum(weights / weights.sum())
+        self.np_rng = np.random.default_rng(seed)
+
+    def sentences(self, count: int):
+        lengths = self.np_rng.integers(6, 30, size=count)
+        picks = np.searchsorted(self.cumulative, self.np_rng.random(lengths.sum()))
+        words, sentences, offset = self.words, [], 0
+        for length in lengths:
+            sentence = " ".join(words[idx] for idx in picks[offset:offset + length])
+            sentences.append(sentence[0].upper() + sentence[1:] + ".")
+            offset += length
+        return sentences
+
+    def paragraph(self) -> str:
+        return " ".join(self.sentences(self.rng.randint(2, 8)))
+
+    def table_rows(self, rows: int, columns: int):
+        return [[self.words[self.rng.randrange(2000)] for _ in range(columns)] for _ in range(rows)]
+
+    def markdown(self, size: int) -> str:
+        parts, length = [], 0
+        while length < size:
+            part = self.rng.choice(["h1", "h2", "h2", "p", "p", "p", "p", "table", "code"])
+            if part in ("h1", "h2"):
+                text = f"{'#' * int(part[1])} {' '.join(self.sentences(1)[0].split()[:5])}"
+            elif part == "table":
+                rows = self.table_rows(self.rng.randint(3, 40), 4)
+                text = "\n".join(["| a | b | c | d |", "|---|---|---|---|"] + [f"| {' | '.join(row)} |" for row in rows])
+            elif part == "code":
+                text = "```python\n" + "\n".join(f"x{idx} = compute({idx})" for idx in range(self.rng.randint(3, 20))) + "\n```"
+            else:
+                text = self.paragraph()
+            parts.append(text)
+            length += len(text) + 2
+        return "\n\n".join(parts)
+
+    def html(self, size: int) -> str:
+        parts, length = ["<html><head><title>t</title><style>p {color: red}</style></head><body>"], 0
+        while length < size:
+            part = self.rng.choice(["h2", "p", "p", "p", "table"])
+            if part == "h2":
+                text = f"<section><h2>{' '.join(self.sentences(1)[0].split()[:5])}</h2>"
+            elif part == "table":
+                rows = self.table_rows(self.rng.randint(3, 40), 4)
+                text = "<table>" + "".join(
+                    "<tr>" + "".join(f"<td>{cell}</td>" for cell in row) + "</tr>" for row in rows) + "</table>"
+            else:
+                text = f"<p>{self.paragraph()}</p>"
+            parts.append(text)
+            length += len(text)
+        return "".join(parts) + "</body></html>"
+
+    def csv(self, size: int) -> str:
+        lines, length = ["id,name,category,description"], 0
+        while length < size:
+            line = f"{len(lines)},{self.words[self.rng.randrange(5000)]},{self.rng.randrange(50)},\"{self.sentences(1)[0]}\""
+            lines.append(line)
+            length += len(line) + 1
+        return "\n".join(lines)
+
+    def pdf_pages(self, size: int):
+        # PDF text comes out as lines without blank lines between paragraphs
+        pages, length = [], 0
+        while length < size:
+            words = " ".join(self.sentences(40)).split()
+            page = "\n".join(" ".join(words[idx:idx + 12]) for idx in range(0, len(words), 12))
+            pages.append(page)
+            length += len(page)
+        return pages
+
+
+def build_corpus(size_mb: float):
+    corpus = Corpus()
+    docs, share = [], size_mb * 2**20 / 4
+    for kind in ("md", "html", "csv"):
+        generate = getattr(corpus, {"md": "markdown"}.get(kind, kind))
+        for idx in range(max(1, int(share // (FILE_MB * 2**20)))):
+            docs.append(Document(page_content=generate(int(min(share, FILE_MB * 2**20))),
+                                 metadata={"source": f"doc{idx}.{kind}"}))
+    for page, text in enumerate(corpus.pdf_pages(int(share))):
+        docs.append(Document(page_content=text, metadata={"source": "report.pdf", "page": page}))
+    return docs
+
+
+def train_tokenizer(docs):
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+
+    tokenizer = Tokenizer(models.BPE())
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    sample = [doc.page_content[:200000] for doc in docs[::max(1, len(docs) // 50)]]
+    trainer = trainers.BpeTrainer(vocab_size=32000, initial_alphabet=pre_tokenizers.ByteLevel.alphabet())
+    tokenizer.train_from_iterator(sample, trainer)
+    return tokenizer
+
+
+class NamedTokenizer:
+    """The parts of the Hugging Face tokenizer API `pack_context` uses, over a `tokenizers` tokenizer."""
+
+    def __init__(self, tokenizer, name: str):
+        self.tokenizer = tokenizer
+        self.name_or_path = name
+
+    def encode(self, text: str, add_special_tokens: bool = True):
+        return self.tokenizer.encode(text, add_special_tokens=add_special_tokens).ids
+
+
+def distribution(label: str, counts, budget: int) -> None:
+    counts = np.asarray(counts)
+    print(f"  {label:>10}: {len(counts):>8} chunks, tokens p5 {np.percentile(counts, 5):5.0f}  "
+          f"p50 {np.percentile(counts, 50):5.0f}  p95 {np.percentile(counts, 95):5.0f}  max {counts.max():5d}  "
+          f"over {budget}: {(counts > budget).mean():6.2%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=float, default=100)
+    parser.add_argument("--tokenizer", help="tokenizer.json path or Hugging Face model id")
+    parser.add_argument("--chunk-tokens", type=int, default=512)
+    parser.add_argument("--chunk-overlap", type=int, default=64)
+    parser.add_argument("--sample", type=int, default=2000, help="Chunks whose num_tokens is checked")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    docs = build_corpus(args.size_mb)
+    size_mb = sum(len(doc.page_content) for doc in docs) / 2**20
+    print(f"Corpus: {len(docs)} documents, {size_mb:.1f} MB, generated in {time.perf_counter() - start:.1f}s")
+    if args.tokenizer:
+        tokenizer, name = load_tokenizer(args.tokenizer), args.tokenizer
+    else:
+        start = time.perf_counter()
+        tokenizer, name = train_tokenizer(docs), "bench-bpe"
+        print(f"Trained a {tokenizer.get_vocab_size()} token BPE tokenizer in {time.perf_counter() - start:.1f}s")
+
+    chunker = StructuredChunker(tokenizer, name, args.chunk_tokens, args.chunk_overlap)
+    start = time.perf_counter()
+    chunks = chunker.split_documents(docs)
+    structured_seconds = time.perf_counter() - start
+
+    # Tokenize time of a sample of blocks, scaled to the corpus
+    block_texts = []
+    for doc in docs[:: max(1, len(docs) // 200)]:
+        text, blocks = document_blocks(doc.page_content, document_format(doc))
+        block_texts.extend(text[block.start:block.end] for block in blocks)
+    start = time.perf_counter()
+    tokenizer.encode_batch(block_texts, add_special_tokens=False)
+    sample_mb = sum(map(len, block_texts)) / 2**20
+    tokenize_share = (time.perf_counter() - start) / max(sample_mb, 1e-9) * size_mb / structured_seconds
+
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200, length_function=len,
+                                              add_start_index=True)
+    start = time.perf_counter()
+    recursive = splitter.split_documents(docs)
+    recursive_seconds = time.perf_counter() - start
+
+    print(f"\n  structured: {structured_seconds:6.1f}s  {size_mb / structured_seconds:6.1f} MB/s "
+          f"(about {tokenize_share:.0%} of it tokenizing)")
+    print(f"   recursive: {recursive_seconds:6.1f}s  {size_mb / recursive_seconds:6.1f} MB/s (character splitting only)")
+
+    print(f"\nChunk sizes in tokens (budget {args.chunk_tokens}):")
+    distribution("structured", [chunk.metadata["num_tokens"] for chunk in chunks], args.chunk_tokens)
+    recursive_counts = [len(encoding) for encoding in tokenizer.encode_batch_fast(
+        [chunk.page_content for chunk in recursive], add_special_tokens=False)]
+    distribution("recursive", recursive_counts, args.chunk_tokens)
+
+    rng = random.Random(0)
+    sample = rng.sample(chunks, min(args.sample, len(chunks)))
+    actual = [len(encoding) for encoding in tokenizer.encode_batch_fast(
+        [chunk.page_content for chunk in sample], add_special_tokens=False)]
+    stored = [chunk.metadata["num_tokens"] for chunk in sample]
+    errors = np.abs(np.asarray(actual) - np.asarray(stored))
+    print(f"\nStored num_tokens of {len(sample)} chunks: {(errors == 0).mean():.1%} exact, "
+          f"max error {errors.max()} tokens, mean {errors.mean():.2f}")
+
+    # Top 20 retrieved chunks per question, as /chat packs them
+    questions = [[(chunk, 1.0 / (rank + 1)) for rank, chunk in enumerate(rng.sample(chunks, 20))] for _ in range(200)]
+    for label, tokenizer_name in (("stored counts", name), ("re-tokenized", "other-model")):
+        named = NamedTokenizer(tokenizer, tokenizer_name)
+        start = time.perf_counter()
+        for docs_and_scores in questions:
+            pack_context(docs_and_scores, named, max_tokens=4096)
+        print(f"pack_context with {label}: {(time.perf_counter() - start) / len(questions) * 1000:.2f} ms per question")
+
+
+if __name__ == "__main__":
+    main()
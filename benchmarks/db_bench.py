@@ -0,0 +1,119 @@
+"""
+Per-query latency of the chat log queries at 1M application_logs rows.
+
+Compares the old access pattern (a fresh aiosqlite connection per call, rollback
+journal, no session index) against the pooled, WAL-mode connections of
+helpers.db_utils on a copy of the same database.
+
+    python -m benchmarks.db_bench --rows 1000000 --queries 200
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+
+import aiosqlite
+import numpy as np
+
+from helpers import db_utils
+from helpers.db_utils import ConnectionPool, get_chat_history, insert_application_logs
+
+TURNS_PER_SESSION = 10
+
+
+def build_database(path: str, rows: int) -> None:
+    conn = sqlite3.connect(path)
+    conn.execute('''CREATE TABLE application_logs
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     session_id TEXT,
+                     user_query TEXT,
+                     response TEXT,
+                     system_prompt TEXT,
+                     retrieved_context TEXT,
+                     model TEXT,
+                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+    # Turns of a session are interleaved with other sessions, as they are in production
+    num_sessions = rows // TURNS_PER_SESSION
+    conn.executemany(
+        'INSERT INTO application_logs (session_id, user_query, response, system_prompt, retrieved_context, model) '
+        'VALUES (?, ?, ?, ?, ?, ?)',
+        (
+            (f'session-{idx % num_sessions}', f'question {idx}', f'answer {idx} ' * 8, 'system', 'context', 'llama3.3')
+            for idx in range(rows)
+        ),
+    )
+    conn.commit()
+    conn.close()
+
+
+async def old_get_chat_history(path: str, session_id: str):
+    async with aiosqlite.connect(path) as conn:
+        conn.row_factory = aiosqlite.Row
+        cursor = await conn.execute(
+            'SELECT user_query, response FROM application_logs WHERE session_id = ? ORDER BY created_at', (session_id,))
+        return await cursor.fetchall()
+
+
+async def old_insert_application_logs(path: str, session_id: str):
+    async with aiosqlite.connect(path) as conn:
+        await conn.execute(
+            'INSERT INTO application_logs (session_id, user_query, response, system_prompt, retrieved_context, model) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (session_id, 'question', 'answer', 'system', 'context', 'llama3.3'))
+        await conn.commit()
+
+
+async def measure(name: str, call, queries: int, num_sessions: int) -> None:
+    latencies = []
+    for _ in range(queries):
+        session_id = f'session-{random.randrange(num_sessions)}'
+        start = time.perf_counter()
+        await call(session_id)
+        latencies.append(time.perf_counter() - start)
+    millis = np.asarray(latencies) * 1000
+    print(f"{name:>32}: p50 {np.percentile(millis, 50):8.3f} ms, p95 {np.percentile(millis, 95):8.3f} ms")
+
+
+async def run(args) -> None:
+    num_sessions = args.rows // TURNS_PER_SESSION
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        old_path = os.path.join(tmp_dir, 'old.db')
+        new_path = os.path.join(tmp_dir, 'new.db')
+        start = time.perf_counter()
+        build_database(old_path, args.rows)
+        shutil.copy(old_path, new_path)
+        print(f"Built {args.rows} rows in {time.perf_counter() - start:.1f}s")
+
+        await measure('old get_chat_history', lambda s: old_get_chat_history(old_path, s), args.queries, num_sessions)
+        await measure(
+            'old insert_application_logs', lambda s: old_insert_application_logs(old_path, s), args.queries, num_sessions
+        )
+
+        db_utils.db_pool = ConnectionPool(new_path, size=4)
+        start = time.perf_counter()
+        await db_utils.create_application_logs()
+        print(f"Created session index in {time.perf_counter() - start:.1f}s")
+        await measure('pooled get_chat_history', get_chat_history, args.queries, num_sessions)
+        await measure(
+            'pooled insert_application_logs',
+            lambda s: insert_application_logs(s, 'question', 'answer', 'system', 'context', 'llama3.3'),
+            args.queries,
+            num_sessions,
+        )
+        await db_utils.db_pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+"""
+Tokens decoded for clients that went away, before and after aborting on disconnect.
+
+Serves /chat over uvicorn from an engine that, like vLLM's engine loop,
+decodes every request in the background at `--tokens-per-second` up to
+`--max-tokens`, whether or not anyone reads its stream, until the request
+finishes or is aborted. `--clients` clients each start a chat, read it for
+a random `--min-read-s` to `--max-read-s` seconds and then close the
+connection, as a user closing the tab; one in `--cancel-every` instead calls
+/chat/{request_id}/cancel and reads the stream to its end.
+
+  before   the previous /chat loop, which streams frames until the engine
+           finishes and never aborts
+  after    api.app itself, with DocQA replaced by a stand-in that streams the
+           engine through GenerationTracker, and its other components by
+           stubs, in a scratch working directory
+
+Reports engine tokens decoded, those decoded after the client left, how long
+after a disconnect the engine request was aborted, the tokens_saved metric
+and the status of the logged chat turns.
+
+    python -m benchmarks.disconnect_bench --clients 32
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Dict
+
+import numpy as np
+import uvicorn
+
+from core.answer_cache import ReplayedCompletion, ReplayedRequestOutput
+from core.context import PackedContext
+from core.generations import GenerationTracker
+
+
+class BackgroundEngine:
+    """Decodes each request in its own task, read or not, until it finishes or is aborted."""
+
+    def __init__(self, max_tokens: int, tokens_per_second: float):
+        self.max_tokens = max_tokens
+        self.step_seconds = 1 / tokens_per_second
+        self.requests: Dict[str, tuple] = {}
+        self.tokens = 0
+        self.tokens_after_disconnect = 0
+        self.disconnected_at: Dict[str, float] = {}
+        self.abort_delays = []
+
+    async def generate(self, prompt: str, sampling_params=None, request_id: str = None):
+        queue: asyncio.Queue = asyncio.Queue()
+        self.requests[request_id] = (asyncio.create_task(self._decode(request_id, queue)), queue)
+        while True:
+            output = await queue.get()
+            if output is None:
+                return
+            yield output
+            if output.finished:
+                return
+
+    async def _decode(self, request_id: str, queue: asyncio.Queue) -> None:
+        try:
+            for step in range(self.max_tokens):
+                await asyncio.sleep(self.step_seconds)
+                self.tokens += 1
+                if request_id in self.disconnected_at:
+                    self.tokens_after_disconnect += 1
+                queue.put_nowait(ReplayedRequestOutput(
+                    outputs=[ReplayedCompletion(text="token ")], finished=step == self.max_tokens - 1
+                ))
+        finally:
+            self.requests.pop(request_id, None)
+
+    async def abort(self, request_id: str) -> None:
+        if request_id in self.disconnected_at:
+            self.abort_delays.append(time.perf_counter() - self.disconnected_at[request_id])
+        entry = self.requests.pop(request_id, None)
+        if entry is not None:
+            task, queue = entry
+            task.cancel()
+            # vLLM ends the stream of an aborted request
+            queue.put_nowait(None)
+
+    async def idle(self) -> None:
+        while self.requests:
+            await asyncio.sleep(0.05)
+
+
+class StandInDocQA:
+    """The parts of DocQA that /chat uses: the engine streamed through a GenerationTracker."""
+
+    def __init__(self, engine: BackgroundEngine):
+        self.engine = engine
+        self.models = {"bench": None}
+        self.generations = GenerationTracker()
+
+    async def __call__(self, query, model_name, session_id=None, tenant=None, filter_file_ids=None, request_id=None):
+        generator = self.generations.track(
+            self.engine.generate(prompt=query, request_id=request_id),
+            request_id, model_name, self.engine, self.engine.max_tokens,
+        )
+        return generator, PackedContext()
+
+    async def cancel(self, request_id: str) -> bool:
+        return await self.generations.cancel(request_id)
+
+
+def create_previous_app(engine: BackgroundEngine):
+    """/chat as it was: stream until the engine finishes, then log the answer."""
+    from uuid import uuid4
+
+    from fastapi import FastAPI
+    from fastapi.responses import StreamingResponse
+
+    from core.streaming import SSEStream
+
+    app = FastAPI()
+
+    @app.post("/chat")
+    async def chat(body: dict):
+        request_id = str(uuid4())
+        result_gen = engine.generate(prompt=body["question"], request_id=request_id)
+        stream = SSEStream(body["session_id"])
+
+        async def generate_response():
+            async for frame in stream.frames(result_gen):
+                yield frame
+
+        return StreamingResponse(
+            generate_response(), media_type="text/event-stream", headers={"X-Request-ID": request_id}
+        )
+
+    return app
+
+
+async def client(port: int, idx: int, read_seconds: float, cancel: bool, engine: BackgroundEngine) -> int:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = json.dumps({"question": f"question {idx}", "model": "bench", "session_id": f"session-{idx}"})
+    writer.write(
+        f"POST /chat HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n{body}".encode()
+    )
+    await writer.drain()
+    request_id = None
+    while (line := await reader.readline()) not in (b"\r\n", b""):
+        if line.lower().startswith(b"x-request-id:"):
+            request_id = line.split(b":", 1)[1].strip().decode()
+    frames = 0
+    deadline = time.perf_counter() + read_seconds
+    while time.perf_counter() < deadline:
+        try:
+            line = await asyncio.wait_for(reader.readline(), deadline - time.perf_counter())
+        except asyncio.TimeoutError:
+            break
+        frames += line.startswith(b"data: ")
+    if cancel:
+        _, cancel_writer = await asyncio.open_connection("127.0.0.1", port)
+        cancel_writer.write(
+            f"POST /chat/{request_id}/cancel HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Length: 0\r\n"
+            f"Connection: close\r\n\r\n".encode()
+        )
+        await cancel_writer.drain()
+        # The stream ends once the request is cancelled
+        async for line in reader:
+            if line == b"0\r\n":
+                break
+        cancel_writer.close()
+    else:
+        engine.disconnected_at[request_id] = time.perf_counter()
+    writer.close()
+    return frames
+
+
+async def run(mode: str, args) -> dict:
+    engine = BackgroundEngine(args.max_tokens, args.tokens_per_second)
+    doc_qa = None
+    if mode == "before":
+        app = create_previous_app(engine)
+    else:
+        import api
+
+        async def ready(*_):
+            return None
+
+        doc_qa = StandInDocQA(engine)
+
+        async def start_doc_qa():
+            return doc_qa
+
+        for name in ("embeddings", "vectorstore", "ingestion"):
+            api.components.components[name].init_fn = ready
+            api.components.components[name].close_fn = ready
+        api.components.components["doc_qa"].init_fn = start_doc_qa
+        api.components.components["doc_qa"].close_fn = ready
+        app = api.app
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, port=port, log_level="warning"))
+    serve_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    if doc_qa is not None:
+        while api.components.not_ready():
+            await asyncio.sleep(0.05)
+
+    rng = random.Random(0)
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        client(port, idx, rng.uniform(args.min_read_s, args.max_read_s), idx % args.cancel_every == 0, engine)
+        for idx in range(args.clients)
+    ))
+    await engine.idle()
+    seconds = time.perf_counter() - start
+    server.should_exit = True
+    await serve_task
+
+    result = {
+        "tokens": engine.tokens,
+        "after_disconnect": engine.tokens_after_disconnect,
+        "abort_delays": engine.abort_delays,
+        "seconds": seconds,
+    }
+    if doc_qa is not None:
+        result["tokens_saved"] = doc_qa.generations.stats()["tokens_saved"]
+        with sqlite3.connect(os.path.join("session_logs_db", "logs.db")) as conn:
+            result["statuses"] = Counter(status for status, in conn.execute("SELECT status FROM application_logs"))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--max-tokens", type=int, default=500, help="As generation max_new_tokens")
+    parser.add_argument("--tokens-per-second", type=float, default=50)
+    parser.add_argument("--min-read-s", type=float, default=0.5)
+    parser.add_argument("--max-read-s", type=float, default=3.0)
+    parser.add_argument("--cancel-every", type=int, default=4)
+    args = parser.parse_args()
+
+    repo = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="disconnect_bench_")
+    # The helpers modules put the relative "helpers" on sys.path, which no longer resolves after chdir
+    sys.path.insert(0, os.path.join(repo, "helpers"))
+    try:
+        # The session database and log directories are created under the working directory
+        shutil.copy(os.path.join(repo, "config.json"), workdir)
+        os.chdir(workdir)
+        print(f"{args.clients} clients, {args.max_tokens} tokens per answer at {args.tokens_per_second:g} tokens/s, "
+              f"reading {args.min_read_s:g}-{args.max_read_s:g}s, one in {args.cancel_every} cancelling")
+        for mode in ("before", "after"):
+            result = asyncio.run(run(mode, args))
+            delays = np.asarray(result["abort_delays"]) * 1000
+            line = (f"{mode:>7}: {result['tokens']:>6} tokens decoded, {result['after_disconnect']:>6} after the "
+                    f"client left, {result['seconds']:5.1f}s until the engine was idle")
+            if len(delays):
+                line += f", abort {np.percentile(delays, 50):.0f}/{delays.max():.0f} ms p50/max after disconnect"
+            print(line)
+            if "tokens_saved" in result:
+                print(f"{'':>9}tokens_saved {result['tokens_saved']}, logged turns {dict(result['statuses'])}")
+    finally:
+        os.chdir(repo)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+Token cadence and query embedding latency while a large upload is embedded.
+
+Runs, in one event loop, `--streams` SSE streams of a FakeEngine at
+`--tokens-per-second`, a question embedded every `--query-interval-ms` as
+the retrieval batcher does, and `--jobs` concurrent ingestion jobs indexing
+`--chunks` chunks each through `index_split_batches` in batches of
+`--batch-size`, as ingestion.embed_batch_size, into a scratch Chroma
+collection. The simulated embedding model spends `--cpu-ms-per-text` of
+Python work per text holding the GIL (pre- and post-processing) and then
+holds a device lock for `--fixed-ms` plus `--gpu-ms-per-text` per text, as a
+GPU runs one forward pass at a time:
+
+  before   the model called directly from the default thread pool, each
+           batch written to Chroma in one call
+  after    the model behind PrioritizedEmbeddings on an EmbeddingExecutor of
+           `--concurrency` threads, documents in calls of `--document-batch-size`,
+           and writes of `--write-batch-size` chunks
+
+Reports the gaps between frames of each stream against the engine step, how
+late a 1 ms timer on the event loop fires, the latency of query embeddings
+and the indexing throughput.
+
+    python -m benchmarks.embedding_cadence_bench --chunks 3000 --jobs 2 --streams 32
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import List
+
+import numpy as np
+
+DIMENSION = 1024
+
+
+class SimulatedModel:
+    """Embedding model with GIL-bound work per text and a serialized device call."""
+
+    def __init__(self, args):
+        self.cpu = args.cpu_ms_per_text / 1000
+        self.fixed = args.fixed_ms / 1000
+        self.gpu = args.gpu_ms_per_text / 1000
+        self.device = threading.Lock()
+        self.vector = [1.0 / DIMENSION ** 0.5] * DIMENSION
+
+    def _python_work(self, count: int) -> None:
+        deadline = time.perf_counter() + self.cpu * count
+        while time.perf_counter() < deadline:
+            pass
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self._python_work(len(texts))
+        with self.device:
+            time.sleep(self.fixed + self.gpu * len(texts))
+        return [list(self.vector) for _ in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def percentiles(values, scale: float = 1000) -> str:
+    values = np.asarray(values) * scale
+    if not len(values):
+        return "       -        -        -"
+    return f"{np.percentile(values, 50):8.1f} {np.percentile(values, 99):8.1f} {values.max():8.1f}"
+
+
+async def run_mode(mode: str, args) -> dict:
+    from langchain_core.documents import Document
+    from langchain_core.embeddings import Embeddings
+
+    from core.fake_engine import FakeEngine
+    from core.streaming import SSEStream
+    from helpers import chroma_utils
+    from helpers.db_utils import db_pool, initialize_db
+    from helpers.embedding_cache import embed_queries
+    from helpers.embedding_executor import EmbeddingExecutor, PrioritizedEmbeddings
+
+    class ModelEmbeddings(SimulatedModel, Embeddings):
+        pass
+
+    model = ModelEmbeddings(args)
+    executor = None
+    if mode == "before":
+        chroma_utils._embedding_function = model
+        chroma_utils.VECTORSTORE_WRITE_BATCH_SIZE = args.batch_size
+    else:
+        chroma_utils.VECTORSTORE_WRITE_BATCH_SIZE = args.write_batch_size
+        executor = EmbeddingExecutor(concurrency=args.concurrency)
+        chroma_utils._embedding_function = PrioritizedEmbeddings(model, executor, args.document_batch_size)
+    embeddings = chroma_utils._embedding_function
+    # Writes bump the tenant's corpus version in the database
+    await initialize_db()
+    # A tenant per mode, so its collection is opened with this mode's embedding function
+    tenant = f"bench-{mode}"
+    await chroma_utils.tenant_indexes.get(tenant)
+
+    done = asyncio.Event()
+    gaps, lags, query_latencies = [], [], []
+    engine = FakeEngine(num_tokens=1_000_000, tokens_per_second=args.tokens_per_second)
+
+    async def stream(idx: int):
+        frames = SSEStream(f"session-{idx}", coalesce_ms=0, coalesce_chars=0).frames(engine.generate(prompt=""))
+        last = None
+        async for _ in frames:
+            now = time.perf_counter()
+            if last is not None:
+                gaps.append(now - last)
+            last = now
+            if done.is_set():
+                break
+        await frames.aclose()
+
+    async def ticker():
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lags.append(time.perf_counter() - start - 0.001)
+
+    async def queries():
+        idx = 0
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.to_thread(embed_queries, embeddings, [f"question {idx}"])
+            query_latencies.append(time.perf_counter() - start)
+            idx += 1
+            await asyncio.sleep(args.query_interval_ms / 1000)
+
+    async def batches(job: int):
+        for offset in range(0, args.chunks, args.batch_size):
+            yield [
+                Document(page_content=f"job {job} chunk {idx} " + "text " * 100, metadata={"source": f"job{job}.pdf"})
+                for idx in range(offset, min(offset + args.batch_size, args.chunks))
+            ]
+
+    async def ingest():
+        # Streams and queries settle before the upload starts
+        await asyncio.sleep(1)
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            chroma_utils.index_split_batches(batches(job), file_id=job + 1, is_new=True, tenant=tenant)
+            for job in range(args.jobs)
+        ))
+        seconds = time.perf_counter() - start
+        done.set()
+        return seconds
+
+    tasks = [asyncio.create_task(stream(idx)) for idx in range(args.streams)]
+    tasks += [asyncio.create_task(ticker()), asyncio.create_task(queries())]
+    seconds = await ingest()
+    await asyncio.gather(*tasks)
+    if executor is not None:
+        await asyncio.to_thread(executor.shutdown)
+    await db_pool.close()
+    return {
+        "seconds": seconds,
+        "gaps": gaps,
+        "lags": lags,
+        "queries": query_latencies,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=3000, help="Chunks per ingestion job")
+    parser.add_argument("--jobs", type=int, default=2, help="Concurrent ingestion jobs, as ingestion.max_workers")
+    parser.add_argument("--batch-size", type=int, default=256, help="As ingestion.embed_batch_size")
+    parser.add_argument("--streams", type=int, default=32)
+    parser.add_argument("--tokens-per-second", type=float, default=30)
+    parser.add_argument("--query-interval-ms", type=float, default=50)
+    parser.add_argument("--cpu-ms-per-text", type=float, default=0.05)
+    parser.add_argument("--fixed-ms", type=float, default=5)
+    parser.add_argument("--gpu-ms-per-text", type=float, default=1)
+    parser.add_argument("--concurrency", type=int, default=1, help="As embedding_executor.concurrency")
+    parser.add_argument("--document-batch-size", type=int, default=32,
+                        help="As embedding_executor.document_batch_size")
+    parser.add_argument("--write-batch-size", type=int, default=32, help="As vectorstore.write_batch_size")
+    args = parser.parse_args()
+
+    repo = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="embedding_cadence_")
+    try:
+        # Chroma, BM25 and log directories are created under the working directory
+        shutil.copy(os.path.join(repo, "config.json"), workdir)
+        os.chdir(workdir)
+        step_ms = 1000 / args.tokens_per_second
+        print(f"{args.jobs} jobs x {args.chunks} chunks, {args.streams} streams with a {step_ms:.1f} ms engine step, "
+              f"a question every {args.query_interval_ms:.0f} ms")
+        print(f"{'mode':>7} {'chunks/s':>9} | {'frame gap ms p50/p99/max':>26} | {'loop lag ms p50/p99/max':>26} "
+              f"| {'query embed ms p50/p99/max':>26}")
+        for mode in ("before", "after"):
+            result = asyncio.run(run_mode(mode, args))
+            print(f"{mode:>7} {args.jobs * args.chunks / result['seconds']:>9.0f} | {percentiles(result['gaps'])} | "
+                  f"{percentiles(result['lags'])} | {percentiles(result['queries'])}")
+    finally:
+        os.chdir(repo)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
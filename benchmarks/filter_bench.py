@@ -0,0 +1,145 @@
+"""
+Search latency and context size of filtered against unfiltered retrieval.
+
+Builds a synthetic corpus of `--files` documents with `--chunks` chunks each,
+random embeddings in a Chroma collection and one vocabulary per document in a
+BM25 index, then runs the same questions about one document with no filter and
+with a `file_id` filter covering `--filter-files` documents, as /chat does when
+a request carries `file_ids`, `filenames` or upload dates. Filtered dense search
+runs both through Chroma's filtered HNSW search and through the exact search
+that `filtered_similarity_search` uses for small filtered sets.
+
+Reports per-query latency of the dense and BM25 searches and, for the top `--k`
+chunks that would reach the reranker and the prompt, how many come from other
+documents and how many characters they add.
+
+    python -m benchmarks.filter_bench --files 500 --chunks 40 --filter-files 1
+"""
+import argparse
+import random
+import tempfile
+import time
+
+import chromadb
+import numpy as np
+from chromadb.config import Settings
+from langchain.vectorstores import Chroma
+
+from helpers.filtered_search import filtered_similarity_search
+from helpers.lexical_index import BM25Index
+
+DIMENSION = 1024
+# Documents sit close together relative to the spread of their chunks, so their neighbourhoods overlap
+CENTER_SPREAD = 0.5
+NOISE = 2.0
+WORDS_PER_CHUNK = 120
+
+
+def chunk_text(file_id: int, rng: random.Random) -> str:
+    # Each document has its own terms plus words shared by the whole corpus
+    words = [f"term{file_id}x{rng.randrange(50)}" if rng.random() < 0.3 else f"common{rng.randrange(2000)}"
+             for _ in range(WORDS_PER_CHUNK)]
+    return " ".join(words)
+
+
+def build_corpus(client, args):
+    rng = random.Random(0)
+    np_rng = np.random.default_rng(0)
+    collection = client.create_collection("bench")
+    lexical_index = BM25Index(path="unused")
+    centers = np_rng.normal(scale=CENTER_SPREAD, size=(args.files, DIMENSION)).astype(np.float32)
+    batch_size = 5000
+    ids, texts, embeddings, metadatas = [], [], [], []
+
+    def flush():
+        collection.add(ids=ids, documents=texts, embeddings=embeddings, metadatas=metadatas)
+        lexical_index.add(ids, texts, [metadata["file_id"] for metadata in metadatas])
+        for items in (ids, texts, embeddings, metadatas):
+            items.clear()
+
+    for file_id in range(args.files):
+        vectors = centers[file_id] + np_rng.normal(scale=NOISE, size=(args.chunks, DIMENSION)).astype(np.float32)
+        for idx, vector in enumerate(vectors):
+            ids.append(f"{file_id}-{idx}")
+            texts.append(chunk_text(file_id, rng))
+            embeddings.append(vector.tolist())
+            metadatas.append({"file_id": file_id})
+            if len(ids) >= batch_size:
+                flush()
+    if ids:
+        flush()
+    return centers, lexical_index
+
+
+def run_queries(vectorstore, lexical_index, centers, args, filtered: bool, max_exact_chunks: int = 0):
+    rng = random.Random(1)
+    np_rng = np.random.default_rng(1)
+    dense_times, lexical_times, off_target, off_target_chars, context_chars = [], [], [], [], []
+    for _ in range(args.queries):
+        target = rng.randrange(args.files)
+        others = rng.sample([file_id for file_id in range(args.files) if file_id != target], args.filter_files - 1)
+        file_ids = [target] + others
+        query_embedding = (centers[target] + np_rng.normal(scale=NOISE, size=DIMENSION)).tolist()
+        query = " ".join(f"term{target}x{rng.randrange(50)}" for _ in range(4)) + " common1 common2"
+
+        start = time.perf_counter()
+        if filtered:
+            where = {"file_id": {"$in": file_ids}}
+            dense = filtered_similarity_search(vectorstore, query_embedding, args.k, where, max_exact_chunks)
+        else:
+            dense = vectorstore.similarity_search_by_vector_with_relevance_scores(query_embedding, k=args.k)
+        dense_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        lexical_index.search(query, args.k, file_ids if filtered else None)
+        lexical_times.append(time.perf_counter() - start)
+
+        outside = [doc for doc, _ in dense if doc.metadata["file_id"] not in file_ids]
+        off_target.append(len(outside))
+        off_target_chars.append(sum(len(doc.page_content) for doc in outside))
+        context_chars.append(sum(len(doc.page_content) for doc, _ in dense))
+    return {
+        "dense_p50_ms": np.percentile(dense_times, 50) * 1000,
+        "dense_p95_ms": np.percentile(dense_times, 95) * 1000,
+        "lexical_p50_ms": np.percentile(lexical_times, 50) * 1000,
+        "lexical_p95_ms": np.percentile(lexical_times, 95) * 1000,
+        "off_target": float(np.mean(off_target)),
+        "off_target_chars": float(np.mean(off_target_chars)),
+        "context_chars": float(np.mean(context_chars)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=500)
+    parser.add_argument("--chunks", type=int, default=40, help="Chunks per document")
+    parser.add_argument("--filter-files", type=int, default=1, help="Documents the filter allows")
+    parser.add_argument("--k", type=int, default=20, help="Candidates per search, as rerank.candidates")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--exact-search-max-chunks", type=int, default=200,
+                        help="As retriever.exact_search_max_chunks")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        client = chromadb.PersistentClient(path=tmp_dir, settings=Settings(anonymized_telemetry=False))
+        start = time.perf_counter()
+        centers, lexical_index = build_corpus(client, args)
+        print(f"Indexed {args.files * args.chunks} chunks of {args.files} documents in "
+              f"{time.perf_counter() - start:.1f}s, filter allows {args.filter_files} of them")
+        vectorstore = Chroma(client=client, collection_name="bench")
+
+        runs = [
+            ("no filter", False, 0),
+            ("filter, hnsw", True, 0),
+            ("filter, exact", True, args.exact_search_max_chunks),
+        ]
+        for label, filtered, max_exact_chunks in runs:
+            stats = run_queries(vectorstore, lexical_index, centers, args, filtered, max_exact_chunks)
+            print(f"{label:>14}: dense p50 {stats['dense_p50_ms']:.2f} ms, p95 {stats['dense_p95_ms']:.2f} ms | "
+                  f"bm25 p50 {stats['lexical_p50_ms']:.2f} ms, p95 {stats['lexical_p95_ms']:.2f} ms | "
+                  f"off-target {stats['off_target']:.1f}/{args.k} chunks, {stats['off_target_chars']:.0f} of "
+                  f"{stats['context_chars']:.0f} context chars")
+
+
+if __name__ == "__main__":
+    main()
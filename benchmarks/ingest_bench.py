@@ -0,0 +1,183 @@
+"""
+Peak memory and wall time of ingesting a large PDF, whole-file against streamed.
+
+Writes a `--pages` page PDF of generated text and indexes it into a fresh Chroma
+collection twice, each run in its own interpreter with a hash-based fake
+embedding, so the numbers show parsing, splitting and the vector store write
+rather than an embedding model:
+
+  before   PyPDFLoader.load() of the whole file and one split of every page in a
+           worker process, as ingestion jobs did, then `index_split_batches` with
+           every chunk in a single batch
+  after    `stream_split_batches` parsing `--pages-per-task` page ranges in
+           `--workers` processes, each batch of `--batch-size` chunks indexed by
+           `index_split_batches` while later ranges are parsed
+
+Reports wall time and peak RSS of the API process and of the largest worker.
+
+    python -m benchmarks.ingest_bench --pages 2000 --batch-size 256 --workers 2
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+DIMENSION = 1024
+LINES_PER_PAGE = 45
+WORDS_PER_LINE = 12
+
+
+class HashEmbeddings:
+    """Deterministic pseudo-embeddings, a few microseconds per text."""
+
+    def _embed(self, text: str):
+        seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+        rng = random.Random(seed)
+        return [rng.random() - 0.5 for _ in range(DIMENSION)]
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+def write_pdf(path: str, pages: int) -> None:
+    """A PDF of `pages` pages of Helvetica text, written object by object."""
+    rng = random.Random(0)
+    vocabulary = [f"word{idx}" for idx in range(5000)]
+    offsets = []
+    with open(path, "wb") as f:
+        def add_object(number: int, body: bytes) -> None:
+            offsets.append((number, f.tell()))
+            f.write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+
+        f.write(b"%PDF-1.4\n")
+        # 1: catalog, 2: page tree, 3: font, then a page and its content stream per page
+        kids = b" ".join(b"%d 0 R" % (4 + 2 * idx) for idx in range(pages))
+        add_object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        add_object(2, b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % pages)
+        add_object(3, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+        for idx in range(pages):
+            lines = [f"Page {idx + 1}."] + [
+                " ".join(rng.choice(vocabulary) for _ in range(WORDS_PER_LINE)) for _ in range(LINES_PER_PAGE)
+            ]
+            text = " Tj T* ".join(f"({line})" for line in lines)
+            stream = f"BT /F1 10 Tf 12 TL 40 800 Td {text} Tj ET".encode("ascii")
+            page, content = 4 + 2 * idx, 5 + 2 * idx
+            add_object(page, b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                             b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content)
+            add_object(content, b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        xref = f.tell()
+        offsets.sort()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(offsets) + 1))
+        for _, offset in offsets:
+            f.write(b"%010d 00000 n \n" % offset)
+        f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(offsets) + 1, xref))
+
+
+def split_whole_file(file_path: str):
+    """The ingestion worker before streaming: load every page, then split them all."""
+    from langchain.document_loaders import PyPDFLoader
+    from helpers.document_utils import get_text_splitter
+
+    return get_text_splitter().split_documents(PyPDFLoader(file_path).load())
+
+
+async def ingest(mode: str, args) -> dict:
+    from helpers import chroma_utils
+    from helpers.chroma_utils import index_split_batches
+    from helpers.db_utils import db_pool, initialize_db
+    from helpers.document_utils import stream_split_batches
+
+    # Writes bump the tenant's corpus version in the database
+    await initialize_db()
+    chroma_utils._embedding_function = HashEmbeddings()
+    executor = ProcessPoolExecutor(max_workers=args.workers, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        start = time.perf_counter()
+        if mode == "before":
+            splits = await asyncio.get_running_loop().run_in_executor(executor, split_whole_file, args.pdf)
+
+            async def whole_file():
+                yield splits
+
+            stats = await index_split_batches(whole_file(), file_id=1, is_new=True)
+        else:
+            batches = stream_split_batches(args.pdf, args.batch_size, executor, args.pages_per_task, args.workers)
+            stats = await index_split_batches(batches, file_id=1, is_new=True)
+        seconds = time.perf_counter() - start
+    finally:
+        executor.shutdown()
+    await chroma_utils.flush_indexes()
+    await db_pool.close()
+    return {
+        "seconds": seconds,
+        "chunks": stats["num_chunks"],
+        "api_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "worker_rss_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+
+
+def run_mode(mode: str, args, repo: str) -> dict:
+    """Run one mode in a fresh interpreter inside a scratch directory holding config.json."""
+    workdir = tempfile.mkdtemp(prefix=f"ingest_{mode}_")
+    try:
+        shutil.copy(os.path.join(repo, "config.json"), workdir)
+        command = [sys.executable, "-m", "benchmarks.ingest_bench", "--run", mode, "--pdf", args.pdf,
+                   "--batch-size", str(args.batch_size), "--workers", str(args.workers),
+                   "--pages-per-task", str(args.pages_per_task)]
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([repo, os.path.join(repo, "helpers")]))
+        result = subprocess.run(command, cwd=workdir, env=env, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise SystemExit(f"{mode} run failed:\n{result.stderr}")
+        return json.loads(result.stdout.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=256, help="Chunks embedded and written per batch")
+    parser.add_argument("--pages-per-task", type=int, default=50, help="PDF pages parsed per worker task")
+    parser.add_argument("--workers", type=int, default=2, help="Parsing processes")
+    parser.add_argument("--pdf", help="Ingest this PDF instead of a generated one")
+    parser.add_argument("--run", choices=["before", "after"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(asyncio.run(ingest(args.run, args))))
+        return
+
+    repo = os.getcwd()
+    scratch = tempfile.mkdtemp(prefix="ingest_bench_")
+    try:
+        if args.pdf is None:
+            args.pdf = os.path.join(scratch, "bench.pdf")
+            start = time.perf_counter()
+            write_pdf(args.pdf, args.pages)
+            print(f"Wrote {args.pages} pages ({os.path.getsize(args.pdf) / 2**20:.1f} MB) "
+                  f"in {time.perf_counter() - start:.1f}s")
+        args.pdf = os.path.abspath(args.pdf)
+        print(f"{'mode':>7} {'chunks':>7} {'wall s':>8} {'API peak RSS MB':>16} {'worker peak RSS MB':>19}")
+        for mode in ("before", "after"):
+            result = run_mode(mode, args, repo)
+            print(f"{mode:>7} {result['chunks']:>7} {result['seconds']:>8.1f} "
+                  f"{result['api_rss_mb']:>16.0f} {result['worker_rss_mb']:>19.0f}")
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Lazy loading and eviction of the ModelManager, on CPU with FakeModelLoader.
+
+Registers the models of config.json (with their `gpu_memory_utilization`
+claims on a simulated device) and walks through the lifecycle, checking after
+each step what `/models` would report:
+
+  startup      nothing is loaded
+  burst        `--concurrency` simultaneous first requests for one model load it once
+  in use       a model with a request in flight survives an idle check past its TTL
+  pressure     a model that does not fit next to the loaded one evicts it first
+  idle TTL     a model idle for longer than `--idle-ttl` seconds is evicted
+  reload       the next request loads an evicted model again
+
+    python -m benchmarks.model_lifecycle --load-seconds 0.5 --concurrency 32
+"""
+import argparse
+import asyncio
+import time
+
+from core.fake_engine import FakeModelLoader
+from core.model_manager import EVICTED, LOADED, UNLOADED, ModelManager
+from helpers.constants import GLOBAL_CONFIG
+
+
+class ModelConfig:
+    def __init__(self, name: str, model_id: str, gpu_memory_utilization: float = 0.9, **_):
+        self.name = name
+        self.model_id = model_id
+        self.gpu_memory_utilization = gpu_memory_utilization
+
+
+def states(manager: ModelManager) -> dict:
+    return {model["name"]: model["state"] for model in manager.info()}
+
+
+def check(label: str, manager: ModelManager, loader: FakeModelLoader, expected: dict, started: float) -> None:
+    actual = states(manager)
+    status = "ok" if all(actual[name] == state for name, state in expected.items()) else "UNEXPECTED"
+    print(f"{time.perf_counter() - started:6.2f}s {label:>9}: {actual}, loads {len(loader.loads)}, "
+          f"free memory {loader.free_memory():.2f} [{status}]")
+    if status != "ok":
+        raise SystemExit(f"expected {expected}")
+
+
+async def request(manager: ModelManager, name: str, tokens: int) -> int:
+    model = await manager.acquire(name)
+    generator = manager.track(name, model.engine.generate(prompt="question"))
+    count = 0
+    async for _ in generator:
+        count += 1
+        if count == tokens:
+            break
+    await generator.aclose()
+    return count
+
+
+async def main(args) -> None:
+    configs = {model["name"]: ModelConfig(**model) for model in GLOBAL_CONFIG["models"]}
+    small, large = sorted(configs, key=lambda name: configs[name].gpu_memory_utilization)[:2]
+    loader = FakeModelLoader(load_seconds=args.load_seconds, num_tokens=args.tokens, tokens_per_second=200)
+    manager = ModelManager(
+        configs, loader.load, unload_fn=loader.unload, free_memory_fn=loader.free_memory, idle_ttl=args.idle_ttl
+    )
+    started = time.perf_counter()
+    check("startup", manager, loader, {name: UNLOADED for name in configs}, started)
+
+    burst_start = time.perf_counter()
+    await asyncio.gather(*(request(manager, small, 4) for _ in range(args.concurrency)))
+    check("burst", manager, loader, {small: LOADED}, started)
+    print(f"        {args.concurrency} concurrent first requests took {time.perf_counter() - burst_start:.2f}s, "
+          f"{loader.loads.count(small)} load of {args.load_seconds}s")
+
+    # A long request keeps the model in use while an idle check runs after the TTL
+    streaming = asyncio.create_task(request(manager, small, args.tokens))
+    await asyncio.sleep(args.idle_ttl * 1.5)
+    await manager.evict_idle()
+    check("in use", manager, loader, {small: LOADED}, started)
+    await streaming
+
+    await request(manager, large, 4)
+    check("pressure", manager, loader, {small: EVICTED, large: LOADED}, started)
+
+    await asyncio.sleep(args.idle_ttl * 1.5)
+    await manager.evict_idle()
+    check("idle TTL", manager, loader, {small: EVICTED, large: EVICTED}, started)
+
+    await request(manager, small, 4)
+    check("reload", manager, loader, {small: LOADED, large: EVICTED}, started)
+    print(f"Loads in order: {loader.loads}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--load-seconds", type=float, default=0.5, help="Simulated load time per model")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--idle-ttl", type=float, default=0.5)
+    parser.add_argument("--tokens", type=int, default=200, help="Tokens of the long request, at 200 tokens/s")
+    asyncio.run(main(parser.parse_args()))
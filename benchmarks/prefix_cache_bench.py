@@ -0,0 +1,203 @@
+"""
+Prefix cache hits and time to first token per turn, previous against current prompt layout.
+
+Plays `--sessions` chat sessions of `--turns` turns each, interleaved turn by
+turn, through HistoryManager (over an in-process FakeRedis session store, with
+an instant fake summarizer), pack_context and the prompt layout, tokenized
+with the whitespace FakeTokenizer so every run gives the same tokens. Sessions
+ask about `--topics` shared documents, and follow-up questions retrieve
+mostly the chunks of the previous turn. Each prompt is looked up in a
+simulated automatic prefix cache like vLLM's: hashes of full `--block-size`
+token blocks chained from the start of the prompt, `--cache-blocks` blocks
+kept in LRU order, and prompt plus answer blocks stored after each request.
+
+  before   summary inside the system prompt, history trimmed by one turn per
+           request once over budget, context in score order
+  after    `build_messages`: byte-identical system prompt, summary, turns
+           trimmed to `history.trim_to` of the budget at once, context in
+           document order, question last
+
+Time to first token is modelled as `--ttft-fixed-ms` plus `--prefill-ms` per
+prompt token missing from the cache. Reports mean prompt tokens, prefix hit
+ratio and modelled TTFT at several turn numbers.
+
+    python -m benchmarks.prefix_cache_bench --sessions 50 --turns 30
+"""
+import argparse
+import asyncio
+import random
+from collections import OrderedDict, defaultdict
+from typing import Dict, List
+
+import numpy as np
+from langchain_core.documents import Document
+
+from core import history as history_module
+from core.context import pack_context
+from core.fake_engine import FakeTokenizer
+from core.history import HistoryManager, SessionHistory
+from core.prompt import build_messages
+from helpers.constants import SYSTEM_PROMPT, PROMPT, HISTORY_SUMMARY_PREFIX
+from helpers.fake_redis import FakeRedis
+from helpers.session_store import ChatTurn, RedisSessionStore
+
+CHUNKS_PER_TOPIC = 40
+WORDS_PER_CHUNK = 120
+CANDIDATES = 10
+FOLLOW_UP_CANDIDATES = 6
+
+
+def previous_messages(history: SessionHistory, question: str, context: str) -> List[Dict[str, str]]:
+    """Prompt layout before build_messages: the summary was appended to the system prompt."""
+    system = SYSTEM_PROMPT
+    if history.summary:
+        system = f"{SYSTEM_PROMPT}\n\n{HISTORY_SUMMARY_PREFIX}\n{history.summary}"
+    return [{"role": "system", "content": system}] + history.messages + [
+        {"role": "user", "content": PROMPT.format(question=question, context=context)}
+    ]
+
+
+class PrefixCache:
+    """Automatic prefix caching over full blocks of tokens, keyed by the hash chain of the prefix."""
+
+    def __init__(self, block_size: int, capacity: int):
+        self.block_size = block_size
+        self.capacity = capacity
+        self.blocks: "OrderedDict[int, None]" = OrderedDict()
+
+    def _hashes(self, tokens: List[str]):
+        parent = None
+        for offset in range(0, len(tokens) - self.block_size + 1, self.block_size):
+            parent = hash((parent, tuple(tokens[offset:offset + self.block_size])))
+            yield parent
+
+    def lookup(self, tokens: List[str]) -> int:
+        cached = 0
+        for block_hash in self._hashes(tokens):
+            if block_hash not in self.blocks:
+                break
+            self.blocks.move_to_end(block_hash)
+            cached += self.block_size
+        return cached
+
+    def insert(self, tokens: List[str]) -> None:
+        for block_hash in self._hashes(tokens):
+            self.blocks[block_hash] = None
+            self.blocks.move_to_end(block_hash)
+        while len(self.blocks) > self.capacity:
+            self.blocks.popitem(last=False)
+
+
+class Corpus:
+    def __init__(self, topics: int, seed: int = 0):
+        self.rng = random.Random(seed)
+        self.words = [f"w{idx}" for idx in range(3000)]
+        self.chunks = {
+            topic: [
+                Document(
+                    page_content=" ".join(self.rng.choice(self.words) for _ in range(WORDS_PER_CHUNK)),
+                    metadata={"file_id": topic, "source": f"doc{topic}.pdf", "page": idx // 4,
+                              "start_index": idx * 1000, "chunk_hash": f"{topic}-{idx}"},
+                )
+                for idx in range(CHUNKS_PER_TOPIC)
+            ]
+            for topic in range(topics)
+        }
+
+    def text(self, rng: random.Random, low: int, high: int) -> str:
+        return " ".join(rng.choice(self.words) for _ in range(rng.randint(low, high)))
+
+    def retrieve(self, rng: random.Random, topic: int, previous: List[Document]) -> List:
+        """Candidates of a turn: most of the previous turn's chunks plus new ones, in a fresh score order."""
+        kept = rng.sample(previous, min(FOLLOW_UP_CANDIDATES, len(previous)))
+        fresh = [doc for doc in self.chunks[topic] if doc not in kept]
+        docs = kept + rng.sample(fresh, CANDIDATES - len(kept))
+        return [(doc, rng.random()) for doc in docs]
+
+
+async def fake_summarize(previous_summary: str, turns: List[Dict]) -> str:
+    words = (previous_summary + " " + " ".join(turn["user_query"] for turn in turns)).split()
+    return " ".join(words[-150:])
+
+
+async def play(layout: str, args, corpus: Corpus):
+    store = RedisSessionStore(FakeRedis())
+    # HistoryManager reads turns and summaries through the module's store
+    history_module.session_store = store
+    manager = HistoryManager(
+        max_tokens=args.history_tokens,
+        trim_to=1.0 if layout == "before" else args.trim_to,
+        summary_input_tokens=args.history_tokens * 2,
+    )
+    build = previous_messages if layout == "before" else build_messages
+    order = "score" if layout == "before" else "document"
+    tokenizer = FakeTokenizer()
+    cache = PrefixCache(args.block_size, args.cache_blocks)
+    rng = random.Random(1)
+    by_turn = defaultdict(list)
+    previous_docs = {session: [] for session in range(args.sessions)}
+
+    for turn in range(1, args.turns + 1):
+        for session in range(args.sessions):
+            session_id = f"session-{session}"
+            topic = session % args.topics
+            history = await manager.load(session_id, tokenizer)
+            question = corpus.text(rng, 8, 20)
+            docs_and_scores = corpus.retrieve(rng, topic, previous_docs[session])
+            previous_docs[session] = [doc for doc, _ in docs_and_scores]
+            context = pack_context(docs_and_scores, tokenizer, args.context_tokens, order=order)
+            prompt = tokenizer.apply_chat_template(
+                build(history, question, context.text), tokenize=True, add_generation_prompt=True
+            )
+            answer = corpus.text(rng, 60, 160)
+
+            cached = cache.lookup(prompt)
+            cache.insert(prompt + answer.split())
+            by_turn[turn].append((len(prompt), cached))
+
+            await store.append_turns([ChatTurn(session_id, question, answer, SYSTEM_PROMPT, "bench", [])])
+            manager.schedule_summary_update(session_id, history, tokenizer, fake_summarize)
+        # Summaries are ready before the next question, as users read the answer first
+        await asyncio.gather(*list(manager._tasks))
+    return by_turn
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=30)
+    parser.add_argument("--topics", type=int, default=5, help="Documents shared by the sessions")
+    parser.add_argument("--history-tokens", type=int, default=2048, help="As history.max_tokens")
+    parser.add_argument("--trim-to", type=float, default=0.5, help="As history.trim_to")
+    parser.add_argument("--context-tokens", type=int, default=1024, help="Context budget")
+    parser.add_argument("--block-size", type=int, default=16)
+    parser.add_argument("--cache-blocks", type=int, default=20000)
+    parser.add_argument("--ttft-fixed-ms", type=float, default=15)
+    parser.add_argument("--prefill-ms", type=float, default=0.25, help="Prefill time per uncached prompt token")
+    args = parser.parse_args()
+
+    corpus = Corpus(args.topics)
+    results = {layout: asyncio.run(play(layout, args, corpus)) for layout in ("before", "after")}
+
+    def summarize(requests):
+        prompt = np.asarray([tokens for tokens, _ in requests], dtype=float)
+        cached = np.asarray([cached for _, cached in requests], dtype=float)
+        ttft = args.ttft_fixed_ms + (prompt - cached) * args.prefill_ms
+        return prompt.mean(), cached.sum() / prompt.sum(), ttft.mean(), np.percentile(ttft, 95)
+
+    print(f"{args.sessions} sessions x {args.turns} turns, modelled TTFT = {args.ttft_fixed_ms:g} ms + "
+          f"{args.prefill_ms:g} ms per uncached token")
+    print(f"{'turn':>5} | {'before: prompt  hit   TTFT  p95':>32} | {'after: prompt  hit   TTFT  p95':>32}")
+    turns = sorted({1, 2, 3, 5, 8, 12, 16, 20, 25, args.turns} & set(range(1, args.turns + 1)))
+    rows = [(str(turn), {layout: results[layout][turn] for layout in results}) for turn in turns]
+    rows.append(("all", {layout: [r for requests in results[layout].values() for r in requests] for layout in results}))
+    for label, requests in rows:
+        line = f"{label:>5}"
+        for layout in ("before", "after"):
+            prompt, ratio, ttft, ttft_p95 = summarize(requests[layout])
+            line += f" | {prompt:13.0f} {ratio:5.0%} {ttft:6.0f} {ttft_p95:4.0f}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
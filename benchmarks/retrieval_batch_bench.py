@@ -0,0 +1,164 @@
+"""
+Latency and throughput of micro-batched retrieval against one query at a time.
+
+Builds a synthetic corpus of `--chunks` chunks with random embeddings in a
+Chroma collection and a BM25 index, registered as the default tenant's
+indexes, and a fake embedding model that holds a lock for `--embed-fixed-ms`
+plus `--embed-per-query-ms` per text on every call, as a GPU runs one forward
+pass at a time whatever the batch size. `--clients` concurrent clients then
+each send questions back to back, `--queries` in total, through:
+
+  single   `aembed_query` and `Retriever.retrieve` per question, as /chat did
+  batched  `RetrievalBatcher.retrieve`, one embedding call and one multi-query
+           search per batch of concurrent questions
+
+Checks that both return the same chunks, then reports per-question p50/p99
+latency, questions per second and the mean batch size, in the configured
+`retriever.mode` without reranking.
+
+    python -m benchmarks.retrieval_batch_bench --chunks 20000 --clients 1 8 32 64
+"""
+import argparse
+import asyncio
+import random
+import tempfile
+import threading
+import time
+from typing import List
+
+import chromadb
+import numpy as np
+from chromadb.config import Settings
+from langchain.vectorstores import Chroma
+from langchain_core.embeddings import Embeddings
+
+from core.retrieval import RetrievalBatcher, Retriever
+from helpers.chroma_utils import TenantIndex, tenant_indexes
+from helpers.constants import DEFAULT_TENANT, GLOBAL_CONFIG
+from helpers.embedding_cache import embed_queries
+from helpers.lexical_index import BM25Index
+
+TOPICS = 200
+WORDS_PER_CHUNK = 80
+
+
+class SimulatedEmbeddings(Embeddings):
+    """Embeddings of a topic vector per question, at the cost of a serialized model call."""
+
+    def __init__(self, centers: np.ndarray, fixed_ms: float, per_query_ms: float):
+        self.centers = centers
+        self.fixed = fixed_ms / 1000
+        self.per_query = per_query_ms / 1000
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def _vectors(self, texts: List[str]) -> List[List[float]]:
+        with self.lock:
+            self.calls += 1
+            time.sleep(self.fixed + self.per_query * len(texts))
+        return [self.centers[int(text.split()[0][5:]) % len(self.centers)].tolist() for text in texts]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._vectors(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._vectors([text])[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        return self._vectors(texts)
+
+
+def build_corpus(client, args):
+    rng = random.Random(0)
+    np_rng = np.random.default_rng(0)
+    centers = np_rng.normal(size=(TOPICS, args.dimension)).astype(np.float32)
+    collection = client.create_collection("bench")
+    lexical_index = BM25Index(path="unused")
+    for offset in range(0, args.chunks, 5000):
+        count = min(5000, args.chunks - offset)
+        topics = np_rng.integers(TOPICS, size=count)
+        vectors = centers[topics] + np_rng.normal(scale=1.0, size=(count, args.dimension)).astype(np.float32)
+        ids = [str(offset + idx) for idx in range(count)]
+        texts = [" ".join([f"topic{topic}"] + [f"word{rng.randrange(5000)}" for _ in range(WORDS_PER_CHUNK)])
+                 for topic in topics]
+        metadatas = [{"file_id": int(topic), "chunk_hash": id_} for topic, id_ in zip(topics, ids)]
+        collection.add(ids=ids, documents=texts, embeddings=vectors.tolist(), metadatas=metadatas)
+        lexical_index.add(ids, texts, [metadata["file_id"] for metadata in metadatas])
+    return centers, lexical_index
+
+
+async def run_clients(retrieve_one, clients: int, queries: int):
+    rng = random.Random(clients)
+    questions = [f"topic{rng.randrange(TOPICS)} word{rng.randrange(5000)} word{rng.randrange(5000)}"
+                 for _ in range(queries)]
+    latencies = []
+
+    async def client(worker: int):
+        for question in questions[worker::clients]:
+            start = time.perf_counter()
+            await retrieve_one(question)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(worker) for worker in range(clients)))
+    return np.asarray(latencies), time.perf_counter() - start
+
+
+async def run(args):
+    retriever_config = dict(GLOBAL_CONFIG["retriever"], k=args.k)
+    retriever = Retriever(retriever_config)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        client = chromadb.PersistentClient(path=tmp_dir, settings=Settings(anonymized_telemetry=False))
+        start = time.perf_counter()
+        centers, lexical_index = build_corpus(client, args)
+        print(f"Indexed {args.chunks} chunks of {args.dimension} dimensions in {time.perf_counter() - start:.1f}s, "
+              f"mode {retriever.mode}, embedding call {args.embed_fixed_ms} ms + {args.embed_per_query_ms} ms/question")
+        vectorstore = Chroma(client=client, collection_name="bench")
+        tenant_indexes.entries[DEFAULT_TENANT] = TenantIndex(DEFAULT_TENANT, vectorstore, lexical_index)
+        embeddings = SimulatedEmbeddings(centers, args.embed_fixed_ms, args.embed_per_query_ms)
+
+        async def single(question):
+            embedding = await embeddings.aembed_query(question)
+            return await retriever.retrieve(question, embedding)
+
+        # Batched retrieval returns the chunks retrieving each question alone does
+        sample = [f"topic{idx} word{idx} word{idx + 1}" for idx in range(0, TOPICS, 10)]
+        alone = [await single(question) for question in sample]
+        batcher = RetrievalBatcher(retriever, lambda texts: embed_queries(embeddings, texts))
+        together = await asyncio.gather(*(batcher.retrieve(question) for question in sample))
+        await batcher.stop()
+        same = sum([doc.metadata["chunk_hash"] for doc, _ in a] == [doc.metadata["chunk_hash"] for doc, _ in b]
+                   for a, (_, b) in zip(alone, together))
+        print(f"Batched results identical to single ones for {same}/{len(sample)} questions")
+
+        print(f"{'clients':>7} {'path':>8} {'p50 ms':>8} {'p99 ms':>8} {'q/s':>8} {'batch':>6}")
+        for clients in args.clients:
+            batcher = RetrievalBatcher(retriever, lambda texts: embed_queries(embeddings, texts),
+                                       args.max_batch_size, args.max_wait_ms)
+            for label, retrieve_one in (("single", single), ("batched", batcher.retrieve)):
+                await run_clients(retrieve_one, clients, min(args.queries, 4 * clients))  # warm up
+                calls = embeddings.calls
+                latencies, seconds = await run_clients(retrieve_one, clients, args.queries)
+                print(f"{clients:>7} {label:>8} {np.percentile(latencies, 50) * 1000:>8.1f} "
+                      f"{np.percentile(latencies, 99) * 1000:>8.1f} {args.queries / seconds:>8.1f} "
+                      f"{args.queries / (embeddings.calls - calls):>6.1f}")
+            await batcher.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=20000)
+    parser.add_argument("--dimension", type=int, default=1024)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=1000, help="Questions per run")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32, 64])
+    parser.add_argument("--embed-fixed-ms", type=float, default=10.0, help="Cost of a model call")
+    parser.add_argument("--embed-per-query-ms", type=float, default=0.5, help="Added cost per question in a call")
+    parser.add_argument("--max-batch-size", type=int, default=32, help="As retriever.batching.max_batch_size")
+    parser.add_argument("--max-wait-ms", type=float, default=2.0, help="As retriever.batching.max_wait_ms")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
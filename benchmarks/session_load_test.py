@@ -0,0 +1,105 @@
+"""
+Multi-worker consistency and latency check for the Redis session store.
+
+Simulates several API replicas, each with its own RedisSessionStore and
+connection, sharing one backend: an in-process FakeRedis by default, or a real
+server with --redis-url. Every turn of every session is served by a random
+replica, which reads the session history first and checks that it holds every
+earlier turn in order. A second phase has all replicas append to the same
+session at once and checks that no turn is lost and ids stay unique.
+
+    python -m benchmarks.session_load_test --workers 8 --sessions 200 --turns 20
+"""
+import argparse
+import asyncio
+import random
+import time
+import uuid
+
+import numpy as np
+
+from helpers.fake_redis import FakeRedis
+from helpers.session_store import ChatTurn, RedisSessionStore
+
+
+def make_client(redis_url):
+    if redis_url is None:
+        return None
+    import redis.asyncio as redis
+
+    return redis.from_url(redis_url, decode_responses=True)
+
+
+async def run_session(workers, session_id: str, turns: int, read_latencies, write_latencies) -> int:
+    errors = 0
+    for idx in range(turns):
+        worker = random.choice(workers)
+        start = time.perf_counter()
+        history = await worker.get_recent_turns(session_id, limit=turns)
+        read_latencies.append(time.perf_counter() - start)
+        seen = [turn["user_query"] for turn in reversed(history)]
+        if seen != [f"{session_id} question {i}" for i in range(idx)]:
+            errors += 1
+
+        turn = ChatTurn(session_id, f"{session_id} question {idx}", f"answer {idx}", "system", "model", [])
+        start = time.perf_counter()
+        await worker.append_turns([turn])
+        write_latencies.append(time.perf_counter() - start)
+    return errors
+
+
+async def concurrent_appends(workers, turns_per_worker: int) -> int:
+    session_id = f"shared-{uuid.uuid4()}"
+
+    async def append(worker, worker_idx):
+        for idx in range(turns_per_worker):
+            await worker.append_turns([ChatTurn(session_id, f"w{worker_idx}-{idx}", "answer", "system", "model", [])])
+
+    await asyncio.gather(*(append(worker, idx) for idx, worker in enumerate(workers)))
+    turns = await workers[0].get_turns_range(session_id, 0, 2 ** 62)
+    ids = [turn["id"] for turn in turns]
+    expected = len(workers) * turns_per_worker
+    return int(len(turns) != expected or len(set(ids)) != expected or ids != sorted(ids))
+
+
+async def run(args) -> None:
+    shared = FakeRedis() if args.redis_url is None else None
+    workers = [
+        RedisSessionStore(shared or make_client(args.redis_url), max_turns=max(args.turns, 200))
+        for _ in range(args.workers)
+    ]
+    read_latencies, write_latencies = [], []
+    start = time.perf_counter()
+    session_ids = [f"load-{uuid.uuid4()}" for _ in range(args.sessions)]
+    errors = await asyncio.gather(
+        *(run_session(workers, session_id, args.turns, read_latencies, write_latencies) for session_id in session_ids)
+    )
+    elapsed = time.perf_counter() - start
+    shared_errors = await concurrent_appends(workers, args.turns)
+
+    reads = np.asarray(read_latencies) * 1000
+    writes = np.asarray(write_latencies) * 1000
+    print(f"{args.workers} workers, {args.sessions} sessions x {args.turns} turns in {elapsed:.2f}s")
+    print(f"history reads: p50 {np.percentile(reads, 50):.3f} ms, p95 {np.percentile(reads, 95):.3f} ms")
+    print(f"turn writes:   p50 {np.percentile(writes, 50):.3f} ms, p95 {np.percentile(writes, 95):.3f} ms")
+    print(f"inconsistent history reads: {sum(errors)}")
+    print(f"concurrent appends to one session consistent: {not shared_errors}")
+
+    for session_id in session_ids:
+        await workers[0].delete_session(session_id)
+    for worker in workers:
+        await worker.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--redis-url", default=None, help="Real Redis server, an in-process fake is used otherwise")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Where API startup time goes: import profile, port bind and readiness.
+
+Imports `api` under `python -X importtime` in a fresh interpreter and reports
+the total import time, the slowest packages (own import time summed over each
+top-level package) and the slowest modules of this repository (cumulative,
+including what they import). Then starts `uvicorn api:app` and reports how long
+until the port accepts connections, `/healthz` answers and `/readyz` reports
+every component ready, with each component's startup time or error.
+
+    python -m benchmarks.startup_profile --top 15 --ready-timeout 600
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+
+FIRST_PARTY = ("api", "schemas", "helpers", "core")
+
+
+def parse_importtime(stderr: str):
+    """(module, self seconds, cumulative seconds) per imported module, in import order."""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append((name.strip(), int(self_us) / 1e6, int(cumulative_us) / 1e6))
+    return modules
+
+
+def import_profile(module: str, top: int) -> None:
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True
+    )
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        print(result.stderr.strip().splitlines()[-1])
+    modules = parse_importtime(result.stderr)
+    total = next((cumulative for name, _, cumulative in modules if name == module), 0.0)
+    print(f"import {module}: {total:.2f}s of imports, {wall:.2f}s with interpreter startup, "
+          f"{len(modules)} modules")
+
+    packages = defaultdict(float)
+    for name, self_seconds, _ in modules:
+        packages[name.split(".")[0]] += self_seconds
+    print(f"\nSlowest packages (own import time):")
+    for name, seconds in sorted(packages.items(), key=lambda item: -item[1])[:top]:
+        print(f"  {seconds:7.3f}s  {name}")
+
+    print(f"\nSlowest modules of this repository (cumulative):")
+    own = [(name, cumulative) for name, _, cumulative in modules if name.split(".")[0] in FIRST_PARTY]
+    for name, seconds in sorted(own, key=lambda item: -item[1])[:top]:
+        print(f"  {seconds:7.3f}s  {name}")
+
+
+def get(url: str):
+    try:
+        with urllib.request.urlopen(url, timeout=2) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def server_profile(port: int, ready_timeout: float) -> None:
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api:app", "--host", "127.0.0.1", "--port", str(port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                break
+            except OSError:
+                if server.poll() is not None:
+                    raise SystemExit(f"uvicorn exited with code {server.returncode} before binding")
+                time.sleep(0.01)
+        print(f"\nport bound after {time.perf_counter() - start:.2f}s")
+        status, _ = get(f"http://127.0.0.1:{port}/healthz")
+        print(f"/healthz {status} after {time.perf_counter() - start:.2f}s")
+
+        deadline = start + ready_timeout
+        while True:
+            status, body = get(f"http://127.0.0.1:{port}/readyz")
+            states = [component["state"] for component in body["components"].values()]
+            if status == 200 or "starting" not in states and "pending" not in states or time.perf_counter() > deadline:
+                break
+            time.sleep(0.1)
+        print(f"/readyz {status} after {time.perf_counter() - start:.2f}s")
+        for name, component in body["components"].items():
+            seconds = f"{component['seconds']:.2f}s" if component["seconds"] is not None else "-"
+            error = f"  {component['error']}" if component["error"] else ""
+            print(f"  {name:>15} {component['state']:>8} {seconds:>8}{error}")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="api")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--port", type=int, default=8183)
+    parser.add_argument("--ready-timeout", type=float, default=600, help="Seconds to wait for /readyz")
+    parser.add_argument("--skip-server", action="store_true", help="Only profile imports")
+    args = parser.parse_args()
+
+    os.environ.setdefault("PYTHONPATH", os.getcwd())
+    import_profile(args.module, args.top)
+    if not args.skip_server:
+        server_profile(args.port, args.ready_timeout)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Server CPU spent per streamed token: the old cumulative-slicing loop vs. SSEStream.
+
+Serves a FastAPI app over uvicorn, backed by FakeEngine, and drives it with
+concurrent streaming clients from a separate process, so the CPU time measured
+in this process is serving overhead only (framing, ASGI and socket writes).
+
+    python -m benchmarks.stream_bench --streams 128 --tokens 512
+"""
+import argparse
+import asyncio
+import json
+import socket
+import sys
+import time
+
+import uvicorn
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+
+from core.fake_engine import FakeEngine
+from core.streaming import SSEStream
+
+PATHS = ("cumulative", "delta", "coalesced")
+
+
+async def cumulative_frames(outputs, session_id):
+    """The original api.py loop: slice the cumulative text and dump a dict per step."""
+    previous_response = ""
+    async for req_output in outputs:
+        full_response = req_output.outputs[0].text
+        token = full_response[len(previous_response):]
+        previous_response = full_response
+        yield f"data: {json.dumps({'token': token, 'session_id': session_id})}\n\n"
+
+
+def create_app(args) -> FastAPI:
+    app = FastAPI()
+    cumulative_engine = FakeEngine(args.tokens, args.tokens_per_second, delta=False)
+    delta_engine = FakeEngine(args.tokens, args.tokens_per_second, delta=True)
+
+    @app.get("/stream")
+    async def stream(path: str, session_id: str):
+        if path == "cumulative":
+            frames = cumulative_frames(cumulative_engine.generate(prompt=""), session_id)
+        elif path == "delta":
+            frames = SSEStream(session_id, coalesce_ms=0, coalesce_chars=0).frames(delta_engine.generate(prompt=""))
+        else:
+            frames = SSEStream(session_id, args.coalesce_ms, args.coalesce_chars).frames(
+                delta_engine.generate(prompt="")
+            )
+        return StreamingResponse(frames, media_type="text/event-stream")
+
+    return app
+
+
+async def read_stream(port: int, path: str, idx: int) -> int:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(
+        f"GET /stream?path={path}&session_id=session-{idx} HTTP/1.1\r\n"
+        f"Host: 127.0.0.1\r\nConnection: close\r\n\r\n".encode()
+    )
+    await writer.drain()
+    num_frames = 0
+    async for line in reader:
+        if line.startswith(b"data: "):
+            num_frames += 1
+    writer.close()
+    return num_frames
+
+
+async def run_clients(port: int, path: str, streams: int) -> None:
+    frames = await asyncio.gather(*(read_stream(port, path, idx) for idx in range(streams)))
+    print(sum(frames))
+
+
+async def run_server(args) -> None:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(create_app(args), port=port, log_level="warning"))
+    serve_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    num_tokens = args.streams * args.tokens
+    for path in PATHS:
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        client = await asyncio.create_subprocess_exec(
+            sys.executable, "-m", "benchmarks.stream_bench", "--client", str(port), path, str(args.streams),
+            stdout=asyncio.subprocess.PIPE,
+        )
+        stdout, _ = await client.communicate()
+        cpu = time.process_time() - cpu_start
+        wall = time.perf_counter() - wall_start
+        num_frames = int(stdout)
+        print(
+            f"{path:>10}: {cpu / num_tokens * 1e6:7.2f} us server CPU/token, "
+            f"{num_frames / num_tokens:5.2f} frames/token, {cpu:6.2f}s CPU, {wall:6.2f}s wall"
+        )
+
+    server.should_exit = True
+    await serve_task
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--client":
+        port, path, streams = sys.argv[2:5]
+        asyncio.run(run_clients(int(port), path, int(streams)))
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, default=128)
+    parser.add_argument("--tokens", type=int, default=512)
+    parser.add_argument("--tokens-per-second", type=float, default=50)
+    parser.add_argument("--coalesce-ms", type=float, default=20)
+    parser.add_argument("--coalesce-chars", type=int, default=256)
+    args = parser.parse_args()
+    asyncio.run(run_server(args))
+
+
+if __name__ == "__main__":
+    main()
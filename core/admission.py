@@ -0,0 +1,275 @@
+import asyncio
+import bisect
+import itertools
+import math
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, AsyncGenerator, Deque, Dict, Optional, Sequence, Tuple
+from uuid import uuid4
+
+from helpers.logger import create_logger
+
+logger = create_logger(__name__)
+
+# Upper bounds of the histogram buckets, observations above the last one count under "+Inf"
+WAIT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+QUEUE_DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+SESSION_LIMIT = "session_limit"
+QUEUE_FULL = "queue_full"
+DEADLINE = "deadline"
+TIMEOUT = "timeout"
+
+
+class AdmissionRejected(RuntimeError):
+    """A request was turned away by admission control, it may be retried after `retry_after` seconds."""
+
+    def __init__(self, message: str, status_code: int, retry_after: int, reason: str):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+@dataclass
+class AdmissionLimits:
+    max_in_flight: int = 8
+    max_queue: int = 32
+    max_wait_ms: float = 10000
+    # Requests of one session admitted or waiting at once
+    max_per_session: int = 2
+
+
+class Histogram:
+    """Observation counts per bucket, cumulative like Prometheus `le` buckets."""
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def stats(self) -> Dict[str, Any]:
+        cumulative = list(itertools.accumulate(self.counts))
+        return {
+            "buckets": {**{str(bound): count for bound, count in zip(self.bounds, cumulative)}, "+Inf": self.count},
+            "count": self.count,
+            "sum": self.sum,
+        }
+
+
+@dataclass
+class ModelAdmission:
+    """Admission state of one model: requests holding a slot, and waiting ones per session."""
+
+    limits: AdmissionLimits
+    in_flight: int = 0
+    queued: int = 0
+    # Round robin over sessions: the first session gets the next free slot, then goes to the back.
+    # Each waiting request is its future and the time it was queued.
+    waiting: "OrderedDict[str, Deque[Tuple[asyncio.Future, float]]]" = field(default_factory=OrderedDict)
+    per_session: Dict[str, int] = field(default_factory=dict)
+    service_seconds: Optional[float] = None
+    admitted: int = 0
+    rejected: Dict[str, int] = field(
+        default_factory=lambda: {SESSION_LIMIT: 0, QUEUE_FULL: 0, DEADLINE: 0, TIMEOUT: 0}
+    )
+    wait_ms: Histogram = field(default_factory=lambda: Histogram(WAIT_BUCKETS_MS))
+    queue_depth: Histogram = field(default_factory=lambda: Histogram(QUEUE_DEPTH_BUCKETS))
+
+
+class AdmissionSlot:
+    """Permission for one request to use a model, held until `release`."""
+
+    def __init__(self, controller: "AdmissionController", model_name: str, session: str):
+        self.controller = controller
+        self.model_name = model_name
+        self.session = session
+        self.admitted_at = time.monotonic()
+        self.released = False
+
+    def release(self) -> None:
+        if not self.released:
+            self.released = True
+            self.controller._release(self)
+
+
+class AdmissionController:
+    """
+    Per-model limits on the requests generating at once and waiting for a turn.
+
+    `acquire` returns a slot right away while a model has fewer than
+    `max_in_flight` requests, otherwise the request waits in the model's queue.
+    Freed slots go to waiting sessions in round robin, so a session sending
+    many requests only delays its own, and a session may not have more than
+    `max_per_session` requests admitted or waiting at once (429).
+
+    A request is rejected at once (503) when the queue is full or when the
+    expected wait, from the queue length and the smoothed time requests hold
+    a slot, exceeds `max_wait_ms`; one still waiting after `max_wait_ms` is
+    rejected then. Rejections carry a `retry_after` estimate of when a slot
+    frees up. `limits` overrides the `default` limits per model name.
+    """
+
+    def __init__(
+        self,
+        default: Optional[AdmissionLimits] = None,
+        limits: Optional[Dict[str, AdmissionLimits]] = None,
+        smoothing: float = 0.2,
+    ):
+        self.default = default or AdmissionLimits()
+        self.limits = limits or {}
+        self.smoothing = smoothing
+        self.models: Dict[str, ModelAdmission] = {}
+
+    def _state(self, model_name: str) -> ModelAdmission:
+        state = self.models.get(model_name)
+        if state is None:
+            state = self.models[model_name] = ModelAdmission(self.limits.get(model_name, self.default))
+        return state
+
+    def expected_wait(self, model_name: str) -> Optional[float]:
+        """Seconds a request arriving now is expected to wait, None before any request finished."""
+        state = self._state(model_name)
+        if state.in_flight < state.limits.max_in_flight and not state.queued:
+            return 0.0
+        if state.service_seconds is None:
+            return None
+        # Slots free up at max_in_flight / service_seconds per second, this request needs queued + 1 of them
+        return (state.queued + 1) * state.service_seconds / state.limits.max_in_flight
+
+    def _reject(self, state: ModelAdmission, model_name: str, reason: str, message: str, retry_after: float):
+        state.rejected[reason] += 1
+        status_code = 429 if reason == SESSION_LIMIT else 503
+        logger.warning(f"Rejected a request for model {model_name} ({reason}): {message}")
+        raise AdmissionRejected(message, status_code, max(1, math.ceil(retry_after)), reason)
+
+    async def acquire(self, model_name: str, session_id: Optional[str] = None) -> AdmissionSlot:
+        """Slot to generate with the model, waiting for one if needed. Raises AdmissionRejected."""
+        state = self._state(model_name)
+        limits = state.limits
+        # Requests without a session are each a session of their own
+        session = session_id or uuid4().hex
+        state.queue_depth.observe(state.queued)
+        if state.per_session.get(session, 0) >= limits.max_per_session:
+            self._reject(
+                state, model_name, SESSION_LIMIT,
+                f"Session {session_id} already has {limits.max_per_session} requests in progress.",
+                state.service_seconds or 1,
+            )
+        expected_wait = self.expected_wait(model_name)
+        if expected_wait == 0.0:
+            state.per_session[session] = state.per_session.get(session, 0) + 1
+            return self._admit(state, model_name, session, 0.0)
+
+        if state.queued >= limits.max_queue:
+            self._reject(
+                state, model_name, QUEUE_FULL,
+                f"Model {model_name} is overloaded, {state.queued} requests are waiting.",
+                expected_wait or limits.max_wait_ms / 1000,
+            )
+        if expected_wait is not None and expected_wait * 1000 > limits.max_wait_ms:
+            self._reject(
+                state, model_name, DEADLINE,
+                f"Model {model_name} is overloaded, the expected wait is {expected_wait:.1f}s.",
+                expected_wait,
+            )
+
+        future = asyncio.get_running_loop().create_future()
+        state.waiting.setdefault(session, deque()).append((future, time.monotonic()))
+        state.queued += 1
+        state.per_session[session] = state.per_session.get(session, 0) + 1
+        try:
+            await asyncio.wait((future,), timeout=limits.max_wait_ms / 1000)
+        except BaseException:
+            self._abandon(state, model_name, session, future)
+            raise
+        if not future.done():
+            self._abandon(state, model_name, session, future)
+            self._reject(
+                state, model_name, TIMEOUT,
+                f"Model {model_name} is overloaded, no slot freed up within {limits.max_wait_ms / 1000:.1f}s.",
+                self.expected_wait(model_name) or limits.max_wait_ms / 1000,
+            )
+        return future.result()
+
+    def _admit(self, state: ModelAdmission, model_name: str, session: str, waited: float) -> AdmissionSlot:
+        state.in_flight += 1
+        state.admitted += 1
+        state.wait_ms.observe(waited * 1000)
+        return AdmissionSlot(self, model_name, session)
+
+    def _dispatch(self, state: ModelAdmission, model_name: str) -> None:
+        """Hand free slots to waiting requests, one session after another."""
+        while state.waiting and state.in_flight < state.limits.max_in_flight:
+            session, waiters = state.waiting.popitem(last=False)
+            future, queued_at = waiters.popleft()
+            if waiters:
+                state.waiting[session] = waiters
+            state.queued -= 1
+            future.set_result(self._admit(state, model_name, session, time.monotonic() - queued_at))
+
+    def _abandon(self, state: ModelAdmission, model_name: str, session: str, future: asyncio.Future) -> None:
+        """Undo a wait that ended without the caller taking its slot: timed out, or the caller was cancelled."""
+        if future.done():
+            # The slot was handed over as the wait ended, it goes to the next request unused
+            future.result().released = True
+            state.in_flight -= 1
+            self._leave_session(state, session)
+            self._dispatch(state, model_name)
+            return
+        waiters = state.waiting[session]
+        waiters.remove(next(waiter for waiter in waiters if waiter[0] is future))
+        if not waiters:
+            del state.waiting[session]
+        state.queued -= 1
+        self._leave_session(state, session)
+        future.cancel()
+
+    def _leave_session(self, state: ModelAdmission, session: str) -> None:
+        remaining = state.per_session[session] - 1
+        if remaining:
+            state.per_session[session] = remaining
+        else:
+            del state.per_session[session]
+
+    def _release(self, slot: AdmissionSlot) -> None:
+        state = self.models[slot.model_name]
+        seconds = time.monotonic() - slot.admitted_at
+        if state.service_seconds is None:
+            state.service_seconds = seconds
+        else:
+            state.service_seconds += self.smoothing * (seconds - state.service_seconds)
+        state.in_flight -= 1
+        self._leave_session(state, slot.session)
+        self._dispatch(state, slot.model_name)
+
+    async def track(self, slot: AdmissionSlot, generator: AsyncGenerator) -> AsyncGenerator:
+        """Pass a generator through, releasing the slot once it is exhausted or closed."""
+        try:
+            async for item in generator:
+                yield item
+        finally:
+            slot.release()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            model_name: {
+                "in_flight": state.in_flight,
+                "max_in_flight": state.limits.max_in_flight,
+                "queue_depth": state.queued,
+                "max_queue": state.limits.max_queue,
+                "admitted": state.admitted,
+                "rejected": dict(state.rejected),
+                "avg_service_seconds": state.service_seconds,
+                "wait_ms": state.wait_ms.stats(),
+                "queue_depth_on_arrival": state.queue_depth.stats(),
+            }
+            for model_name, state in self.models.items()
+        }
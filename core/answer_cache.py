@@ -0,0 +1,145 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import AsyncGenerator, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from core.context import PackedContext
+
+
+@dataclass
+class CachedAnswer:
+    """A generated answer, the context it came from and the cumulative text length after each streamed step."""
+
+    model_name: str
+    tenant: str
+    corpus_version: int
+    embedding: np.ndarray
+    file_ids: Tuple[int, ...]
+    context: PackedContext
+    text: str
+    offsets: List[int]
+    generation_seconds: float
+
+
+@dataclass
+class ReplayedCompletion:
+    text: str
+
+
+@dataclass
+class ReplayedRequestOutput:
+    """Mirrors the fields of vLLM's RequestOutput that the API streams from."""
+
+    outputs: List[ReplayedCompletion]
+    finished: bool
+
+
+class SemanticAnswerCache:
+    """
+    Answers keyed by query embedding, model name, tenant and corpus version.
+
+    A new question hits when its cosine similarity to a cached question of the
+    same model and tenant is at least `similarity_threshold` and retrieval
+    returned the same file ids. Entries from an older corpus version of their
+    tenant are dropped on the next lookup, so any write to a tenant's
+    collection invalidates that tenant's answers.
+    """
+
+    def __init__(self, similarity_threshold: float = 0.95, max_entries: int = 1000):
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[int, CachedAnswer]" = OrderedDict()
+        self.corpus_versions: Dict[str, int] = {}
+        self.lock = threading.Lock()
+        self._next_id = 0
+        self._matrices: Dict[Tuple[str, str], Tuple[List[int], np.ndarray]] = {}
+        self.lookups = 0
+        self.hits = 0
+        self.seconds_saved = 0.0
+
+    @staticmethod
+    def normalize(embedding: Sequence[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _sync_version(self, tenant: str, corpus_version: int) -> None:
+        if corpus_version != self.corpus_versions.get(tenant):
+            for entry_id in [entry_id for entry_id, entry in self.entries.items() if entry.tenant == tenant]:
+                del self.entries[entry_id]
+            for key in [key for key in self._matrices if key[0] == tenant]:
+                del self._matrices[key]
+            self.corpus_versions[tenant] = corpus_version
+
+    def _matrix(self, tenant: str, model_name: str) -> Tuple[List[int], np.ndarray]:
+        key = (tenant, model_name)
+        if key not in self._matrices:
+            ids = [
+                entry_id for entry_id, entry in self.entries.items()
+                if entry.tenant == tenant and entry.model_name == model_name
+            ]
+            vectors = [self.entries[entry_id].embedding for entry_id in ids]
+            self._matrices[key] = (ids, np.stack(vectors) if vectors else np.empty((0, 0), np.float32))
+        return self._matrices[key]
+
+    def get(
+        self,
+        embedding: np.ndarray,
+        model_name: str,
+        file_ids: Tuple[int, ...],
+        corpus_version: int,
+        tenant: str,
+    ) -> Optional[CachedAnswer]:
+        with self.lock:
+            self._sync_version(tenant, corpus_version)
+            self.lookups += 1
+            ids, matrix = self._matrix(tenant, model_name)
+            if not ids:
+                return None
+            similarities = matrix @ embedding
+            for idx in np.argsort(-similarities):
+                if similarities[idx] < self.similarity_threshold:
+                    break
+                entry = self.entries[ids[idx]]
+                if entry.file_ids == file_ids:
+                    self.entries.move_to_end(ids[idx])
+                    self.hits += 1
+                    self.seconds_saved += entry.generation_seconds
+                    return entry
+            return None
+
+    def put(self, answer: CachedAnswer) -> None:
+        with self.lock:
+            if answer.corpus_version != self.corpus_versions.get(answer.tenant):
+                # The corpus changed while the answer was being generated
+                return
+            self.entries[self._next_id] = answer
+            self._next_id += 1
+            self._matrices.pop((answer.tenant, answer.model_name), None)
+            while len(self.entries) > self.max_entries:
+                _, evicted = self.entries.popitem(last=False)
+                self._matrices.pop((evicted.tenant, evicted.model_name), None)
+
+    @staticmethod
+    async def replay(answer: CachedAnswer) -> AsyncGenerator[ReplayedRequestOutput, None]:
+        """Yield the cached answer as deltas, with the same step boundaries it was generated with."""
+        start = 0
+        for step, offset in enumerate(answer.offsets):
+            yield ReplayedRequestOutput(
+                outputs=[ReplayedCompletion(text=answer.text[start:offset])],
+                finished=step == len(answer.offsets) - 1,
+            )
+            start = offset
+
+    def stats(self) -> Dict[str, float]:
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+                "seconds_saved": self.seconds_saved,
+                "avg_seconds_saved_per_hit": self.seconds_saved / self.hits if self.hits else 0.0,
+            }
@@ -0,0 +1,180 @@
+import re
+from dataclasses import dataclass, field
+from typing import Iterable, List, Optional, Set, Tuple
+
+from langchain_core.documents import Document
+
+from helpers.document_utils import hash_text, chunk_id
+
+CHUNK_SEPARATOR = "\n\n"
+_WORD = re.compile(r"\w+")
+
+
+@dataclass
+class ContextChunk:
+    text: str
+    score: float
+    file_id: Optional[int] = None
+    source: Optional[str] = None
+    page: Optional[int] = None
+    start: Optional[int] = None
+    num_tokens: Optional[int] = None
+    chunk_ids: List[str] = field(default_factory=list)
+
+    @property
+    def end(self) -> Optional[int]:
+        return None if self.start is None else self.start + len(self.text)
+
+
+@dataclass
+class PackedContext:
+    """Context sent to the model, plus what it was built from."""
+
+    text: str = ""
+    chunks: List[ContextChunk] = field(default_factory=list)
+    num_tokens: int = 0
+    num_candidates: int = 0
+
+    @property
+    def file_ids(self) -> Tuple[int, ...]:
+        return tuple(sorted({chunk.file_id for chunk in self.chunks if chunk.file_id is not None}))
+
+    @property
+    def chunk_ids(self) -> List[str]:
+        return [id_ for chunk in self.chunks for id_ in chunk.chunk_ids]
+
+
+def chunk_key(doc: Document) -> str:
+    """Chroma id of a chunk, recomputed from its metadata."""
+    chunk_hash = doc.metadata.get("chunk_hash") or hash_text(doc.page_content)
+    return chunk_id(doc.metadata.get("file_id"), chunk_hash)
+
+
+def to_context_chunk(doc: Document, score: float, tokenizer_name: Optional[str] = None) -> ContextChunk:
+    metadata = doc.metadata
+    file_id = metadata.get("file_id")
+    # Token counts stored at ingestion only hold for the tokenizer that produced them
+    trusted = tokenizer_name is not None and metadata.get("tokenizer") == tokenizer_name
+    return ContextChunk(
+        text=doc.page_content,
+        score=score,
+        file_id=file_id,
+        source=metadata.get("source"),
+        page=metadata.get("page"),
+        start=metadata.get("start_index"),
+        num_tokens=metadata.get("num_tokens") if trusted else None,
+        chunk_ids=[chunk_key(doc)],
+    )
+
+
+def merge_adjacent(chunks: List[ContextChunk]) -> List[ContextChunk]:
+    """Merge chunks of the same file and page whose spans overlap or touch, dropping the overlap."""
+    positioned, merged = {}, []
+    for chunk in chunks:
+        if chunk.start is None or chunk.file_id is None:
+            merged.append(chunk)
+        else:
+            positioned.setdefault((chunk.file_id, chunk.source, chunk.page), []).append(chunk)
+
+    for group in positioned.values():
+        group.sort(key=lambda chunk: chunk.start)
+        current = group[0]
+        for chunk in group[1:]:
+            if chunk.start > current.end:
+                merged.append(current)
+                current = chunk
+                continue
+            text = current.text
+            if chunk.end > current.end:
+                text += chunk.text[current.end - chunk.start:]
+            current = ContextChunk(
+                text=text,
+                score=max(current.score, chunk.score),
+                file_id=current.file_id,
+                source=current.source,
+                page=current.page,
+                start=current.start,
+                chunk_ids=current.chunk_ids + chunk.chunk_ids,
+            )
+        merged.append(current)
+    return merged
+
+
+def _shingles(text: str, size: int = 3) -> Set[Tuple[str, ...]]:
+    words = _WORD.findall(text.lower())
+    if len(words) <= size:
+        return {tuple(words)}
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def drop_near_duplicates(chunks: Iterable[ContextChunk], threshold: float) -> List[ContextChunk]:
+    """Keep the best scored chunk among those whose word shingles overlap by `threshold` (Jaccard) or more."""
+    kept, kept_shingles = [], []
+    for chunk in sorted(chunks, key=lambda chunk: chunk.score, reverse=True):
+        shingles = _shingles(chunk.text)
+        if any(
+            len(shingles & other) / max(len(shingles | other), 1) >= threshold
+            for other in kept_shingles
+        ):
+            continue
+        kept.append(chunk)
+        kept_shingles.append(shingles)
+    return kept
+
+
+def document_position(chunk: ContextChunk) -> Tuple:
+    return (
+        chunk.file_id if chunk.file_id is not None else -1,
+        chunk.source or "",
+        chunk.page if chunk.page is not None else -1,
+        chunk.start if chunk.start is not None else -1,
+        chunk.text,
+    )
+
+
+def pack_context(
+    docs_and_scores: List[Tuple[Document, float]],
+    tokenizer,
+    max_tokens: int,
+    dedup_threshold: float = 0.9,
+    order: str = "score",
+) -> PackedContext:
+    """
+    Assemble retrieved chunks into a prompt context of at most `max_tokens` tokens.
+
+    Adjacent and overlapping chunks of the same file are merged, near-duplicates
+    are dropped, and the remaining chunks are packed greedily by score: a chunk
+    that does not fit is skipped in favour of smaller, lower scored ones. Chunks
+    whose `num_tokens` metadata was counted with this tokenizer at ingestion are
+    not tokenized again. With `order="document"` the packed chunks are written
+    in document order (file, page, position) instead of by score, so the same
+    set of chunks always gives the same context text.
+
+    Args:
+        docs_and_scores (List[Tuple[Document, float]]): Retrieved chunks, higher score is better
+        tokenizer: Tokenizer of the model the context is built for
+        max_tokens (int): Token budget of the context
+        dedup_threshold (float): Shingle Jaccard similarity above which chunks count as duplicates
+        order (str): `score` (best first) or `document`
+
+    Returns:
+        PackedContext: The packed context and the chunks it contains
+    """
+    tokenizer_name = getattr(tokenizer, "name_or_path", None)
+    chunks = merge_adjacent([to_context_chunk(doc, score, tokenizer_name) for doc, score in docs_and_scores])
+    chunks = drop_near_duplicates(chunks, dedup_threshold)
+
+    separator_tokens = len(tokenizer.encode(CHUNK_SEPARATOR, add_special_tokens=False))
+    packed = PackedContext(num_candidates=len(docs_and_scores))
+    for chunk in chunks:
+        if chunk.num_tokens is None:
+            chunk.num_tokens = len(tokenizer.encode(chunk.text, add_special_tokens=False))
+        cost = chunk.num_tokens + (separator_tokens if packed.chunks else 0)
+        if packed.num_tokens + cost > max_tokens:
+            continue
+        packed.chunks.append(chunk)
+        packed.num_tokens += cost
+    if order == "document":
+        packed.chunks.sort(key=document_position)
+    packed.text = CHUNK_SEPARATOR.join(chunk.text for chunk in packed.chunks)
+    return packed
@@ -0,0 +1,93 @@
+import asyncio
+import threading
+import time
+from typing import AsyncGenerator, Dict, List, Optional, Set, Tuple
+
+from core.answer_cache import ReplayedCompletion, ReplayedRequestOutput
+
+FAKE_TOKENS = ("The ", "answer ", "is ", "in ", "the ", "retrieved ", "context", ". ")
+
+
+class FakeEngine:
+    """
+    Stand-in for AsyncLLMEngine that streams canned tokens at a fixed rate.
+
+    Used to exercise the serving path without a GPU. With `delta` each output
+    carries only the new token, like vLLM's RequestOutputKind.DELTA, otherwise
+    the text is cumulative. The stream of an aborted request ends at its next
+    step, and `tokens_generated` counts the tokens of all requests.
+    """
+
+    def __init__(self, num_tokens: int = 256, tokens_per_second: float = 50, delta: bool = True):
+        self.num_tokens = num_tokens
+        self.step_seconds = 1 / tokens_per_second if tokens_per_second else 0
+        self.delta = delta
+        self.aborted: Set[str] = set()
+        self.tokens_generated = 0
+
+    async def generate(
+        self, prompt: str, sampling_params=None, request_id: Optional[str] = None
+    ) -> AsyncGenerator[ReplayedRequestOutput, None]:
+        text = ""
+        for step in range(self.num_tokens):
+            await asyncio.sleep(self.step_seconds)
+            if request_id in self.aborted:
+                self.aborted.discard(request_id)
+                return
+            self.tokens_generated += 1
+            token = FAKE_TOKENS[step % len(FAKE_TOKENS)]
+            text += token
+            yield ReplayedRequestOutput(
+                outputs=[ReplayedCompletion(text=token if self.delta else text)],
+                finished=step == self.num_tokens - 1,
+            )
+
+    async def abort(self, request_id: str) -> None:
+        self.aborted.add(request_id)
+
+
+class FakeTokenizer:
+    """Whitespace tokenizer with the parts of the Hugging Face tokenizer API that DocQA uses."""
+
+    def encode(self, text: str, add_special_tokens: bool = True) -> List[str]:
+        return text.split()
+
+    def apply_chat_template(self, messages: List[Dict[str, str]], tokenize: bool = True, add_generation_prompt: bool = False):
+        text = "".join(f"<{message['role']}>\n{message['content']}\n" for message in messages)
+        if add_generation_prompt:
+            text += "<assistant>\n"
+        return self.encode(text) if tokenize else text
+
+
+class FakeModelLoader:
+    """
+    Loads FakeEngines for the ModelManager, taking `load_seconds` per model.
+
+    Each loaded engine claims its model's `gpu_memory_utilization` of a
+    simulated device until it is unloaded, and `free_memory` reports what is
+    left, so loading, idle and memory-pressure eviction can run on CPU.
+    """
+
+    def __init__(self, load_seconds: float = 0.0, num_tokens: int = 256, tokens_per_second: float = 50):
+        self.load_seconds = load_seconds
+        self.num_tokens = num_tokens
+        self.tokens_per_second = tokens_per_second
+        self.allocated: Dict[int, float] = {}
+        self.loads: List[str] = []
+        self.lock = threading.Lock()
+
+    def load(self, config) -> Tuple[FakeEngine, FakeTokenizer]:
+        time.sleep(self.load_seconds)
+        engine = FakeEngine(self.num_tokens, self.tokens_per_second)
+        with self.lock:
+            self.allocated[id(engine)] = getattr(config, "gpu_memory_utilization", 0.0)
+            self.loads.append(config.name)
+        return engine, FakeTokenizer()
+
+    def unload(self, engine: FakeEngine) -> None:
+        with self.lock:
+            self.allocated.pop(id(engine), None)
+
+    def free_memory(self) -> float:
+        with self.lock:
+            return max(0.0, 1.0 - sum(self.allocated.values()))
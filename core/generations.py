@@ -0,0 +1,113 @@
+import asyncio
+from dataclasses import dataclass
+from typing import Any, AsyncGenerator, Dict, Set
+
+from helpers.logger import create_logger
+
+logger = create_logger(__name__)
+
+# How an answer stream ended, as logged with the chat turn
+COMPLETED = "completed"
+DISCONNECTED = "disconnected"
+CANCELLED = "cancelled"
+
+
+@dataclass
+class ActiveGeneration:
+    """An engine request whose outputs are still being streamed."""
+
+    model_name: str
+    engine: Any
+    max_tokens: int
+    generated_tokens: int = 0
+    cancelled: bool = False
+    aborted: bool = False
+
+
+class GenerationTracker:
+    """
+    Engine requests being streamed, by request id, so they can be aborted.
+
+    `track` passes a request's outputs through and counts its tokens. When the
+    stream stops before the engine finished, because the client went away
+    (the stream was closed or its task cancelled) or `cancel` was called, the
+    request is aborted on the engine so it stops decoding tokens nobody reads,
+    and the tokens it could still have generated, up to `max_tokens`, count
+    as saved.
+    """
+
+    def __init__(self):
+        self.active: Dict[str, ActiveGeneration] = {}
+        self.completed = 0
+        self.aborted = {DISCONNECTED: 0, CANCELLED: 0}
+        self.generated_tokens_aborted = 0
+        self.tokens_saved = 0
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def track(
+        self, generator: AsyncGenerator, request_id: str, model_name: str, engine: Any, max_tokens: int
+    ) -> AsyncGenerator:
+        generation = ActiveGeneration(model_name, engine, max_tokens)
+        self.active[request_id] = generation
+        finished = False
+        try:
+            async for output in generator:
+                token_ids = getattr(output.outputs[0], "token_ids", None)
+                generation.generated_tokens += len(token_ids) if token_ids is not None else 1
+                finished = output.finished
+                yield output
+                if generation.cancelled:
+                    break
+        except asyncio.CancelledError:
+            # vLLM ends the stream of a request it aborted by raising CancelledError in it
+            if not generation.cancelled:
+                raise
+        finally:
+            del self.active[request_id]
+            # Returns at once when the engine's stream already ended
+            await generator.aclose()
+            if finished:
+                self.completed += 1
+            else:
+                self._stopped(request_id, generation)
+
+    def _stopped(self, request_id: str, generation: ActiveGeneration) -> None:
+        reason = CANCELLED if generation.cancelled else DISCONNECTED
+        saved = max(0, generation.max_tokens - generation.generated_tokens)
+        self.aborted[reason] += 1
+        self.generated_tokens_aborted += generation.generated_tokens
+        self.tokens_saved += saved
+        logger.info(
+            f"Request {request_id} {reason} after {generation.generated_tokens} tokens, "
+            f"up to {saved} tokens not generated"
+        )
+        if not generation.aborted:
+            # The stream may be stopping in a cancelled task, which cannot await the engine anymore
+            task = asyncio.create_task(self._abort(request_id, generation))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _abort(self, request_id: str, generation: ActiveGeneration) -> None:
+        generation.aborted = True
+        try:
+            await generation.engine.abort(request_id)
+        except Exception as e:
+            logger.error(f"Failed to abort request {request_id} on model {generation.model_name}: {str(e)}")
+
+    async def cancel(self, request_id: str) -> bool:
+        """Stop generating an answer, returns False when no such request is being streamed."""
+        generation = self.active.get(request_id)
+        if generation is None:
+            return False
+        generation.cancelled = True
+        await self._abort(request_id, generation)
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": len(self.active),
+            "completed": self.completed,
+            "aborted": dict(self.aborted),
+            "generated_tokens_aborted": self.generated_tokens_aborted,
+            "tokens_saved": self.tokens_saved,
+        }
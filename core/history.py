@@ -0,0 +1,165 @@
+import asyncio
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from helpers.chat_log import chat_log_writer
+from helpers.session_store import session_store
+from helpers.logger import create_logger
+
+logger = create_logger(__name__)
+
+# Rough cost of the chat template wrapping one user / assistant pair
+TURN_OVERHEAD_TOKENS = 8
+
+
+@dataclass
+class SessionHistory:
+    """History to prepend to the prompt of one request."""
+
+    messages: List[Dict[str, str]] = field(default_factory=list)
+    summary: Optional[str] = None
+    num_tokens: int = 0
+    # Newest turn that fell out of the budget without being summarized yet
+    unsummarized_until: Optional[int] = None
+
+
+class HistoryManager:
+    """
+    Keeps the prompt history of a session within a token budget.
+
+    The most recent turns that fit `max_tokens` (counted with the model's
+    tokenizer) are sent verbatim. Turns that no longer fit are folded into a
+    rolling summary kept in the session store: each update only feeds the
+    previous summary plus the newly dropped turns to the model. Rows are read
+    newest first, a page at a time, and only after the summarized point.
+
+    When summarizing, an overflowing history is cut down to `trim_to` of the
+    budget at once rather than by one turn per request, so the turns sent
+    (a prefix of the prompt) stay the same until the budget fills again and
+    the engine's prefix cache keeps hitting in between.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = 2048,
+        page_size: int = 8,
+        summarize: bool = True,
+        summary_max_tokens: int = 256,
+        summary_input_tokens: int = 4096,
+        trim_to: float = 0.5,
+    ):
+        self.max_tokens = max_tokens
+        self.page_size = page_size
+        self.summarize = summarize
+        self.summary_max_tokens = summary_max_tokens
+        self.summary_input_tokens = summary_input_tokens
+        self.trim_to = trim_to
+        self._updating: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+    @staticmethod
+    def count_tokens(tokenizer, text: str) -> int:
+        return len(tokenizer.encode(text, add_special_tokens=False))
+
+    def turn_tokens(self, tokenizer, turn: Dict) -> int:
+        return (
+            self.count_tokens(tokenizer, turn["user_query"])
+            + self.count_tokens(tokenizer, turn["response"])
+            + TURN_OVERHEAD_TOKENS
+        )
+
+    async def has_history(self, session_id: Optional[str]) -> bool:
+        """Whether the session has any turn or summary, without reading or counting them."""
+        if not session_id:
+            return False
+        await chat_log_writer.wait_for_session(session_id)
+        if await session_store.get_summary(session_id):
+            return True
+        return bool(await session_store.get_recent_turns(session_id, limit=1))
+
+    async def load(self, session_id: Optional[str], tokenizer) -> SessionHistory:
+        history = SessionHistory()
+        if not session_id:
+            return history
+
+        await chat_log_writer.wait_for_session(session_id)
+        summary_row = await session_store.get_summary(session_id)
+        summarized_until = 0
+        if summary_row:
+            history.summary = summary_row["summary"]
+            summarized_until = summary_row["summarized_until"]
+            history.num_tokens = self.count_tokens(tokenizer, history.summary)
+
+        kept = []
+        before_id = None
+        while True:
+            turns = await session_store.get_recent_turns(
+                session_id, after_id=summarized_until, before_id=before_id, limit=self.page_size
+            )
+            for turn in turns:
+                num_tokens = self.turn_tokens(tokenizer, turn)
+                if history.num_tokens + num_tokens > self.max_tokens:
+                    history.unsummarized_until = turn["id"]
+                    break
+                history.num_tokens += num_tokens
+                kept.append((turn, num_tokens))
+            if history.unsummarized_until is not None or len(turns) < self.page_size:
+                break
+            before_id = turns[-1]["id"]
+
+        if history.unsummarized_until is not None and self.summarize:
+            while kept and history.num_tokens > self.trim_to * self.max_tokens:
+                turn, num_tokens = kept.pop()
+                history.num_tokens -= num_tokens
+                history.unsummarized_until = turn["id"]
+        for turn, _ in reversed(kept):
+            history.messages.extend([
+                {"role": "user", "content": turn["user_query"]},
+                {"role": "assistant", "content": turn["response"]},
+            ])
+        return history
+
+    def schedule_summary_update(
+        self,
+        session_id: str,
+        history: SessionHistory,
+        tokenizer,
+        summarize_fn: Callable[[str, List[Dict]], Awaitable[str]],
+    ) -> None:
+        """Fold turns that fell out of the budget into the stored summary, in the background."""
+        if not self.summarize or history.unsummarized_until is None or session_id in self._updating:
+            return
+        self._updating.add(session_id)
+        task = asyncio.create_task(
+            self._update_summary(session_id, history.unsummarized_until, tokenizer, summarize_fn)
+        )
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _update_summary(
+        self,
+        session_id: str,
+        until_id: int,
+        tokenizer,
+        summarize_fn: Callable[[str, List[Dict]], Awaitable[str]],
+    ) -> None:
+        try:
+            summary_row = await session_store.get_summary(session_id)
+            previous_summary = summary_row["summary"] if summary_row else ""
+            summarized_until = summary_row["summarized_until"] if summary_row else 0
+            turns = await session_store.get_turns_range(session_id, summarized_until, until_id)
+            # A long backlog is folded in over several updates, oldest turns first
+            num_tokens = 0
+            for idx, turn in enumerate(turns):
+                num_tokens += self.turn_tokens(tokenizer, turn)
+                if idx > 0 and num_tokens > self.summary_input_tokens:
+                    turns = turns[:idx]
+                    break
+            if not turns:
+                return
+            summary = await summarize_fn(previous_summary, turns)
+            await session_store.upsert_summary(session_id, summary, turns[-1]["id"])
+        except Exception as e:
+            logger.error(f"Failed to update summary of session {session_id}: {str(e)}")
+        finally:
+            self._updating.discard(session_id)
@@ -0,0 +1,223 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncGenerator, Callable, Dict, List, Optional
+
+from helpers.logger import create_logger
+
+logger = create_logger(__name__)
+
+UNLOADED = "unloaded"
+LOADING = "loading"
+LOADED = "loaded"
+EVICTED = "evicted"
+FAILED = "failed"
+
+
+class ModelLoadError(RuntimeError):
+    """A model could not be loaded, the request that needed it cannot be served."""
+
+
+@dataclass
+class ManagedModel:
+    """Lifecycle state of one configured model and, while loaded, its engine and tokenizer."""
+
+    name: str
+    config: Any
+    memory_fraction: float
+    state: str = UNLOADED
+    engine: Any = None
+    tokenizer: Any = None
+    in_flight: int = 0
+    last_used: float = 0.0
+    load_seconds: Optional[float] = None
+    loads: int = 0
+    evictions: int = 0
+    error: Optional[str] = None
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "model_id": getattr(self.config, "model_id", None),
+            "state": self.state,
+            "in_flight": self.in_flight,
+            "idle_seconds": time.monotonic() - self.last_used if self.state == LOADED and not self.in_flight else None,
+            "load_seconds": self.load_seconds,
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "error": self.error,
+        }
+
+
+class ModelManager:
+    """
+    Loads models on their first request and evicts them when idle.
+
+    `load_fn(config)` returns `(engine, tokenizer)` and runs in a worker thread;
+    each model has its own lock, so concurrent requests for a model that is not
+    loaded yet wait for a single load. `acquire` marks the model in use until
+    `release`; a model in use is never evicted.
+
+    A model is evicted once it has been idle for `idle_ttl` seconds, and idle
+    models are evicted least recently used first when `free_memory_fn()` (the
+    free fraction of accelerator memory) is below `min_free_memory`, or below
+    the `memory_fraction` a model about to be loaded will claim. `unload_fn`
+    releases an evicted engine's memory.
+    """
+
+    def __init__(
+        self,
+        configs: Dict[str, Any],
+        load_fn: Callable[[Any], tuple],
+        unload_fn: Optional[Callable[[Any], None]] = None,
+        free_memory_fn: Optional[Callable[[], float]] = None,
+        idle_ttl: Optional[float] = 1800,
+        check_interval: float = 30,
+        min_free_memory: float = 0.0,
+        memory_fraction_fn: Callable[[Any], float] = lambda config: getattr(config, "gpu_memory_utilization", 0.0),
+    ):
+        self.models = {
+            name: ManagedModel(name=name, config=config, memory_fraction=memory_fraction_fn(config))
+            for name, config in configs.items()
+        }
+        self.load_fn = load_fn
+        self.unload_fn = unload_fn
+        self.free_memory_fn = free_memory_fn
+        self.idle_ttl = idle_ttl
+        self.check_interval = check_interval
+        self.min_free_memory = min_free_memory
+        self.task: Optional[asyncio.Task] = None
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.models
+
+    def names(self) -> List[str]:
+        return list(self.models)
+
+    def info(self) -> List[Dict[str, Any]]:
+        return [model.info() for model in self.models.values()]
+
+    async def start(self, preload: Optional[List[str]] = None) -> None:
+        self.task = asyncio.create_task(self._run())
+        for name in preload or []:
+            asyncio.create_task(self._preload(name))
+
+    async def stop(self) -> None:
+        if self.task is None:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+
+    async def acquire(self, name: str) -> ManagedModel:
+        """Loaded model, loading it first if needed. Must be paired with `release`."""
+        if name not in self.models:
+            raise KeyError(f"Model {name} not found. Available models: {self.names()}")
+        model = self.models[name]
+        model.in_flight += 1
+        try:
+            if model.state != LOADED:
+                async with model.lock:
+                    if model.state != LOADED:
+                        await self._load(model)
+        except BaseException:
+            model.in_flight -= 1
+            raise
+        model.last_used = time.monotonic()
+        return model
+
+    def release(self, name: str) -> None:
+        model = self.models[name]
+        model.in_flight -= 1
+        model.last_used = time.monotonic()
+
+    async def track(self, name: str, generator: AsyncGenerator) -> AsyncGenerator:
+        """Pass a generator through, releasing the model once it is exhausted or closed."""
+        try:
+            async for item in generator:
+                yield item
+        finally:
+            self.release(name)
+
+    async def evict(self, name: str) -> bool:
+        """Unload a model unless it is in use, returns whether it was unloaded."""
+        model = self.models[name]
+        async with model.lock:
+            if model.state != LOADED or model.in_flight:
+                return False
+            engine = model.engine
+            model.engine = model.tokenizer = None
+            model.state = EVICTED
+            model.evictions += 1
+        if self.unload_fn is not None:
+            await asyncio.to_thread(self.unload_fn, engine)
+        logger.info(f"Evicted model {name}")
+        return True
+
+    async def evict_idle(self) -> List[str]:
+        """Evict models idle for longer than `idle_ttl`, then idle ones while memory is short."""
+        evicted = []
+        now = time.monotonic()
+        if self.idle_ttl is not None:
+            for model in list(self.models.values()):
+                if model.state == LOADED and not model.in_flight and now - model.last_used >= self.idle_ttl:
+                    if await self.evict(model.name):
+                        evicted.append(model.name)
+        evicted.extend(await self._free_memory(self.min_free_memory))
+        return evicted
+
+    async def _free_memory(self, needed: float, keep: Optional[str] = None) -> List[str]:
+        """Evict idle models, least recently used first, until `needed` of the memory is free."""
+        evicted = []
+        if self.free_memory_fn is None or needed <= 0:
+            return evicted
+        while self.free_memory_fn() < needed:
+            idle = [
+                model for model in self.models.values()
+                if model.state == LOADED and not model.in_flight and model.name != keep
+            ]
+            if not idle:
+                break
+            victim = min(idle, key=lambda model: model.last_used)
+            if await self.evict(victim.name):
+                evicted.append(victim.name)
+        return evicted
+
+    async def _load(self, model: ManagedModel) -> None:
+        previous_state = model.state
+        model.state = LOADING
+        model.error = None
+        try:
+            evicted = await self._free_memory(max(model.memory_fraction, self.min_free_memory), keep=model.name)
+            if evicted:
+                logger.info(f"Evicted {evicted} to make room for model {model.name}")
+            start = time.perf_counter()
+            model.engine, model.tokenizer = await asyncio.to_thread(self.load_fn, model.config)
+            model.load_seconds = time.perf_counter() - start
+        except Exception as e:
+            model.state = FAILED
+            model.error = str(e)
+            logger.error(f"Failed to load model {model.name} (was {previous_state}): {str(e)}")
+            raise ModelLoadError(f"Model {model.name} could not be loaded: {str(e)}") from e
+        model.state = LOADED
+        model.loads += 1
+        logger.info(f"Loaded model {model.name} in {model.load_seconds:.1f}s")
+
+    async def _preload(self, name: str) -> None:
+        try:
+            await self.acquire(name)
+        except Exception:
+            return
+        self.release(name)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await self.evict_idle()
+            except Exception as e:
+                logger.error(f"Model eviction check failed: {str(e)}")
@@ -0,0 +1,64 @@
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+import numpy as np
+
+from core.history import SessionHistory
+from helpers.constants import SYSTEM_PROMPT, PROMPT, HISTORY_SUMMARY_PREFIX
+
+# The same object, and so the same bytes, starts every prompt of every session
+SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_PROMPT}
+
+
+def build_messages(history: SessionHistory, question: str, context: str) -> List[Dict[str, str]]:
+    """
+    Chat messages of a request, from the most to the least stable part.
+
+    The engine's prefix cache reuses the KV cache of the longest token prefix
+    a request shares with earlier ones, so the prompt is laid out as: the
+    system prompt, identical for every request; the session summary, which
+    only changes when older turns are folded into it; the prior turns, which
+    only grow between folds; and last the user turn with the retrieved context
+    followed by the question. Requests of a session share everything up to
+    their newest prior turn, and standalone questions about the same
+    documents share the system prompt and the context.
+    """
+    messages = [SYSTEM_MESSAGE]
+    if history.summary:
+        messages.append({"role": "system", "content": f"{HISTORY_SUMMARY_PREFIX}\n{history.summary}"})
+    messages.extend(history.messages)
+    messages.append({"role": "user", "content": PROMPT.format(context=context, question=question)})
+    return messages
+
+
+class PrefixCacheStats:
+    """Share of prompt tokens the engine found in its prefix cache, over the last `window` requests."""
+
+    def __init__(self, window: int = 1000):
+        self.ratios: Deque[float] = deque(maxlen=window)
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.lock = threading.Lock()
+
+    def record(self, prompt_tokens: int, cached_tokens: int) -> Optional[float]:
+        if not prompt_tokens:
+            return None
+        ratio = cached_tokens / prompt_tokens
+        with self.lock:
+            self.ratios.append(ratio)
+            self.prompt_tokens += prompt_tokens
+            self.cached_tokens += cached_tokens
+        return ratio
+
+    def stats(self) -> Dict[str, float]:
+        with self.lock:
+            ratios = np.asarray(self.ratios)
+            return {
+                "requests": len(ratios),
+                "hit_ratio": self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0,
+                "p50_hit_ratio": float(np.percentile(ratios, 50)) if len(ratios) else 0.0,
+                "p5_hit_ratio": float(np.percentile(ratios, 5)) if len(ratios) else 0.0,
+                "prompt_tokens": self.prompt_tokens,
+                "cached_tokens": self.cached_tokens,
+            }
@@ -0,0 +1,65 @@
+import asyncio
+import threading
+from typing import List, Optional, Tuple
+
+import torch
+from langchain_core.documents import Document
+from sentence_transformers import CrossEncoder
+
+
+class CrossEncoderReranker:
+    """
+    Rescores (query, chunk) pairs with a cross-encoder and keeps the best `top_n`.
+
+    Pairs are scored in batches of `batch_size` on a worker thread so the event
+    loop keeps serving other requests. Only one request scores at a time: on a
+    CPU host concurrent scoring would only fight over the same cores.
+    """
+
+    def __init__(
+        self,
+        model_id: str = "cross-encoder/ms-marco-MiniLM-L-6-v2",
+        top_n: int = 3,
+        batch_size: int = 16,
+        max_length: int = 512,
+        device: Optional[str] = None,
+    ):
+        self.top_n = top_n
+        self.batch_size = batch_size
+        device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.model = CrossEncoder(model_id, max_length=max_length, device=device)
+        self.lock = threading.Lock()
+
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        return self.score_pairs([(query, text) for text in texts])
+
+    def score_pairs(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        with self.lock:
+            scores = self.model.predict(
+                pairs,
+                batch_size=self.batch_size,
+                convert_to_numpy=True,
+                show_progress_bar=False,
+            )
+        return scores.tolist()
+
+    async def rerank(
+        self, query: str, docs_and_scores: List[Tuple[Document, float]]
+    ) -> List[Tuple[Document, float]]:
+        """Top `top_n` candidates by cross-encoder score, higher is better."""
+        return (await self.rerank_batch([query], [docs_and_scores]))[0]
+
+    async def rerank_batch(
+        self, queries: List[str], candidates: List[List[Tuple[Document, float]]]
+    ) -> List[List[Tuple[Document, float]]]:
+        """`rerank` of several queries, their pairs scored in one pass over the model."""
+        pairs = [(query, doc.page_content) for query, docs_and_scores in zip(queries, candidates)
+                 for doc, _ in docs_and_scores]
+        scores = await asyncio.to_thread(self.score_pairs, pairs) if pairs else []
+        reranked, offset = [], 0
+        for docs_and_scores in candidates:
+            docs = [doc for doc, _ in docs_and_scores]
+            ranked = sorted(zip(docs, scores[offset:offset + len(docs)]), key=lambda item: item[1], reverse=True)
+            reranked.append(ranked[:self.top_n])
+            offset += len(docs)
+        return reranked
@@ -0,0 +1,384 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from core.context import chunk_key
+from helpers.chroma_utils import tenant_indexes, get_chunks_by_ids
+from helpers.constants import DEFAULT_TENANT
+from helpers.filtered_search import batch_similarity_search, filtered_similarity_search
+from helpers.logger import create_logger
+
+logger = create_logger(__name__)
+
+RETRIEVAL_MODES = ("dense", "lexical", "hybrid")
+
+
+class StageTimings:
+    """Latency of each retrieval stage over the last `window` requests."""
+
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self.samples: Dict[str, Deque[float]] = {}
+        self.counts: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float) -> None:
+        with self.lock:
+            self.samples.setdefault(stage, deque(maxlen=self.window)).append(seconds)
+            self.counts[stage] = self.counts.get(stage, 0) + 1
+
+    @contextmanager
+    def measure(self, stage: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self.lock:
+            stats = {}
+            for stage, samples in self.samples.items():
+                millis = np.asarray(samples) * 1000
+                stats[stage] = {
+                    "count": self.counts[stage],
+                    "avg_ms": float(millis.mean()),
+                    "p50_ms": float(np.percentile(millis, 50)),
+                    "p95_ms": float(np.percentile(millis, 95)),
+                    "max_ms": float(millis.max()),
+                }
+            return stats
+
+
+class Retriever:
+    """
+    Dense, lexical (BM25) or hybrid retrieval over the indexed chunks of a tenant.
+
+    Hybrid mode runs both searches and fuses their rankings with reciprocal
+    rank fusion: each chunk scores sum(1 / (rrf_k + rank)) over the lists it
+    appears in.
+
+    `file_ids` restricts every stage to chunks of those files: it is pushed
+    down as a `where` filter on the `file_id` metadata into Chroma and as a
+    file filter into the BM25 index, so candidates only come from those files.
+    Filters matching at most `exact_search_max_chunks` chunks are searched
+    exactly rather than through the HNSW index.
+
+    With a reranker, the first stage fetches `rerank.candidates` chunks and the
+    cross-encoder keeps the best `rerank.top_n` of them; otherwise the first
+    stage returns `k` chunks directly.
+    """
+
+    def __init__(self, config: Dict[str, Any], rerank_config: Optional[Dict[str, Any]] = None):
+        self.mode = config.get("mode", "dense")
+        if self.mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retriever mode {self.mode}, expected one of {RETRIEVAL_MODES}")
+        self.k = config["k"]
+        self.dense_k = config.get("dense_k", 20)
+        self.lexical_k = config.get("lexical_k", 20)
+        self.rrf_k = config.get("rrf_k", 60)
+        self.exact_search_max_chunks = config.get("exact_search_max_chunks", 200)
+        self.timings = StageTimings()
+        rerank_config = dict(rerank_config or {})
+        self.reranker = None
+        if rerank_config.pop("enabled", False):
+            # Imports torch and sentence-transformers, only when reranking is on
+            from core.rerank import CrossEncoderReranker
+
+            self.candidates = rerank_config.pop("candidates", 20)
+            self.reranker = CrossEncoderReranker(**rerank_config)
+
+    async def dense_search(
+        self,
+        query_embedding: Sequence[float],
+        k: int,
+        tenant: str = DEFAULT_TENANT,
+        file_ids: Optional[Sequence[int]] = None,
+    ) -> List[Tuple[Document, float]]:
+        async with tenant_indexes.use(tenant) as index:
+            with self.timings.measure("dense"):
+                if file_ids is None:
+                    retrieved = await asyncio.to_thread(
+                        index.vectorstore.similarity_search_by_vector_with_relevance_scores, query_embedding, k=k
+                    )
+                else:
+                    retrieved = await asyncio.to_thread(
+                        filtered_similarity_search,
+                        index.vectorstore,
+                        query_embedding,
+                        k,
+                        {"file_id": {"$in": list(file_ids)}},
+                        self.exact_search_max_chunks,
+                    )
+        # Chroma returns distances, lower is closer
+        return [(doc, -distance) for doc, distance in retrieved]
+
+    async def lexical_search(
+        self, query: str, k: int, tenant: str = DEFAULT_TENANT, file_ids: Optional[Sequence[int]] = None
+    ) -> List[Tuple[Document, float]]:
+        async with tenant_indexes.use(tenant) as index:
+            with self.timings.measure("lexical"):
+                hits = await asyncio.to_thread(index.lexical_index.search, query, k, file_ids)
+                docs = await get_chunks_by_ids([chunk_id for chunk_id, _ in hits], tenant)
+        return [(docs[chunk_id], score) for chunk_id, score in hits if chunk_id in docs]
+
+    def fuse(self, *rankings: List[Tuple[Document, float]]) -> List[Tuple[Document, float]]:
+        fused: Dict[str, List] = {}
+        for ranking in rankings:
+            for rank, (doc, _) in enumerate(ranking):
+                entry = fused.setdefault(chunk_key(doc), [doc, 0.0])
+                entry[1] += 1.0 / (self.rrf_k + rank + 1)
+        return sorted(((doc, score) for doc, score in fused.values()), key=lambda item: item[1], reverse=True)
+
+    async def search(
+        self,
+        query: str,
+        query_embedding: Sequence[float],
+        k: int,
+        tenant: str = DEFAULT_TENANT,
+        file_ids: Optional[Sequence[int]] = None,
+    ) -> List[Tuple[Document, float]]:
+        if file_ids is not None and not file_ids:
+            return []
+        if self.mode == "dense":
+            return await self.dense_search(query_embedding, k, tenant, file_ids)
+        if self.mode == "lexical":
+            return await self.lexical_search(query, k, tenant, file_ids)
+        dense, lexical = await asyncio.gather(
+            self.dense_search(query_embedding, max(self.dense_k, k), tenant, file_ids),
+            self.lexical_search(query, max(self.lexical_k, k), tenant, file_ids),
+        )
+        return self.fuse(dense, lexical)[:k]
+
+    async def retrieve(
+        self,
+        query: str,
+        query_embedding: Sequence[float],
+        tenant: str = DEFAULT_TENANT,
+        file_ids: Optional[Sequence[int]] = None,
+    ) -> List[Tuple[Document, float]]:
+        """Best chunks for the query in the tenant's documents, as (document, score) with higher scores first."""
+        with self.timings.measure("retrieve"):
+            if self.reranker is None:
+                return await self.search(query, query_embedding, self.k, tenant, file_ids)
+            candidates = await self.search(query, query_embedding, self.candidates, tenant, file_ids)
+            with self.timings.measure("rerank"):
+                return await self.reranker.rerank(query, candidates)
+
+    async def dense_search_batch(
+        self,
+        query_embeddings: Sequence[Sequence[float]],
+        k: int,
+        tenant: str = DEFAULT_TENANT,
+        file_ids: Optional[Sequence[int]] = None,
+    ) -> List[List[Tuple[Document, float]]]:
+        """`dense_search` of several queries in one multi-query search of the index."""
+        where = None if file_ids is None else {"file_id": {"$in": list(file_ids)}}
+        async with tenant_indexes.use(tenant) as index:
+            with self.timings.measure("dense"):
+                retrieved = await asyncio.to_thread(
+                    batch_similarity_search, index.vectorstore, query_embeddings, k, where, self.exact_search_max_chunks
+                )
+        return [[(doc, -distance) for doc, distance in hits] for hits in retrieved]
+
+    async def lexical_search_batch(
+        self, queries: Sequence[str], k: int, tenant: str = DEFAULT_TENANT, file_ids: Optional[Sequence[int]] = None
+    ) -> List[List[Tuple[Document, float]]]:
+        """`lexical_search` of several queries, their chunks fetched in one lookup."""
+        async with tenant_indexes.use(tenant) as index:
+            with self.timings.measure("lexical"):
+                hits = await asyncio.to_thread(
+                    lambda: [index.lexical_index.search(query, k, file_ids) for query in queries]
+                )
+                docs = await get_chunks_by_ids(
+                    list({chunk_id for query_hits in hits for chunk_id, _ in query_hits}), tenant
+                )
+        return [
+            [(docs[chunk_id], score) for chunk_id, score in query_hits if chunk_id in docs]
+            for query_hits in hits
+        ]
+
+    async def search_batch(
+        self,
+        queries: Sequence[str],
+        query_embeddings: Sequence[Sequence[float]],
+        k: int,
+        tenant: str = DEFAULT_TENANT,
+        file_ids: Optional[Sequence[int]] = None,
+    ) -> List[List[Tuple[Document, float]]]:
+        """`search` of several queries of one tenant with the same file filter."""
+        if file_ids is not None and not file_ids:
+            return [[] for _ in queries]
+        if self.mode == "dense":
+            return await self.dense_search_batch(query_embeddings, k, tenant, file_ids)
+        if self.mode == "lexical":
+            return await self.lexical_search_batch(queries, k, tenant, file_ids)
+        dense, lexical = await asyncio.gather(
+            self.dense_search_batch(query_embeddings, max(self.dense_k, k), tenant, file_ids),
+            self.lexical_search_batch(queries, max(self.lexical_k, k), tenant, file_ids),
+        )
+        return [self.fuse(query_dense, query_lexical)[:k] for query_dense, query_lexical in zip(dense, lexical)]
+
+    async def retrieve_batch(
+        self,
+        queries: Sequence[str],
+        query_embeddings: Sequence[Sequence[float]],
+        tenants: Sequence[str],
+        file_ids: Sequence[Optional[Sequence[int]]],
+    ) -> List[List[Tuple[Document, float]]]:
+        """
+        `retrieve` of several queries at once, in query order.
+
+        Queries of the same tenant with the same file filter share one search,
+        and the candidates of all queries are reranked in one pass.
+        """
+        groups: Dict[Tuple[str, Optional[Tuple[int, ...]]], List[int]] = {}
+        for idx, (tenant, query_file_ids) in enumerate(zip(tenants, file_ids)):
+            key = (tenant, None if query_file_ids is None else tuple(sorted(query_file_ids)))
+            groups.setdefault(key, []).append(idx)
+        k = self.k if self.reranker is None else self.candidates
+        with self.timings.measure("retrieve"):
+            searched = await asyncio.gather(*(
+                self.search_batch(
+                    [queries[idx] for idx in indices], [query_embeddings[idx] for idx in indices], k, tenant, group_file_ids
+                )
+                for (tenant, group_file_ids), indices in groups.items()
+            ))
+            results: List[List[Tuple[Document, float]]] = [[] for _ in queries]
+            for indices, group_results in zip(groups.values(), searched):
+                for idx, docs_and_scores in zip(indices, group_results):
+                    results[idx] = docs_and_scores
+            if self.reranker is None:
+                return results
+            with self.timings.measure("rerank"):
+                return await self.reranker.rerank_batch(list(queries), results)
+
+
+@dataclass
+class RetrievalRequest:
+    query: str
+    tenant: str
+    file_ids: Optional[Tuple[int, ...]]
+    future: asyncio.Future = field(repr=False)
+    enqueued_at: float = 0.0
+
+
+class RetrievalBatcher:
+    """
+    Micro-batches concurrent retrievals into one embedding call and one search.
+
+    Requests are queued, and a single scheduler task takes the first waiting
+    request plus whatever arrives within `max_wait_ms` of it, up to
+    `max_batch_size` queries. The batch is embedded with one `embed_fn` call
+    (one forward pass of the embedding model), searched with one multi-query
+    search per tenant and filter and reranked in one pass, and each waiting
+    coroutine gets its own query embedding and chunks back. Requests that
+    queue up while a batch runs form the next batch without further waiting,
+    so batches grow with load while an idle server adds at most
+    `max_wait_ms` of latency.
+    """
+
+    def __init__(
+        self,
+        retriever: Retriever,
+        embed_fn: Callable[[List[str]], List[List[float]]],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 2.0,
+    ):
+        self.retriever = retriever
+        self.embed_fn = embed_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue: "asyncio.Queue[RetrievalRequest]" = asyncio.Queue()
+        self.task: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.queries = 0
+        self.largest_batch = 0
+
+    async def retrieve(
+        self, query: str, tenant: str = DEFAULT_TENANT, file_ids: Optional[Sequence[int]] = None
+    ) -> Tuple[List[float], List[Tuple[Document, float]]]:
+        """Embedding of the query and its best chunks, as `Retriever.retrieve` returns them."""
+        return (await self.retrieve_many([query], tenant, file_ids))[0]
+
+    async def retrieve_many(
+        self, queries: Sequence[str], tenant: str = DEFAULT_TENANT, file_ids: Optional[Sequence[int]] = None
+    ) -> List[Tuple[List[float], List[Tuple[Document, float]]]]:
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+        loop = asyncio.get_running_loop()
+        file_ids = None if file_ids is None else tuple(file_ids)
+        futures = []
+        for query in queries:
+            future = loop.create_future()
+            self.queue.put_nowait(RetrievalRequest(query, tenant, file_ids, future, loop.time()))
+            futures.append(future)
+        return list(await asyncio.gather(*futures))
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        while not self.queue.empty():
+            request = self.queue.get_nowait()
+            if not request.future.done():
+                request.future.set_exception(RuntimeError("Retrieval batcher stopped"))
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "batches": self.batches,
+            "queries": self.queries,
+            "avg_batch_size": self.queries / self.batches if self.batches else 0.0,
+            "max_batch_size": self.largest_batch,
+            "queue_depth": self.queue.qsize(),
+        }
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = batch[0].enqueued_at + self.max_wait
+            while len(batch) < self.max_batch_size:
+                if not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Requests whose caller went away are not searched for
+            batch = [request for request in batch if not request.future.done()]
+            if batch:
+                await self._process(batch)
+
+    async def _process(self, batch: List[RetrievalRequest]) -> None:
+        queries = [request.query for request in batch]
+        try:
+            with self.retriever.timings.measure("embed"):
+                embeddings = await asyncio.to_thread(self.embed_fn, queries)
+            results = await self.retriever.retrieve_batch(
+                queries, embeddings, [request.tenant for request in batch], [request.file_ids for request in batch]
+            )
+        except Exception as e:
+            logger.error(f"Retrieval of a batch of {len(batch)} queries failed: {str(e)}")
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            return
+        self.batches += 1
+        self.queries += len(batch)
+        self.largest_batch = max(self.largest_batch, len(batch))
+        for request, embedding, docs_and_scores in zip(batch, embeddings, results):
+            if not request.future.done():
+                request.future.set_result((embedding, docs_and_scores))
@@ -1,16 +1,41 @@
+import asyncio
+import gc
+import time
 from dataclasses import dataclass
-from typing import Dict, List, AsyncGenerator, Tuple
+from typing import Dict, List, AsyncGenerator, Optional, Sequence, Tuple
 from uuid import uuid4
 
 import torch
+from langchain_core.documents import Document
 from transformers import AutoTokenizer
 from vllm.engine.arg_utils import AsyncEngineArgs
+from vllm.distributed.parallel_state import destroy_model_parallel
 from vllm.engine.async_llm_engine import AsyncLLMEngine
-from vllm.sampling_params import SamplingParams
+from vllm.sampling_params import SamplingParams, RequestOutputKind
 from vllm.outputs import RequestOutput
 
-from helpers.chroma_utils import vectorstore
-from helpers.constants import HF_TOKEN, SYSTEM_PROMPT, PROMPT, GLOBAL_CONFIG
+from core.admission import AdmissionController, AdmissionLimits
+from core.answer_cache import SemanticAnswerCache, CachedAnswer
+from core.context import PackedContext, pack_context
+from core.fake_engine import FakeModelLoader
+from core.generations import GenerationTracker
+from core.history import HistoryManager, SessionHistory
+from core.model_manager import ManagedModel, ModelManager
+from core.prompt import PrefixCacheStats, build_messages
+from core.retrieval import RetrievalBatcher, Retriever
+from helpers.chroma_utils import get_embedding_function
+from helpers.db_utils import get_corpus_version
+from helpers.embedding_cache import embed_queries
+from helpers.constants import (
+    HF_TOKEN,
+    GLOBAL_CONFIG,
+    SUMMARY_SYSTEM_PROMPT,
+    SUMMARY_PROMPT,
+    DEFAULT_TENANT,
+)
+from helpers.logger import create_logger
+
+logger = create_logger(__name__)
 
 NUM_GPUS = torch.cuda.device_count()
 
@@ -24,6 +49,8 @@ class ModelConfig:
     gpu_memory_utilization: float = 0.9
     trust_remote_code: bool = True
     max_model_len: int = 8912
+    # Reuse the KV cache of prompt prefixes shared with earlier requests, see core.prompt
+    enable_prefix_caching: bool = True
 
 
 @dataclass
@@ -37,19 +64,63 @@ class GenerationConfig:
     repetition_penalty: float
 
 
+def load_vllm_model(model_cfg: ModelConfig) -> Tuple[AsyncLLMEngine, AutoTokenizer]:
+    """Build the engine and tokenizer of a model, on all GPUs."""
+    engine_args = AsyncEngineArgs(
+        model=model_cfg.model_id,
+        tensor_parallel_size=NUM_GPUS,
+        gpu_memory_utilization=model_cfg.gpu_memory_utilization,
+        trust_remote_code=model_cfg.trust_remote_code,
+        max_model_len=model_cfg.max_model_len,
+        enable_prefix_caching=model_cfg.enable_prefix_caching,
+        token=HF_TOKEN,
+    )
+    tokenizer = AutoTokenizer.from_pretrained(model_cfg.model_id)
+    return AsyncLLMEngine.from_engine_args(engine_args), tokenizer
+
+
+def unload_vllm_model(engine: AsyncLLMEngine) -> None:
+    """Stop an engine and release its weights and KV cache from GPU memory."""
+    engine.shutdown_background_loop()
+    # The wrapped LLMEngine owns the model executor, the AsyncLLMEngine shell may still be referenced
+    engine.engine = None
+    destroy_model_parallel()
+    gc.collect()
+    torch.cuda.empty_cache()
+
+
+def free_gpu_memory() -> float:
+    """Free fraction of memory on the fullest GPU."""
+    if not NUM_GPUS:
+        return 1.0
+    return min(free / total for free, total in (torch.cuda.mem_get_info(idx) for idx in range(NUM_GPUS)))
+
+
 class DocQA:
     def __init__(self):
         self.config = GLOBAL_CONFIG
-        self.retriever = vectorstore.as_retriever(
-            search_kwargs={"k": self.config["retriever"]["k"]}
-        )
-        self.system_dict = {"role": "system", "content": SYSTEM_PROMPT}
+        self.retriever = Retriever(self.config["retriever"], self.config.get("rerank"))
+        self.batcher = self._get_batcher()
+        context_config = self.config.get("context", {})
+        self.context_max_tokens = context_config.get("max_tokens", 4096)
+        self.dedup_threshold = context_config.get("dedup_threshold", 0.9)
+        self.context_order = context_config.get("order", "document")
+        self.prefix_cache = PrefixCacheStats()
         self.sampling_params = self._get_sampling_params()
+        self.answer_cache = self._get_answer_cache()
+        self.admission = self._get_admission()
+        self.generations = GenerationTracker()
+        self.history = HistoryManager(**self.config.get("history", {}))
+        self.summary_sampling_params = SamplingParams(
+            max_tokens=self.history.summary_max_tokens,
+            temperature=0.0,
+            output_kind=RequestOutputKind.FINAL_ONLY,
+        )
         self._init_models()
 
     def _init_models(self) -> None:
-        """Initialize model artifacts as specified in the configuration."""
-        self.models = {}
+        """Register the configured models, each is loaded on its first request."""
+        configs = {}
         for model_config in self.config["models"]:
             model_cfg = ModelConfig(
                 **{
@@ -58,22 +129,24 @@ class DocQA:
                     if k in ModelConfig.__annotations__
                 }
             )
+            configs[model_cfg.name] = model_cfg
 
-            engine_args = AsyncEngineArgs(
-                model=model_cfg.model_id,
-                tensor_parallel_size=NUM_GPUS,
-                gpu_memory_utilization=model_cfg.gpu_memory_utilization,
-                trust_remote_code=model_cfg.trust_remote_code,
-                max_model_len=model_cfg.max_model_len,
-                token=HF_TOKEN,
-            )
-            tokenizer = AutoTokenizer.from_pretrained(model_cfg.model_id)
-            model = AsyncLLMEngine.from_engine_args(engine_args)
-            
-            self.models[model_cfg.name] = {
-                "model": model,
-                "tokenizer": tokenizer
-            }
+        manager_config = self.config.get("model_manager", {})
+        if manager_config.get("fake_engine", False):
+            loader = FakeModelLoader()
+            load_fn, unload_fn, free_memory_fn = loader.load, loader.unload, loader.free_memory
+        else:
+            load_fn, unload_fn, free_memory_fn = load_vllm_model, unload_vllm_model, free_gpu_memory
+        self.models = ModelManager(
+            configs,
+            load_fn,
+            unload_fn=unload_fn,
+            free_memory_fn=free_memory_fn,
+            idle_ttl=manager_config.get("idle_ttl_seconds", 1800),
+            check_interval=manager_config.get("check_interval_seconds", 30),
+            min_free_memory=manager_config.get("min_free_memory", 0.0),
+        )
+        self.preload_models = manager_config.get("preload", [])
 
     def _get_sampling_params(self) -> SamplingParams:
         gen_config = self.config["generation"]
@@ -82,41 +155,279 @@ class DocQA:
             temperature=gen_config["temperature"],
             top_p=gen_config["top_p"],
             repetition_penalty=gen_config["repetition_penalty"],
+            # Each output carries only the newly generated text
+            output_kind=RequestOutputKind.DELTA,
         )
 
-    async def __call__(
-        self, query: str, model_name: str, messages: List[Dict[str, str]]
-    ) -> Tuple[AsyncGenerator[RequestOutput, None], str]:
+    def _get_batcher(self) -> RetrievalBatcher | None:
+        """Micro-batcher that embeds and searches concurrent questions together, None when disabled."""
+        batching_config = dict(self.config["retriever"].get("batching", {}))
+        if not batching_config.pop("enabled", False):
+            return None
+        return RetrievalBatcher(
+            self.retriever, lambda texts: embed_queries(get_embedding_function(), texts), **batching_config
+        )
+
+    def _get_answer_cache(self) -> SemanticAnswerCache | None:
+        cache_config = self.config.get("answer_cache", {})
+        if not cache_config.get("enabled", False):
+            return None
+        return SemanticAnswerCache(
+            similarity_threshold=cache_config.get("similarity_threshold", 0.95),
+            max_entries=cache_config.get("max_entries", 1000),
+        )
+
+    def _get_admission(self) -> AdmissionController | None:
+        """Per-model limits on concurrent and queued chat requests, None when disabled."""
+        admission_config = dict(self.config.get("admission", {}))
+        if not admission_config.pop("enabled", False):
+            return None
+        model_limits = admission_config.pop("models", {})
+        default = AdmissionLimits(**admission_config)
+        return AdmissionController(
+            default,
+            {name: AdmissionLimits(**{**admission_config, **limits}) for name, limits in model_limits.items()},
+        )
+
+    def _context_budget(self, model: ManagedModel, history: SessionHistory, query: str) -> int:
+        """Tokens left for retrieved context once the prompt around it and the answer are accounted for."""
+        tokenizer = model.tokenizer
+        model_cfg = model.config
+        prompt_tokens = len(
+            tokenizer.apply_chat_template(
+                build_messages(history, query, context=""),
+                tokenize=True,
+                add_generation_prompt=True,
+            )
+        )
+        budget = model_cfg.max_model_len - self.sampling_params.max_tokens - prompt_tokens
+        return max(0, min(budget, self.context_max_tokens))
+
+    async def _track_prefix_hits(
+        self, request_generator: AsyncGenerator[RequestOutput, None], request_id: str
+    ) -> AsyncGenerator[RequestOutput, None]:
+        """Pass engine outputs through and record how much of the prompt the prefix cache served."""
+        first = True
+        async for req_output in request_generator:
+            if first:
+                first = False
+                cached_tokens = getattr(req_output, "num_cached_tokens", None)
+                prompt_token_ids = getattr(req_output, "prompt_token_ids", None)
+                if cached_tokens is not None and prompt_token_ids:
+                    ratio = self.prefix_cache.record(len(prompt_token_ids), cached_tokens)
+                    logger.info(
+                        f"Request {request_id}: {cached_tokens}/{len(prompt_token_ids)} prompt tokens "
+                        f"from the prefix cache ({ratio:.1%})"
+                    )
+            yield req_output
+
+    async def _record_answer(
+        self,
+        request_generator: AsyncGenerator[RequestOutput, None],
+        model_name: str,
+        query_embedding,
+        file_ids: Tuple[int, ...],
+        corpus_version: int,
+        tenant: str,
+        context: PackedContext,
+    ) -> AsyncGenerator[RequestOutput, None]:
+        """Pass engine outputs through and store the finished answer in the answer cache."""
+        start = time.perf_counter()
+        parts, offsets = [], []
+        num_chars = 0
+        req_output = None
+        async for req_output in request_generator:
+            delta = req_output.outputs[0].text
+            parts.append(delta)
+            num_chars += len(delta)
+            offsets.append(num_chars)
+            yield req_output
+        if req_output is not None and req_output.finished:
+            self.answer_cache.put(
+                CachedAnswer(
+                    model_name=model_name,
+                    tenant=tenant,
+                    corpus_version=corpus_version,
+                    embedding=query_embedding,
+                    file_ids=file_ids,
+                    context=context,
+                    text="".join(parts),
+                    offsets=offsets,
+                    generation_seconds=time.perf_counter() - start,
+                )
+            )
+
+    async def _summarize(self, model_name: str, session_id: str, previous_summary: str, turns: List[Dict]) -> str:
         """
-        Generate responses based on the query and specified model.
+        Fold conversation turns into the running summary of a session. Summaries wait for an
+        admission slot of the model like answers, under a session of their own so they never
+        count against the chat requests of the session; a rejected summary is folded in on a
+        later turn.
         """
-        if model_name not in self.models:
-            raise KeyError(
-                f"Model {model_name} not found. Available models: {list(self.models.keys())}"
-            )
+        admission_session = f"summary-{session_id}"
+        slot = await self.admission.acquire(model_name, admission_session) if self.admission is not None else None
+        try:
+            model = await self.models.acquire(model_name)
+            try:
+                return await self._generate_summary(model.engine, model.tokenizer, previous_summary, turns)
+            finally:
+                self.models.release(model_name)
+        finally:
+            if slot is not None:
+                slot.release()
 
-        model = self.models[model_name]["model"]
-        tokenizer = self.models[model_name]["tokenizer"]
-        # Retrieve relevant documents
-        retrieved_docs = await self.retriever.ainvoke(query)
-        retrieved_docs = "\n".join([doc.page_content for doc in retrieved_docs])
-        # Prepare input messages
-        messages_copy = messages.copy()
-        messages_copy.insert(0, self.system_dict)
-        messages_copy.append(
-            {
-                "role": "user",
-                "content": PROMPT.format(question=query, context=retrieved_docs),
-            }
+    async def _generate_summary(self, engine, tokenizer, previous_summary: str, turns: List[Dict]) -> str:
+        turns_text = "\n".join(
+            f"User: {turn['user_query']}\nAssistant: {turn['response']}" for turn in turns
         )
         input_text = tokenizer.apply_chat_template(
-            messages_copy, tokenize=False, add_generation_prompt=True
+            [
+                {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+                {
+                    "role": "user",
+                    "content": SUMMARY_PROMPT.format(summary=previous_summary or "(empty)", turns=turns_text),
+                },
+            ],
+            tokenize=False,
+            add_generation_prompt=True,
         )
-        request_id = str(uuid4())
-        request_generator = model.generate(
+        req_output = None
+        async for req_output in engine.generate(
             prompt=input_text,
-            sampling_params=self.sampling_params,
-            request_id=request_id,
+            sampling_params=self.summary_sampling_params,
+            request_id=f"summary-{uuid4()}",
+        ):
+            pass
+        return req_output.outputs[0].text.strip()
+
+    async def __call__(
+        self,
+        query: str,
+        model_name: str,
+        session_id: Optional[str] = None,
+        tenant: str = DEFAULT_TENANT,
+        filter_file_ids: Optional[Sequence[int]] = None,
+        request_id: Optional[str] = None,
+    ) -> Tuple[AsyncGenerator[RequestOutput, None], PackedContext]:
+        """
+        Generate responses based on the query and specified model, from the tenant's documents
+        (only those in `filter_file_ids` when given). A cached answer is replayed right away,
+        without an admission slot or the model. Otherwise the request waits for an admission
+        slot of the model, raising AdmissionRejected when it cannot get one in time, and the
+        model is loaded first if it is not; the slot and the model count as in use until the
+        returned generator is exhausted or closed. Closing it early aborts the engine request,
+        which `cancel(request_id)` also does.
+        """
+        # Follow-up questions depend on the session history, only standalone ones are cached
+        use_cache = self.answer_cache is not None and not await self.history.has_history(session_id)
+        # Read before retrieving, a write during retrieval makes the answer stale
+        corpus_version = await get_corpus_version(tenant) if use_cache else 0
+        query_embedding, docs_and_scores = await self._retrieve(query, tenant, filter_file_ids)
+        file_ids = tuple(sorted({doc.metadata.get("file_id", -1) for doc, _ in docs_and_scores}))
+        cache_key = None
+        if use_cache:
+            query_embedding = self.answer_cache.normalize(query_embedding)
+            cached = self.answer_cache.get(query_embedding, model_name, file_ids, corpus_version, tenant)
+            if cached is not None:
+                return self.answer_cache.replay(cached), cached.context
+            cache_key = (query_embedding, file_ids, corpus_version)
+
+        # Admission limits count generations only, cache hits never reach the engine
+        slot = await self.admission.acquire(model_name, session_id) if self.admission is not None else None
+        try:
+            model = await self.models.acquire(model_name)
+            try:
+                result_gen, context = await self._answer(
+                    model, query, session_id, tenant, docs_and_scores, request_id or str(uuid4()), cache_key
+                )
+            except BaseException:
+                self.models.release(model_name)
+                raise
+        except BaseException:
+            if slot is not None:
+                slot.release()
+            raise
+        if slot is not None:
+            result_gen = self.admission.track(slot, result_gen)
+        return result_gen, context
+
+    async def cancel(self, request_id: str) -> bool:
+        """Abort an answer being generated, returns False when there is no such request."""
+        return await self.generations.cancel(request_id)
+
+    async def retrieve(
+        self, queries: Sequence[str], tenant: str = DEFAULT_TENANT, filter_file_ids: Optional[Sequence[int]] = None
+    ) -> List[List[Tuple[Document, float]]]:
+        """Best chunks for each query, retrieved together in batches rather than one query at a time."""
+        if self.batcher is not None:
+            retrieved = await self.batcher.retrieve_many(queries, tenant, filter_file_ids)
+            return [docs_and_scores for _, docs_and_scores in retrieved]
+        with self.retriever.timings.measure("embed"):
+            embeddings = await asyncio.to_thread(embed_queries, get_embedding_function(), list(queries))
+        return await self.retriever.retrieve_batch(
+            queries, embeddings, [tenant] * len(queries), [filter_file_ids] * len(queries)
+        )
+
+    async def _retrieve(
+        self, query: str, tenant: str, filter_file_ids: Optional[Sequence[int]]
+    ) -> Tuple[List[float], List[Tuple[Document, float]]]:
+        """Embedding of the query and its best chunks."""
+        if self.batcher is not None:
+            return await self.batcher.retrieve(query, tenant, filter_file_ids)
+        with self.retriever.timings.measure("embed"):
+            query_embedding = await get_embedding_function().aembed_query(query)
+        return query_embedding, await self.retriever.retrieve(query, query_embedding, tenant, filter_file_ids)
+
+    async def _answer(
+        self,
+        model: ManagedModel,
+        query: str,
+        session_id: Optional[str],
+        tenant: str,
+        docs_and_scores: List[Tuple[Document, float]],
+        request_id: str,
+        cache_key: Optional[tuple],
+    ) -> Tuple[AsyncGenerator[RequestOutput, None], PackedContext]:
+        """Generate the answer from retrieved chunks, stored in the answer cache under `cache_key` when given."""
+        model_name = model.name
+        tokenizer = model.tokenizer
+        history = await self.history.load(session_id, tokenizer)
+        context = pack_context(
+            docs_and_scores,
+            tokenizer,
+            self._context_budget(model, history, query),
+            self.dedup_threshold,
+            self.context_order,
+        )
+
+        input_text = tokenizer.apply_chat_template(
+            build_messages(history, query, context.text), tokenize=False, add_generation_prompt=True
+        )
+        request_generator = self.generations.track(
+            self._track_prefix_hits(
+                model.engine.generate(
+                    prompt=input_text,
+                    sampling_params=self.sampling_params,
+                    request_id=request_id,
+                ),
+                request_id,
+            ),
+            request_id,
+            model_name,
+            model.engine,
+            self.sampling_params.max_tokens,
         )
+        if session_id:
+            self.history.schedule_summary_update(
+                session_id,
+                history,
+                tokenizer,
+                lambda summary, turns: self._summarize(model_name, session_id, summary, turns),
+            )
+        if cache_key is not None:
+            query_embedding, file_ids, corpus_version = cache_key
+            request_generator = self._record_answer(
+                request_generator, model_name, query_embedding, file_ids, corpus_version, tenant, context
+            )
 
-        return request_generator, retrieved_docs
+        return self.models.track(model_name, request_generator), context
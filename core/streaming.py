@@ -0,0 +1,66 @@
+import json
+import time
+from typing import AsyncGenerator, List
+
+
+class SSEStream:
+    """
+    Turns engine delta outputs into Server-Sent Events frames for one response.
+
+    Deltas are buffered and sent as one frame once `coalesce_ms` passed since
+    the first buffered delta or `coalesce_chars` characters are waiting,
+    whichever comes first. The window is checked as deltas arrive, so a
+    buffered delta waits at most one engine step past it; the last one is
+    flushed when the generation ends. The parts of each frame that never
+    change are serialized once up front, so a frame costs a single
+    `json.dumps` of the new text. The full answer is available as `text` once
+    the stream is done, and `finished` tells whether the engine finished it.
+    """
+
+    def __init__(self, session_id: str, coalesce_ms: float = 20, coalesce_chars: int = 256):
+        self.coalesce_seconds = coalesce_ms / 1000
+        self.coalesce_chars = coalesce_chars
+        # Same bytes as json.dumps({'token': token, 'session_id': session_id})
+        self._prefix = 'data: {"token": '
+        self._suffix = f', "session_id": {json.dumps(session_id)}}}\n\n'
+        self.parts: List[str] = []
+        self.num_frames = 0
+        self.finished = False
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    def frame(self, token: str) -> str:
+        self.num_frames += 1
+        return self._prefix + json.dumps(token) + self._suffix
+
+    async def frames(self, outputs: AsyncGenerator) -> AsyncGenerator[str, None]:
+        """
+        Yield SSE frames for engine outputs whose `.outputs[0].text` holds only the new text.
+
+        `outputs` is closed when the frames stop, also when they are closed
+        early, so whatever it holds for the request is released right away.
+        """
+        pending: List[str] = []
+        pending_chars = 0
+        deadline = 0.0
+        try:
+            async for output in outputs:
+                self.finished = output.finished
+                delta = output.outputs[0].text
+                if not delta:
+                    continue
+                self.parts.append(delta)
+                pending.append(delta)
+                pending_chars += len(delta)
+                now = time.monotonic()
+                if len(pending) == 1:
+                    deadline = now + self.coalesce_seconds
+                if pending_chars >= self.coalesce_chars or now >= deadline:
+                    yield self.frame("".join(pending))
+                    pending, pending_chars = [], 0
+            if pending:
+                yield self.frame("".join(pending))
+        finally:
+            await outputs.aclose()
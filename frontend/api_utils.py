@@ -77,4 +77,40 @@ def delete_document(file_id):
             return None
     except Exception as e:
         st.error(f"An error occurred while deleting the document: {str(e)}")
-        return None
\ No newline at end of file
+        return None
+
+def list_sessions():
+    try:
+        response = requests.get("http://localhost:8083/sessions")
+        if response.status_code == 200:
+            return response.json()
+        else:
+            st.error(f"Failed to fetch chat sessions. Error: {response.status_code} - {response.text}")
+            return []
+    except Exception as e:
+        st.error(f"An error occurred while fetching chat sessions: {str(e)}")
+        return []
+
+def get_session_history(session_id):
+    try:
+        response = requests.get(f"http://localhost:8083/sessions/{session_id}")
+        if response.status_code == 200:
+            return response.json()
+        else:
+            st.error(f"Failed to load chat session. Error: {response.status_code} - {response.text}")
+            return []
+    except Exception as e:
+        st.error(f"An error occurred while loading the chat session: {str(e)}")
+        return []
+
+def delete_session(session_id):
+    try:
+        response = requests.delete(f"http://localhost:8083/sessions/{session_id}")
+        if response.status_code == 200:
+            return response.json()
+        else:
+            st.error(f"Failed to delete chat session. Error: {response.status_code} - {response.text}")
+            return None
+    except Exception as e:
+        st.error(f"An error occurred while deleting the chat session: {str(e)}")
+        return None
@@ -2,8 +2,9 @@ import sys
 import streamlit as st
 import sys
 # sys.path.append("helpers")
-from frontend.api_utils import upload_document, list_documents, delete_document
-from helpers.db_utils import get_all_chat_sessions, get_chat_history, delete_chat_session
+from frontend.api_utils import (
+    upload_document, list_documents, delete_document, list_sessions, get_session_history, delete_session
+)
 
 
 
@@ -36,7 +37,7 @@ def display_chat_history():
         create_new_chat()
 
     st.divider()
-    chat_sessions = get_all_chat_sessions()
+    chat_sessions = list_sessions()
     if not chat_sessions:
         st.info("No previous chats found", icon="ℹ️")
         return
@@ -53,7 +54,7 @@ def display_chat_history():
                     use_container_width=True
                 ):
                     # Load this chat session
-                    messages = get_chat_history(session['session_id'])
+                    messages = get_session_history(session['session_id'])
                     st.session_state.session_id = session['session_id']
                     st.session_state.messages = []
                     for msg in messages:
@@ -68,7 +69,7 @@ def display_chat_history():
                     help="Delete this chat",
                     type="secondary",
                 ):
-                    if delete_chat_session(session['session_id']):
+                    if delete_session(session['session_id']):
                         # If currently viewing this chat, create a new session
                         if st.session_state.session_id == session['session_id']:
                             create_new_chat()
@@ -85,7 +86,7 @@ def display_document_management():
             with st.spinner("Uploading..."):
                 upload_response = upload_document(uploaded_file)
                 if upload_response:
-                    st.success(f"File '{uploaded_file.name}' uploaded successfully.")
+                    st.success(f"File '{uploaded_file.name}' uploaded and queued for indexing.")
                     st.session_state.documents = list_documents()
     
     # Document List Section
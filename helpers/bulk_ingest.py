@@ -0,0 +1,253 @@
+"""
+Bulk ingestion of many documents at once.
+
+Usage:
+    python -m helpers.bulk_ingest <directory-or-zip> [--workers N] [--batch-size N] [--tenant NAME]
+
+The CLI writes the indexes directly and refuses to run while an API process
+serves from the same working directory.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Union
+
+from helpers.chroma_utils import (
+    add_chunks_to_chroma,
+    delete_chunks_from_chroma,
+    delete_doc_from_chroma,
+    flush_indexes,
+    get_chunk_ids,
+    index_lock,
+    IndexLocked,
+    plan_chunk_updates,
+)
+from helpers.constants import GLOBAL_CONFIG, ALLOWED_EXTENSIONS, DEFAULT_TENANT
+from helpers.db_utils import (
+    db_pool,
+    initialize_db,
+    insert_document_records,
+    delete_document_records,
+    get_document_by_hash,
+    get_latest_document_by_filename,
+    update_document_hashes,
+)
+from helpers.document_utils import split_document, hash_file
+
+ingestion_config = GLOBAL_CONFIG.get('ingestion', {})
+DEFAULT_BATCH_SIZE = ingestion_config.get('bulk_batch_size', 512)
+
+
+async def bulk_index_documents(
+    files: List[Tuple[str, str]],
+    max_workers: Optional[int] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    tenant: str = DEFAULT_TENANT,
+) -> Dict[str, Any]:
+    """
+    Parse, embed and index many documents in one pass.
+
+    Files whose content hash is already indexed are skipped, files re-uploaded
+    under a known filename only embed their changed chunks. The rest are parsed
+    in parallel across a process pool, their rows are inserted into
+    `document_store` in one transaction, and chunks from all files are pooled
+    into batches of `batch_size` so each `add_documents` call embeds many files
+    at once. Each batch is written as soon as it fills up and files are parsed
+    only a few ahead of the writes, so memory holds a few files and one batch
+    rather than every chunk of the collection.
+
+    Args:
+        files (List[Tuple[str, str]]): (filename, file_path) pairs
+        max_workers (Optional[int]): Parser processes, defaults to the CPU count
+        batch_size (int): Chunks per embedding / vector store write
+        tenant (str): Tenant the documents belong to
+
+    Returns:
+        Dict[str, Any]: Per-file results and overall throughput
+    """
+    start = time.perf_counter()
+    results = [{"filename": filename, "status": "pending", "file_id": None, "num_chunks": 0,
+                "chunks_reused": 0, "chunks_embedded": 0, "error": None}
+               for filename, _ in files]
+
+    candidates = []
+    for idx, (filename, file_path) in enumerate(files):
+        if os.path.splitext(filename)[1].lower() not in ALLOWED_EXTENSIONS:
+            results[idx].update(status="failed", error="Unsupported file type")
+        else:
+            candidates.append(idx)
+
+    hashes = await asyncio.gather(*[asyncio.to_thread(hash_file, files[idx][1]) for idx in candidates])
+    content_hashes, updates, to_parse, seen_hashes = {}, {}, [], set()
+    for idx, content_hash in zip(candidates, hashes):
+        duplicate = await get_document_by_hash(content_hash, tenant)
+        if duplicate or content_hash in seen_hashes:
+            results[idx].update(status="skipped", error="Identical content is already indexed")
+            if duplicate:
+                reused = len(await get_chunk_ids(duplicate["id"], tenant))
+                results[idx].update(file_id=duplicate["id"], num_chunks=reused, chunks_reused=reused)
+            continue
+        seen_hashes.add(content_hash)
+        content_hashes[idx] = content_hash
+        previous = await get_latest_document_by_filename(files[idx][0], tenant)
+        if previous:
+            updates[idx] = previous["id"]
+        to_parse.append(idx)
+
+    # Rows of new files are inserted in one transaction, those of files that fail are removed below
+    new_idxs = [idx for idx in to_parse if idx not in updates]
+    file_ids = dict(updates)
+    file_ids.update(zip(new_idxs, await insert_document_records([files[idx][0] for idx in new_idxs], tenant)))
+
+    failed, stale_ids, chunks = set(), {}, []
+
+    async def write(batch):
+        try:
+            await add_chunks_to_chroma(
+                [chunk for _, chunk, _ in batch], [chunk_id for _, _, chunk_id in batch], tenant
+            )
+        except Exception as e:
+            for idx, _, _ in batch:
+                results[idx].update(status="failed", error=f"Indexing failed: {str(e)}")
+                failed.add(idx)
+
+    # Parsers stay busy while a parsed file is being embedded, without parsing far ahead of the writes
+    max_pending = 2 * (max_workers or os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        async for idx, splits in parse_files([(idx, files[idx][1]) for idx in to_parse], executor, max_pending):
+            if isinstance(splits, Exception):
+                results[idx].update(status="failed", error=str(splits))
+                failed.add(idx)
+                continue
+            new_chunks, new_ids, stale_ids[idx], reused = await plan_chunk_updates(
+                splits, file_ids[idx], is_new=idx not in updates, tenant=tenant
+            )
+            results[idx].update(file_id=file_ids[idx], num_chunks=reused + len(new_chunks),
+                                chunks_reused=reused, chunks_embedded=len(new_chunks))
+            chunks.extend((idx, chunk, chunk_id) for chunk, chunk_id in zip(new_chunks, new_ids))
+            while len(chunks) >= batch_size:
+                await write(chunks[:batch_size])
+                chunks = chunks[batch_size:]
+        if chunks:
+            await write(chunks)
+
+    succeeded = [idx for idx in to_parse if idx not in failed]
+    await delete_chunks_from_chroma([chunk_id for idx in succeeded for chunk_id in stale_ids[idx]], tenant)
+    await update_document_hashes([(file_ids[idx], content_hashes[idx]) for idx in succeeded])
+
+    # New files spanning several batches may be partially written, re-uploads keep their previous version
+    failed_new_file_ids = [file_ids[idx] for idx in failed if idx not in updates]
+    for file_id in failed_new_file_ids:
+        await delete_doc_from_chroma(file_id, tenant)
+    if failed_new_file_ids:
+        await delete_document_records(failed_new_file_ids)
+
+    for result in results:
+        if result["status"] == "pending":
+            result["status"] = "indexed"
+        elif result["status"] == "failed":
+            result.update(num_chunks=0, chunks_reused=0, chunks_embedded=0)
+
+    elapsed = time.perf_counter() - start
+    indexed = [result for result in results if result["status"] == "indexed"]
+    num_chunks = sum(result["num_chunks"] for result in indexed)
+    return {
+        "files": results,
+        "num_succeeded": len(indexed),
+        "num_skipped": sum(result["status"] == "skipped" for result in results),
+        "num_failed": sum(result["status"] == "failed" for result in results),
+        "num_chunks": num_chunks,
+        "chunks_reused": sum(result["chunks_reused"] for result in indexed),
+        "chunks_embedded": sum(result["chunks_embedded"] for result in indexed),
+        "elapsed_seconds": elapsed,
+        "docs_per_second": len(indexed) / elapsed if elapsed else 0.0,
+        "chunks_per_second": num_chunks / elapsed if elapsed else 0.0,
+    }
+
+
+async def parse_files(
+    files: List[Tuple[int, str]], executor: Executor, max_pending: int
+) -> AsyncIterator[Tuple[int, Union[List, Exception]]]:
+    """
+    Chunks of each (idx, file_path) in order, as (idx, chunks) or (idx, the
+    exception parsing raised). Files are split in `executor` at most
+    `max_pending` ahead of the consumer, so memory holds those files' chunks
+    and the consumer's batch instead of the whole collection.
+    """
+    loop = asyncio.get_running_loop()
+    pending = deque()
+    next_file = 0
+    try:
+        while pending or next_file < len(files):
+            while next_file < len(files) and len(pending) < max(1, max_pending):
+                idx, file_path = files[next_file]
+                pending.append((idx, loop.run_in_executor(executor, split_document, file_path)))
+                next_file += 1
+            idx, future = pending.popleft()
+            try:
+                splits = await future
+            except Exception as e:
+                splits = e
+            yield idx, splits
+    finally:
+        for _, future in pending:
+            future.cancel()
+
+
+def collect_files(root: str) -> List[Tuple[str, str]]:
+    """List (filename, file_path) pairs for every supported file under `root`."""
+    files = []
+    for dirpath, _, filenames in os.walk(root):
+        for filename in sorted(filenames):
+            if os.path.splitext(filename)[1].lower() in ALLOWED_EXTENSIONS:
+                files.append((filename, os.path.join(dirpath, filename)))
+    return files
+
+
+async def run_cli(files: List[Tuple[str, str]], max_workers: int, batch_size: int, tenant: str) -> Dict[str, Any]:
+    # A running API holds the indexes open and would neither see these writes nor keep its own consistent
+    index_lock.acquire(exclusive=True, blocking=False)
+    try:
+        await initialize_db()
+        try:
+            return await bulk_index_documents(files, max_workers=max_workers, batch_size=batch_size, tenant=tenant)
+        finally:
+            await flush_indexes()
+            await db_pool.close()
+    finally:
+        index_lock.release()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk index a directory or zip archive of documents.")
+    parser.add_argument("path", help="Directory or .zip archive to ingest")
+    parser.add_argument("--workers", type=int, default=None, help="Parser processes (default: CPU count)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Chunks per embedding batch")
+    parser.add_argument("--tenant", default=DEFAULT_TENANT, help="Tenant to index the documents for")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        root = args.path
+        if zipfile.is_zipfile(args.path):
+            with zipfile.ZipFile(args.path) as archive:
+                archive.extractall(tmp_dir)
+            root = tmp_dir
+        elif not os.path.isdir(args.path):
+            parser.error(f"{args.path} is neither a directory nor a zip archive")
+
+        try:
+            report = asyncio.run(run_cli(collect_files(root), args.workers, args.batch_size, args.tenant))
+        except IndexLocked as e:
+            parser.exit(1, f"{e}. Stop the API first, or upload the documents through POST /upload-docs.\n")
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
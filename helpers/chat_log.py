@@ -0,0 +1,152 @@
+import asyncio
+from collections import Counter
+from typing import List, Optional
+
+from helpers.constants import GLOBAL_CONFIG
+from helpers.session_store import ChatTurn, session_store
+from helpers.logger import create_logger
+
+logger = create_logger(__name__)
+
+
+class ChatLogWriter:
+    """
+    Write-behind logger for chat turns.
+
+    `log` only enqueues the turn; a background task writes queued turns to
+    the session store in one transaction per batch, once `batch_size` turns
+    are waiting or `flush_interval` seconds after the first one arrived. When
+    `max_queue_size` turns are waiting, because the store is slower than the
+    traffic, `log` waits for room in the queue, so callers slow down instead
+    of losing turns. A failed batch is retried with a growing delay and
+    dropped after `max_attempts` attempts, which keeps the queue moving while
+    the store is down. `stop` writes what is still queued, with one attempt
+    per batch, for at most `stop_timeout` seconds.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = 64,
+        flush_interval: float = 0.2,
+        max_queue_size: int = 10000,
+        max_attempts: int = 5,
+        stop_timeout: float = 10.0,
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.stop_timeout = stop_timeout
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        self.pending: Counter = Counter()
+        self.flushed: Optional[asyncio.Condition] = None
+        self.task: Optional[asyncio.Task] = None
+        self.stopping = False
+        self.written = 0
+        self.waited = 0
+        self.dropped = 0
+
+    async def start(self) -> None:
+        self.flushed = asyncio.Condition()
+        self.stopping = False
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self.task is None:
+            return
+        # Queued batches get a single attempt from now on, so the queue drains even while the store is down
+        self.stopping = True
+        try:
+            await asyncio.wait_for(self._drain(), self.stop_timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Chat log writer stopped after {self.stop_timeout}s, {self.queue.qsize()} turns not written")
+        self.task = None
+
+    async def _drain(self) -> None:
+        await self.queue.put(None)
+        await self.task
+
+    async def log(self, turn: ChatTurn) -> None:
+        if self.queue.full():
+            self.waited += 1
+            logger.warning(f"Chat log queue is full, a turn of session {turn.session_id} waits for room")
+        # Counted while waiting for room too, so history reads of the session wait for it
+        self.pending[turn.session_id] += 1
+        try:
+            await self.queue.put(turn)
+        except BaseException:
+            self.pending[turn.session_id] -= 1
+            self.pending += Counter()
+            logger.error(f"A turn of session {turn.session_id} was not logged, its request was cancelled")
+            raise
+
+    async def wait_for_session(self, session_id: str, timeout: float = 5.0) -> None:
+        """Wait until queued turns of a session are written, so its history reads see them."""
+        if not self.pending.get(session_id) or self.flushed is None:
+            return
+        async with self.flushed:
+            try:
+                await asyncio.wait_for(
+                    self.flushed.wait_for(lambda: not self.pending.get(session_id)), timeout
+                )
+            except asyncio.TimeoutError:
+                logger.warning(f"Chat turns of session {session_id} still queued after {timeout}s")
+
+    async def _collect(self) -> tuple:
+        """Next batch, and whether the stop sentinel was reached."""
+        turn = await self.queue.get()
+        if turn is None:
+            return [], True
+        batch = [turn]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - loop.time()
+            try:
+                turn = self.queue.get_nowait() if timeout <= 0 else await asyncio.wait_for(self.queue.get(), timeout)
+            except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                break
+            if turn is None:
+                return batch, True
+            batch.append(turn)
+        return batch, False
+
+    async def _write(self, batch: List[ChatTurn]) -> None:
+        attempt = 1
+        while True:
+            try:
+                await session_store.append_turns(batch)
+                self.written += len(batch)
+                break
+            except Exception as e:
+                if attempt >= self.max_attempts or self.stopping:
+                    self.dropped += len(batch)
+                    logger.error(f"Dropped {len(batch)} chat turns after {attempt} failed writes: {str(e)}")
+                    break
+                logger.warning(f"Failed to write {len(batch)} chat turns (attempt {attempt}): {str(e)}")
+                await asyncio.sleep(self.flush_interval * 2 ** (attempt - 1))
+                attempt += 1
+        # Dropped turns are done too, history reads waiting for them go ahead without them
+        async with self.flushed:
+            self.pending.subtract(turn.session_id for turn in batch)
+            self.pending += Counter()
+            self.flushed.notify_all()
+
+    async def _run(self) -> None:
+        done = False
+        while not done:
+            batch, done = await self._collect()
+            if batch:
+                await self._write(batch)
+
+    def stats(self) -> dict:
+        return {"queued": self.queue.qsize(), "written": self.written, "waited": self.waited, "dropped": self.dropped}
+
+
+chat_log_config = GLOBAL_CONFIG.get('chat_log', {})
+chat_log_writer = ChatLogWriter(
+    batch_size=chat_log_config.get('batch_size', 64),
+    flush_interval=chat_log_config.get('flush_interval', 0.2),
+    max_queue_size=chat_log_config.get('max_queue_size', 10000),
+    max_attempts=chat_log_config.get('max_attempts', 5),
+    stop_timeout=chat_log_config.get('stop_timeout', 10.0),
+)
@@ -1,104 +1,572 @@
+from __future__ import annotations
+
+import asyncio
 import os
-from typing import List
-
-from langchain.document_loaders import (
-    PyPDFLoader, 
-    Docx2txtLoader, 
-    TextLoader, 
-    UnstructuredHTMLLoader, 
-    CSVLoader,
-    UnstructuredMarkdownLoader
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, AsyncIterator, Dict, List, Optional, Set, Tuple, Union
+
+from helpers.constants import (
+    GLOBAL_CONFIG,
+    CHROMA_DB_NAME,
+    EMBEDDING_CACHE_DIR_NAME,
+    LEXICAL_INDEX_DIR_NAME,
+    FAISS_INDEX_DIR_NAME,
+    INDEX_LOCK_NAME,
+    DEFAULT_TENANT,
 )
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.embeddings import HuggingFaceEmbeddings
-from langchain.vectorstores import Chroma
-from langchain.schema import Document
+from helpers.db_utils import bump_corpus_version
+from helpers.document_utils import hash_text, chunk_id
 
-from helpers.constants import GLOBAL_CONFIG, CHROMA_DB_NAME
+# Imported where they are used, so that importing this module stays cheap
+if TYPE_CHECKING:
+    from langchain.vectorstores import Chroma
+    from langchain_core.documents import Document
+
+    from helpers.faiss_store import FaissVectorStore
+    from helpers.lexical_index import BM25Index
 
 
 db_path = os.path.join(os.getcwd(), CHROMA_DB_NAME)
-text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200, length_function=len)
 
-embedding_function = HuggingFaceEmbeddings(
-    model_name=GLOBAL_CONFIG['retriever']['model_id'],
-    model_kwargs={'device': 'cuda'}
-)
+embedding_cache_config = GLOBAL_CONFIG.get('embedding_cache', {})
+embedding_executor_config = GLOBAL_CONFIG.get('embedding_executor', {})
+retriever_config = GLOBAL_CONFIG['retriever']
+vectorstore_config = GLOBAL_CONFIG.get('vectorstore', {})
+LEXICAL_FLUSH_INTERVAL = retriever_config.get('lexical_flush_interval', 30)
+VECTORSTORE_BACKENDS = ('chroma', 'faiss')
+VECTORSTORE_BACKEND = vectorstore_config.get('backend', 'chroma')
+if VECTORSTORE_BACKEND not in VECTORSTORE_BACKENDS:
+    raise ValueError(f"Unknown vector store backend {VECTORSTORE_BACKEND}, expected one of {VECTORSTORE_BACKENDS}")
+VECTORSTORE_FLUSH_INTERVAL = vectorstore_config.get('flush_interval', 0)
+# Chroma holds the GIL for a whole write, small writes let the event loop run in between
+VECTORSTORE_WRITE_BATCH_SIZE = vectorstore_config.get('write_batch_size', 32)
+
+# The embedding model and the Chroma client are created on first use, not on import
+_embedding_function = None
+_embedding_executor = None
+_chroma_client = None
+_embedding_lock = threading.Lock()
+_chroma_client_lock = threading.Lock()
+
+
+def get_embedding_function():
+    """
+    Embedding model of the retriever, loaded on first use.
+
+    Returns:
+        Embeddings: HuggingFace embeddings run on the embedding executor, behind the embedding cache when it is enabled
+    """
+    global _embedding_function, _embedding_executor
+    with _embedding_lock:
+        if _embedding_function is None:
+            from langchain.embeddings import HuggingFaceEmbeddings
+            from helpers.embedding_executor import EmbeddingExecutor, PrioritizedEmbeddings
+
+            embeddings = HuggingFaceEmbeddings(
+                model_name=retriever_config['model_id'],
+                model_kwargs={'device': retriever_config.get('device', 'cuda')}
+            )
+            # Model calls run on dedicated threads, queries ahead of document batches
+            _embedding_executor = EmbeddingExecutor(concurrency=embedding_executor_config.get('concurrency', 1))
+            embeddings = PrioritizedEmbeddings(
+                embeddings,
+                _embedding_executor,
+                document_batch_size=embedding_executor_config.get('document_batch_size', 32),
+            )
+            if embedding_cache_config.get('enabled', False):
+                from helpers.embedding_cache import CachedEmbeddings
+
+                embeddings = CachedEmbeddings(
+                    embeddings,
+                    model_id=retriever_config['model_id'],
+                    cache_dir=os.path.join(os.getcwd(), EMBEDDING_CACHE_DIR_NAME),
+                    max_entries=embedding_cache_config.get('max_entries', 500_000),
+                    memory_entries=embedding_cache_config.get('memory_entries', 10_000),
+                )
+            _embedding_function = embeddings
+    return _embedding_function
+
+
+def get_embedding_executor():
+    """Executor running the embedding model's calls, None until the model is loaded."""
+    return _embedding_executor
+
+
+def get_chroma_client():
+    """Persistent Chroma client, opened on first use."""
+    global _chroma_client
+    with _chroma_client_lock:
+        if _chroma_client is None:
+            import chromadb
+            from chromadb.config import Settings
+
+            client_settings = Settings(anonymized_telemetry=False, is_persistent=True, persist_directory=db_path)
+            if vectorstore_config.get('memory_limit_bytes'):
+                # Chroma unloads the least recently used collection indexes beyond this limit
+                client_settings.chroma_segment_cache_policy = 'LRU'
+                client_settings.chroma_memory_limit_bytes = vectorstore_config['memory_limit_bytes']
+            _chroma_client = chromadb.PersistentClient(path=db_path, settings=client_settings)
+    return _chroma_client
+
+
+class IndexLocked(RuntimeError):
+    """Raised when another process holds the index lock in a conflicting mode."""
+
+
+class IndexLock:
+    """
+    Advisory file lock over the vector store, BM25 and FAISS files of the working directory.
+
+    API processes share it while they serve, since their writes go through
+    their own open indexes. The bulk ingestion CLI writes the stores directly,
+    so it takes the lock exclusively, and neither side writes under indexes
+    the other one holds open. Closing the lock file releases the lock, also
+    when the process dies.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def acquire(self, exclusive: bool = False, blocking: bool = True) -> None:
+        import fcntl
+
+        lock_file = open(self.path, 'a')
+        mode = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        try:
+            fcntl.flock(lock_file, mode if blocking else mode | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            holder = "an API process" if exclusive else "bulk ingestion"
+            raise IndexLocked(f"The indexes in {os.path.dirname(self.path)} are in use by {holder}")
+        self._file = lock_file
+
+    def release(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+index_lock = IndexLock(os.path.join(os.getcwd(), INDEX_LOCK_NAME))
 
-vectorstore = Chroma(persist_directory=db_path, embedding_function=embedding_function)
 
+# Tenant names end up in collection names and index paths
+TENANT_PATTERN = re.compile(r'^[A-Za-z0-9](?:[A-Za-z0-9_-]{0,46}[A-Za-z0-9])?$')
 
-async def load_and_split_document(file_path: str) -> List[Document]:
+
+def validate_tenant(tenant: str) -> str:
+    if not TENANT_PATTERN.match(tenant):
+        raise ValueError(
+            f"Invalid tenant {tenant!r}: use 1-48 letters, digits, '-' or '_', "
+            "starting and ending with a letter or digit"
+        )
+    return tenant
+
+
+# Chroma._LANGCHAIN_DEFAULT_COLLECTION_NAME, without importing chromadb
+DEFAULT_COLLECTION_NAME = 'langchain'
+
+
+def collection_name(tenant: str) -> str:
+    # The default tenant keeps the collection documents were indexed into before tenants existed
+    return DEFAULT_COLLECTION_NAME if tenant == DEFAULT_TENANT else f'tenant-{tenant}'
+
+
+def create_vectorstore(tenant: str):
     """
-    Load and split documents from various file types.
+    Open the vector store collection of a tenant with the configured backend.
+
     Args:
-        file_path (str): Path to the document file
-    
+        tenant (str): Tenant owning the collection
+
     Returns:
-        List[Document]: List of document chunks
-    """
-    file_ext = file_path.lower().split('.')[-1]
-    loaders = {
-        'pdf': PyPDFLoader,
-        'docx': Docx2txtLoader,
-        'txt': TextLoader,
-        'html': UnstructuredHTMLLoader,
-        'csv': CSVLoader,
-        'md': UnstructuredMarkdownLoader
-    }
-    
-    if file_ext not in loaders:
-        raise ValueError(f"Unsupported file type: {file_path}")
-    
-    try:
-        loader = loaders[file_ext](file_path)
-        documents = loader.load()
-        return text_splitter.split_documents(documents)
-    except Exception as e:
-        raise RuntimeError(f"Error loading {file_path}: {str(e)}")
+        Chroma | FaissVectorStore: Collection exposing the Chroma calls used in this module
+    """
+    if VECTORSTORE_BACKEND == 'faiss':
+        from helpers.faiss_store import FaissVectorStore
+
+        return FaissVectorStore(
+            os.path.join(os.getcwd(), FAISS_INDEX_DIR_NAME, collection_name(tenant)),
+            get_embedding_function(),
+            **vectorstore_config.get('faiss', {}),
+        )
+    from langchain.vectorstores import Chroma
+
+    return Chroma(
+        client=get_chroma_client(),
+        collection_name=collection_name(tenant),
+        embedding_function=get_embedding_function(),
+    )
+
+
+# Every store of the process comes from `create_vectorstore`, so its type follows the configured backend
+
+def count_chunks(store) -> int:
+    return store.count() if VECTORSTORE_BACKEND == 'faiss' else store._collection.count()
+
+
+def delete_chunks_where(store, where: Dict) -> None:
+    if VECTORSTORE_BACKEND == 'faiss':
+        store.delete(where=where)
+    else:
+        store._collection.delete(where=where)
+
+
+def flush_vectorstore(store, min_interval: float = 0.0) -> None:
+    # Chroma persists every write itself
+    if VECTORSTORE_BACKEND == 'faiss':
+        store.flush(min_interval)
+
+
+@dataclass
+class TenantIndex:
+    """Vector store collection of one tenant and the BM25 index over the same chunks."""
+
+    tenant: str
+    vectorstore: Union[Chroma, FaissVectorStore]
+    lexical_index: Optional[BM25Index] = None
+    # Requests using the index right now, and in total, see `TenantIndexCache.use`
+    users: int = 0
+    uses: int = 0
+    closing: bool = False
+
+
+def open_tenant_index(tenant: str) -> TenantIndex:
+    from helpers.lexical_index import BM25Index
+
+    index = TenantIndex(tenant=tenant, vectorstore=create_vectorstore(tenant))
+    # BM25 index over the same chunks, maintained whenever the retriever is not purely dense
+    if retriever_config.get('mode', 'dense') != 'dense':
+        lexical_dir = os.path.join(os.getcwd(), LEXICAL_INDEX_DIR_NAME)
+        if tenant != DEFAULT_TENANT:
+            lexical_dir = os.path.join(lexical_dir, 'tenants', tenant)
+        index.lexical_index = BM25Index.load(os.path.join(lexical_dir, 'index.pkl'))
+    return index
+
+
+class TenantIndexCache:
+    """
+    Lazily opened tenant indexes, at most `max_open` idle ones at a time.
+
+    Requests work with a tenant's indexes inside `use`, which keeps them open
+    until the request is done. Once more than `max_open` tenants are open,
+    the least recently used ones that no request is using are closed (their
+    indexes flushed and dropped from memory); busy ones are closed after
+    their last request. A tenant is opened once even when several requests
+    ask for it at the same time, and its BM25 index is brought in step with
+    the vector store on open.
+    """
+
+    def __init__(self, max_open: int = 64):
+        self.max_open = max_open
+        self.entries: "OrderedDict[str, TenantIndex]" = OrderedDict()
+        self.opening: Dict[str, asyncio.Future] = {}
+
+    async def get(self, tenant: str = DEFAULT_TENANT) -> TenantIndex:
+        """Open a tenant's indexes, may be closed again at any await unless held through `use`."""
+        index = self.entries.get(tenant)
+        if index is not None:
+            self.entries.move_to_end(tenant)
+            return index
+        validate_tenant(tenant)
+        if tenant not in self.opening:
+            self.opening[tenant] = asyncio.ensure_future(self._open(tenant))
+        return await asyncio.shield(self.opening[tenant])
+
+    @asynccontextmanager
+    async def use(self, tenant: str = DEFAULT_TENANT) -> AsyncIterator[TenantIndex]:
+        """A tenant's indexes, kept open until the block exits."""
+        index = await self.get(tenant)
+        index.users += 1
+        index.uses += 1
+        try:
+            yield index
+        finally:
+            index.users -= 1
+            await self._close_idle()
+
+    async def _open(self, tenant: str) -> TenantIndex:
+        try:
+            index = await asyncio.to_thread(open_tenant_index, tenant)
+            await sync_lexical_index(index)
+            self.entries[tenant] = index
+            return index
+        finally:
+            del self.opening[tenant]
+
+    async def _close_idle(self) -> None:
+        """Close the least recently used idle tenants while more than `max_open` are open."""
+        for tenant, index in list(self.entries.items()):
+            if len(self.entries) <= self.max_open:
+                return
+            # Not used yet: just opened for a request that has not picked it up
+            if index.users or not index.uses or index.closing:
+                continue
+            uses = index.uses
+            index.closing = True
+            try:
+                await flush_tenant_index(index)
+            finally:
+                index.closing = False
+            # A request that used it during the flush may have left writes the flush missed, it stays open
+            if not index.users and index.uses == uses and self.entries.get(tenant) is index:
+                del self.entries[tenant]
+
+    def open_indexes(self) -> List[TenantIndex]:
+        return list(self.entries.values())
 
 
-async def index_document_to_chroma(file_path: str, file_id: int) -> bool:
+tenant_indexes = TenantIndexCache(max_open=vectorstore_config.get('max_open_tenants', 64))
+
+def tag_chunks(
+    splits: List[Document], file_id: int, seen: Optional[Set[str]] = None
+) -> Tuple[List[Document], List[str]]:
     """
-    Index a document to Chroma vector store with a specific file ID.
-    
+    Add `file_id` and `chunk_hash` metadata to each split and derive its Chroma id.
+    Identical chunks within the same file are kept once.
+
     Args:
-        file_path (str): Path to the document to be indexed
+        splits (List[Document]): Document chunks produced by `helpers.document_utils.split_document`
         file_id (int): Unique identifier for the document
-    
+        seen (Optional[Set[str]]): Ids of the file's chunks in earlier batches, updated in place
+
     Returns:
-        bool: True if indexing succeeds, False otherwise
+        Tuple[List[Document], List[str]]: Unique chunks and their ids
     """
-    try:
-        splits = await load_and_split_document(file_path)
-        # Add metadata to each split
-        for split in splits:
-            split.metadata['file_id'] = file_id
-        
-        await vectorstore.aadd_documents(splits)
-        return True
-    except Exception as e:
-        print(f"Error indexing document: {e}")
-        return False
+    chunks, ids = [], []
+    seen = set() if seen is None else seen
+    for split in splits:
+        chunk_hash = hash_text(split.page_content)
+        split_id = chunk_id(file_id, chunk_hash)
+        if split_id in seen:
+            continue
+        seen.add(split_id)
+        split.metadata['file_id'] = file_id
+        split.metadata['chunk_hash'] = chunk_hash
+        chunks.append(split)
+        ids.append(split_id)
+    return chunks, ids
+
+
+async def get_chunk_ids(file_id: int, tenant: str = DEFAULT_TENANT) -> List[str]:
+    """Ids of all chunks currently stored for a file."""
+    async with tenant_indexes.use(tenant) as index:
+        result = await asyncio.to_thread(index.vectorstore.get, where={"file_id": file_id}, include=[])
+    return result['ids']
+
+
+async def plan_chunk_updates(
+    splits: List[Document], file_id: int, is_new: bool = False, tenant: str = DEFAULT_TENANT
+) -> Tuple[List[Document], List[str], List[str], int]:
+    """
+    Diff freshly split chunks of a file against what Chroma already holds for it.
+
+    Args:
+        splits (List[Document]): Document chunks produced by `helpers.document_utils.split_document`
+        file_id (int): Unique identifier for the document
+        is_new (bool): Skip the lookup for files that cannot have stored chunks yet
+        tenant (str): Tenant owning the document
+
+    Returns:
+        Tuple[List[Document], List[str], List[str], int]: Chunks to embed, their ids,
+            ids of stale chunks to delete and the number of reused chunks
+    """
+    chunks, ids = tag_chunks(splits, file_id)
+    existing_ids = set() if is_new else set(await get_chunk_ids(file_id, tenant))
+    new_chunks = [chunk for chunk, id_ in zip(chunks, ids) if id_ not in existing_ids]
+    new_ids = [id_ for id_ in ids if id_ not in existing_ids]
+    stale_ids = list(existing_ids - set(ids))
+    return new_chunks, new_ids, stale_ids, len(ids) - len(new_ids)
+
+
+async def index_split_batches(
+    batches: AsyncIterator[List[Document]],
+    file_id: int,
+    is_new: bool = False,
+    tenant: str = DEFAULT_TENANT,
+    added: Optional[List[str]] = None,
+) -> Dict[str, float]:
+    """
+    Incrementally index the chunks of a file as they are parsed, one batch at a time:
+    chunks whose content hash is already stored are reused and new ones are embedded
+    and written before the next batch is read, so only one batch of chunks and
+    embeddings is held at a time. Stale chunks are deleted once the whole file has
+    been read, so a failure never leaves the file with fewer chunks than before.
+
+    Args:
+        batches (AsyncIterator[List[Document]]): Chunks of the file, see `helpers.document_utils.stream_split_batches`
+        file_id (int): Unique identifier for the document
+        is_new (bool): Skip the lookup of stored chunks for a brand new file
+        tenant (str): Tenant whose collection the document goes into
+        added (Optional[List[str]]): Ids of the chunks written so far, updated in place, so that
+            a caller can remove them when indexing fails partway
+
+    Returns:
+        Dict[str, float]: Counts of chunks, reused, embedded and deleted chunks, and the seconds
+            spent waiting for parsed batches and indexing them
+    """
+    existing_ids = set() if is_new else set(await get_chunk_ids(file_id, tenant))
+    seen: Set[str] = set()
+    stats = {"num_chunks": 0, "chunks_reused": 0, "chunks_embedded": 0, "parse_seconds": 0.0, "index_seconds": 0.0}
+    start = time.perf_counter()
+    async for splits in batches:
+        stats["parse_seconds"] += time.perf_counter() - start
+        start = time.perf_counter()
+        chunks, ids = tag_chunks(splits, file_id, seen)
+        new_chunks = [chunk for chunk, id_ in zip(chunks, ids) if id_ not in existing_ids]
+        new_ids = [id_ for id_ in ids if id_ not in existing_ids]
+        await add_chunks_to_chroma(new_chunks, new_ids, tenant)
+        if added is not None:
+            added.extend(new_ids)
+        stats["num_chunks"] += len(splits)
+        stats["chunks_reused"] += len(ids) - len(new_ids)
+        stats["chunks_embedded"] += len(new_chunks)
+        stats["index_seconds"] += time.perf_counter() - start
+        start = time.perf_counter()
+    stats["parse_seconds"] += time.perf_counter() - start
+    start = time.perf_counter()
+    stale_ids = list(existing_ids - seen)
+    await delete_chunks_from_chroma(stale_ids, tenant)
+    stats["chunks_deleted"] = len(stale_ids)
+    stats["index_seconds"] += time.perf_counter() - start
+    return stats
+
+
+async def add_chunks_to_chroma(chunks: List[Document], ids: List[str], tenant: str = DEFAULT_TENANT) -> None:
+    """
+    Write already tagged chunks to Chroma, `vectorstore.write_batch_size` chunks
+    per embedding call and write.
+
+    Args:
+        chunks (List[Document]): Chunks carrying `file_id` and `chunk_hash` metadata
+        ids (List[str]): Chroma ids of the chunks, see `chunk_id`
+        tenant (str): Tenant whose collection the chunks go into
+    """
+    if chunks:
+        async with tenant_indexes.use(tenant) as index:
+            size = VECTORSTORE_WRITE_BATCH_SIZE
+            for offset in range(0, len(chunks), size):
+                await index.vectorstore.aadd_documents(chunks[offset:offset + size], ids=ids[offset:offset + size])
+            await bump_corpus_version(tenant)
+            await asyncio.to_thread(flush_vectorstore, index.vectorstore, VECTORSTORE_FLUSH_INTERVAL)
+            if index.lexical_index is not None:
+                await asyncio.to_thread(
+                    index.lexical_index.add,
+                    ids,
+                    [chunk.page_content for chunk in chunks],
+                    [chunk.metadata['file_id'] for chunk in chunks],
+                )
+                await asyncio.to_thread(index.lexical_index.flush, LEXICAL_FLUSH_INTERVAL)
+
+
+async def delete_chunks_from_chroma(ids: List[str], tenant: str = DEFAULT_TENANT) -> None:
+    if ids:
+        async with tenant_indexes.use(tenant) as index:
+            await index.vectorstore.adelete(ids=ids)
+            await bump_corpus_version(tenant)
+            await asyncio.to_thread(flush_vectorstore, index.vectorstore, VECTORSTORE_FLUSH_INTERVAL)
+            if index.lexical_index is not None:
+                await asyncio.to_thread(index.lexical_index.remove, ids)
+                await asyncio.to_thread(index.lexical_index.flush, LEXICAL_FLUSH_INTERVAL)
+
+
+async def get_chunks_by_ids(ids: List[str], tenant: str = DEFAULT_TENANT) -> Dict[str, Document]:
+    """Fetch stored chunks by Chroma id, ids that no longer exist are left out."""
+    from langchain_core.documents import Document
+
+    if not ids:
+        return {}
+    async with tenant_indexes.use(tenant) as index:
+        result = await asyncio.to_thread(index.vectorstore.get, ids=ids, include=["documents", "metadatas"])
+    return {
+        id_: Document(page_content=text, metadata=metadata or {})
+        for id_, text, metadata in zip(result['ids'], result['documents'], result['metadatas'])
+    }
 
 
-async def delete_doc_from_chroma(file_id: int):
+async def sync_lexical_index(index: TenantIndex, page_size: int = 5000) -> None:
+    """
+    Bring a tenant's BM25 index in step with its vector store collection.
+
+    The chunk ids of both are compared, so a BM25 index that missed some writes
+    is repaired even when it holds as many chunks as the collection: chunks
+    missing from it are fetched and added, chunks no longer stored are removed.
+
+    Args:
+        index (TenantIndex): Freshly opened indexes of the tenant
+        page_size (int): Chunks read from the vector store per call
+    """
+    lexical_index = index.lexical_index
+    if lexical_index is None:
+        return
+    vectorstore = index.vectorstore
+    count = await asyncio.to_thread(count_chunks, vectorstore)
+    stored_ids: Set[str] = set()
+    for offset in range(0, count, page_size):
+        page = await asyncio.to_thread(vectorstore.get, include=[], limit=page_size, offset=offset)
+        stored_ids.update(page['ids'])
+    indexed_ids = await asyncio.to_thread(lexical_index.chunk_id_set)
+    missing = list(stored_ids - indexed_ids)
+    removed = list(indexed_ids - stored_ids)
+    if not missing and not removed:
+        return
+    print(f"Syncing lexical index of tenant {index.tenant}: adding {len(missing)} chunks, removing {len(removed)}")
+    await asyncio.to_thread(lexical_index.remove, removed)
+    for offset in range(0, len(missing), page_size):
+        page = await asyncio.to_thread(
+            vectorstore.get, ids=missing[offset:offset + page_size], include=["documents", "metadatas"]
+        )
+        await asyncio.to_thread(
+            lexical_index.add,
+            page['ids'],
+            page['documents'],
+            [(metadata or {}).get('file_id') for metadata in page['metadatas']],
+        )
+    await asyncio.to_thread(lexical_index.flush)
+
+
+async def flush_tenant_index(index: TenantIndex) -> None:
+    """Persist the BM25 index and, for the faiss backend, the vector index of a tenant."""
+    if index.lexical_index is not None:
+        await asyncio.to_thread(index.lexical_index.flush)
+    await asyncio.to_thread(flush_vectorstore, index.vectorstore)
+
+
+async def flush_indexes() -> None:
+    """Persist the indexes of every open tenant."""
+    for index in tenant_indexes.open_indexes():
+        await flush_tenant_index(index)
+
+
+async def delete_doc_from_chroma(file_id: int, tenant: str = DEFAULT_TENANT):
     """
     Delete all document chunks associated with a specific file ID from Chroma.
-    
+
     Args:
         file_id (int): Unique identifier of the document to delete
-    
+        tenant (str): Tenant owning the document
+
     Returns:
         bool: True if deletion succeeds, False otherwise
     """
     try:
-        docs = await vectorstore.aget(where={"file_id": file_id})
-        print(f"Found {len(docs['ids'])} document chunks for file_id {file_id}")
-        
-        await vectorstore._collection.adelete(where={"file_id": file_id})
+        async with tenant_indexes.use(tenant) as index:
+            docs = await asyncio.to_thread(index.vectorstore.get, where={"file_id": file_id}, include=[])
+            print(f"Found {len(docs['ids'])} document chunks for file_id {file_id}")
+
+            await asyncio.to_thread(delete_chunks_where, index.vectorstore, {"file_id": file_id})
+            await bump_corpus_version(tenant)
+            await asyncio.to_thread(flush_vectorstore, index.vectorstore, VECTORSTORE_FLUSH_INTERVAL)
+            if index.lexical_index is not None:
+                await asyncio.to_thread(index.lexical_index.remove_file, file_id)
+                await asyncio.to_thread(index.lexical_index.flush, LEXICAL_FLUSH_INTERVAL)
         print(f"Deleted all documents with file_id {file_id}")
-        
+
         return True
     except Exception as e:
         print(f"Error deleting document with file_id {file_id} from Chroma: {str(e)}")
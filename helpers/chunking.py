@@ -0,0 +1,372 @@
+from __future__ import annotations
+
+import csv
+import io
+import os
+import re
+from dataclasses import dataclass
+from html import unescape
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+    from tokenizers import Tokenizer
+
+# Document format per file extension; everything else (PDF pages, docx) is plain text
+FORMATS = {'md': 'markdown', 'html': 'html', 'csv': 'csv'}
+
+_FENCE = r"^(?:```|~~~)[^\n]*\n[\s\S]*?^(?:```|~~~)[ \t]*$"
+_HEADING = r"^(#{1,6})[ \t]+[^\n]*$"
+_PARAGRAPH = r"(?:^(?!#{1,6}[ \t]|```|~~~)[ \t]*\S[^\n]*(?:\n|\Z))+"
+# Headings and code fences end a paragraph, so a table or list right under a heading is a block of its own.
+# A fence that is never closed falls through to the last alternative, one line at a time.
+_MARKDOWN_BLOCK = re.compile(rf"{_FENCE}|(?P<heading>{_HEADING})|{_PARAGRAPH}|^[^\n]*\S[^\n]*$", re.M)
+_TEXT_BLOCK = re.compile(r"(?:^[ \t]*\S[^\n]*(?:\n|\Z))+", re.M)
+_WHITESPACE = re.compile(r"\s+")
+# Comments, doctypes and processing instructions, tags (name group), or text up to the next tag
+_HTML_TOKEN = re.compile(r"<!--[\s\S]*?-->|<[!?][^>]*>|<(/?)([a-zA-Z][\w:-]*)[^>]*>|[^<]+|<")
+
+
+@dataclass
+class Block:
+    """A structural unit of a document: `text[start:end]` of the rendered document text."""
+
+    start: int
+    end: int
+    heading_level: int = 0
+
+
+def markdown_blocks(text: str) -> List[Block]:
+    """Headings, fenced code and paragraphs (which keeps tables and lists whole) of a Markdown text."""
+    blocks = []
+    for match in _MARKDOWN_BLOCK.finditer(text):
+        end = match.start() + len(match.group().rstrip())
+        level = len(match.group().split(None, 1)[0]) if match.group('heading') else 0
+        blocks.append(Block(match.start(), end, level))
+    return blocks
+
+
+def text_blocks(text: str) -> List[Block]:
+    """Paragraphs (runs of non-blank lines) of a plain text."""
+    return [Block(match.start(), match.start() + len(match.group().rstrip())) for match in _TEXT_BLOCK.finditer(text)]
+
+
+class _HTMLRenderer:
+    """
+    Renders HTML as text, one block per heading, paragraph-like element and table.
+
+    Tags are found with a regular expression rather than html.parser, which is
+    several times slower; malformed markup degrades to text instead of failing.
+    """
+
+    BLOCK_TAGS = {'p', 'div', 'li', 'pre', 'blockquote', 'section', 'article', 'header', 'footer', 'main',
+                  'ul', 'ol', 'dl', 'dt', 'dd', 'figure', 'figcaption', 'form', 'nav', 'aside', 'body'}
+    HEADING_TAGS = {'h1': 1, 'h2': 2, 'h3': 3, 'h4': 4, 'h5': 5, 'h6': 6}
+    SKIP_TAGS = {'script', 'style', 'title', 'template', 'noscript', 'textarea'}
+
+    def __init__(self):
+        self.parts: List[str] = []
+        self.length = 0
+        self.blocks: List[Block] = []
+        self.buffer: List[str] = []
+        self.heading_level = 0
+        self.table_depth = 0
+        self.row: Optional[List[List[str]]] = None
+        self.rows: List[str] = []
+
+    def feed(self, html: str):
+        pos = 0
+        while pos < len(html):
+            match = _HTML_TOKEN.match(html, pos)
+            pos = match.end()
+            tag = match.group(2)
+            if tag is None:
+                if match.group()[0] != '<' or match.group() == '<':
+                    self.handle_data(unescape(match.group()))
+                continue
+            tag = tag.lower()
+            if match.group(1):
+                self.handle_endtag(tag)
+            elif tag in self.SKIP_TAGS:
+                # Raw text such as scripts may contain '<', skip straight to the closing tag
+                end = re.compile(rf"</{tag}\s*>", re.I).search(html, pos)
+                pos = end.end() if end else len(html)
+            else:
+                self.handle_starttag(tag)
+
+    def handle_starttag(self, tag):
+        if tag == 'table':
+            self.flush()
+            self.table_depth += 1
+        elif self.table_depth:
+            if tag == 'tr':
+                self.row = []
+            elif tag in ('td', 'th') and self.row is not None:
+                self.row.append([])
+        elif tag in self.HEADING_TAGS:
+            self.flush()
+            self.heading_level = self.HEADING_TAGS[tag]
+        elif tag in self.BLOCK_TAGS:
+            self.flush()
+        elif tag == 'br':
+            self.buffer.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag == 'table' and self.table_depth:
+            self.table_depth -= 1
+            if not self.table_depth:
+                self.add_block('\n'.join(self.rows))
+                self.rows = []
+        elif self.table_depth:
+            if tag == 'tr' and self.row is not None:
+                cells = [_WHITESPACE.sub(' ', ''.join(cell)).strip() for cell in self.row]
+                if any(cells):
+                    self.rows.append(' | '.join(cells))
+                self.row = None
+        elif tag in self.HEADING_TAGS:
+            self.flush()
+            self.heading_level = 0
+        elif tag in self.BLOCK_TAGS:
+            self.flush()
+
+    def handle_data(self, data):
+        if self.table_depth:
+            if self.row:
+                self.row[-1].append(data)
+        else:
+            self.buffer.append(data)
+
+    def flush(self):
+        if self.buffer:
+            self.add_block('\n'.join(_WHITESPACE.sub(' ', line).strip() for line in ''.join(self.buffer).split('\n')))
+            self.buffer = []
+
+    def add_block(self, text: str):
+        text = text.strip()
+        if not text:
+            return
+        if self.parts:
+            self.parts.append('\n\n')
+            self.length += 2
+        self.blocks.append(Block(self.length, self.length + len(text), self.heading_level))
+        self.parts.append(text)
+        self.length += len(text)
+
+    def close(self):
+        self.flush()
+        if self.rows:
+            self.add_block('\n'.join(self.rows))
+
+
+def html_blocks(html: str) -> Tuple[str, List[Block]]:
+    """Rendered text of an HTML document and its blocks; table rows become `cell | cell` lines."""
+    renderer = _HTMLRenderer()
+    renderer.feed(html)
+    renderer.close()
+    return ''.join(renderer.parts), renderer.blocks
+
+
+def csv_blocks(text: str) -> Tuple[str, List[Block]]:
+    """Rendered text of a CSV file and one block per row, as `column: value` lines like CSVLoader."""
+    reader = csv.reader(io.StringIO(text))
+    header = next(reader, [])
+    parts, blocks, length = [], [], 0
+    for row in reader:
+        row_text = '\n'.join(f"{column.strip()}: {value.strip()}" for column, value in zip(header, row))
+        if not row_text:
+            continue
+        if parts:
+            parts.append('\n\n')
+            length += 2
+        blocks.append(Block(length, length + len(row_text)))
+        parts.append(row_text)
+        length += len(row_text)
+    return ''.join(parts), blocks
+
+
+def document_blocks(text: str, fmt: str) -> Tuple[str, List[Block]]:
+    """Text the chunks of a document are cut from and its structural blocks."""
+    if fmt == 'markdown':
+        return text, markdown_blocks(text)
+    if fmt == 'html':
+        return html_blocks(text)
+    if fmt == 'csv':
+        return csv_blocks(text)
+    return text, text_blocks(text)
+
+
+def document_format(doc: Document) -> str:
+    source = doc.metadata.get('source') or ''
+    return FORMATS.get(source.lower().rsplit('.', 1)[-1], 'text')
+
+
+def load_tokenizer(name: str) -> Tokenizer:
+    """A `tokenizers` tokenizer from a tokenizer.json file or a Hugging Face model id."""
+    from tokenizers import Tokenizer
+
+    from helpers.constants import HF_TOKEN
+
+    if os.path.isfile(name):
+        return Tokenizer.from_file(name)
+    return Tokenizer.from_pretrained(name, token=HF_TOKEN)
+
+
+class StructuredChunker:
+    """
+    Splits documents on their structure into chunks of at most `chunk_tokens` tokens.
+
+    Markdown is split into headings, fenced code and paragraphs (tables and
+    lists stay whole), HTML into headings, paragraph-like elements and tables,
+    CSV into rows and plain text (PDF pages, docx) into paragraphs. A heading
+    always starts a new chunk and its path is stored as `section`. Consecutive
+    blocks of a section are packed into a chunk as long as they fit, and the
+    next chunk repeats trailing blocks of up to `chunk_overlap` tokens. A block
+    larger than `chunk_tokens` is cut into windows of its tokens, preferably
+    at a line or sentence end.
+
+    All blocks of the documents passed to `split_documents` are tokenized in
+    one `encode_batch` call, which the Rust tokenizer spreads over all cores,
+    and packed with cumulative sums, so no text is tokenized twice. A chunk's
+    token count, the sum of its blocks' and separators' counts, is stored as
+    `num_tokens` with the tokenizer name, for context assembly to reuse.
+    """
+
+    def __init__(self, tokenizer: Tokenizer, tokenizer_name: str, chunk_tokens: int = 512, chunk_overlap: int = 64):
+        if not 0 <= chunk_overlap < chunk_tokens:
+            raise ValueError("chunk_overlap must be smaller than chunk_tokens")
+        self.tokenizer = tokenizer
+        self.tokenizer_name = tokenizer_name
+        self.chunk_tokens = chunk_tokens
+        self.chunk_overlap = chunk_overlap
+        self._separator_tokens: Dict[Tuple[str, str], int] = {}
+
+    def split_documents(self, documents: Iterable[Document]) -> List[Document]:
+        from langchain_core.documents import Document
+
+        parsed = []
+        for doc in documents:
+            text, blocks = document_blocks(doc.page_content, document_format(doc))
+            parsed.append((doc, text, blocks))
+        block_texts = [text[block.start:block.end] for _, text, blocks in parsed for block in blocks]
+        encodings = self.tokenizer.encode_batch(block_texts, add_special_tokens=False)
+
+        chunks, offset = [], 0
+        for doc, text, blocks in parsed:
+            doc_encodings = encodings[offset:offset + len(blocks)]
+            offset += len(blocks)
+            for start, end, num_tokens, section in self._pack(text, blocks, doc_encodings):
+                metadata = {
+                    **doc.metadata,
+                    'start_index': start,
+                    'num_tokens': num_tokens,
+                    'tokenizer': self.tokenizer_name,
+                }
+                if section:
+                    metadata['section'] = section
+                chunks.append(Document(page_content=text[start:end], metadata=metadata))
+        return chunks
+
+    def _pack(self, text: str, blocks: List[Block], encodings) -> List[Tuple[int, int, int, str]]:
+        """(start, end, num_tokens, section) of the chunks of one document."""
+        # Units are blocks that fit and windows of those that do not; `group` changes where a chunk must end
+        starts, ends, tokens, groups, sections = [], [], [], [], []
+        headings: List[Tuple[int, str]] = []
+        group, section, has_body = 0, '', False
+        for block, encoding in zip(blocks, encodings):
+            if block.heading_level:
+                headings = [(level, title) for level, title in headings if level < block.heading_level]
+                headings.append((block.heading_level, text[block.start:block.end].lstrip('#').strip()))
+                section = ' > '.join(title for _, title in headings)
+                # Headings directly under each other open one chunk together
+                if has_body:
+                    group += 1
+                has_body = False
+            else:
+                has_body = True
+            if len(encoding) <= self.chunk_tokens:
+                starts.append(block.start)
+                ends.append(block.end)
+                tokens.append(len(encoding))
+                groups.append(group)
+                sections.append(section)
+                continue
+            for start, end, num_tokens in self._windows(text, block, encoding):
+                group += 1
+                starts.append(start)
+                ends.append(end)
+                tokens.append(num_tokens)
+                groups.append(group)
+                sections.append(section)
+            group += 1
+        if not starts:
+            return []
+
+        separators = [0] + [
+            self._count_separator(text[ends[idx - 1]:starts[idx]], text[starts[idx]:starts[idx] + 1])
+            if groups[idx] == groups[idx - 1] else 0
+            for idx in range(1, len(starts))
+        ]
+        # cost[i] is unit i plus the separator before it, so a chunk of units a..b-1 has cum[b] - cum[a] - sep[a]
+        separators = np.asarray(separators, dtype=np.int64)
+        cum = np.concatenate(([0], np.cumsum(np.asarray(tokens, dtype=np.int64) + separators)))
+        group_ids = np.asarray(groups)
+        group_ends = np.searchsorted(group_ids, group_ids, side='right')
+
+        chunks, first = [], 0
+        while first < len(starts):
+            limit = group_ends[first]
+            last = int(np.searchsorted(cum, cum[first] + separators[first] + self.chunk_tokens, side='right')) - 1
+            last = min(max(last, first + 1), limit)
+            num_tokens = int(cum[last] - cum[first] - separators[first])
+            chunks.append((starts[first], ends[last - 1], num_tokens, sections[last - 1]))
+            if last == limit or not self.chunk_overlap:
+                first = last
+                continue
+            # Start the next chunk at the trailing units worth at most `chunk_overlap` tokens
+            overlap_start = int(np.searchsorted(cum, cum[last] - self.chunk_overlap, side='left'))
+            first = max(first + 1, min(overlap_start, last))
+        return chunks
+
+    def _windows(self, text: str, block: Block, encoding) -> List[Tuple[int, int, int]]:
+        """(start, end, num_tokens) of windows of at most `chunk_tokens` tokens of an oversized block."""
+        token_starts = np.fromiter((offset[0] for offset in encoding.offsets), dtype=np.int64, count=len(encoding))
+        block_text = text[block.start:block.end]
+        num_tokens = len(token_starts)
+        windows, first = [], 0
+        while first < num_tokens:
+            last = min(first + self.chunk_tokens, num_tokens)
+            if last < num_tokens:
+                last = self._cut(block_text, token_starts, first, last)
+            end = len(block_text[:token_starts[last] if last < num_tokens else len(block_text)].rstrip())
+            # Whitespace tokens stripped from the end of the window are not counted
+            count = int(np.searchsorted(token_starts, end, side='left')) - first
+            windows.append((block.start + int(token_starts[first]), block.start + end, count))
+            if last == num_tokens:
+                break
+            first = max(first + 1, last - self.chunk_overlap)
+        return windows
+
+    @staticmethod
+    def _cut(block_text: str, token_starts: np.ndarray, first: int, last: int) -> int:
+        """Token index in the second half of the window at which to cut, at a line or sentence end if possible."""
+        lowest = first + (last - first) // 2
+        for boundary in ('\n', '. ', ' '):
+            for idx in range(last, lowest, -1):
+                start = int(token_starts[idx])
+                if block_text.endswith(boundary, 0, start) or block_text.startswith(boundary, start):
+                    return idx
+        return last
+
+    def _count_separator(self, separator: str, following: str) -> int:
+        """Tokens a separator adds in front of a block starting with `following`."""
+        # Pre-tokenizers may split whitespace differently before a word than at the end of a text
+        key = (separator, following)
+        count = self._separator_tokens.get(key)
+        if count is None:
+            encode = self.tokenizer.encode
+            count = len(encode(separator + following, add_special_tokens=False)) - len(
+                encode(following, add_special_tokens=False))
+            self._separator_tokens[key] = count
+        return count
@@ -0,0 +1,131 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from helpers.logger import create_logger
+
+logger = create_logger(__name__)
+
+PENDING = "pending"
+STARTING = "starting"
+READY = "ready"
+FAILED = "failed"
+
+
+class ComponentNotReady(RuntimeError):
+    """A component a request needs is still starting or failed to start."""
+
+
+@dataclass
+class Component:
+    name: str
+    init_fn: Callable[[], Awaitable[Any]]
+    close_fn: Optional[Callable[[Any], Awaitable[None]]] = None
+    depends_on: Tuple[str, ...] = ()
+    state: str = PENDING
+    value: Any = None
+    error: Optional[str] = None
+    seconds: Optional[float] = None
+    task: Optional[asyncio.Task] = field(default=None, repr=False)
+
+    def info(self) -> Dict[str, Any]:
+        return {"state": self.state, "seconds": self.seconds, "error": self.error}
+
+
+class ComponentRegistry:
+    """
+    Application components initialized in the background once the server is up.
+
+    `start` schedules every component and returns at once, so the server binds
+    its port without waiting for models or indexes to load. A component starts
+    as soon as those in its `depends_on` are ready, independent components
+    start concurrently, and a failed dependency fails its dependents. `stop`
+    cancels components still starting and closes ready ones in reverse
+    registration order.
+    """
+
+    def __init__(self):
+        self.components: Dict[str, Component] = {}
+
+    def register(
+        self,
+        name: str,
+        init_fn: Callable[[], Awaitable[Any]],
+        close_fn: Optional[Callable[[Any], Awaitable[None]]] = None,
+        depends_on: Tuple[str, ...] = (),
+    ) -> None:
+        unknown = [dependency for dependency in depends_on if dependency not in self.components]
+        if unknown:
+            raise ValueError(f"Component {name} depends on unregistered components {unknown}")
+        self.components[name] = Component(name=name, init_fn=init_fn, close_fn=close_fn, depends_on=depends_on)
+
+    async def start(self) -> None:
+        for component in self.components.values():
+            component.task = asyncio.create_task(self._start(component))
+
+    async def stop(self) -> None:
+        for component in self.components.values():
+            if component.task is not None and not component.task.done():
+                component.task.cancel()
+        await asyncio.gather(
+            *(component.task for component in self.components.values() if component.task is not None),
+            return_exceptions=True,
+        )
+        for component in reversed(list(self.components.values())):
+            if component.state == READY and component.close_fn is not None:
+                try:
+                    await component.close_fn(component.value)
+                except Exception as e:
+                    logger.error(f"Failed to close component {component.name}: {str(e)}")
+            component.state, component.value, component.task = PENDING, None, None
+
+    async def wait(self, name: str) -> Any:
+        """Value of a component, once it has started."""
+        component = self.components[name]
+        if component.task is None:
+            raise ComponentNotReady(f"Component {name} has not been started")
+        await asyncio.shield(component.task)
+        return self.get(name)
+
+    def get(self, name: str) -> Any:
+        component = self.components[name]
+        if component.state != READY:
+            detail = f": {component.error}" if component.error else ""
+            raise ComponentNotReady(f"Component {name} is {component.state}{detail}")
+        return component.value
+
+    def peek(self, name: str) -> Any:
+        """Value of a component if it is ready, otherwise None."""
+        component = self.components[name]
+        return component.value if component.state == READY else None
+
+    def not_ready(self, names: Optional[List[str]] = None) -> List[str]:
+        names = names if names is not None else list(self.components)
+        return [name for name in names if self.components[name].state != READY]
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        return {name: component.info() for name, component in self.components.items()}
+
+    async def _start(self, component: Component) -> None:
+        try:
+            for dependency in component.depends_on:
+                await self.wait(dependency)
+        except ComponentNotReady as e:
+            component.state = FAILED
+            component.error = str(e)
+            logger.error(f"Component {component.name} not started: {str(e)}")
+            return
+        component.state = STARTING
+        start = time.perf_counter()
+        try:
+            component.value = await component.init_fn()
+        except Exception as e:
+            component.state = FAILED
+            component.error = f"{type(e).__name__}: {e}"
+            component.seconds = time.perf_counter() - start
+            logger.error(f"Component {component.name} failed to start: {component.error}")
+            return
+        component.seconds = time.perf_counter() - start
+        component.state = READY
+        logger.info(f"Component {component.name} ready in {component.seconds:.2f}s")
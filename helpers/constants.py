@@ -21,7 +21,14 @@ def load_config(config_path: str) -> Dict[str, Any]:
 HF_TOKEN = os.getenv('HF_TOKEN')
 # DB
 CHROMA_DB_NAME = "chroma_db"
+LEXICAL_INDEX_DIR_NAME = "bm25_index"
+FAISS_INDEX_DIR_NAME = "faiss_index"
+DEFAULT_TENANT = "default"
 SQL_DB_NAME = "session_logs_db"
+UPLOADS_DIR_NAME = "uploads"
+EMBEDDING_CACHE_DIR_NAME = "embedding_cache"
+INDEX_LOCK_NAME = "index.lock"
+ALLOWED_EXTENSIONS = [".pdf", ".docx", '.md', '.csv', '.html']
 LOGGING_LEVEL = os.getenv("LOGGING_LEVEL", "DEBUG")
 # configs
 GLOBAL_CONFIG = load_config(config_path)
@@ -31,3 +38,10 @@ PROMPT = """Answer the question below from the following context:
 ### Context: {context}
 ### User's question: {question}
 """
+SUMMARY_SYSTEM_PROMPT = "You maintain a concise running summary of a conversation between a user and an AI assistant."
+SUMMARY_PROMPT = """Update the running summary with the new conversation turns below. Keep the facts, names, numbers and open questions needed to answer follow-up questions. Return only the updated summary.
+### Current summary: {summary}
+### New conversation turns:
+{turns}
+"""
+HISTORY_SUMMARY_PREFIX = "Summary of the earlier conversation:"
@@ -1,32 +1,113 @@
 import aiosqlite
+import asyncio
 import os
 import sys
+from contextlib import asynccontextmanager
+from datetime import timezone
 
 sys.path.append("helpers")
-from constants import SQL_DB_NAME
+from constants import SQL_DB_NAME, GLOBAL_CONFIG, DEFAULT_TENANT
 
 SQL_DB_PATH = os.path.join(os.getcwd(), SQL_DB_NAME)
 if not os.path.exists(SQL_DB_PATH):
     os.mkdir(SQL_DB_PATH)
 
-async def get_db_connection():
-    conn = await aiosqlite.connect(f'{SQL_DB_PATH}/logs.db')
+SQLITE_PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA busy_timeout = 5000',
+    'PRAGMA cache_size = -65536',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA mmap_size = 268435456',
+)
+
+async def get_db_connection(db_file=None):
+    """Open a tuned connection, sqlite3 keeps up to `cached_statements` prepared statements on it"""
+    conn = await aiosqlite.connect(db_file or f'{SQL_DB_PATH}/logs.db', cached_statements=256)
     conn.row_factory = aiosqlite.Row
+    for pragma in SQLITE_PRAGMAS:
+        await conn.execute(pragma)
     return conn
 
+class ConnectionPool:
+    """
+    Long-lived SQLite connections shared by all requests: `size` readers and a
+    single writer, since SQLite serializes writes anyway. Opened at app startup,
+    or lazily on first use, and reopened if used from a different event loop.
+    """
+
+    def __init__(self, db_file=None, size=4):
+        self.db_file = db_file
+        self.size = size
+        self.loop = None
+        self.connections = []
+        self.readers = None
+        self.writer = None
+        self.write_lock = None
+        self._opened = None
+
+    async def open(self):
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            await self.close()
+            self.loop = loop
+            self._opened = loop.create_future()
+            try:
+                self.connections = [await get_db_connection(self.db_file) for _ in range(self.size + 1)]
+                self.writer = self.connections[0]
+                self.readers = asyncio.Queue()
+                for conn in self.connections[1:]:
+                    self.readers.put_nowait(conn)
+                self.write_lock = asyncio.Lock()
+                self._opened.set_result(None)
+            except Exception:
+                self._opened.cancel()
+                await self.close()
+                raise
+        await self._opened
+
+    async def close(self):
+        connections, self.connections = self.connections, []
+        self.loop = None
+        for conn in connections:
+            await conn.close()
+
+    @asynccontextmanager
+    async def read(self):
+        await self.open()
+        conn = await self.readers.get()
+        try:
+            yield conn
+        finally:
+            self.readers.put_nowait(conn)
+
+    @asynccontextmanager
+    async def write(self):
+        """Writer connection, committed on exit and rolled back on error"""
+        await self.open()
+        async with self.write_lock:
+            try:
+                yield self.writer
+                await self.writer.commit()
+            except BaseException:
+                await self.writer.rollback()
+                raise
+
+db_pool = ConnectionPool(size=GLOBAL_CONFIG.get('database', {}).get('pool_size', 4))
+
 async def delete_chat_session(session_id):
     """Delete a chat session and all its messages"""
-    async with await get_db_connection() as conn:
-        try:
+    try:
+        async with db_pool.write() as conn:
             await conn.execute('DELETE FROM application_logs WHERE session_id = ?', (session_id,))
-            await conn.commit()
-            return True
-        except Exception as e:
-            print(f"Error deleting chat session: {e}")
-            return False
+            await conn.execute('DELETE FROM session_summaries WHERE session_id = ?', (session_id,))
+        return True
+    except Exception as e:
+        print(f"Error deleting chat session: {e}")
+        return False
 
 async def create_application_logs():
-    async with await get_db_connection() as conn:
+    async with db_pool.write() as conn:
         await conn.execute('''CREATE TABLE IF NOT EXISTS application_logs
                         (id INTEGER PRIMARY KEY AUTOINCREMENT,
                          session_id TEXT,
@@ -36,17 +117,31 @@ async def create_application_logs():
                          retrieved_context TEXT,
                          model TEXT,
                          created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
-        await conn.commit()
+        # Newer rows reference the context chunks by Chroma id (JSON list) instead of copying their text,
+        # and record whether the answer was completed or stopped early
+        await add_missing_columns(conn, 'application_logs', {
+            'context_chunk_ids': 'TEXT',
+            'status': "TEXT DEFAULT 'completed'",
+        })
+        await conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_application_logs_session_created ON application_logs(session_id, created_at)')
 
-async def insert_application_logs(session_id, user_query, response, system_prompt, retrieved_context, model):
-    async with await get_db_connection() as conn:
+async def insert_application_logs(session_id, user_query, response, system_prompt, retrieved_context, model,
+                                  context_chunk_ids=None):
+    async with db_pool.write() as conn:
         await conn.execute(
-            'INSERT INTO application_logs (session_id, user_query, response, system_prompt, retrieved_context, model) VALUES (?, ?, ?, ?, ?, ?)',
-            (session_id, user_query, response, system_prompt, retrieved_context, model))
-        await conn.commit()
+            'INSERT INTO application_logs (session_id, user_query, response, system_prompt, retrieved_context, model, context_chunk_ids) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (session_id, user_query, response, system_prompt, retrieved_context, model, context_chunk_ids))
+
+async def insert_application_logs_batch(rows):
+    """Insert many turns in one transaction, `rows` are (session_id, user_query, response, system_prompt, model, context_chunk_ids, status)"""
+    async with db_pool.write() as conn:
+        await conn.executemany(
+            'INSERT INTO application_logs (session_id, user_query, response, system_prompt, model, context_chunk_ids, status) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            rows)
 
 async def get_chat_history(session_id):
-    async with await get_db_connection() as conn:
+    async with db_pool.read() as conn:
         cursor = await conn.execute('SELECT user_query, response FROM application_logs WHERE session_id = ? ORDER BY created_at', (session_id,))
         rows = await cursor.fetchall()
         messages = []
@@ -57,35 +152,177 @@ async def get_chat_history(session_id):
             ])
         return messages
 
+async def add_missing_columns(conn, table, columns):
+    """Add columns introduced after the table was first created"""
+    cursor = await conn.execute(f'PRAGMA table_info({table})')
+    existing = {row['name'] for row in await cursor.fetchall()}
+    for name, declaration in columns.items():
+        if name not in existing:
+            await conn.execute(f'ALTER TABLE {table} ADD COLUMN {name} {declaration}')
+
+async def get_recent_chat_turns(session_id, after_id=0, before_id=None, limit=8):
+    """Newest turns first, restricted to after_id < id < before_id"""
+    async with db_pool.read() as conn:
+        cursor = await conn.execute(
+            '''SELECT id, user_query, response FROM application_logs
+               WHERE session_id = ? AND id > ? AND id < ?
+               ORDER BY id DESC LIMIT ?''',
+            (session_id, after_id, before_id if before_id is not None else 2 ** 63 - 1, limit))
+        rows = await cursor.fetchall()
+        return [dict(row) for row in rows]
+
+async def get_chat_turns_range(session_id, after_id, until_id):
+    """Turns with after_id < id <= until_id, oldest first"""
+    async with db_pool.read() as conn:
+        cursor = await conn.execute(
+            '''SELECT id, user_query, response FROM application_logs
+               WHERE session_id = ? AND id > ? AND id <= ?
+               ORDER BY id''',
+            (session_id, after_id, until_id))
+        rows = await cursor.fetchall()
+        return [dict(row) for row in rows]
+
+async def create_session_summaries():
+    async with db_pool.write() as conn:
+        await conn.execute('''CREATE TABLE IF NOT EXISTS session_summaries
+                        (session_id TEXT PRIMARY KEY,
+                         summary TEXT,
+                         summarized_until INTEGER DEFAULT 0,
+                         updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+
+async def get_session_summary(session_id):
+    async with db_pool.read() as conn:
+        cursor = await conn.execute(
+            'SELECT summary, summarized_until FROM session_summaries WHERE session_id = ?', (session_id,))
+        row = await cursor.fetchone()
+        return dict(row) if row else None
+
+async def upsert_session_summary(session_id, summary, summarized_until):
+    async with db_pool.write() as conn:
+        await conn.execute(
+            '''INSERT INTO session_summaries (session_id, summary, summarized_until) VALUES (?, ?, ?)
+               ON CONFLICT(session_id) DO UPDATE SET
+                   summary = excluded.summary,
+                   summarized_until = excluded.summarized_until,
+                   updated_at = CURRENT_TIMESTAMP''',
+            (session_id, summary, summarized_until))
+
 async def create_document_store():
-    async with await get_db_connection() as conn:
+    async with db_pool.write() as conn:
         await conn.execute('''CREATE TABLE IF NOT EXISTS document_store
                         (id INTEGER PRIMARY KEY AUTOINCREMENT,
                          filename TEXT,
-                         upload_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
-        await conn.commit()
+                         upload_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                         content_hash TEXT)''')
+        await add_missing_columns(conn, 'document_store', {
+            'content_hash': 'TEXT',
+            'tenant': f"TEXT NOT NULL DEFAULT '{DEFAULT_TENANT}'",
+        })
+        await conn.execute('CREATE INDEX IF NOT EXISTS idx_document_store_content_hash ON document_store(content_hash)')
+        await conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_document_store_upload_timestamp ON document_store(upload_timestamp)')
+        await conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_document_store_tenant_hash ON document_store(tenant, content_hash)')
+        await conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_document_store_tenant_uploaded ON document_store(tenant, upload_timestamp)')
 
-async def insert_document_record(filename):
-    async with await get_db_connection() as conn:
-        cursor = await conn.execute('INSERT INTO document_store (filename) VALUES (?)', (filename,))
-        await conn.commit()
+async def insert_document_record(filename, tenant=DEFAULT_TENANT):
+    async with db_pool.write() as conn:
+        cursor = await conn.execute('INSERT INTO document_store (filename, tenant) VALUES (?, ?)', (filename, tenant))
         return cursor.lastrowid
 
+async def insert_document_records(filenames, tenant=DEFAULT_TENANT):
+    """Insert several documents in a single transaction, returns their ids in order"""
+    async with db_pool.write() as conn:
+        file_ids = []
+        for filename in filenames:
+            cursor = await conn.execute(
+                'INSERT INTO document_store (filename, tenant) VALUES (?, ?)', (filename, tenant))
+            file_ids.append(cursor.lastrowid)
+        return file_ids
+
+async def get_document(file_id):
+    async with db_pool.read() as conn:
+        cursor = await conn.execute(
+            'SELECT id, filename, upload_timestamp, content_hash, tenant FROM document_store WHERE id = ?', (file_id,))
+        row = await cursor.fetchone()
+        return dict(row) if row else None
+
+async def get_document_by_hash(content_hash, tenant=DEFAULT_TENANT):
+    """Duplicates are only looked up within a tenant, so uploads never reveal another tenant's documents"""
+    async with db_pool.read() as conn:
+        cursor = await conn.execute(
+            'SELECT id, filename, upload_timestamp FROM document_store WHERE tenant = ? AND content_hash = ? LIMIT 1',
+            (tenant, content_hash))
+        row = await cursor.fetchone()
+        return dict(row) if row else None
+
+async def get_latest_document_by_filename(filename, tenant=DEFAULT_TENANT):
+    """Most recent indexed document with this filename, treated as the previous version of a re-upload"""
+    async with db_pool.read() as conn:
+        cursor = await conn.execute(
+            '''SELECT id, filename, upload_timestamp, content_hash FROM document_store
+               WHERE tenant = ? AND filename = ? AND content_hash IS NOT NULL
+               ORDER BY upload_timestamp DESC, id DESC LIMIT 1''', (tenant, filename))
+        row = await cursor.fetchone()
+        return dict(row) if row else None
+
+async def update_document_hashes(updates):
+    """Record the content hash of indexed documents, `updates` is a list of (file_id, content_hash)"""
+    async with db_pool.write() as conn:
+        await conn.executemany(
+            'UPDATE document_store SET content_hash = ?, upload_timestamp = CURRENT_TIMESTAMP WHERE id = ?',
+            [(content_hash, file_id) for file_id, content_hash in updates])
+
+async def delete_document_records(file_ids):
+    async with db_pool.write() as conn:
+        await conn.executemany('DELETE FROM document_store WHERE id = ?', [(file_id,) for file_id in file_ids])
+        return True
+
 async def delete_document_record(file_id):
-    async with await get_db_connection() as conn:
+    async with db_pool.write() as conn:
         await conn.execute('DELETE FROM document_store WHERE id = ?', (file_id,))
-        await conn.commit()
         return True
 
-async def get_all_documents():
-    async with await get_db_connection() as conn:
-        cursor = await conn.execute('SELECT id, filename, upload_timestamp FROM document_store ORDER BY upload_timestamp DESC')
+async def get_all_documents(tenant=DEFAULT_TENANT):
+    async with db_pool.read() as conn:
+        cursor = await conn.execute(
+            'SELECT id, filename, upload_timestamp FROM document_store WHERE tenant = ? ORDER BY upload_timestamp DESC',
+            (tenant,))
         rows = await cursor.fetchall()
         return [dict(row) for row in rows]
 
+def _sql_timestamp(value):
+    """Datetime as stored by CURRENT_TIMESTAMP, naive datetimes are taken as UTC"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return value.strftime('%Y-%m-%d %H:%M:%S')
+
+async def filter_document_ids(tenant=DEFAULT_TENANT, file_ids=None, filenames=None, uploaded_after=None,
+                              uploaded_before=None):
+    """Ids of the tenant's documents matching every given filter, filters left as None match everything"""
+    conditions, params = ['tenant = ?'], [tenant]
+    if file_ids is not None:
+        conditions.append(f"id IN ({', '.join('?' * len(file_ids))})")
+        params.extend(file_ids)
+    if filenames is not None:
+        conditions.append(f"filename IN ({', '.join('?' * len(filenames))})")
+        params.extend(filenames)
+    if uploaded_after is not None:
+        conditions.append('upload_timestamp >= ?')
+        params.append(_sql_timestamp(uploaded_after))
+    if uploaded_before is not None:
+        conditions.append('upload_timestamp < ?')
+        params.append(_sql_timestamp(uploaded_before))
+    async with db_pool.read() as conn:
+        cursor = await conn.execute(
+            f"SELECT id FROM document_store WHERE {' AND '.join(conditions)}", params)
+        rows = await cursor.fetchall()
+        return [row['id'] for row in rows]
+
 async def get_all_chat_sessions():
     """Retrieve all unique chat sessions with their first message and timestamp"""
-    async with await get_db_connection() as conn:
+    async with db_pool.read() as conn:
         cursor = await conn.execute('''
             SELECT DISTINCT 
                 session_id,
@@ -98,10 +335,113 @@ async def get_all_chat_sessions():
         rows = await cursor.fetchall()
         return [dict(row) for row in rows]
 
+async def create_ingestion_jobs():
+    async with db_pool.write() as conn:
+        await conn.execute('''CREATE TABLE IF NOT EXISTS ingestion_jobs
+                        (id TEXT PRIMARY KEY,
+                         file_id INTEGER,
+                         filename TEXT,
+                         file_path TEXT,
+                         stage TEXT DEFAULT 'queued',
+                         num_chunks INTEGER,
+                         error TEXT,
+                         parse_seconds REAL,
+                         index_seconds REAL,
+                         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                         started_at TIMESTAMP,
+                         finished_at TIMESTAMP)''')
+        await add_missing_columns(conn, 'ingestion_jobs', INGESTION_JOB_ADDED_COLUMNS)
+        # At most one unfinished job per content, so identical concurrent uploads are indexed once.
+        # Duplicates queued before the index existed are failed first, the oldest one is kept.
+        await conn.execute(
+            f'''UPDATE ingestion_jobs SET stage = 'failed', error = 'Duplicate of an unfinished job'
+               WHERE {UNFINISHED_JOB} AND content_hash IS NOT NULL AND rowid NOT IN
+                   (SELECT MIN(rowid) FROM ingestion_jobs WHERE {UNFINISHED_JOB} GROUP BY tenant, content_hash)''')
+        await conn.execute(
+            f'''CREATE UNIQUE INDEX IF NOT EXISTS idx_ingestion_jobs_unfinished_hash
+               ON ingestion_jobs(tenant, content_hash) WHERE {UNFINISHED_JOB}''')
+
+INGESTION_JOB_ADDED_COLUMNS = {
+    'tenant': f"TEXT NOT NULL DEFAULT '{DEFAULT_TENANT}'",
+    'content_hash': 'TEXT',
+    'is_update': 'INTEGER DEFAULT 0',
+    'chunks_reused': 'INTEGER',
+    'chunks_embedded': 'INTEGER',
+    'chunks_deleted': 'INTEGER',
+}
+UNFINISHED_JOB = "stage NOT IN ('completed', 'failed')"
+INGESTION_JOB_FIELDS = ('stage', 'num_chunks', 'error', 'parse_seconds', 'index_seconds', 'started_at', 'finished_at',
+                        'chunks_reused', 'chunks_embedded', 'chunks_deleted')
+
+async def insert_ingestion_job(job_id, file_id, filename, file_path, content_hash=None, is_update=False,
+                               tenant=DEFAULT_TENANT):
+    """Record a queued job, returns False when an unfinished job of the tenant already has this content hash"""
+    try:
+        async with db_pool.write() as conn:
+            await conn.execute(
+                '''INSERT INTO ingestion_jobs (id, file_id, filename, file_path, content_hash, is_update, tenant)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                (job_id, file_id, filename, file_path, content_hash, int(is_update), tenant))
+        return True
+    except aiosqlite.IntegrityError:
+        return False
+
+async def update_ingestion_job(job_id, **fields):
+    unknown = set(fields) - set(INGESTION_JOB_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown ingestion job fields: {sorted(unknown)}")
+    assignments = ', '.join(f'{field} = ?' for field in fields)
+    async with db_pool.write() as conn:
+        await conn.execute(
+            f'UPDATE ingestion_jobs SET {assignments} WHERE id = ?',
+            (*fields.values(), job_id))
+
+async def get_ingestion_job(job_id):
+    async with db_pool.read() as conn:
+        cursor = await conn.execute('SELECT * FROM ingestion_jobs WHERE id = ?', (job_id,))
+        row = await cursor.fetchone()
+        return dict(row) if row else None
+
+async def get_unfinished_ingestion_jobs():
+    """Jobs that were queued or in flight when the API last stopped, oldest first"""
+    async with db_pool.read() as conn:
+        cursor = await conn.execute(f"SELECT * FROM ingestion_jobs WHERE {UNFINISHED_JOB} ORDER BY created_at")
+        rows = await cursor.fetchall()
+        return [dict(row) for row in rows]
+
+async def get_unfinished_ingestion_job_by_hash(content_hash, tenant=DEFAULT_TENANT):
+    """Job still indexing a file with this content hash, uploads of the same content wait for it"""
+    async with db_pool.read() as conn:
+        cursor = await conn.execute(
+            f'SELECT * FROM ingestion_jobs WHERE tenant = ? AND content_hash = ? AND {UNFINISHED_JOB} LIMIT 1',
+            (tenant, content_hash))
+        row = await cursor.fetchone()
+        return dict(row) if row else None
+
+async def create_corpus_versions():
+    async with db_pool.write() as conn:
+        await conn.execute('''CREATE TABLE IF NOT EXISTS corpus_versions
+                        (tenant TEXT PRIMARY KEY,
+                         version INTEGER NOT NULL DEFAULT 0)''')
+
+async def get_corpus_version(tenant=DEFAULT_TENANT):
+    """Version of a tenant's indexed chunks, shared by every process so their answer caches see each other's writes"""
+    async with db_pool.read() as conn:
+        cursor = await conn.execute('SELECT version FROM corpus_versions WHERE tenant = ?', (tenant,))
+        row = await cursor.fetchone()
+        return row['version'] if row else 0
+
+async def bump_corpus_version(tenant=DEFAULT_TENANT):
+    """Called after every write to a tenant's collection"""
+    async with db_pool.write() as conn:
+        await conn.execute(
+            '''INSERT INTO corpus_versions (tenant, version) VALUES (?, 1)
+               ON CONFLICT(tenant) DO UPDATE SET version = version + 1''', (tenant,))
+
 async def initialize_db():
+    """Create and migrate the tables, called at startup of every process that uses the database"""
     await create_application_logs()
+    await create_session_summaries()
     await create_document_store()
-
-# Run initialization
-import asyncio
-asyncio.run(initialize_db())
+    await create_ingestion_jobs()
+    await create_corpus_versions()
@@ -0,0 +1,218 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import importlib
+from collections import deque
+from concurrent.futures import Executor
+from typing import TYPE_CHECKING, AsyncIterator, Iterable, Iterator, List, Optional
+
+from helpers.constants import GLOBAL_CONFIG
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+
+# Kept free of embedding / vector store imports so that it can be loaded cheaply
+# inside ingestion worker processes.
+chunker_config = GLOBAL_CONFIG.get('chunker', {})
+CHUNKER_STRATEGY = chunker_config.get('strategy', 'recursive')
+# Read as text and split on their own structure by the structured chunker, instead of going through a loader
+RAW_TEXT_FORMATS = ('txt', 'md', 'html', 'csv')
+_text_splitter = None
+
+
+def get_text_splitter():
+    """
+    Splitter shared by all documents, created on first use.
+
+    `chunker.strategy` selects the StructuredChunker (`structured`), which sizes
+    chunks in `chunker.tokenizer` tokens, or a RecursiveCharacterTextSplitter of
+    1000 characters (`recursive`).
+    """
+    global _text_splitter
+    if _text_splitter is None:
+        if CHUNKER_STRATEGY == 'structured':
+            from helpers.chunking import StructuredChunker, load_tokenizer
+
+            tokenizer_name = chunker_config['tokenizer']
+            _text_splitter = StructuredChunker(
+                load_tokenizer(tokenizer_name),
+                tokenizer_name,
+                chunk_tokens=chunker_config.get('chunk_tokens', 512),
+                chunk_overlap=chunker_config.get('chunk_overlap', 64),
+            )
+        else:
+            from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+            # start_index lets context assembly merge overlapping neighbours
+            _text_splitter = RecursiveCharacterTextSplitter(
+                chunk_size=1000, chunk_overlap=200, length_function=len, add_start_index=True
+            )
+    return _text_splitter
+
+
+# Loader class per file type, imported on first use of that type
+LOADERS = {
+    'pdf': 'PyPDFLoader',
+    'docx': 'Docx2txtLoader',
+    'txt': 'TextLoader',
+    'html': 'UnstructuredHTMLLoader',
+    'csv': 'CSVLoader',
+    'md': 'UnstructuredMarkdownLoader'
+}
+
+
+def get_loader(file_ext: str):
+    """Document loader class for a file extension."""
+    return getattr(importlib.import_module('langchain.document_loaders'), LOADERS[file_ext])
+
+
+def file_extension(file_path: str) -> str:
+    file_ext = file_path.lower().split('.')[-1]
+    if file_ext not in LOADERS:
+        raise ValueError(f"Unsupported file type: {file_path}")
+    return file_ext
+
+
+def count_pdf_pages(file_path: str) -> int:
+    from pypdf import PdfReader
+
+    return len(PdfReader(file_path).pages)
+
+
+def iter_pdf_pages(file_path: str, start: int = 0, stop: Optional[int] = None) -> Iterator[Document]:
+    """Pages `start` to `stop` of a PDF, extracted one at a time with the metadata PyPDFLoader gives them."""
+    from langchain_core.documents import Document
+    from pypdf import PdfReader
+
+    reader = PdfReader(file_path)
+    stop = len(reader.pages) if stop is None else min(stop, len(reader.pages))
+    for page_number in range(start, stop):
+        yield Document(
+            page_content=reader.pages[page_number].extract_text(),
+            metadata={'source': file_path, 'page': page_number},
+        )
+
+
+def iter_pages(file_path: str) -> Iterator[Document]:
+    """Pages of a PDF, or the documents the loader of another file type produces, one at a time."""
+    file_ext = file_extension(file_path)
+    if file_ext == 'pdf':
+        # PyPDFLoader.lazy_load extracts every page before yielding the first
+        return iter_pdf_pages(file_path)
+    if CHUNKER_STRATEGY == 'structured' and file_ext in RAW_TEXT_FORMATS:
+        return iter([read_text(file_path)])
+    return get_loader(file_ext)(file_path).lazy_load()
+
+
+def read_text(file_path: str) -> Document:
+    """The raw text of a file as one document, markup included."""
+    from langchain_core.documents import Document
+
+    with open(file_path, encoding='utf-8', errors='replace') as f:
+        return Document(page_content=f.read(), metadata={'source': file_path})
+
+
+def iter_splits(pages: Iterable[Document]) -> Iterator[Document]:
+    """Chunks of each page as it arrives, the same chunks `split_documents` gives for all pages at once."""
+    text_splitter = get_text_splitter()
+    for page in pages:
+        yield from text_splitter.split_documents([page])
+
+
+def split_document(file_path: str) -> List[Document]:
+    """
+    Load and split a document synchronously.
+    Args:
+        file_path (str): Path to the document file
+
+    Returns:
+        List[Document]: List of document chunks
+    """
+    file_extension(file_path)
+    try:
+        return list(iter_splits(iter_pages(file_path)))
+    except Exception as e:
+        raise RuntimeError(f"Error loading {file_path}: {str(e)}")
+
+
+def split_pdf_pages(file_path: str, start: int, stop: int) -> List[Document]:
+    """Chunks of pages `start` to `stop` of a PDF, run in ingestion worker processes."""
+    try:
+        return list(iter_splits(iter_pdf_pages(file_path, start, stop)))
+    except Exception as e:
+        raise RuntimeError(f"Error loading pages {start}-{stop} of {file_path}: {str(e)}")
+
+
+async def stream_split_batches(
+    file_path: str,
+    batch_size: int = 256,
+    executor: Optional[Executor] = None,
+    pages_per_task: int = 50,
+    max_pending: int = 2,
+) -> AsyncIterator[List[Document]]:
+    """
+    Chunks of a document in batches of at most `batch_size`, parsed as they are consumed.
+
+    PDFs are parsed and split `pages_per_task` pages at a time in `executor`
+    (several workers of a process pool parse ranges in parallel), at most
+    `max_pending` ranges ahead of the consumer, so memory holds a few page
+    ranges and one batch instead of the whole document. Other file types are
+    parsed and split in one task.
+
+    Args:
+        file_path (str): Path to the document file
+        batch_size (int): Chunks per yielded batch
+        executor (Optional[Executor]): Pool the parsing runs in, the default thread pool when None
+        pages_per_task (int): PDF pages parsed per task
+        max_pending (int): PDF page ranges parsed ahead of the consumer
+
+    Returns:
+        AsyncIterator[List[Document]]: Batches of chunks in document order
+    """
+    loop = asyncio.get_running_loop()
+    if file_extension(file_path) == 'pdf':
+        num_pages = await loop.run_in_executor(executor, count_pdf_pages, file_path)
+        tasks = [
+            (split_pdf_pages, file_path, start, min(start + pages_per_task, num_pages))
+            for start in range(0, num_pages, pages_per_task)
+        ]
+    else:
+        tasks = [(split_document, file_path)]
+
+    pending = deque()
+    next_task = 0
+    batch: List[Document] = []
+    try:
+        while pending or next_task < len(tasks):
+            while next_task < len(tasks) and len(pending) < max(1, max_pending):
+                pending.append(loop.run_in_executor(executor, *tasks[next_task]))
+                next_task += 1
+            batch.extend(await pending.popleft())
+            while len(batch) >= batch_size:
+                yield batch[:batch_size]
+                batch = batch[batch_size:]
+        if batch:
+            yield batch
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def hash_file(file_path: str) -> str:
+    """SHA-256 of a file's bytes, read in blocks."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def hash_text(text: str) -> str:
+    """SHA-256 of a chunk's text."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def chunk_id(file_id: int, chunk_hash: str) -> str:
+    """Deterministic Chroma id of a chunk, so unchanged chunks keep their id across uploads."""
+    return f"{file_id}-{chunk_hash}"
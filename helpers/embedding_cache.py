@@ -0,0 +1,202 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# SQLite caps the number of bound parameters per statement
+_LOOKUP_BATCH = 500
+# Embeddings whose embed_query is embed_documents([query])[0], so queries can share one forward pass
+_QUERY_AS_DOCUMENT = ('HuggingFaceEmbeddings',)
+
+
+def embed_queries(embeddings: Embeddings, texts: List[str]) -> List[List[float]]:
+    """Embeddings of several queries, in one batched forward pass where the model embeds queries like documents."""
+    if hasattr(embeddings, 'embed_queries'):
+        return embeddings.embed_queries(texts)
+    if type(embeddings).__name__ in _QUERY_AS_DOCUMENT:
+        return embeddings.embed_documents(texts)
+    return [embeddings.embed_query(text) for text in texts]
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper backed by a two tier cache keyed by (model id, text hash).
+
+    The front tier is an in-memory LRU of `memory_entries` vectors. The disk tier
+    stores up to `max_entries` float32 vectors in a memory-mapped `.npy` array,
+    with an SQLite index mapping each key to its row and last use; once full, the
+    least recently used rows are overwritten. Query and document embeddings are
+    keyed separately since some models embed them differently.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        model_id: str,
+        cache_dir: str,
+        max_entries: int = 500_000,
+        memory_entries: int = 10_000,
+    ):
+        self.embeddings = embeddings
+        self.model_id = model_id
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.cache_dir = os.path.join(cache_dir, re.sub(r'[^A-Za-z0-9_.-]', '_', model_id))
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.vectors_path = os.path.join(self.cache_dir, 'vectors.npy')
+
+        self.lock = threading.Lock()
+        self.memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.conn = sqlite3.connect(os.path.join(self.cache_dir, 'index.db'), check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS entries
+                             (key TEXT PRIMARY KEY, slot INTEGER UNIQUE, last_used INTEGER)''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_entries_last_used ON entries(last_used)')
+        self.conn.commit()
+        self.clock = self.conn.execute('SELECT COALESCE(MAX(last_used), 0) FROM entries').fetchone()[0]
+        self.vectors: Optional[np.ndarray] = None
+        if os.path.exists(self.vectors_path):
+            self._open_vectors()
+
+    def _open_vectors(self, dim: Optional[int] = None) -> None:
+        if os.path.exists(self.vectors_path):
+            vectors = np.load(self.vectors_path, mmap_mode='r+')
+            if vectors.shape[0] == self.max_entries and dim in (None, vectors.shape[1]):
+                self.vectors = vectors
+                return
+            # Capacity or dimension changed: start over rather than remap slots
+            del vectors
+            os.remove(self.vectors_path)
+            self.conn.execute('DELETE FROM entries')
+            self.conn.commit()
+        if dim is not None:
+            self.vectors = np.lib.format.open_memmap(
+                self.vectors_path, mode='w+', dtype=np.float32, shape=(self.max_entries, dim)
+            )
+
+    def _key(self, kind: str, text: str) -> str:
+        return hashlib.sha256(f"{kind}\0{text}".encode('utf-8')).hexdigest()
+
+    def _lookup(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        found = {}
+        disk_keys = []
+        for key in keys:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                found[key] = self.memory[key]
+            elif self.vectors is not None:
+                disk_keys.append(key)
+        self.memory_hits += len(found)
+
+        touched = []
+        for start in range(0, len(disk_keys), _LOOKUP_BATCH):
+            batch = disk_keys[start:start + _LOOKUP_BATCH]
+            rows = self.conn.execute(
+                f"SELECT key, slot FROM entries WHERE key IN ({','.join('?' * len(batch))})", batch
+            ).fetchall()
+            for key, slot in rows:
+                vector = np.array(self.vectors[slot])
+                found[key] = vector
+                self._remember(key, vector)
+                touched.append(key)
+        if touched:
+            self.clock += 1
+            self.conn.executemany('UPDATE entries SET last_used = ? WHERE key = ?',
+                                  [(self.clock, key) for key in touched])
+            self.conn.commit()
+        self.disk_hits += len(touched)
+        return found
+
+    def _remember(self, key: str, vector: np.ndarray) -> None:
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def _store(self, new: Dict[str, np.ndarray]) -> None:
+        if self.vectors is None:
+            self._open_vectors(dim=len(next(iter(new.values()))))
+        # Another thread may have stored some of these keys while we were embedding
+        keys = list(new)
+        for start in range(0, len(keys), _LOOKUP_BATCH):
+            batch = keys[start:start + _LOOKUP_BATCH]
+            for (key,) in self.conn.execute(
+                f"SELECT key FROM entries WHERE key IN ({','.join('?' * len(batch))})", batch
+            ):
+                new.pop(key)
+        # A batch larger than the whole cache only keeps its tail
+        items = list(new.items())[-self.max_entries:]
+        if not items:
+            return
+        used = self.conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+        free = list(range(used, min(used + len(items), self.max_entries)))
+        if len(free) < len(items):
+            victims = self.conn.execute(
+                'SELECT key, slot FROM entries ORDER BY last_used LIMIT ?', (len(items) - len(free),)
+            ).fetchall()
+            self.conn.executemany('DELETE FROM entries WHERE key = ?', [(key,) for key, _ in victims])
+            for key, _ in victims:
+                self.memory.pop(key, None)
+            free.extend(slot for _, slot in victims)
+            self.evictions += len(victims)
+
+        self.clock += 1
+        for (key, vector), slot in zip(items, free):
+            self.vectors[slot] = vector
+        self.vectors.flush()
+        self.conn.executemany('INSERT INTO entries (key, slot, last_used) VALUES (?, ?, ?)',
+                              [(key, slot, self.clock) for (key, _), slot in zip(items, free)])
+        self.conn.commit()
+
+    def _embed(self, kind: str, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(kind, text) for text in texts]
+        with self.lock:
+            found = self._lookup(keys)
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        if missing:
+            if kind == 'query':
+                computed = embed_queries(self.embeddings, list(missing.values()))
+            else:
+                computed = self.embeddings.embed_documents(list(missing.values()))
+            new = {key: np.asarray(vector, dtype=np.float32) for key, vector in zip(missing, computed)}
+            with self.lock:
+                self.misses += len(new)
+                self._store(dict(new))
+                for key, vector in new.items():
+                    self._remember(key, vector)
+            found.update(new)
+        return [found[key].tolist() for key in keys]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed('document', texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed('query', [text])[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        return self._embed('query', texts)
+
+    def stats(self) -> Dict[str, float]:
+        with self.lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                "memory_entries": len(self.memory),
+                "disk_entries": self.conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0],
+            }
@@ -0,0 +1,145 @@
+import asyncio
+import itertools
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Dict, List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from helpers.embedding_cache import embed_queries
+
+# Lower runs first: interactive queries go ahead of bulk document batches
+QUERY = 0
+DOCUMENT = 1
+PRIORITY_NAMES = {QUERY: 'query', DOCUMENT: 'document'}
+
+
+class EmbeddingExecutor:
+    """
+    Dedicated threads running embedding model calls in priority order.
+
+    Work waits in one priority queue served by `concurrency` threads, so at
+    most that many model calls run at once whatever the number of callers,
+    and the default thread pool and the event loop never wait on the model.
+    A waiting query call always runs before any waiting document call; a call
+    already running is not interrupted, so callers keep document calls short.
+    """
+
+    def __init__(self, concurrency: int = 1, window: int = 1000):
+        self.concurrency = concurrency
+        self.queue: "queue.PriorityQueue" = queue.PriorityQueue()
+        self.sequence = itertools.count()
+        self.threads: List[threading.Thread] = []
+        self.lock = threading.Lock()
+        self.queued = {priority: 0 for priority in PRIORITY_NAMES}
+        self.running = 0
+        self.completed = {priority: 0 for priority in PRIORITY_NAMES}
+        self.waits: Dict[int, Deque[float]] = {priority: deque(maxlen=window) for priority in PRIORITY_NAMES}
+
+    def submit(self, priority: int, fn: Callable, *args: Any) -> Future:
+        future: Future = Future()
+        with self.lock:
+            if not self.threads:
+                self._start()
+            self.queued[priority] += 1
+        self.queue.put((priority, next(self.sequence), time.perf_counter(), future, fn, args))
+        return future
+
+    def _start(self) -> None:
+        for idx in range(self.concurrency):
+            thread = threading.Thread(target=self._work, name=f'embedding-{idx}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def _work(self) -> None:
+        while True:
+            priority, _, submitted_at, future, fn, args = self.queue.get()
+            if future is None:
+                return
+            with self.lock:
+                self.queued[priority] -= 1
+                self.running += 1
+                self.waits[priority].append(time.perf_counter() - submitted_at)
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(fn(*args))
+                    except BaseException as e:
+                        future.set_exception(e)
+            finally:
+                with self.lock:
+                    self.running -= 1
+                    self.completed[priority] += 1
+
+    def shutdown(self) -> None:
+        """Stop the threads once the work queued so far is done."""
+        with self.lock:
+            threads, self.threads = self.threads, []
+        for _ in threads:
+            # Sorts after every queued call
+            self.queue.put((len(PRIORITY_NAMES), next(self.sequence), 0.0, None, None, ()))
+        for thread in threads:
+            thread.join()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            waits = {priority: np.asarray(samples) * 1000 for priority, samples in self.waits.items()}
+            return {
+                "concurrency": self.concurrency,
+                "running": self.running,
+                "queue_depth": {PRIORITY_NAMES[priority]: count for priority, count in self.queued.items()},
+                "completed": {PRIORITY_NAMES[priority]: count for priority, count in self.completed.items()},
+                "wait_ms": {
+                    PRIORITY_NAMES[priority]: {
+                        "p50": float(np.percentile(samples, 50)) if len(samples) else 0.0,
+                        "p95": float(np.percentile(samples, 95)) if len(samples) else 0.0,
+                        "max": float(samples.max()) if len(samples) else 0.0,
+                    }
+                    for priority, samples in waits.items()
+                },
+            }
+
+
+class PrioritizedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper running every model call on an EmbeddingExecutor.
+
+    Queries run at query priority. Documents are embedded in calls of at most
+    `document_batch_size` texts at document priority, so a query arriving
+    while a large upload is being embedded waits for one such call at most.
+    The async methods await the executor directly instead of parking a thread
+    of the default pool on the model.
+    """
+
+    def __init__(self, embeddings: Embeddings, executor: EmbeddingExecutor, document_batch_size: int = 32):
+        self.embeddings = embeddings
+        self.executor = executor
+        self.document_batch_size = document_batch_size
+
+    def _submit_documents(self, texts: List[str]) -> List[Future]:
+        size = self.document_batch_size
+        return [
+            self.executor.submit(DOCUMENT, self.embeddings.embed_documents, texts[offset:offset + size])
+            for offset in range(0, len(texts), size)
+        ]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [vector for future in self._submit_documents(texts) for vector in future.result()]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.executor.submit(QUERY, self.embeddings.embed_query, text).result()
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        return self.executor.submit(QUERY, embed_queries, self.embeddings, texts).result()
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        batches = await asyncio.gather(*(asyncio.wrap_future(future) for future in self._submit_documents(texts)))
+        return [vector for batch in batches for vector in batch]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await asyncio.wrap_future(self.executor.submit(QUERY, self.embeddings.embed_query, text))
+
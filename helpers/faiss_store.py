@@ -0,0 +1,543 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+# SQLite caps the number of bound parameters per statement
+_LOOKUP_BATCH = 500
+METRICS = ("l2", "ip")
+
+
+def _import_faiss():
+    try:
+        import faiss
+    except ImportError as e:
+        raise ImportError(
+            "The faiss vector store backend needs the faiss package, install faiss-cpu or faiss-gpu"
+        ) from e
+    return faiss
+
+
+def _batches(items: Sequence, size: int = _LOOKUP_BATCH) -> Iterable[Sequence]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class FaissVectorStore(VectorStore):
+    """
+    Local vector store on a FAISS index, used in place of a Chroma collection.
+
+    `index` is a `faiss.index_factory` description such as "IVF1024,PQ64"
+    (inverted lists of product-quantized codes, 64 bytes per vector),
+    "IVF1024,SQ8" (int8 scalar quantization, 1 byte per dimension),
+    "HNSW32,SQ8" or "Flat"; a "B" prefix as in "BIVF1024" or "BFlat" stores
+    binary codes (1 bit per dimension, Hamming distance). Chunk ids, texts and
+    metadata live next to the index in SQLite, vectors are addressed by an
+    integer id assigned on insert.
+
+    Indexes that need training keep their first vectors in an exact flat index
+    until `train_size` of them are stored, then get trained on those. With
+    `rescore`, the best `k * rescore` candidates of the quantized index are
+    re-ranked by exact distance against float32 vectors kept in a
+    memory-mapped file. With `mmap`, the codes of IVF indexes are kept in an
+    on-disk inverted list file and other indexes are memory-mapped, so resident
+    memory only grows with the parts of the index searches touch.
+
+    Distances follow Chroma: squared L2 for `metric="l2"`, 1 - inner product
+    for `metric="ip"`, and Hamming distance for binary codes without rescoring.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        embedding_function: Embeddings,
+        index: str = "IVF1024,SQ8",
+        metric: str = "l2",
+        train_size: int = 50_000,
+        nprobe: int = 16,
+        ef_search: int = 64,
+        rescore: int = 0,
+        mmap: bool = False,
+    ):
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric {metric}, expected one of {METRICS}")
+        self.faiss = _import_faiss()
+        self.path = path
+        self._embedding = embedding_function
+        self.metric = metric
+        self.train_size = train_size
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.rescore = rescore
+        self.mmap = mmap
+        self.lock = threading.RLock()
+        self.dirty = False
+        self.last_flush = 0.0
+        os.makedirs(path, exist_ok=True)
+        self.index_path = os.path.join(path, "index.faiss")
+        self.staging_path = os.path.join(path, "staging.faiss")
+        self.invlists_path = os.path.join(path, "index.ivfdata")
+        self.vectors_path = os.path.join(path, "vectors.f32")
+
+        self.conn = sqlite3.connect(os.path.join(path, "docstore.db"), check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS chunks
+                             (int_id INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL, file_id INTEGER,
+                              document TEXT, metadata TEXT)''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_chunks_file_id ON chunks(file_id)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self.conn.commit()
+        meta = dict(self.conn.execute('SELECT key, value FROM meta').fetchall())
+        self.next_id = int(meta.get('next_id', 0))
+        self.dim = int(meta['dim']) if 'dim' in meta else None
+        self.vectors_from = int(meta['vectors_from']) if 'vectors_from' in meta else None
+        self.index_spec = meta.get('index', index)
+        if self.index_spec != index or meta.get('metric', metric) != metric:
+            print(
+                f"Vector store at {path} was built as {self.index_spec} ({meta.get('metric')}), "
+                f"keeping it instead of {index} ({metric})"
+            )
+            self.metric = meta.get('metric', metric)
+        self.binary = self.index_spec.startswith("B")
+        self.index = None
+        self.staging = None
+        self.vectors: Optional[np.ndarray] = None
+        if self.dim is not None:
+            self._load()
+
+    # Index files
+
+    def _ivf(self, index):
+        """The IVF part of a float or binary index, None for other indexes."""
+        if self.binary:
+            return index if isinstance(index, self.faiss.IndexBinaryIVF) else None
+        return self.faiss.try_extract_index_ivf(index)
+
+    def _new_index(self):
+        faiss = self.faiss
+        if self.binary:
+            index = faiss.index_binary_factory(self.dim, self.index_spec)
+            if not isinstance(index, faiss.IndexBinaryIVF):
+                return faiss.IndexBinaryIDMap2(index)
+        else:
+            metric = faiss.METRIC_L2 if self.metric == "l2" else faiss.METRIC_INNER_PRODUCT
+            index = faiss.index_factory(self.dim, self.index_spec, metric)
+            if faiss.try_extract_index_ivf(index) is None:
+                return faiss.IndexIDMap2(index)
+        if self.mmap:
+            self._replace_invlists(self._ivf(index), self.invlists_path)
+        return index
+
+    def _replace_invlists(self, ivf, path: str):
+        """Move the inverted lists of `ivf` to an on-disk inverted list file at `path`."""
+        faiss = self.faiss
+        invlists = faiss.OnDiskInvertedLists(ivf.nlist, ivf.code_size, path)
+        if ivf.ntotal:
+            # Merging empty lists would map an empty file
+            sources = faiss.InvertedListsPtrVector()
+            sources.push_back(ivf.invlists)
+            invlists.merge_from_multiple(sources.data(), sources.size())
+        # The index frees the inverted lists, not the Python wrapper
+        invlists.this.disown()
+        ivf.replace_invlists(invlists, True)
+        return invlists
+
+    def _new_staging(self):
+        faiss = self.faiss
+        flat = faiss.IndexFlatL2(self.dim) if self.metric == "l2" else faiss.IndexFlatIP(self.dim)
+        return faiss.IndexIDMap2(flat)
+
+    def _load(self) -> None:
+        faiss = self.faiss
+        if os.path.exists(self.index_path):
+            read_index = faiss.read_index_binary if self.binary else faiss.read_index
+            if os.path.exists(self.invlists_path):
+                self.index = read_index(self.index_path, faiss.IO_FLAG_ONDISK_SAME_DIR)
+            else:
+                self.index = read_index(self.index_path, faiss.IO_FLAG_MMAP if self.mmap else 0)
+                ivf = self._ivf(self.index)
+                if self.mmap and ivf is not None:
+                    # Memory-mapped inverted lists are read-only, adds need a list file that can grow
+                    self._replace_invlists(ivf, self.invlists_path)
+        else:
+            self.index = self._new_index()
+        if os.path.exists(self.staging_path):
+            self.staging = faiss.read_index(self.staging_path)
+        else:
+            self.staging = self._new_staging()
+        self._open_vectors()
+
+    def _open_vectors(self) -> None:
+        if self.vectors_from is None or not os.path.exists(self.vectors_path):
+            self.vectors = None
+            return
+        rows = os.path.getsize(self.vectors_path) // (4 * self.dim)
+        self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(rows, self.dim)) if rows else None
+
+    def _set_meta(self, **values) -> None:
+        self.conn.executemany(
+            'INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value',
+            [(key, str(value)) for key, value in values.items()],
+        )
+
+    def _initialize(self, dim: int) -> None:
+        self.dim = dim
+        if self.rescore:
+            self.vectors_from = self.next_id
+            open(self.vectors_path, 'ab').close()
+        self._set_meta(dim=dim, index=self.index_spec, metric=self.metric,
+                       **({'vectors_from': self.vectors_from} if self.vectors_from is not None else {}))
+        self.conn.commit()
+        self.index = self._new_index()
+        self.staging = self._new_staging()
+        self._open_vectors()
+
+    def flush(self, min_interval: float = 0.0) -> None:
+        """Persist the index if it changed and at least `min_interval` seconds passed since the last write."""
+        with self.lock:
+            if not self.dirty or time.monotonic() - self.last_flush < min_interval:
+                return
+            faiss = self.faiss
+            self._compact_invlists()
+            for index, path in ((self.index, self.index_path), (self.staging, self.staging_path)):
+                tmp_path = f"{path}.tmp"
+                if self.binary and index is self.index:
+                    faiss.write_index_binary(index, tmp_path)
+                else:
+                    faiss.write_index(index, tmp_path)
+                os.replace(tmp_path, path)
+            self.dirty = False
+            self.last_flush = time.monotonic()
+
+    def _compact_invlists(self) -> None:
+        """Rewrite on-disk inverted lists once growth left the file mostly empty space."""
+        faiss = self.faiss
+        ivf = self._ivf(self.index)
+        if ivf is None:
+            return
+        invlists = faiss.downcast_InvertedLists(ivf.invlists)
+        if not isinstance(invlists, faiss.OnDiskInvertedLists):
+            return
+        # Lists double their capacity as they grow, which can leave the file several times larger than its data
+        used = sum(invlists.list_size(list_no) for list_no in range(ivf.nlist)) * (ivf.code_size + 8)
+        if os.path.getsize(self.invlists_path) <= 2 * used + 2 ** 20:
+            return
+        tmp_path = f"{self.invlists_path}.tmp"
+        compact = self._replace_invlists(ivf, tmp_path)
+        os.replace(tmp_path, self.invlists_path)
+        compact.filename = self.invlists_path
+
+    def close(self) -> None:
+        with self.lock:
+            if self.index is not None:
+                self.flush()
+            self.conn.close()
+
+    # Writes
+
+    def _codes(self, vectors: np.ndarray) -> np.ndarray:
+        # Binary codes keep the sign of each dimension
+        return np.packbits(vectors > 0, axis=1) if self.binary else vectors
+
+    def _index_vectors(self, vectors: np.ndarray, int_ids: np.ndarray) -> None:
+        if self.index.is_trained:
+            self.index.add_with_ids(self._codes(vectors), int_ids)
+            return
+        self.staging.add_with_ids(vectors, int_ids)
+        if self.staging.ntotal < self.train_size:
+            return
+        # Enough vectors to train on: move everything staged into the trained index
+        flat = self.faiss.downcast_index(self.staging.index)
+        staged = self.faiss.rev_swig_ptr(flat.get_xb(), flat.ntotal * self.dim).reshape(flat.ntotal, self.dim).copy()
+        staged_ids = self.faiss.vector_to_array(self.staging.id_map).astype(np.int64)
+        self.index.train(self._codes(staged))
+        self.index.add_with_ids(self._codes(staged), staged_ids)
+        self.staging = self._new_staging()
+
+    def add_embeddings(
+        self,
+        ids: Sequence[str],
+        embeddings: Sequence[Sequence[float]],
+        texts: Sequence[str],
+        metadatas: Optional[Sequence[Dict[str, Any]]] = None,
+    ) -> List[str]:
+        """Store already embedded chunks, replacing chunks with the same id."""
+        if not ids:
+            return []
+        vectors = np.ascontiguousarray(embeddings, dtype=np.float32)
+        metadatas = metadatas or [{} for _ in ids]
+        with self.lock:
+            if self.dim is None:
+                self._initialize(vectors.shape[1])
+            self._delete_int_ids(self._int_ids_for_ids(ids))
+            int_ids = np.arange(self.next_id, self.next_id + len(ids), dtype=np.int64)
+            self.next_id += len(ids)
+            if self.vectors_from is not None:
+                with open(self.vectors_path, 'ab') as f:
+                    f.write(vectors.tobytes())
+            self._index_vectors(vectors, int_ids)
+            self.conn.executemany(
+                'INSERT INTO chunks (int_id, id, file_id, document, metadata) VALUES (?, ?, ?, ?, ?)',
+                [
+                    (int(int_id), id_, (metadata or {}).get('file_id'), text, json.dumps(metadata or {}))
+                    for int_id, id_, text, metadata in zip(int_ids, ids, texts, metadatas)
+                ],
+            )
+            self._set_meta(next_id=self.next_id)
+            self.conn.commit()
+            if self.vectors_from is not None:
+                self._open_vectors()
+            self.dirty = True
+        return list(ids)
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        ids = list(ids) if ids is not None else [str(uuid.uuid4()) for _ in texts]
+        embeddings = self._embedding.embed_documents(texts)
+        return self.add_embeddings(ids, embeddings, texts, metadatas)
+
+    def _delete_int_ids(self, int_ids: List[int]) -> None:
+        if not int_ids:
+            return
+        selector = self.faiss.IDSelectorBatch(np.asarray(int_ids, dtype=np.int64))
+        for index in (self.index, self.staging):
+            try:
+                index.remove_ids(selector)
+            except RuntimeError:
+                # HNSW cannot remove vectors, search drops ids missing from the docstore instead
+                pass
+        for batch in _batches(int_ids):
+            self.conn.execute(
+                f"DELETE FROM chunks WHERE int_id IN ({', '.join('?' * len(batch))})", [int(i) for i in batch])
+        self.dirty = True
+
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None, **kwargs: Any) -> bool:
+        with self.lock:
+            if self.index is None:
+                return True
+            int_ids = self._int_ids_for_ids(ids) if ids is not None else []
+            if where is not None:
+                int_ids += self._int_ids_where(where)
+            self._delete_int_ids(int_ids)
+            self.conn.commit()
+        return True
+
+    # Reads
+
+    def _int_ids_for_ids(self, ids: Sequence[str]) -> List[int]:
+        int_ids = []
+        for batch in _batches(list(ids)):
+            rows = self.conn.execute(
+                f"SELECT int_id FROM chunks WHERE id IN ({', '.join('?' * len(batch))})", list(batch)).fetchall()
+            int_ids.extend(row[0] for row in rows)
+        return int_ids
+
+    @staticmethod
+    def _where_sql(where: Dict[str, Any]) -> Tuple[str, List[Any]]:
+        # Only the file_id filters chroma_utils and the retriever build are supported
+        if set(where) != {"file_id"}:
+            raise ValueError(f"Unsupported filter {where}, only file_id filters are supported")
+        condition = where["file_id"]
+        if not isinstance(condition, dict):
+            return "file_id = ?", [condition]
+        if set(condition) == {"$eq"}:
+            return "file_id = ?", [condition["$eq"]]
+        if set(condition) == {"$in"}:
+            values = list(condition["$in"])
+            return f"file_id IN ({', '.join('?' * len(values))})", values
+        raise ValueError(f"Unsupported filter {where}, use a value, $eq or $in")
+
+    def _int_ids_where(self, where: Dict[str, Any]) -> List[int]:
+        clause, params = self._where_sql(where)
+        return [row[0] for row in self.conn.execute(f"SELECT int_id FROM chunks WHERE {clause}", params)]
+
+    def count(self) -> int:
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM chunks').fetchone()[0]
+
+    def get(
+        self,
+        ids: Optional[Sequence[str]] = None,
+        where: Optional[Dict[str, Any]] = None,
+        limit: Optional[int] = None,
+        offset: Optional[int] = None,
+        include: Sequence[str] = ("documents", "metadatas"),
+    ) -> Dict[str, Any]:
+        """Stored chunks in the shape Chroma's `get` returns them."""
+        conditions, params = [], []
+        if ids is not None:
+            conditions.append(f"id IN ({', '.join('?' * len(ids))})")
+            params.extend(ids)
+        if where is not None:
+            clause, where_params = self._where_sql(where)
+            conditions.append(clause)
+            params.extend(where_params)
+        query = 'SELECT int_id, id, document, metadata FROM chunks'
+        if conditions:
+            query += f" WHERE {' AND '.join(conditions)}"
+        query += ' ORDER BY int_id'
+        if limit is not None or offset:
+            query += ' LIMIT ? OFFSET ?'
+            params.extend([-1 if limit is None else limit, offset or 0])
+        with self.lock:
+            rows = self.conn.execute(query, params).fetchall()
+        result: Dict[str, Any] = {"ids": [row[1] for row in rows]}
+        if "documents" in include:
+            result["documents"] = [row[2] for row in rows]
+        if "metadatas" in include:
+            result["metadatas"] = [json.loads(row[3]) for row in rows]
+        if "embeddings" in include:
+            result["embeddings"] = [self._vector(row[0]) for row in rows]
+        return result
+
+    def _vector(self, int_id: int) -> Optional[np.ndarray]:
+        if self.vectors is None or int_id < self.vectors_from or int_id - self.vectors_from >= len(self.vectors):
+            return None
+        return np.asarray(self.vectors[int_id - self.vectors_from])
+
+    def _search_params(self, index, selector=None):
+        faiss = self.faiss
+        ivf = faiss.try_extract_index_ivf(index)
+        if ivf is not None:
+            return faiss.SearchParametersIVF(sel=selector, nprobe=self.nprobe)
+        inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap2) else index
+        if isinstance(inner, faiss.IndexHNSW):
+            return faiss.SearchParametersHNSW(sel=selector, efSearch=self.ef_search)
+        return faiss.SearchParameters(sel=selector)
+
+    def _search(
+        self, queries: np.ndarray, k: int, allowed: Optional[np.ndarray] = None
+    ) -> List[List[Tuple[int, float]]]:
+        """(label, distance) of the closest vectors to each row of `queries`, closest first."""
+        trained = self.index.is_trained
+        index = self.index if trained else self.staging
+        if index.ntotal == 0:
+            return [[] for _ in queries]
+        quantized = trained and self.index_spec != "Flat"
+        fetch = k * self.rescore if quantized and self.rescore else k
+        selector = None if allowed is None else self.faiss.IDSelectorBatch(allowed)
+        if self.binary and trained:
+            codes = self._codes(queries)
+            if isinstance(index, self.faiss.IndexBinaryIVF):
+                index.nprobe = self.nprobe
+            if selector is None:
+                distances, labels = index.search(codes, fetch)
+            else:
+                # Binary indexes take no selector, over-fetch and filter instead
+                distances, labels = index.search(codes, min(index.ntotal, max(fetch * 8, 256)))
+                keep = np.isin(labels, allowed)
+                distances = [row[row_keep][:fetch] for row, row_keep in zip(distances, keep)]
+                labels = [row[row_keep][:fetch] for row, row_keep in zip(labels, keep)]
+        else:
+            distances, labels = index.search(queries, fetch, params=self._search_params(index, selector))
+
+        results = []
+        for query, query_labels, query_distances in zip(queries, labels, distances):
+            hits = [(int(label), float(distance)) for label, distance in zip(query_labels, query_distances)
+                    if label != -1]
+            if self.metric == "ip" and not (self.binary and trained):
+                hits = [(label, 1.0 - score) for label, score in hits]
+
+            if quantized and self.rescore and hits:
+                vectors = [self._vector(label) for label, _ in hits]
+                if all(vector is not None for vector in vectors):
+                    exact = np.stack(vectors)
+                    if self.metric == "l2":
+                        exact_distances = ((exact - query) ** 2).sum(axis=1)
+                    else:
+                        exact_distances = 1.0 - exact @ query
+                    hits = [(label, float(distance)) for (label, _), distance in zip(hits, exact_distances)]
+            hits.sort(key=lambda hit: hit[1])
+            results.append(hits)
+        return results
+
+    def similarity_search_by_vector_with_relevance_scores(
+        self, embedding: List[float], k: int = 4, filter: Optional[Dict[str, Any]] = None, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        """Closest chunks as (document, distance), like the Chroma method of the same name."""
+        return self.similarity_search_by_vectors_with_relevance_scores([embedding], k, filter)[0]
+
+    def similarity_search_by_vectors_with_relevance_scores(
+        self, embeddings: Sequence[Sequence[float]], k: int = 4, filter: Optional[Dict[str, Any]] = None
+    ) -> List[List[Tuple[Document, float]]]:
+        """Closest chunks of several queries in one index search and one docstore lookup."""
+        queries = np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1)
+        with self.lock:
+            if self.index is None:
+                return [[] for _ in embeddings]
+            allowed = None
+            if filter is not None:
+                allowed = np.asarray(self._int_ids_where(filter), dtype=np.int64)
+                if not len(allowed):
+                    return [[] for _ in embeddings]
+            results = self._search(queries, k, allowed)
+            rows = {}
+            labels = list({label for hits in results for label, _ in hits})
+            for batch in _batches(labels):
+                for int_id, document, metadata in self.conn.execute(
+                    f"SELECT int_id, document, metadata FROM chunks WHERE int_id IN ({', '.join('?' * len(batch))})",
+                    batch,
+                ):
+                    rows[int_id] = (document, metadata)
+        # Ids missing from the docstore were deleted from an index that cannot remove vectors
+        return [
+            [
+                (Document(page_content=rows[label][0], metadata=json.loads(rows[label][1])), distance)
+                for label, distance in hits if label in rows
+            ][:k]
+            for hits in results
+        ]
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, filter: Optional[Dict[str, Any]] = None, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_relevance_scores(
+            self._embedding.embed_query(query), k, filter
+        )
+
+    def similarity_search_by_vector(
+        self, embedding: List[float], k: int = 4, filter: Optional[Dict[str, Any]] = None, **kwargs: Any
+    ) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_relevance_scores(embedding, k, filter)]
+
+    def similarity_search(
+        self, query: str, k: int = 4, filter: Optional[Dict[str, Any]] = None, **kwargs: Any
+    ) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        return self._euclidean_relevance_score_fn if self.metric == "l2" else self._cosine_relevance_score_fn
+
+    @property
+    def embeddings(self) -> Optional[Embeddings]:
+        return self._embedding
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        path: str = "faiss_index",
+        **kwargs: Any,
+    ) -> "FaissVectorStore":
+        store = cls(path, embedding, **kwargs)
+        store.add_texts(texts, metadatas, ids)
+        store.flush()
+        return store
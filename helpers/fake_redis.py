@@ -0,0 +1,139 @@
+import time
+from typing import Any, Dict, List, Optional
+
+
+class FakeRedis:
+    """
+    In-process stand-in for `redis.asyncio.Redis`, covering the commands the
+    session store uses, with string responses as with `decode_responses=True`.
+
+    Several store instances sharing one FakeRedis behave like API replicas
+    sharing one Redis server.
+    """
+
+    def __init__(self):
+        self.data: Dict[str, Any] = {}
+        self.expiry: Dict[str, float] = {}
+
+    def _get(self, key: str, default=None):
+        deadline = self.expiry.get(key)
+        if deadline is not None and deadline <= time.monotonic():
+            self.data.pop(key, None)
+            self.expiry.pop(key, None)
+        return self.data.get(key, default)
+
+    def _set_default(self, key: str, factory):
+        value = self._get(key)
+        if value is None:
+            value = self.data[key] = factory()
+        return value
+
+    async def ping(self) -> bool:
+        return True
+
+    async def incr(self, key: str, amount: int = 1) -> int:
+        value = int(self._get(key, 0)) + amount
+        self.data[key] = str(value)
+        return value
+
+    async def rpush(self, key: str, *values: str) -> int:
+        items = self._set_default(key, list)
+        items.extend(str(value) for value in values)
+        return len(items)
+
+    async def ltrim(self, key: str, start: int, end: int) -> bool:
+        items = self._get(key)
+        if items is not None:
+            end = len(items) if end == -1 else end + 1
+            self.data[key] = items[start:end]
+        return True
+
+    async def lrange(self, key: str, start: int, end: int) -> List[str]:
+        items = self._get(key, [])
+        return list(items[start:] if end == -1 else items[start:end + 1])
+
+    async def expire(self, key: str, seconds: int) -> bool:
+        if self._get(key) is None:
+            return False
+        self.expiry[key] = time.monotonic() + seconds
+        return True
+
+    async def hset(self, key: str, mapping: Dict[str, Any]) -> int:
+        fields = self._set_default(key, dict)
+        added = len(set(mapping) - set(fields))
+        fields.update({field: str(value) for field, value in mapping.items()})
+        return added
+
+    async def hsetnx(self, key: str, field: str, value: Any) -> bool:
+        fields = self._set_default(key, dict)
+        if field in fields:
+            return False
+        fields[field] = str(value)
+        return True
+
+    async def hgetall(self, key: str) -> Dict[str, str]:
+        return dict(self._get(key, {}))
+
+    async def zadd(self, key: str, mapping: Dict[str, float], nx: bool = False) -> int:
+        members = self._set_default(key, dict)
+        added = 0
+        for member, score in mapping.items():
+            if member not in members:
+                added += 1
+            elif nx:
+                continue
+            members[member] = float(score)
+        return added
+
+    async def zrevrange(self, key: str, start: int, end: int) -> List[str]:
+        members = self._get(key, {})
+        ordered = sorted(members, key=lambda member: members[member], reverse=True)
+        return ordered[start:] if end == -1 else ordered[start:end + 1]
+
+    async def zrem(self, key: str, *members: str) -> int:
+        existing = self._get(key, {})
+        return sum(existing.pop(member, None) is not None for member in members)
+
+    async def delete(self, *keys: str) -> int:
+        removed = 0
+        for key in keys:
+            if self._get(key) is not None:
+                removed += 1
+            self.data.pop(key, None)
+            self.expiry.pop(key, None)
+        return removed
+
+    def pipeline(self, transaction: bool = True) -> "FakePipeline":
+        return FakePipeline(self)
+
+    async def aclose(self) -> None:
+        pass
+
+
+class FakePipeline:
+    """Queues commands and runs them back to back on `execute`, which no other coroutine can interleave with."""
+
+    def __init__(self, redis: FakeRedis):
+        self.redis = redis
+        self.commands: List[tuple] = []
+
+    def __getattr__(self, name: str):
+        command = getattr(self.redis, name)
+
+        def queue(*args, **kwargs) -> "FakePipeline":
+            self.commands.append((command, args, kwargs))
+            return self
+
+        return queue
+
+    async def execute(self) -> List[Any]:
+        commands, self.commands = self.commands, []
+        # Each fake command completes without suspending, so the batch runs atomically
+        return [await command(*args, **kwargs) for command, args, kwargs in commands]
+
+    async def __aenter__(self) -> "FakePipeline":
+        return self
+
+    async def __aexit__(self, *exc_info) -> Optional[bool]:
+        self.commands = []
+        return None
@@ -0,0 +1,109 @@
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from helpers.faiss_store import FaissVectorStore
+
+
+def _distances(embeddings: np.ndarray, queries: np.ndarray, space: str) -> np.ndarray:
+    """Distance of each chunk to each query, shape (queries, chunks)."""
+    # Same distances as Chroma reports for each hnsw:space
+    products = queries @ embeddings.T
+    if space == "cosine":
+        norms = np.linalg.norm(queries, axis=1)[:, None] * np.linalg.norm(embeddings, axis=1)[None, :]
+        return 1.0 - products / np.maximum(norms, 1e-12)
+    if space == "ip":
+        return 1.0 - products
+    squared = (queries ** 2).sum(axis=1)[:, None] - 2 * products + (embeddings ** 2).sum(axis=1)[None, :]
+    return np.maximum(squared, 0.0)
+
+
+def filtered_similarity_search(
+    vectorstore, query_embedding: Sequence[float], k: int, where: Dict[str, Any], max_exact_chunks: int = 200
+) -> List[Tuple[Document, float]]:
+    """
+    Nearest chunks among those matching a metadata filter, as (document, distance).
+
+    Chroma's filtered HNSW search walks the graph until it has found `k` allowed
+    neighbours, which takes longer than an unfiltered search when the filter
+    keeps only a small part of the collection. When at most `max_exact_chunks`
+    chunks match, they are fetched and scored exactly instead.
+
+    Args:
+        vectorstore (Chroma | FaissVectorStore): Collection to search
+        query_embedding (Sequence[float]): Embedded query
+        k (int): Number of chunks to return
+        where (Dict[str, Any]): Chroma metadata filter
+        max_exact_chunks (int): Largest filtered set scored exactly, 0 always uses the HNSW index
+
+    Returns:
+        List[Tuple[Document, float]]: Closest chunks first
+    """
+    return batch_similarity_search(vectorstore, [query_embedding], k, where, max_exact_chunks)[0]
+
+
+def batch_similarity_search(
+    vectorstore,
+    query_embeddings: Sequence[Sequence[float]],
+    k: int,
+    where: Optional[Dict[str, Any]] = None,
+    max_exact_chunks: int = 200,
+) -> List[List[Tuple[Document, float]]]:
+    """
+    Nearest chunks of several queries at once, as (document, distance) per query.
+
+    The queries go through one multi-query call of the index (Chroma's `query`
+    with all embeddings, one FAISS search over the query matrix) and, for small
+    filtered sets, one distance matrix over the matching chunks.
+
+    Args:
+        vectorstore (Chroma | FaissVectorStore): Collection to search
+        query_embeddings (Sequence[Sequence[float]]): Embedded queries
+        k (int): Number of chunks to return per query
+        where (Optional[Dict[str, Any]]): Chroma metadata filter, None searches every chunk
+        max_exact_chunks (int): Largest filtered set scored exactly, 0 always uses the HNSW index
+
+    Returns:
+        List[List[Tuple[Document, float]]]: Closest chunks first, for each query in order
+    """
+    if not query_embeddings:
+        return []
+    if isinstance(vectorstore, FaissVectorStore):
+        # FAISS applies the filter inside the index search itself
+        return vectorstore.similarity_search_by_vectors_with_relevance_scores(query_embeddings, k=k, filter=where)
+    collection = vectorstore._collection
+    matching = []
+    if where is not None and max_exact_chunks > 0:
+        matching = collection.get(where=where, include=[], limit=max_exact_chunks + 1)["ids"]
+        if not matching:
+            return [[] for _ in query_embeddings]
+    if where is None or max_exact_chunks <= 0 or len(matching) > max_exact_chunks:
+        result = collection.query(
+            query_embeddings=[list(embedding) for embedding in query_embeddings],
+            n_results=k,
+            where=where,
+            include=["documents", "metadatas", "distances"],
+        )
+        return [
+            [
+                (Document(page_content=document, metadata=metadata or {}), distance)
+                for document, metadata, distance in zip(documents, metadatas, distances)
+            ]
+            for documents, metadatas, distances in zip(result["documents"], result["metadatas"], result["distances"])
+        ]
+
+    result = collection.get(ids=matching, include=["embeddings", "documents", "metadatas"])
+    space = (collection.metadata or {}).get("hnsw:space", "l2")
+    distances = _distances(
+        np.asarray(result["embeddings"], dtype=np.float32), np.asarray(query_embeddings, dtype=np.float32), space
+    )
+    results = []
+    for query_distances in distances:
+        top = np.argsort(query_distances)[:k]
+        results.append([
+            (Document(page_content=result["documents"][idx], metadata=result["metadatas"][idx] or {}),
+             float(query_distances[idx]))
+            for idx in top
+        ])
+    return results
@@ -0,0 +1,169 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import AsyncIterator, List, Optional
+
+from helpers.chroma_utils import delete_chunks_from_chroma, delete_doc_from_chroma, index_split_batches
+from helpers.constants import GLOBAL_CONFIG, UPLOADS_DIR_NAME
+from helpers.db_utils import (
+    get_ingestion_job,
+    get_unfinished_ingestion_jobs,
+    update_ingestion_job,
+    update_document_hashes,
+    delete_document_record,
+)
+from helpers.document_utils import stream_split_batches
+from helpers.logger import create_logger
+
+logger = create_logger(__name__)
+
+UPLOADS_DIR = os.path.join(os.getcwd(), UPLOADS_DIR_NAME)
+if not os.path.exists(UPLOADS_DIR):
+    os.mkdir(UPLOADS_DIR)
+
+FINISHED_STAGES = ('completed', 'failed')
+
+
+class IngestionQueueFull(Exception):
+    """Raised when the ingestion backlog is at capacity."""
+
+
+def _utc_now() -> str:
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class IngestionQueue:
+    """
+    Bounded background queue for document ingestion.
+
+    Parsing and splitting run in a process pool so large files never block the
+    event loop; PDFs are parsed `pages_per_task` pages at a time, so several
+    workers share a large file. Chunks are embedded and written in batches of
+    `batch_size` while later pages are still being parsed, which bounds memory
+    by the batch size rather than by the size of the document. Embedding and the
+    Chroma write stay in the API process, which owns the embedding model and
+    the persistent Chroma client. Every stage
+    transition is written to the `ingestion_jobs` table, so jobs that were
+    queued or in flight when the API stopped are picked up again by `start`.
+    """
+
+    def __init__(
+        self, max_workers: int = 2, max_queue_size: int = 100, batch_size: int = 256, pages_per_task: int = 50
+    ):
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self.batch_size = batch_size
+        self.pages_per_task = pages_per_task
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.workers: List[asyncio.Task] = []
+
+    async def start(self) -> None:
+        # spawn keeps CUDA / vLLM state of the API process out of the workers
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context('spawn'),
+        )
+        pending = await get_unfinished_ingestion_jobs()
+        for job in pending:
+            self.queue.put_nowait(job['id'])
+        if pending:
+            logger.info(f"Resuming {len(pending)} unfinished ingestion jobs")
+        self.workers = [
+            asyncio.create_task(self._worker()) for _ in range(self.max_workers)
+        ]
+
+    async def stop(self) -> None:
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def submit(self, job_id: str) -> None:
+        """Enqueue a job already recorded with `insert_ingestion_job`."""
+        if self.queue.qsize() >= self.max_queue_size:
+            raise IngestionQueueFull(
+                f"Ingestion queue is full ({self.max_queue_size} pending jobs)"
+            )
+        self.queue.put_nowait(job_id)
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self.queue.get()
+            try:
+                await self._run_job(job_id)
+            except Exception as e:
+                logger.error(f"Ingestion job {job_id} crashed: {str(e)}")
+            finally:
+                self.queue.task_done()
+
+    @staticmethod
+    async def _mark_indexing(job_id: str, batches: AsyncIterator[List]) -> AsyncIterator[List]:
+        """Pass batches through, moving the job to 'indexing' once the first one is parsed."""
+        indexing = False
+        async for batch in batches:
+            if not indexing:
+                await update_ingestion_job(job_id, stage='indexing')
+                indexing = True
+            yield batch
+
+    @staticmethod
+    async def _discard_partial(job: dict, added: List[str]) -> None:
+        """Remove what a failed job wrote, so no chunks of a half-indexed file stay searchable."""
+        try:
+            if job['is_update']:
+                # Re-uploads keep the previous version of the document, stale chunks are only deleted on success
+                await delete_chunks_from_chroma(added, job['tenant'])
+            else:
+                await delete_doc_from_chroma(job['file_id'], job['tenant'])
+                await delete_document_record(job['file_id'])
+        except Exception as e:
+            logger.error(f"Failed to remove the chunks of failed job {job['id']}: {str(e)}")
+
+    async def _run_job(self, job_id: str) -> None:
+        job = await get_ingestion_job(job_id)
+        if job is None or job['stage'] in FINISHED_STAGES:
+            return
+        resumed = job['stage'] != 'queued'
+        added: List[str] = []
+        try:
+            await update_ingestion_job(job_id, stage='parsing', started_at=_utc_now())
+            batches = stream_split_batches(
+                job['file_path'], self.batch_size, self.executor, self.pages_per_task, max_pending=self.max_workers
+            )
+            # Chunks written by an interrupted run are found by hash and reused
+            stats = await index_split_batches(
+                self._mark_indexing(job_id, batches), job['file_id'],
+                is_new=not (job['is_update'] or resumed), tenant=job['tenant'], added=added,
+            )
+            await update_document_hashes([(job['file_id'], job['content_hash'])])
+
+            await update_ingestion_job(job_id, stage='completed', finished_at=_utc_now(), **stats)
+            logger.info(
+                f"Indexed {job['filename']} (file_id {job['file_id']}): {stats['num_chunks']} chunks, "
+                f"{stats['chunks_embedded']} embedded, {stats['chunks_reused']} reused, "
+                f"{stats['chunks_deleted']} deleted, parse {stats['parse_seconds']:.2f}s, "
+                f"index {stats['index_seconds']:.2f}s"
+            )
+        except Exception as e:
+            await update_ingestion_job(job_id, stage='failed', error=str(e), finished_at=_utc_now())
+            logger.error(f"Failed to index {job['filename']}: {str(e)}")
+            await self._discard_partial(job, added)
+        # Only reached once the job is finished; a cancelled job keeps its file for the next start
+        if os.path.exists(job['file_path']):
+            os.remove(job['file_path'])
+
+
+ingestion_config = GLOBAL_CONFIG.get('ingestion', {})
+ingestion_queue = IngestionQueue(
+    max_workers=ingestion_config.get('max_workers', 2),
+    max_queue_size=ingestion_config.get('max_queue_size', 100),
+    batch_size=ingestion_config.get('embed_batch_size', 256),
+    pages_per_task=ingestion_config.get('pdf_pages_per_task', 50),
+)
@@ -0,0 +1,244 @@
+import bisect
+import os
+import pickle
+import re
+import threading
+import time
+from array import array
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+# Identifiers such as "AB-1234.5" or "clause_7/2" are indexed whole and by their parts
+_TOKEN = re.compile(r"\w+(?:[-_./:]\w+)*")
+_PART = re.compile(r"[^\W_]+")
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for match in _TOKEN.finditer(text.lower()):
+        token = match.group()
+        tokens.append(token)
+        parts = _PART.findall(token)
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+class BM25Index:
+    """
+    In-process inverted index with Okapi BM25 scoring.
+
+    Postings are kept per term as two compact arrays (internal doc numbers and
+    term frequencies), documents as parallel arrays of chunk id, file id and
+    length. Deletes only tombstone a document; the arrays are compacted once
+    more than half of them are dead. The index is pickled to `path` by `flush`.
+    """
+
+    def __init__(self, path: str, k1: float = 1.5, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.lock = threading.Lock()
+        # Serializes writes of the file, searches and updates only wait for the snapshot under `lock`
+        self.flush_lock = threading.Lock()
+        self.postings: Dict[str, Tuple[array, array]] = {}
+        self.chunk_ids: List[str] = []
+        self.file_ids = array('q')
+        self.lengths = array('I')
+        self.alive = bytearray()
+        self.positions: Dict[str, int] = {}
+        self.num_alive = 0
+        self.total_length = 0
+        self.dirty = False
+        self.last_flush = 0.0
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> "BM25Index":
+        index = cls(path, **kwargs)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                state = pickle.load(f)
+            for name, value in state.items():
+                setattr(index, name, value)
+            index.positions = {
+                chunk_id: doc for doc, chunk_id in enumerate(index.chunk_ids) if index.alive[doc]
+            }
+        return index
+
+    def __len__(self) -> int:
+        return self.num_alive
+
+    def chunk_id_set(self) -> Set[str]:
+        """Ids of the chunks currently indexed."""
+        with self.lock:
+            return set(self.positions)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.postings = {}
+            self.chunk_ids = []
+            self.file_ids = array('q')
+            self.lengths = array('I')
+            self.alive = bytearray()
+            self.positions = {}
+            self.num_alive = 0
+            self.total_length = 0
+            self.dirty = True
+
+    def add(self, chunk_ids: Sequence[str], texts: Sequence[str], file_ids: Sequence[int]) -> None:
+        with self.lock:
+            for chunk_id, text, file_id in zip(chunk_ids, texts, file_ids):
+                if chunk_id in self.positions:
+                    self._remove(self.positions[chunk_id])
+                doc = len(self.chunk_ids)
+                counts: Dict[str, int] = {}
+                tokens = tokenize(text)
+                for token in tokens:
+                    counts[token] = counts.get(token, 0) + 1
+                for token, count in counts.items():
+                    if token not in self.postings:
+                        self.postings[token] = (array('I'), array('H'))
+                    docs, tfs = self.postings[token]
+                    docs.append(doc)
+                    tfs.append(min(count, 0xFFFF))
+                self.chunk_ids.append(chunk_id)
+                self.file_ids.append(file_id if file_id is not None else -1)
+                self.lengths.append(len(tokens))
+                self.alive.append(1)
+                self.positions[chunk_id] = doc
+                self.num_alive += 1
+                self.total_length += len(tokens)
+            self.dirty = True
+
+    def _remove(self, doc: int) -> None:
+        if self.alive[doc]:
+            self.alive[doc] = 0
+            self.num_alive -= 1
+            self.total_length -= self.lengths[doc]
+            del self.positions[self.chunk_ids[doc]]
+
+    def remove(self, chunk_ids: Iterable[str]) -> None:
+        with self.lock:
+            for chunk_id in chunk_ids:
+                if chunk_id in self.positions:
+                    self._remove(self.positions[chunk_id])
+            self.dirty = True
+            self._maybe_compact()
+
+    def remove_file(self, file_id: int) -> None:
+        with self.lock:
+            file_ids = np.frombuffer(self.file_ids, dtype=np.int64)
+            for doc in np.flatnonzero(file_ids == file_id):
+                self._remove(int(doc))
+            self.dirty = True
+            self._maybe_compact()
+
+    def _maybe_compact(self) -> None:
+        if len(self.chunk_ids) < 1024 or self.num_alive * 2 > len(self.chunk_ids):
+            return
+        remap = np.full(len(self.chunk_ids), -1, dtype=np.int64)
+        alive = np.frombuffer(self.alive, dtype=np.uint8).astype(bool)
+        remap[alive] = np.arange(int(alive.sum()))
+        postings = {}
+        for token, (docs, tfs) in self.postings.items():
+            old_docs = np.frombuffer(docs, dtype=np.uint32)
+            keep = alive[old_docs]
+            if keep.any():
+                postings[token] = (
+                    array('I', remap[old_docs[keep]].astype(np.uint32).tobytes()),
+                    array('H', np.frombuffer(tfs, dtype=np.uint16)[keep].tobytes()),
+                )
+        self.postings = postings
+        self.chunk_ids = [chunk_id for chunk_id, flag in zip(self.chunk_ids, self.alive) if flag]
+        self.file_ids = array('q', np.frombuffer(self.file_ids, dtype=np.int64)[alive].tobytes())
+        self.lengths = array('I', np.frombuffer(self.lengths, dtype=np.uint32)[alive].tobytes())
+        self.alive = bytearray(b'\x01' * len(self.chunk_ids))
+        self.positions = {chunk_id: doc for doc, chunk_id in enumerate(self.chunk_ids)}
+
+    def search(
+        self, query: str, k: int = 10, file_ids: Optional[Sequence[int]] = None
+    ) -> List[Tuple[str, float]]:
+        """Top `k` (chunk id, BM25 score) pairs, optionally restricted to some files."""
+        with self.lock:
+            if not self.num_alive:
+                return []
+            avg_length = self.total_length / self.num_alive
+            lengths = np.frombuffer(self.lengths, dtype=np.uint32)
+            allowed = None
+            if file_ids is not None:
+                # Postings are narrowed to the allowed files before scoring
+                allowed = np.isin(np.frombuffer(self.file_ids, dtype=np.int64), list(file_ids))
+            all_docs, all_scores = [], []
+            for token in set(tokenize(query)):
+                if token not in self.postings:
+                    continue
+                docs, tfs = self.postings[token]
+                docs = np.frombuffer(docs, dtype=np.uint32)
+                tfs = np.frombuffer(tfs, dtype=np.uint16)
+                # Postings still hold tombstoned docs until compaction, hence the clamp
+                idf = np.log(1 + (max(self.num_alive - len(docs), 0) + 0.5) / (len(docs) + 0.5))
+                if allowed is not None:
+                    keep = allowed[docs]
+                    docs, tfs = docs[keep], tfs[keep]
+                    if not len(docs):
+                        continue
+                tfs = tfs.astype(np.float32)
+                norm = self.k1 * (1 - self.b + self.b * lengths[docs] / avg_length)
+                all_docs.append(docs)
+                all_scores.append(idf * tfs * (self.k1 + 1) / (tfs + norm))
+            if not all_docs:
+                return []
+
+            docs, inverse = np.unique(np.concatenate(all_docs), return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate(all_scores))
+            keep = np.frombuffer(self.alive, dtype=np.uint8)[docs].astype(bool)
+            docs, scores = docs[keep], scores[keep]
+            if len(docs) > k:
+                top = np.argpartition(-scores, k)[:k]
+                docs, scores = docs[top], scores[top]
+            order = np.argsort(-scores)
+            return [(self.chunk_ids[docs[i]], float(scores[i])) for i in order]
+
+    def flush(self, min_interval: float = 0.0) -> None:
+        """Persist the index if it changed and at least `min_interval` seconds passed since the last write."""
+        with self.flush_lock:
+            with self.lock:
+                if not self.dirty or time.monotonic() - self.last_flush < min_interval:
+                    return
+                # Docs are only appended between compactions, which replace the arrays instead of changing
+                # them, so the arrays can be read up to `num_docs` outside the lock. Tombstones are copied.
+                num_docs = len(self.chunk_ids)
+                postings = dict(self.postings)
+                chunk_ids, file_ids, lengths = self.chunk_ids, self.file_ids, self.lengths
+                alive = bytes(self.alive)
+                num_alive, total_length = self.num_alive, self.total_length
+                self.dirty = False
+            try:
+                state = {
+                    'postings': {
+                        token: self._postings_before(docs, tfs, num_docs) for token, (docs, tfs) in postings.items()
+                    },
+                    'chunk_ids': chunk_ids[:num_docs],
+                    'file_ids': file_ids[:num_docs],
+                    'lengths': lengths[:num_docs],
+                    'alive': bytearray(alive),
+                    'num_alive': num_alive,
+                    'total_length': total_length,
+                }
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                tmp_path = f"{self.path}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                with self.lock:
+                    self.dirty = True
+                raise
+            self.last_flush = time.monotonic()
+
+    @staticmethod
+    def _postings_before(docs: array, tfs: array, num_docs: int) -> Tuple[array, array]:
+        """Postings of docs numbered below `num_docs`, those added since are at the end."""
+        end = bisect.bisect_left(docs, num_docs)
+        return docs[:end], tfs[:end]
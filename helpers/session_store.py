@@ -0,0 +1,273 @@
+import json
+import time
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from helpers import db_utils
+from helpers.constants import GLOBAL_CONFIG
+
+
+@dataclass
+class ChatTurn:
+    session_id: str
+    user_query: str
+    response: str
+    system_prompt: str
+    model: str
+    context_chunk_ids: List[str]
+    # "completed", or "disconnected" / "cancelled" when the answer stopped early and `response` is partial
+    status: str = "completed"
+
+    def to_row(self) -> tuple:
+        return (
+            self.session_id,
+            self.user_query,
+            self.response,
+            self.system_prompt,
+            self.model,
+            json.dumps(self.context_chunk_ids),
+            self.status,
+        )
+
+
+def turns_to_messages(turns: List[Dict]) -> List[Dict[str, str]]:
+    messages = []
+    for turn in turns:
+        messages.extend([
+            {"role": "user", "content": turn["user_query"]},
+            {"role": "assistant", "content": turn["response"]},
+        ])
+    return messages
+
+
+class SessionStore(ABC):
+    """
+    Where chat turns and rolling summaries of sessions live.
+
+    Turn ids increase within a session, `after_id` / `before_id` / `until_id`
+    bounds are exclusive, exclusive and inclusive respectively. Turns returned
+    as dicts carry at least `id`, `user_query` and `response`.
+    """
+
+    async def open(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    @abstractmethod
+    async def append_turns(self, turns: List[ChatTurn]) -> None:
+        """Store finished turns, in order."""
+
+    @abstractmethod
+    async def get_recent_turns(
+        self, session_id: str, after_id: int = 0, before_id: Optional[int] = None, limit: int = 8
+    ) -> List[Dict]:
+        """Newest turns first, restricted to after_id < id < before_id."""
+
+    @abstractmethod
+    async def get_turns_range(self, session_id: str, after_id: int, until_id: int) -> List[Dict]:
+        """Turns with after_id < id <= until_id, oldest first."""
+
+    @abstractmethod
+    async def get_summary(self, session_id: str) -> Optional[Dict]:
+        """`summary` and `summarized_until` of a session, None if it has no summary yet."""
+
+    @abstractmethod
+    async def upsert_summary(self, session_id: str, summary: str, summarized_until: int) -> None:
+        pass
+
+    @abstractmethod
+    async def get_chat_history(self, session_id: str) -> List[Dict[str, str]]:
+        """All turns of a session as chat messages, oldest first."""
+
+    @abstractmethod
+    async def get_all_sessions(self) -> List[Dict]:
+        """`session_id`, `first_message` and `started_at` of every session, newest first."""
+
+    @abstractmethod
+    async def delete_session(self, session_id: str) -> bool:
+        pass
+
+
+class SQLiteSessionStore(SessionStore):
+    """Sessions in the local `application_logs` and `session_summaries` tables."""
+
+    async def append_turns(self, turns: List[ChatTurn]) -> None:
+        await db_utils.insert_application_logs_batch([turn.to_row() for turn in turns])
+
+    async def get_recent_turns(self, session_id, after_id=0, before_id=None, limit=8):
+        return await db_utils.get_recent_chat_turns(session_id, after_id, before_id, limit)
+
+    async def get_turns_range(self, session_id, after_id, until_id):
+        return await db_utils.get_chat_turns_range(session_id, after_id, until_id)
+
+    async def get_summary(self, session_id):
+        return await db_utils.get_session_summary(session_id)
+
+    async def upsert_summary(self, session_id, summary, summarized_until):
+        await db_utils.upsert_session_summary(session_id, summary, summarized_until)
+
+    async def get_chat_history(self, session_id):
+        return await db_utils.get_chat_history(session_id)
+
+    async def get_all_sessions(self):
+        return await db_utils.get_all_chat_sessions()
+
+    async def delete_session(self, session_id):
+        return await db_utils.delete_chat_session(session_id)
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Sessions in Redis, shared by every API replica pointing at the same server.
+
+    Each session keeps its newest `max_turns` turns as JSON in a capped list
+    (older turns are covered by the rolling summary) and expires `ttl_seconds`
+    after its last write. Turn ids come from a per-session counter, so they
+    stay ordered whichever replica wrote the turn.
+
+    Keys: `session:<id>:turns` (list), `session:<id>:last_id` (counter),
+    `session:<id>:summary` and `session:<id>:meta` (hashes), and the `sessions`
+    sorted set of session ids by start time.
+    """
+
+    SESSIONS_KEY = "sessions"
+
+    def __init__(self, client, max_turns: int = 200, ttl_seconds: int = 7 * 24 * 3600):
+        self.client = client
+        self.max_turns = max_turns
+        self.ttl_seconds = ttl_seconds
+
+    @staticmethod
+    def _key(session_id: str, name: str) -> str:
+        return f"session:{session_id}:{name}"
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+    async def append_turns(self, turns: List[ChatTurn]) -> None:
+        by_session: Dict[str, List[ChatTurn]] = defaultdict(list)
+        for turn in turns:
+            by_session[turn.session_id].append(turn)
+
+        # Reserve a block of ids per session in one round trip
+        async with self.client.pipeline(transaction=False) as pipe:
+            for session_id, session_turns in by_session.items():
+                pipe.incr(self._key(session_id, "last_id"), len(session_turns))
+            last_ids = await pipe.execute()
+
+        now = time.time()
+        created_at = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        async with self.client.pipeline(transaction=True) as pipe:
+            for (session_id, session_turns), last_id in zip(by_session.items(), last_ids):
+                first_id = last_id - len(session_turns) + 1
+                records = [
+                    json.dumps({
+                        "id": first_id + offset,
+                        "user_query": turn.user_query,
+                        "response": turn.response,
+                        "system_prompt": turn.system_prompt,
+                        "model": turn.model,
+                        "context_chunk_ids": turn.context_chunk_ids,
+                        "status": turn.status,
+                        "created_at": created_at,
+                    })
+                    for offset, turn in enumerate(session_turns)
+                ]
+                turns_key = self._key(session_id, "turns")
+                meta_key = self._key(session_id, "meta")
+                pipe.rpush(turns_key, *records)
+                pipe.ltrim(turns_key, -self.max_turns, -1)
+                pipe.hsetnx(meta_key, "first_message", session_turns[0].user_query)
+                pipe.hsetnx(meta_key, "started_at", created_at)
+                pipe.zadd(self.SESSIONS_KEY, {session_id: now}, nx=True)
+                for name in ("turns", "last_id", "meta", "summary"):
+                    pipe.expire(self._key(session_id, name), self.ttl_seconds)
+            await pipe.execute()
+
+    async def _turns(self, session_id: str) -> List[Dict[str, Any]]:
+        records = await self.client.lrange(self._key(session_id, "turns"), 0, -1)
+        # Replicas may push concurrently, so list order is not guaranteed to follow ids
+        return sorted((json.loads(record) for record in records), key=lambda turn: turn["id"])
+
+    async def get_recent_turns(self, session_id, after_id=0, before_id=None, limit=8):
+        turns = [
+            turn for turn in await self._turns(session_id)
+            if turn["id"] > after_id and (before_id is None or turn["id"] < before_id)
+        ]
+        return turns[::-1][:limit]
+
+    async def get_turns_range(self, session_id, after_id, until_id):
+        return [turn for turn in await self._turns(session_id) if after_id < turn["id"] <= until_id]
+
+    async def get_summary(self, session_id):
+        fields = await self.client.hgetall(self._key(session_id, "summary"))
+        if not fields:
+            return None
+        return {"summary": fields["summary"], "summarized_until": int(fields["summarized_until"])}
+
+    async def upsert_summary(self, session_id, summary, summarized_until):
+        key = self._key(session_id, "summary")
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hset(key, mapping={"summary": summary, "summarized_until": summarized_until})
+            pipe.expire(key, self.ttl_seconds)
+            await pipe.execute()
+
+    async def get_chat_history(self, session_id):
+        return turns_to_messages(await self._turns(session_id))
+
+    async def get_all_sessions(self):
+        session_ids = await self.client.zrevrange(self.SESSIONS_KEY, 0, -1)
+        async with self.client.pipeline(transaction=False) as pipe:
+            for session_id in session_ids:
+                pipe.hgetall(self._key(session_id, "meta"))
+            metas = await pipe.execute()
+
+        sessions, expired = [], []
+        for session_id, meta in zip(session_ids, metas):
+            if not meta:
+                expired.append(session_id)
+                continue
+            sessions.append({
+                "session_id": session_id,
+                "first_message": meta["first_message"],
+                "started_at": meta["started_at"],
+            })
+        if expired:
+            await self.client.zrem(self.SESSIONS_KEY, *expired)
+        return sessions
+
+    async def delete_session(self, session_id):
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.delete(*(self._key(session_id, name) for name in ("turns", "last_id", "meta", "summary")))
+            pipe.zrem(self.SESSIONS_KEY, session_id)
+            await pipe.execute()
+        return True
+
+
+def create_session_store(config: Dict[str, Any]) -> SessionStore:
+    backend = config.get("backend", "sqlite")
+    if backend == "sqlite":
+        return SQLiteSessionStore()
+    if backend == "redis":
+        import redis.asyncio as redis
+
+        client = redis.from_url(config.get("redis_url", "redis://localhost:6379/0"), decode_responses=True)
+    elif backend == "fake_redis":
+        from helpers.fake_redis import FakeRedis
+
+        client = FakeRedis()
+    else:
+        raise ValueError(f"Unknown session store backend {backend}, expected sqlite, redis or fake_redis")
+    return RedisSessionStore(
+        client,
+        max_turns=config.get("max_turns", 200),
+        ttl_seconds=config.get("ttl_seconds", 7 * 24 * 3600),
+    )
+
+
+session_store = create_session_store(GLOBAL_CONFIG.get("session_store", {}))
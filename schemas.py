@@ -1,13 +1,46 @@
 from pydantic import BaseModel, Field
 from datetime import datetime
+from typing import List, Optional
 
 
-class QueryInput(BaseModel):
+class DocumentFilter(BaseModel):
+    # Optional document filters, retrieval only searches documents matching all of them
+    file_ids: Optional[List[int]] = None
+    filenames: Optional[List[str]] = None
+    uploaded_after: Optional[datetime] = None
+    uploaded_before: Optional[datetime] = None
+
+    def has_document_filter(self) -> bool:
+        return any(
+            value is not None
+            for value in (self.file_ids, self.filenames, self.uploaded_after, self.uploaded_before)
+        )
+
+
+class QueryInput(DocumentFilter):
     question: str
     session_id: str = Field(default=None)
     model: str = Field(default='llama3.3') # default model
 
 
+class RetrieveRequest(DocumentFilter):
+    questions: List[str] = Field(min_length=1, max_length=256)
+
+
+class RetrievedChunk(BaseModel):
+    chunk_id: str
+    file_id: Optional[int] = None
+    source: Optional[str] = None
+    page: Optional[int] = None
+    text: str
+    score: float
+
+
+class RetrieveResult(BaseModel):
+    question: str
+    chunks: List[RetrievedChunk]
+
+
 class DocumentInfo(BaseModel):
     id: int
     filename: str
@@ -15,4 +48,55 @@ class DocumentInfo(BaseModel):
 
 
 class DeleteFileRequest(BaseModel):
-    file_id: int
\ No newline at end of file
+    file_id: int
+
+
+class SessionInfo(BaseModel):
+    session_id: str
+    first_message: str
+    started_at: datetime
+
+
+class ChatMessage(BaseModel):
+    role: str
+    content: str
+
+
+class JobInfo(BaseModel):
+    id: str
+    file_id: int
+    filename: str
+    stage: str
+    num_chunks: Optional[int] = None
+    error: Optional[str] = None
+    parse_seconds: Optional[float] = None
+    index_seconds: Optional[float] = None
+    chunks_reused: Optional[int] = None
+    chunks_embedded: Optional[int] = None
+    chunks_deleted: Optional[int] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+
+class BulkIngestFileResult(BaseModel):
+    filename: str
+    status: str
+    file_id: Optional[int] = None
+    num_chunks: int = 0
+    chunks_reused: int = 0
+    chunks_embedded: int = 0
+    error: Optional[str] = None
+
+
+class BulkIngestReport(BaseModel):
+    files: List[BulkIngestFileResult]
+    num_succeeded: int
+    num_skipped: int
+    num_failed: int
+    num_chunks: int
+    chunks_reused: int
+    chunks_embedded: int
+    elapsed_seconds: float
+    docs_per_second: float
+    chunks_per_second: float
\ No newline at end of file
@@ -0,0 +1,14 @@
+import os
+import shutil
+import sys
+import tempfile
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The helpers modules import each other through a "helpers" entry on sys.path
+sys.path[:0] = [REPO, os.path.join(REPO, "helpers")]
+
+# config.json is read from the working directory, and loggers and the session database are created under it on import
+WORKDIR = tempfile.mkdtemp(prefix="tests_")
+shutil.copy(os.path.join(REPO, "config.json"), WORKDIR)
+os.chdir(WORKDIR)
@@ -0,0 +1,164 @@
+import asyncio
+
+import pytest
+
+from core.admission import (
+    DEADLINE, QUEUE_FULL, SESSION_LIMIT, TIMEOUT, AdmissionController, AdmissionLimits, AdmissionRejected,
+)
+
+
+def controller(**limits) -> AdmissionController:
+    return AdmissionController(AdmissionLimits(**{"max_in_flight": 1, "max_queue": 4, "max_wait_ms": 1000, **limits}))
+
+
+async def waiting(admission: AdmissionController, session: str) -> asyncio.Task:
+    """A request queued for the model, once the event loop got it to wait."""
+    task = asyncio.ensure_future(admission.acquire("model", session))
+    await asyncio.sleep(0)
+    return task
+
+
+def test_admits_at_once_below_max_in_flight():
+    async def run():
+        admission = controller(max_in_flight=2)
+        slots = [await admission.acquire("model", f"session-{idx}") for idx in range(2)]
+        state = admission.models["model"]
+        assert state.in_flight == 2
+        assert state.queued == 0
+        for slot in slots:
+            slot.release()
+            slot.release()
+        assert state.in_flight == 0
+        assert state.per_session == {}
+        assert state.service_seconds is not None
+
+    asyncio.run(run())
+
+
+def test_full_queue_is_rejected_with_503():
+    async def run():
+        admission = controller(max_queue=1)
+        slot = await admission.acquire("model", "a")
+        queued = await waiting(admission, "b")
+        with pytest.raises(AdmissionRejected) as rejected:
+            await admission.acquire("model", "c")
+        assert rejected.value.status_code == 503
+        assert rejected.value.reason == QUEUE_FULL
+        slot.release()
+        (await queued).release()
+        assert admission.stats()["model"]["rejected"][QUEUE_FULL] == 1
+
+    asyncio.run(run())
+
+
+def test_expected_wait_over_deadline_is_rejected_with_503():
+    async def run():
+        admission = controller(max_in_flight=2, max_wait_ms=1000)
+        slots = [await admission.acquire("model", f"session-{idx}") for idx in range(2)]
+        admission.models["model"].service_seconds = 10.0
+        assert admission.expected_wait("model") == 5.0
+        with pytest.raises(AdmissionRejected) as rejected:
+            await admission.acquire("model", "late")
+        assert rejected.value.status_code == 503
+        assert rejected.value.reason == DEADLINE
+        assert rejected.value.retry_after == 5
+        assert admission.models["model"].queued == 0
+        for slot in slots:
+            slot.release()
+
+    asyncio.run(run())
+
+
+def test_session_over_its_limit_is_rejected_with_429():
+    async def run():
+        admission = controller(max_per_session=2)
+        slot = await admission.acquire("model", "busy")
+        queued = await waiting(admission, "busy")
+        with pytest.raises(AdmissionRejected) as rejected:
+            await admission.acquire("model", "busy")
+        assert rejected.value.status_code == 429
+        assert rejected.value.reason == SESSION_LIMIT
+        # Other sessions are not affected
+        other = await waiting(admission, "other")
+        slot.release()
+        (await queued).release()
+        (await other).release()
+
+    asyncio.run(run())
+
+
+def test_request_waiting_past_max_wait_is_rejected():
+    async def run():
+        admission = controller(max_wait_ms=50)
+        slot = await admission.acquire("model", "a")
+        with pytest.raises(AdmissionRejected) as rejected:
+            await admission.acquire("model", "b")
+        assert rejected.value.reason == TIMEOUT
+        state = admission.models["model"]
+        assert state.queued == 0
+        assert state.per_session == {"a": 1}
+        slot.release()
+        assert state.in_flight == 0
+
+    asyncio.run(run())
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def run():
+        admission = controller()
+        slot = await admission.acquire("model", "a")
+        cancelled = await waiting(admission, "b")
+        queued = await waiting(admission, "c")
+        state = admission.models["model"]
+        assert state.queued == 2
+        cancelled.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        assert state.queued == 1
+        assert "b" not in state.per_session
+        assert list(state.waiting) == ["c"]
+        slot.release()
+        (await queued).release()
+        assert state.in_flight == 0
+        assert state.per_session == {}
+
+    asyncio.run(run())
+
+
+def test_slot_handed_to_a_cancelled_waiter_goes_to_the_next_one():
+    async def run():
+        admission = controller()
+        slot = await admission.acquire("model", "a")
+        cancelled = await waiting(admission, "b")
+        queued = await waiting(admission, "c")
+        state = admission.models["model"]
+        # The slot is handed to "b", which is cancelled before it resumes to take it
+        slot.release()
+        cancelled.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        next_slot = await queued
+        assert next_slot.session == "c"
+        assert state.in_flight == 1
+        assert state.per_session == {"c": 1}
+        next_slot.release()
+        assert state.in_flight == 0
+
+    asyncio.run(run())
+
+
+def test_freed_slots_go_to_sessions_in_round_robin():
+    async def run():
+        admission = controller(max_per_session=3)
+        slot = await admission.acquire("model", "holder")
+        pending = {await waiting(admission, session) for session in ("heavy", "heavy", "heavy", "light")}
+        order = []
+        while pending:
+            slot.release()
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            slot = done.pop().result()
+            order.append(slot.session)
+        slot.release()
+        assert order == ["heavy", "light", "heavy", "heavy"]
+
+    asyncio.run(run())
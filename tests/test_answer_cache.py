@@ -0,0 +1,91 @@
+import asyncio
+
+import numpy as np
+
+from core.answer_cache import CachedAnswer, SemanticAnswerCache
+from core.context import PackedContext
+
+
+def answer(embedding, model_name="model", tenant="tenant", corpus_version=0, file_ids=(1, 2), text="abcdef"):
+    return CachedAnswer(
+        model_name=model_name,
+        tenant=tenant,
+        corpus_version=corpus_version,
+        embedding=SemanticAnswerCache.normalize(embedding),
+        file_ids=file_ids,
+        context=PackedContext(),
+        text=text,
+        offsets=[2, 4, 6],
+        generation_seconds=1.5,
+    )
+
+
+def lookup(cache, embedding, model_name="model", file_ids=(1, 2), corpus_version=0, tenant="tenant"):
+    return cache.get(SemanticAnswerCache.normalize(embedding), model_name, file_ids, corpus_version, tenant)
+
+
+def test_normalize():
+    assert np.allclose(SemanticAnswerCache.normalize([3, 4]), [0.6, 0.8])
+    assert np.allclose(SemanticAnswerCache.normalize([0, 0]), [0, 0])
+
+
+def test_hit_on_similar_question_with_same_files():
+    cache = SemanticAnswerCache(similarity_threshold=0.95)
+    assert lookup(cache, [1, 0]) is None
+    cache.put(answer([1, 0]))
+    assert lookup(cache, [1, 0.1]).text == "abcdef"
+    stats = cache.stats()
+    assert stats["lookups"] == 2
+    assert stats["hits"] == 1
+    assert stats["seconds_saved"] == 1.5
+
+
+def test_miss_below_threshold_or_on_other_files_model_or_tenant():
+    cache = SemanticAnswerCache(similarity_threshold=0.95)
+    lookup(cache, [1, 0])
+    cache.put(answer([1, 0]))
+    assert lookup(cache, [1, 1]) is None
+    assert lookup(cache, [1, 0], file_ids=(1, 3)) is None
+    assert lookup(cache, [1, 0], model_name="other") is None
+    assert lookup(cache, [1, 0], tenant="other") is None
+    assert lookup(cache, [1, 0]) is not None
+
+
+def test_new_corpus_version_invalidates_only_its_tenant():
+    cache = SemanticAnswerCache()
+    lookup(cache, [1, 0])
+    lookup(cache, [1, 0], tenant="other")
+    cache.put(answer([1, 0]))
+    cache.put(answer([1, 0], tenant="other"))
+    assert lookup(cache, [1, 0], corpus_version=1) is None
+    assert lookup(cache, [1, 0], corpus_version=1, tenant="tenant") is None
+    assert lookup(cache, [1, 0], tenant="other") is not None
+    assert cache.stats()["entries"] == 1
+
+
+def test_answer_generated_before_a_corpus_change_is_not_stored():
+    cache = SemanticAnswerCache()
+    lookup(cache, [1, 0], corpus_version=1)
+    cache.put(answer([1, 0], corpus_version=0))
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = SemanticAnswerCache(max_entries=2)
+    lookup(cache, [1, 0])
+    cache.put(answer([1, 0], text="first"))
+    cache.put(answer([0, 1], text="second"))
+    assert lookup(cache, [1, 0]).text == "first"
+    cache.put(answer([1, 1], text="third"))
+    assert lookup(cache, [0, 1]) is None
+    assert lookup(cache, [1, 0]).text == "first"
+    assert lookup(cache, [1, 1]).text == "third"
+
+
+def test_replay_keeps_step_boundaries():
+    async def replay():
+        return [output async for output in SemanticAnswerCache.replay(answer([1, 0]))]
+
+    outputs = asyncio.run(replay())
+    assert [output.outputs[0].text for output in outputs] == ["ab", "cd", "ef"]
+    assert [output.finished for output in outputs] == [False, False, True]
@@ -0,0 +1,132 @@
+import asyncio
+import hashlib
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from helpers import bulk_ingest, chroma_utils, db_utils
+from helpers.bulk_ingest import bulk_index_documents
+
+_tenants = itertools.count()
+
+
+class HashEmbeddings(Embeddings):
+    """Deterministic vectors, failing for any text containing "poison"."""
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if any("poison" in text for text in texts):
+            raise RuntimeError("embedding failed")
+        return [[byte / 255 for byte in hashlib.sha256(text.encode()).digest()[:8]] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def split_lines(file_path: str) -> List[Document]:
+    """One chunk per line, files starting with "corrupt" fail to parse."""
+    with open(file_path) as f:
+        text = f.read()
+    if text.startswith("corrupt"):
+        raise ValueError("Cannot parse file")
+    return [Document(page_content=line, metadata={"source": file_path}) for line in text.splitlines()]
+
+
+@pytest.fixture
+def ingest(tmp_path, monkeypatch):
+    """Run `test(index, write_file, tenant)` against a fresh database and tenant collection."""
+    pool = db_utils.ConnectionPool(db_file=str(tmp_path / "logs.db"), size=2)
+    monkeypatch.setattr(db_utils, "db_pool", pool)
+    monkeypatch.setattr(chroma_utils, "_embedding_function", HashEmbeddings())
+    # Parsing runs in threads with a line splitter instead of spawned processes loading the chunker's tokenizer
+    monkeypatch.setattr(bulk_ingest, "split_document", split_lines)
+    monkeypatch.setattr(bulk_ingest, "ProcessPoolExecutor",
+                        lambda max_workers=None, mp_context=None: ThreadPoolExecutor(max_workers))
+    tenant = f"bulk-{next(_tenants)}"
+
+    def write_file(name: str, *lines: str):
+        path = tmp_path / "files" / name
+        path.parent.mkdir(exist_ok=True)
+        path.write_text("\n".join(lines))
+        return name, str(path)
+
+    def run(test):
+        async def main():
+            await db_utils.initialize_db()
+            try:
+                await test(write_file, tenant)
+            finally:
+                await pool.close()
+
+        asyncio.run(main())
+
+    return run
+
+
+def by_filename(report):
+    return {result["filename"]: result for result in report["files"]}
+
+
+def test_identical_files_are_skipped_and_changed_ones_reindexed(ingest):
+    async def test(write_file, tenant):
+        first = await bulk_index_documents([
+            write_file("a.md", "alpha", "beta"),
+            write_file("b.md", "gamma", "delta"),
+            write_file("copy.md", "alpha", "beta"),
+            write_file("notes.txt", "text"),
+        ], max_workers=2, batch_size=3, tenant=tenant)
+        results = by_filename(first)
+        assert results["a.md"]["status"] == "indexed" and results["a.md"]["chunks_embedded"] == 2
+        assert results["copy.md"]["status"] == "skipped"
+        assert results["notes.txt"] == {**results["notes.txt"], "status": "failed", "error": "Unsupported file type"}
+        assert (first["num_succeeded"], first["num_skipped"], first["num_failed"]) == (2, 1, 1)
+        a_id, b_id = results["a.md"]["file_id"], results["b.md"]["file_id"]
+
+        second = by_filename(await bulk_index_documents([
+            write_file("a.md", "alpha", "beta"),
+            write_file("b.md", "gamma", "epsilon"),
+        ], max_workers=2, tenant=tenant))
+        assert second["a.md"] == {**second["a.md"], "status": "skipped", "file_id": a_id, "chunks_reused": 2}
+        # Re-uploads keep their file id and only embed the chunks that changed
+        assert second["b.md"] == {**second["b.md"], "status": "indexed", "file_id": b_id, "num_chunks": 2,
+                                  "chunks_reused": 1, "chunks_embedded": 1}
+        stored = await chroma_utils.get_chunks_by_ids(await chroma_utils.get_chunk_ids(b_id, tenant), tenant)
+        assert sorted(doc.page_content for doc in stored.values()) == ["epsilon", "gamma"]
+        assert len(await db_utils.get_all_documents(tenant)) == 2
+
+    ingest(test)
+
+
+def test_failed_files_leave_nothing_behind_and_re_uploads_keep_their_previous_version(ingest):
+    async def test(write_file, tenant):
+        kept = await bulk_index_documents([write_file("keep.md", "seven", "eight")], max_workers=1, tenant=tenant)
+        keep_id = kept["files"][0]["file_id"]
+
+        # Two chunks per batch: the first half of partial.md is written before its second batch fails
+        report = await bulk_index_documents([
+            write_file("good.md", "one", "two"),
+            write_file("partial.md", "three", "four", "poison five", "six"),
+            write_file("corrupt.md", "corrupt"),
+            write_file("keep.md", "nine", "poison ten"),
+        ], max_workers=1, batch_size=2, tenant=tenant)
+        results = by_filename(report)
+        assert results["good.md"]["status"] == "indexed"
+        assert results["partial.md"] == {**results["partial.md"], "status": "failed", "num_chunks": 0,
+                                         "error": "Indexing failed: embedding failed"}
+        assert results["corrupt.md"] == {**results["corrupt.md"], "status": "failed", "error": "Cannot parse file"}
+        assert results["keep.md"]["status"] == "failed"
+        assert (report["num_succeeded"], report["num_failed"], report["chunks_embedded"]) == (1, 3, 2)
+
+        assert await chroma_utils.get_chunk_ids(results["partial.md"]["file_id"], tenant) == []
+        assert sorted(doc["filename"] for doc in await db_utils.get_all_documents(tenant)) == ["good.md", "keep.md"]
+        stored = await chroma_utils.get_chunks_by_ids(await chroma_utils.get_chunk_ids(keep_id, tenant), tenant)
+        assert sorted(doc.page_content for doc in stored.values()) == ["eight", "seven"]
+
+        # The previous version is still the one matched by content
+        again = await bulk_index_documents([write_file("keep.md", "seven", "eight")], max_workers=1, tenant=tenant)
+        assert again["files"][0] == {**again["files"][0], "status": "skipped", "file_id": keep_id}
+
+    ingest(test)
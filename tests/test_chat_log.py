@@ -0,0 +1,93 @@
+import asyncio
+
+from helpers import chat_log
+from helpers.chat_log import ChatLogWriter
+from helpers.session_store import ChatTurn
+
+
+class SlowStore:
+    """Session store whose writes wait until `open` is set, recording the turns written."""
+
+    def __init__(self):
+        self.turns = []
+        self.open = asyncio.Event()
+
+    async def append_turns(self, turns):
+        await self.open.wait()
+        self.turns.extend(turns)
+
+
+class FailingStore:
+    def __init__(self):
+        self.calls = 0
+
+    async def append_turns(self, turns):
+        self.calls += 1
+        raise ConnectionError("store is down")
+
+
+def turn(session_id: str, idx: int) -> ChatTurn:
+    return ChatTurn(session_id, f"question {idx}", f"answer {idx}", "system", "model", [])
+
+
+def test_full_queue_holds_callers_back_instead_of_dropping_turns(monkeypatch):
+    async def run():
+        store = SlowStore()
+        monkeypatch.setattr(chat_log, "session_store", store)
+        writer = ChatLogWriter(batch_size=2, flush_interval=0.01, max_queue_size=2)
+        await writer.start()
+        turns = [turn(session, idx) for idx in range(5) for session in ("a", "b", "c")]
+        logging = []
+        for t in turns:
+            logging.append(asyncio.ensure_future(writer.log(t)))
+            await asyncio.sleep(0)
+        await asyncio.sleep(0.05)
+        # The store is stalled: the queue is full and the callers past it wait for room
+        assert writer.queue.full()
+        assert sum(not task.done() for task in logging) == len(turns) - 2 - 2
+        store.open.set()
+        await asyncio.gather(*logging)
+        await writer.stop()
+
+        assert store.turns == turns
+        stats = writer.stats()
+        assert stats["written"] == 15
+        assert stats["waited"] == len(turns) - 2 - 2
+        assert stats["dropped"] == 0
+        assert not writer.pending
+
+    asyncio.run(run())
+
+
+def test_history_reads_wait_for_turns_still_waiting_for_room(monkeypatch):
+    async def run():
+        store = SlowStore()
+        monkeypatch.setattr(chat_log, "session_store", store)
+        writer = ChatLogWriter(batch_size=1, flush_interval=0.01, max_queue_size=1)
+        await writer.start()
+        logging = [asyncio.ensure_future(writer.log(turn("a", idx))) for idx in range(4)]
+        await asyncio.sleep(0.05)
+        asyncio.get_running_loop().call_later(0.05, store.open.set)
+        await writer.wait_for_session("a")
+        assert [t.user_query for t in store.turns] == [f"question {idx}" for idx in range(4)]
+        await asyncio.gather(*logging)
+        await writer.stop()
+
+    asyncio.run(run())
+
+
+def test_failed_writes_are_retried_then_counted(monkeypatch):
+    async def run():
+        store = FailingStore()
+        monkeypatch.setattr(chat_log, "session_store", store)
+        writer = ChatLogWriter(batch_size=10, flush_interval=0.001, max_attempts=3)
+        await writer.start()
+        await writer.log(turn("a", 0))
+        await writer.log(turn("a", 1))
+        await writer.wait_for_session("a")
+        assert store.calls == 3
+        assert writer.stats()["dropped"] == 2
+        assert not writer.pending
+        await writer.stop()
+
+    asyncio.run(run())
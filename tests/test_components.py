@@ -0,0 +1,128 @@
+import asyncio
+
+import pytest
+
+from helpers.components import FAILED, PENDING, READY, ComponentNotReady, ComponentRegistry
+
+
+def test_start_returns_at_once_and_dependents_wait_for_their_dependencies():
+    registry = ComponentRegistry()
+    events = []
+    release = {}
+
+    def init(name):
+        async def init_fn():
+            release[name] = asyncio.Event()
+            events.append(f"start {name}")
+            await release[name].wait()
+            events.append(f"ready {name}")
+            return name.upper()
+        return init_fn
+
+    registry.register("db", init("db"))
+    registry.register("model", init("model"))
+    registry.register("chat", init("chat"), depends_on=("db", "model"))
+
+    async def run():
+        await registry.start()
+        await asyncio.sleep(0.01)
+        # Independent components start together, the dependent one waits
+        assert events == ["start db", "start model"]
+        assert registry.not_ready() == ["db", "model", "chat"]
+        assert registry.peek("db") is None
+        release["db"].set()
+        assert await registry.wait("db") == "DB"
+        await asyncio.sleep(0.01)
+        assert "start chat" not in events
+        release["model"].set()
+        await asyncio.sleep(0.01)
+        release["chat"].set()
+        value = await registry.wait("chat")
+        await registry.stop()
+        return value
+
+    assert asyncio.run(run()) == "CHAT"
+    assert events == ["start db", "start model", "ready db", "ready model", "start chat", "ready chat"]
+
+
+def test_a_failed_dependency_fails_its_dependents():
+    registry = ComponentRegistry()
+
+    async def broken():
+        raise OSError("no GPU")
+
+    async def never():
+        raise AssertionError("started despite a failed dependency")
+
+    async def ok():
+        return "ok"
+
+    registry.register("model", broken)
+    registry.register("retriever", never, depends_on=("model",))
+    registry.register("chat", never, depends_on=("retriever",))
+    registry.register("database", ok)
+
+    async def run():
+        await registry.start()
+        with pytest.raises(ComponentNotReady, match="Component model is failed: OSError: no GPU"):
+            await registry.wait("model")
+        with pytest.raises(ComponentNotReady, match="Component chat is failed: Component retriever is failed"):
+            await registry.wait("chat")
+        assert await registry.wait("database") == "ok"
+        status = registry.status()
+        await registry.stop()
+        return status
+
+    status = asyncio.run(run())
+    assert status["model"]["state"] == FAILED
+    assert status["retriever"] == {"state": FAILED, "seconds": None, "error": "Component model is failed: OSError: no GPU"}
+    assert status["chat"]["state"] == FAILED
+    assert status["database"]["state"] == READY
+
+
+def test_stop_cancels_starting_components_and_closes_ready_ones_in_reverse_order():
+    registry = ComponentRegistry()
+    closed = []
+
+    async def ready(name):
+        return name
+
+    async def close(value):
+        closed.append(value)
+        if value == "second":
+            raise RuntimeError("close failed")
+
+    async def slow():
+        await asyncio.sleep(60)
+
+    registry.register("first", lambda: ready("first"), close)
+    registry.register("second", lambda: ready("second"), close)
+    registry.register("third", lambda: ready("third"), close)
+    registry.register("slow", slow, close)
+
+    async def run():
+        await registry.start()
+        await registry.wait("third")
+        assert registry.not_ready() == ["slow"]
+        await registry.stop()
+
+    asyncio.run(run())
+    # A failing close does not keep the others open, the cancelled component is never closed
+    assert closed == ["third", "second", "first"]
+    assert all(info["state"] == PENDING for info in registry.status().values())
+
+
+def test_unknown_dependencies_and_unstarted_components_are_rejected():
+    registry = ComponentRegistry()
+
+    async def init():
+        return 1
+
+    with pytest.raises(ValueError, match="unregistered components \\['db'\\]"):
+        registry.register("chat", init, depends_on=("db",))
+    registry.register("db", init)
+    with pytest.raises(ComponentNotReady, match="has not been started"):
+        asyncio.run(registry.wait("db"))
+    with pytest.raises(ComponentNotReady, match="Component db is pending"):
+        registry.get("db")
+    assert registry.not_ready(["db"]) == ["db"]
@@ -0,0 +1,84 @@
+from typing import List
+
+from langchain_core.documents import Document
+
+from core.context import CHUNK_SEPARATOR, chunk_key, pack_context
+
+
+class SpaceTokenizer:
+    """One token per space separated word, the chunk separator counting as one."""
+
+    name_or_path = "space"
+
+    def __init__(self):
+        self.encoded: List[str] = []
+
+    def encode(self, text: str, add_special_tokens: bool = False) -> List[str]:
+        self.encoded.append(text)
+        return text.split(" ")
+
+
+def words(prefix: str, count: int) -> str:
+    return " ".join(f"{prefix}{idx}" for idx in range(count))
+
+
+def doc(text: str, file_id: int = 1, page: int = 0, start: int = 0, **metadata) -> Document:
+    return Document(page_content=text, metadata={"file_id": file_id, "source": f"{file_id}.pdf", "page": page,
+                                                 "start_index": start, **metadata})
+
+
+def test_overlapping_chunks_of_a_page_are_merged():
+    text = words("w", 30)
+    first, second = doc(text[:100], start=0), doc(text[80:], start=80)
+    other_page = doc(text[80:], page=1, start=80)
+    packed = pack_context([(second, 0.9), (first, 0.5), (other_page, 0.1)], SpaceTokenizer(), max_tokens=1000,
+                          dedup_threshold=1.1)
+    merged = next(chunk for chunk in packed.chunks if chunk.page == 0)
+    assert merged.text == text
+    assert merged.score == 0.9
+    assert merged.chunk_ids == [chunk_key(first), chunk_key(second)]
+    assert len(packed.chunks) == 2
+    assert packed.chunk_ids == [chunk_key(first), chunk_key(second), chunk_key(other_page)]
+
+
+def test_near_duplicates_keep_the_best_scored_chunk():
+    text = words("w", 40)
+    packed = pack_context(
+        [(doc(text, file_id=1), 0.2), (doc(text + " extra", file_id=2), 0.8), (doc(words("x", 5), file_id=3), 0.5)],
+        SpaceTokenizer(),
+        max_tokens=1000,
+    )
+    assert [chunk.file_id for chunk in packed.chunks] == [2, 3]
+    assert packed.file_ids == (2, 3)
+    assert packed.num_candidates == 3
+
+
+def test_chunks_that_do_not_fit_are_skipped_for_smaller_ones():
+    big, medium, small = doc(words("a", 60), file_id=1), doc(words("b", 30), file_id=2), doc(words("c", 9), file_id=3)
+    packed = pack_context([(medium, 0.9), (big, 0.8), (small, 0.1)], SpaceTokenizer(), max_tokens=40)
+    # 30 tokens, then 9 more plus one for the separator; the 60 token chunk never fits
+    assert [chunk.file_id for chunk in packed.chunks] == [2, 3]
+    assert packed.num_tokens == 40
+    assert packed.text == medium.page_content + CHUNK_SEPARATOR + small.page_content
+    assert pack_context([(big, 1.0)], SpaceTokenizer(), max_tokens=59).chunks == []
+
+
+def test_token_counts_from_ingestion_are_reused_for_the_same_tokenizer():
+    tokenizer = SpaceTokenizer()
+    counted = doc(words("a", 10), file_id=1, num_tokens=10, tokenizer="space")
+    other_tokenizer = doc(words("b", 10), file_id=2, num_tokens=3, tokenizer="other")
+    packed = pack_context([(counted, 0.9), (other_tokenizer, 0.8)], tokenizer, max_tokens=100)
+    assert [chunk.num_tokens for chunk in packed.chunks] == [10, 10]
+    assert tokenizer.encoded == [CHUNK_SEPARATOR, other_tokenizer.page_content]
+
+
+def test_document_order_follows_file_page_and_position():
+    chunks = [
+        (doc(words("c", 5), file_id=2, page=0, start=0), 0.9),
+        (doc(words("b", 5), file_id=1, page=3, start=0), 0.8),
+        (doc(words("a", 5), file_id=1, page=0, start=500), 0.7),
+    ]
+    by_score = pack_context(chunks, SpaceTokenizer(), max_tokens=100)
+    by_position = pack_context(chunks, SpaceTokenizer(), max_tokens=100, order="document")
+    assert [chunk.text[0] for chunk in by_score.chunks] == ["c", "b", "a"]
+    assert [chunk.text[0] for chunk in by_position.chunks] == ["a", "b", "c"]
@@ -0,0 +1,178 @@
+import asyncio
+import threading
+import time
+from typing import List
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from core.fake_engine import FakeEngine
+from core.streaming import SSEStream
+from helpers import chroma_utils, db_utils
+from helpers.embedding_cache import embed_queries
+from helpers.embedding_executor import DOCUMENT, QUERY, EmbeddingExecutor, PrioritizedEmbeddings
+
+
+class RecordingEmbeddings(Embeddings):
+    def __init__(self):
+        self.calls = []
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls.append(("documents", list(texts)))
+        return [[float(len(text))] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        self.calls.append(("query", text))
+        return [float(len(text))]
+
+
+class SlowEmbeddings(Embeddings):
+    """Model with Python work per text holding the GIL and a device running one forward pass at a time."""
+
+    def __init__(self):
+        self.device = threading.Lock()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        deadline = time.perf_counter() + 0.00005 * len(texts)
+        while time.perf_counter() < deadline:
+            pass
+        with self.device:
+            time.sleep(0.005 + 0.001 * len(texts))
+        return [[1.0] * 64 for _ in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def blocked(executor: EmbeddingExecutor) -> threading.Event:
+    """Occupy the executor's only thread until the returned event is set."""
+    started, release = threading.Event(), threading.Event()
+    executor.submit(DOCUMENT, lambda: (started.set(), release.wait()))
+    started.wait()
+    return release
+
+
+def test_waiting_queries_run_before_waiting_documents():
+    executor = EmbeddingExecutor(concurrency=1)
+    order = []
+    release = blocked(executor)
+    futures = [executor.submit(DOCUMENT, order.append, f"document {idx}") for idx in range(3)]
+    futures += [executor.submit(QUERY, order.append, f"query {idx}") for idx in range(2)]
+    assert executor.stats()["queue_depth"] == {"query": 2, "document": 3}
+    release.set()
+    for future in futures:
+        future.result(timeout=5)
+    assert order == ["query 0", "query 1", "document 0", "document 1", "document 2"]
+    executor.shutdown()
+    assert executor.stats()["completed"] == {"query": 2, "document": 4}
+
+
+def test_shutdown_finishes_queued_work():
+    executor = EmbeddingExecutor(concurrency=2)
+    futures = [executor.submit(DOCUMENT, pow, idx, 2) for idx in range(10)]
+    executor.shutdown()
+    assert [future.result(timeout=0) for future in futures] == [idx ** 2 for idx in range(10)]
+
+
+def test_errors_are_raised_to_the_caller():
+    executor = EmbeddingExecutor()
+    future = executor.submit(QUERY, lambda: 1 / 0)
+    assert isinstance(future.exception(timeout=5), ZeroDivisionError)
+    executor.shutdown()
+
+
+def test_queries_go_ahead_of_queued_document_batches():
+    executor = EmbeddingExecutor(concurrency=1)
+    model = RecordingEmbeddings()
+    embeddings = PrioritizedEmbeddings(model, executor, document_batch_size=2)
+    release = blocked(executor)
+
+    async def run():
+        documents = asyncio.ensure_future(embeddings.aembed_documents(["a", "bb", "ccc", "dddd", "eeeee"]))
+        await asyncio.sleep(0.05)
+        query = asyncio.ensure_future(embeddings.aembed_query("query"))
+        await asyncio.sleep(0.05)
+        release.set()
+        return await documents, await query
+
+    vectors, query_vector = asyncio.run(run())
+    executor.shutdown()
+    assert vectors == [[1.0], [2.0], [3.0], [4.0], [5.0]]
+    assert query_vector == [5.0]
+    assert model.calls == [
+        ("query", "query"),
+        ("documents", ["a", "bb"]),
+        ("documents", ["ccc", "dddd"]),
+        ("documents", ["eeeee"]),
+    ]
+
+
+def test_streams_and_queries_keep_their_cadence_during_an_upload(tmp_path, monkeypatch):
+    """A short run of benchmarks/embedding_cadence_bench.py, "after" mode with the configured batch sizes."""
+    pool = db_utils.ConnectionPool(db_file=str(tmp_path / "logs.db"), size=2)
+    monkeypatch.setattr(db_utils, "db_pool", pool)
+    executor = EmbeddingExecutor(concurrency=1)
+    embeddings = PrioritizedEmbeddings(SlowEmbeddings(), executor, document_batch_size=32)
+    monkeypatch.setattr(chroma_utils, "_embedding_function", embeddings)
+    monkeypatch.setattr(chroma_utils, "VECTORSTORE_WRITE_BATCH_SIZE", 32)
+    engine = FakeEngine(num_tokens=1_000_000, tokens_per_second=30)
+    gaps, query_latencies = [], []
+
+    async def main():
+        await db_utils.initialize_db()
+        await chroma_utils.tenant_indexes.get("cadence")
+        done = asyncio.Event()
+
+        async def stream(idx: int):
+            frames = SSEStream(f"session-{idx}", coalesce_ms=0, coalesce_chars=0).frames(engine.generate(prompt=""))
+            last = None
+            async for _ in frames:
+                now = time.perf_counter()
+                if last is not None:
+                    gaps.append(now - last)
+                last = now
+                if done.is_set():
+                    break
+            await frames.aclose()
+
+        async def queries():
+            idx = 0
+            while not done.is_set():
+                start = time.perf_counter()
+                await asyncio.to_thread(embed_queries, embeddings, [f"question {idx}"])
+                query_latencies.append(time.perf_counter() - start)
+                idx += 1
+                await asyncio.sleep(0.05)
+
+        async def batches(job: int):
+            # Two batches of ingestion.embed_batch_size chunks
+            for offset in range(0, 512, 256):
+                yield [
+                    Document(page_content=f"job {job} chunk {idx} " + "text " * 100, metadata={"source": f"job{job}.pdf"})
+                    for idx in range(offset, offset + 256)
+                ]
+
+        tasks = [asyncio.create_task(stream(idx)) for idx in range(16)] + [asyncio.create_task(queries())]
+        await asyncio.sleep(0.2)
+        await asyncio.gather(*(
+            chroma_utils.index_split_batches(batches(job), file_id=job + 1, is_new=True, tenant="cadence")
+            for job in range(2)
+        ))
+        done.set()
+        await asyncio.gather(*tasks)
+
+    async def run():
+        try:
+            await main()
+        finally:
+            await pool.close()
+
+    try:
+        asyncio.run(run())
+    finally:
+        executor.shutdown()
+    # Calling the model from the default thread pool with whole batches stalls frames for ~500 ms and
+    # queries for ~1 s here; the executor keeps both within a few engine steps of the 33 ms one
+    assert np.percentile(gaps, 99) < 0.35
+    assert np.percentile(query_latencies, 99) < 0.4
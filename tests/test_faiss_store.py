@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("faiss")
+
+from helpers.faiss_store import FaissVectorStore
+
+INDEXES = ["Flat", "IVF4,SQ8", "IVF4,PQ4x4", "HNSW8,SQ8", "BFlat", "BIVF4"]
+DIM = 32
+
+
+def vectors(rng, count):
+    return rng.standard_normal((count, DIM)).astype(np.float32)
+
+
+def open_store(path, index, mmap, rescore=0):
+    return FaissVectorStore(str(path), None, index=index, train_size=300, nprobe=4, rescore=rescore, mmap=mmap)
+
+
+def add(store, rng, prefix, count):
+    embeddings = vectors(rng, count)
+    ids = [f"{prefix}-{idx}" for idx in range(count)]
+    store.add_embeddings(ids, embeddings, ids, [{"file_id": idx % 3} for idx in range(count)])
+    return embeddings
+
+
+@pytest.mark.parametrize("mmap", [False, True])
+@pytest.mark.parametrize("index", INDEXES)
+def test_saved_index_takes_adds_after_reopening(tmp_path, index, mmap):
+    rng = np.random.default_rng(0)
+    store = open_store(tmp_path, index, mmap)
+    # Past train_size, so IVF indexes are trained before they are saved
+    add(store, rng, "a", 400)
+    store.close()
+
+    store = open_store(tmp_path, index, mmap)
+    added = add(store, rng, "b", 50)
+    store.delete(ids=["a-0"])
+    store.close()
+
+    store = open_store(tmp_path, index, mmap)
+    assert store.count() == 449
+    hits = store.similarity_search_by_vector_with_relevance_scores(list(added[7]), k=3)
+    assert hits[0][0].page_content == "b-7"
+    assert all(doc.page_content != "a-0" for doc, _ in store.similarity_search_by_vector_with_relevance_scores(
+        list(vectors(rng, 1)[0]), k=449))
+    store.close()
+
+
+@pytest.mark.parametrize("index", ["IVF4,SQ8", "BIVF4"])
+def test_index_saved_in_memory_can_be_reopened_with_mmap(tmp_path, index):
+    rng = np.random.default_rng(0)
+    store = open_store(tmp_path, index, mmap=False)
+    add(store, rng, "a", 400)
+    store.close()
+
+    store = open_store(tmp_path, index, mmap=True)
+    added = add(store, rng, "b", 10)
+    store.close()
+    store = open_store(tmp_path, index, mmap=True)
+    assert store.count() == 410
+    assert store.similarity_search_by_vector_with_relevance_scores(list(added[3]), k=1)[0][0].page_content == "b-3"
+    store.close()
@@ -0,0 +1,139 @@
+import asyncio
+from typing import Dict, List
+
+import pytest
+
+from core import history as history_module
+from core.history import HistoryManager
+from helpers.fake_redis import FakeRedis
+from helpers.session_store import ChatTurn, RedisSessionStore
+
+
+class WordTokenizer:
+    def encode(self, text: str, add_special_tokens: bool = False) -> List[str]:
+        return text.split()
+
+
+# "question N" and "answer N" are two words each, plus the chat template overhead
+TURN_TOKENS = 4 + history_module.TURN_OVERHEAD_TOKENS
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = RedisSessionStore(FakeRedis())
+    monkeypatch.setattr(history_module, "session_store", store)
+    return store
+
+
+async def add_turns(store: RedisSessionStore, start: int, stop: int) -> None:
+    await store.append_turns([
+        ChatTurn("s", f"question {idx}", f"answer {idx}", "system", "model", []) for idx in range(start, stop)
+    ])
+
+
+def questions(messages: List[Dict[str, str]]) -> List[str]:
+    return [message["content"] for message in messages if message["role"] == "user"]
+
+
+class Summarizer:
+    """Summarize function that records its inputs and can be held back."""
+
+    def __init__(self):
+        self.calls = []
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def __call__(self, previous_summary: str, turns: List[Dict]) -> str:
+        self.calls.append((previous_summary, [turn["id"] for turn in turns]))
+        await self.release.wait()
+        return f"summary up to {turns[-1]['id']}"
+
+
+def test_newest_turns_within_the_budget_are_kept_in_order(store):
+    manager = HistoryManager(max_tokens=4 * TURN_TOKENS + 2, page_size=3, summarize=False)
+
+    async def run():
+        await add_turns(store, 1, 11)
+        return await manager.load("s", WordTokenizer())
+
+    history = asyncio.run(run())
+    assert questions(history.messages) == [f"question {idx}" for idx in range(7, 11)]
+    assert history.messages[1] == {"role": "assistant", "content": "answer 7"}
+    assert history.num_tokens == 4 * TURN_TOKENS
+    assert history.unsummarized_until == 6
+    assert history.summary is None
+
+
+def test_an_overflowing_history_is_trimmed_to_trim_to_of_the_budget(store):
+    manager = HistoryManager(max_tokens=4 * TURN_TOKENS + 2, page_size=3, trim_to=0.5)
+
+    async def run():
+        await add_turns(store, 1, 11)
+        return await manager.load("s", WordTokenizer())
+
+    history = asyncio.run(run())
+    # Four turns fit, two are cut at once so that the next requests send the same turns
+    assert questions(history.messages) == ["question 9", "question 10"]
+    assert history.num_tokens == 2 * TURN_TOKENS
+    # Turns up to 8 are left for the summary
+    assert history.unsummarized_until == 8
+
+
+def test_summary_updates_run_once_per_session_and_fold_in_new_turns_only(store):
+    manager = HistoryManager(max_tokens=4 * TURN_TOKENS + 2, page_size=3, trim_to=0.5)
+    tokenizer, summarize = WordTokenizer(), Summarizer()
+
+    async def run():
+        await add_turns(store, 1, 11)
+        history = await manager.load("s", tokenizer)
+        summarize.release.clear()
+        manager.schedule_summary_update("s", history, tokenizer, summarize)
+        manager.schedule_summary_update("s", history, tokenizer, summarize)
+        await asyncio.sleep(0.01)
+        summarize.release.set()
+        await asyncio.gather(*manager._tasks)
+        summarized = await manager.load("s", tokenizer)
+
+        await add_turns(store, 11, 16)
+        history = await manager.load("s", tokenizer)
+        manager.schedule_summary_update("s", history, tokenizer, summarize)
+        await asyncio.gather(*manager._tasks)
+        return summarized, await store.get_summary("s")
+
+    summarized, summary_row = asyncio.run(run())
+    assert summarize.calls == [
+        ("", [1, 2, 3, 4, 5, 6, 7, 8]),
+        ("summary up to 8", [9, 10, 11, 12, 13, 14]),
+    ]
+    assert summarized.summary == "summary up to 8"
+    assert questions(summarized.messages) == ["question 9", "question 10"]
+    assert summarized.num_tokens == 4 + 2 * TURN_TOKENS
+    assert summarized.unsummarized_until is None
+    assert summary_row["summary"] == "summary up to 14"
+    assert summary_row["summarized_until"] == 14
+
+
+def test_a_long_backlog_is_summarized_over_several_updates(store):
+    manager = HistoryManager(max_tokens=TURN_TOKENS, summary_input_tokens=2 * TURN_TOKENS + 1)
+    tokenizer, summarize = WordTokenizer(), Summarizer()
+
+    async def run():
+        await add_turns(store, 1, 8)
+        for _ in range(2):
+            history = await manager.load("s", tokenizer)
+            manager.schedule_summary_update("s", history, tokenizer, summarize)
+            await asyncio.gather(*manager._tasks)
+
+    asyncio.run(run())
+    assert summarize.calls == [("", [1, 2]), ("summary up to 2", [3, 4])]
+
+
+def test_has_history_sees_turns(store):
+    manager = HistoryManager()
+
+    async def run():
+        before = await manager.has_history("s")
+        await add_turns(store, 1, 2)
+        return before, await manager.has_history("s"), await manager.has_history(None)
+
+    assert asyncio.run(run()) == (False, True, False)
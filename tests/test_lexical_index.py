@@ -0,0 +1,73 @@
+import os
+
+from helpers.lexical_index import BM25Index, tokenize
+
+
+def test_identifiers_are_indexed_whole_and_by_parts():
+    assert tokenize("See AB-1234.5 and clause_7/2") == [
+        "see", "ab-1234.5", "ab", "1234", "5", "and", "clause_7/2", "clause", "7", "2",
+    ]
+
+
+def test_search_ranks_matches_and_filters_by_file(tmp_path):
+    index = BM25Index(str(tmp_path / "index.pkl"))
+    index.add(
+        ["a", "b", "c"],
+        ["invoice total due in march", "march weather report", "invoice AB-1234 paid"],
+        [1, 2, 3],
+    )
+    results = index.search("invoice march")
+    # Only "a" matches both terms
+    assert results[0][0] == "a" and {chunk_id for chunk_id, _ in results} == {"a", "b", "c"}
+    assert [chunk_id for chunk_id, _ in index.search("invoice march", k=1)] == ["a"]
+    assert {chunk_id for chunk_id, _ in index.search("invoice march", file_ids=[2, 3])} == {"b", "c"}
+    assert [chunk_id for chunk_id, _ in index.search("ab-1234")] == ["c"]
+    assert index.search("nothing") == []
+
+
+def test_re_added_and_removed_chunks_leave_the_results(tmp_path):
+    index = BM25Index(str(tmp_path / "index.pkl"))
+    index.add(["a", "b", "c"], ["apple pie", "apple tart", "pear tart"], [1, 1, 2])
+    index.add(["a"], ["cherry pie"], [1])
+    assert len(index) == 3
+    assert [chunk_id for chunk_id, _ in index.search("apple")] == ["b"]
+    index.remove(["b", "missing"])
+    assert index.search("apple") == []
+    index.remove_file(2)
+    assert index.chunk_id_set() == {"a"}
+    assert index.search("tart") == []
+
+
+def test_compaction_and_flush_round_trip(tmp_path):
+    path = str(tmp_path / "lexical" / "index.pkl")
+    index = BM25Index(path)
+    ids = [f"chunk-{idx}" for idx in range(2000)]
+    index.add(ids, [f"common word{idx} file{idx % 4}" for idx in range(2000)], [idx % 4 for idx in range(2000)])
+    index.remove(ids[:1200])
+    # More than half tombstoned: the arrays only hold live documents from now on
+    assert len(index.chunk_ids) == 800
+    assert index.positions == {chunk_id: doc for doc, chunk_id in enumerate(ids[1200:])}
+    assert all(len(docs) == len(tfs) <= 800 for docs, tfs in index.postings.values())
+    index.add(["late"], ["common word1999 late"], [9])
+
+    index.flush()
+    reloaded = BM25Index.load(path)
+    assert len(reloaded) == 801
+    assert reloaded.chunk_id_set() == set(ids[1200:]) | {"late"}
+    for query, file_ids in [("word1999", None), ("common file1", [1]), ("word5", None), ("late", [9])]:
+        assert reloaded.search(query, file_ids=file_ids) == index.search(query, file_ids=file_ids)
+    assert reloaded.search("word5") == []
+
+
+def test_flush_writes_only_changes_and_respects_the_interval(tmp_path):
+    path = str(tmp_path / "index.pkl")
+    index = BM25Index(path)
+    index.flush()
+    assert not os.path.exists(path)
+    index.add(["a"], ["apple"], [1])
+    index.flush()
+    index.add(["b"], ["banana"], [1])
+    index.flush(min_interval=3600)
+    assert BM25Index.load(path).chunk_id_set() == {"a"}
+    index.flush()
+    assert BM25Index.load(path).chunk_id_set() == {"a", "b"}
@@ -0,0 +1,123 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from core.fake_engine import FakeModelLoader
+from core.model_manager import EVICTED, FAILED, LOADED, UNLOADED, ModelLoadError, ModelManager
+
+
+def manager(loader, memory=None, **kwargs):
+    memory = memory or {"a": 0.4, "b": 0.4}
+    configs = {name: SimpleNamespace(name=name, gpu_memory_utilization=fraction) for name, fraction in memory.items()}
+    return ModelManager(configs, loader.load, loader.unload, loader.free_memory, **kwargs)
+
+
+def test_concurrent_requests_wait_for_one_load():
+    async def run():
+        loader = FakeModelLoader(load_seconds=0.05)
+        models = manager(loader)
+        assert models.models["a"].state == UNLOADED
+        acquired = await asyncio.gather(*(models.acquire("a") for _ in range(4)))
+        assert all(model.engine is acquired[0].engine is not None for model in acquired)
+        assert loader.loads == ["a"]
+        assert models.models["a"].state == LOADED
+        assert models.models["a"].in_flight == 4
+        for _ in acquired:
+            models.release("a")
+        assert models.models["a"].in_flight == 0
+
+    asyncio.run(run())
+
+
+def test_model_in_use_is_not_evicted():
+    async def run():
+        loader = FakeModelLoader()
+        models = manager(loader)
+        await models.acquire("a")
+        assert not await models.evict("a")
+        models.release("a")
+        assert await models.evict("a")
+        assert models.models["a"].state == EVICTED
+        assert models.models["a"].engine is None
+        assert loader.free_memory() == pytest.approx(1.0)
+
+        # An evicted model is loaded again on its next request
+        await models.acquire("a")
+        models.release("a")
+        assert loader.loads == ["a", "a"]
+        assert models.models["a"].loads == 2
+        assert models.models["a"].evictions == 1
+
+    asyncio.run(run())
+
+
+def test_idle_models_are_evicted_after_ttl():
+    async def run():
+        loader = FakeModelLoader()
+        models = manager(loader, idle_ttl=0)
+        await models.acquire("a")
+        await models.acquire("b")
+        models.release("b")
+        assert await models.evict_idle() == ["b"]
+        assert models.models["a"].state == LOADED
+        models.release("a")
+        assert await models.evict_idle() == ["a"]
+
+    asyncio.run(run())
+
+
+def test_least_recently_used_idle_model_makes_room_for_a_load():
+    async def run():
+        loader = FakeModelLoader()
+        models = manager(loader, memory={"a": 0.4, "b": 0.4, "c": 0.4}, idle_ttl=None)
+        for name in ("a", "b"):
+            await models.acquire(name)
+            models.release(name)
+        await models.acquire("c")
+        models.release("c")
+        assert models.models["a"].state == EVICTED
+        assert models.models["b"].state == LOADED
+        assert models.models["c"].state == LOADED
+
+        # A model in use stays loaded even when memory is short
+        await models.acquire("b")
+        await models.acquire("a")
+        assert models.models["b"].state == LOADED
+        assert models.models["c"].state == EVICTED
+
+    asyncio.run(run())
+
+
+def test_failed_load_releases_the_request():
+    def load(config):
+        raise RuntimeError("out of memory")
+
+    async def run():
+        models = ModelManager({"a": SimpleNamespace(name="a")}, load)
+        with pytest.raises(ModelLoadError):
+            await models.acquire("a")
+        assert models.models["a"].state == FAILED
+        assert models.models["a"].error == "out of memory"
+        assert models.models["a"].in_flight == 0
+        with pytest.raises(KeyError):
+            await models.acquire("missing")
+
+    asyncio.run(run())
+
+
+def test_track_releases_when_the_stream_is_closed():
+    async def tokens():
+        for token in ("a", "b", "c"):
+            yield token
+
+    async def run():
+        models = manager(FakeModelLoader())
+        await models.acquire("a")
+        stream = models.track("a", tokens())
+        assert await stream.__anext__() == "a"
+        assert models.models["a"].in_flight == 1
+        await stream.aclose()
+        assert models.models["a"].in_flight == 0
+
+    asyncio.run(run())
@@ -0,0 +1,134 @@
+import asyncio
+import time
+from typing import List
+
+import pytest
+from langchain_core.documents import Document
+
+from core.retrieval import RetrievalBatcher, StageTimings
+
+
+class FakeRetriever:
+    def __init__(self, fail: bool = False):
+        self.timings = StageTimings()
+        self.fail = fail
+        self.batches = []
+
+    async def retrieve_batch(self, queries, embeddings, tenants, file_ids):
+        self.batches.append((list(queries), list(tenants), list(file_ids)))
+        if self.fail:
+            raise RuntimeError("search failed")
+        return [[(Document(page_content=f"{tenant}: {query}"), 1.0)] for query, tenant in zip(queries, tenants)]
+
+
+class RecordingEmbed:
+    def __init__(self, seconds: float = 0.0):
+        self.seconds = seconds
+        self.calls: List[List[str]] = []
+
+    def __call__(self, texts: List[str]) -> List[List[float]]:
+        self.calls.append(list(texts))
+        time.sleep(self.seconds)
+        return [[float(len(text))] for text in texts]
+
+
+def test_concurrent_requests_share_one_embedding_call_and_search():
+    retriever, embed = FakeRetriever(), RecordingEmbed()
+    batcher = RetrievalBatcher(retriever, embed, max_wait_ms=50)
+
+    async def run():
+        try:
+            return await asyncio.gather(
+                batcher.retrieve("a", tenant="t1"),
+                batcher.retrieve("bb", tenant="t2", file_ids=[3, 4]),
+                batcher.retrieve_many(["ccc", "dddd"], tenant="t1"),
+            )
+        finally:
+            await batcher.stop()
+
+    single_a, single_b, many = asyncio.run(run())
+    assert embed.calls == [["a", "bb", "ccc", "dddd"]]
+    assert retriever.batches == [(["a", "bb", "ccc", "dddd"], ["t1", "t2", "t1", "t1"], [None, (3, 4), None, None])]
+    assert single_a == ([1.0], [(Document(page_content="t1: a"), 1.0)])
+    assert single_b[1][0][0].page_content == "t2: bb"
+    assert [embedding for embedding, _ in many] == [[3.0], [4.0]]
+    assert batcher.stats() == {
+        "batches": 1, "queries": 4, "avg_batch_size": 4.0, "max_batch_size": 4, "queue_depth": 0,
+    }
+
+
+def test_a_lone_request_waits_at_most_max_wait():
+    embed = RecordingEmbed()
+    batcher = RetrievalBatcher(FakeRetriever(), embed, max_wait_ms=50)
+
+    async def run():
+        try:
+            start = time.perf_counter()
+            await batcher.retrieve("first")
+            first = time.perf_counter() - start
+            await asyncio.sleep(0.1)
+            await batcher.retrieve("second")
+            return first
+        finally:
+            await batcher.stop()
+
+    first = asyncio.run(run())
+    assert 0.04 <= first < 0.5
+    assert embed.calls == [["first"], ["second"]]
+
+
+def test_batches_are_capped_and_requests_queued_meanwhile_form_the_next_one():
+    # Every embedding call takes longer than max_wait, requests arriving during one are batched next
+    embed = RecordingEmbed(seconds=0.05)
+    batcher = RetrievalBatcher(FakeRetriever(), embed, max_batch_size=4, max_wait_ms=5)
+
+    async def run():
+        try:
+            first = asyncio.ensure_future(batcher.retrieve_many([f"q{idx}" for idx in range(6)]))
+            await asyncio.sleep(0.02)
+            second = asyncio.ensure_future(batcher.retrieve_many(["late 0", "late 1"]))
+            await asyncio.gather(first, second)
+        finally:
+            await batcher.stop()
+
+    asyncio.run(run())
+    assert embed.calls == [["q0", "q1", "q2", "q3"], ["q4", "q5", "late 0", "late 1"]]
+    assert batcher.stats()["max_batch_size"] == 4
+
+
+def test_a_failed_batch_fails_its_callers_only():
+    retriever = FakeRetriever(fail=True)
+    batcher = RetrievalBatcher(retriever, RecordingEmbed(), max_wait_ms=20)
+
+    async def run():
+        try:
+            results = await asyncio.gather(batcher.retrieve("a"), batcher.retrieve("b"), return_exceptions=True)
+            retriever.fail = False
+            return results, await batcher.retrieve("c")
+        finally:
+            await batcher.stop()
+
+    results, later = asyncio.run(run())
+    assert [str(result) for result in results] == ["search failed", "search failed"]
+    assert later[1][0][0].page_content == "default: c"
+    assert batcher.stats()["batches"] == 1
+
+
+def test_cancelled_callers_are_not_searched_for():
+    retriever, embed = FakeRetriever(), RecordingEmbed()
+    batcher = RetrievalBatcher(retriever, embed, max_wait_ms=50)
+
+    async def run():
+        try:
+            gone = asyncio.ensure_future(batcher.retrieve("gone"))
+            kept = asyncio.ensure_future(batcher.retrieve("kept"))
+            await asyncio.sleep(0)
+            gone.cancel()
+            await kept
+            with pytest.raises(asyncio.CancelledError):
+                await gone
+        finally:
+            await batcher.stop()
+
+    asyncio.run(run())
+    assert embed.calls == [["kept"]]
@@ -0,0 +1,116 @@
+import asyncio
+
+import pytest
+
+from helpers import db_utils
+from helpers.fake_redis import FakeRedis
+from helpers.session_store import ChatTurn, RedisSessionStore, SQLiteSessionStore
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def run_with_store(request, tmp_path, monkeypatch):
+    """Run `test(store)` against a fresh store of each backend, the Redis one backed by FakeRedis."""
+    def run(test):
+        async def main():
+            if request.param == "sqlite":
+                pool = db_utils.ConnectionPool(db_file=str(tmp_path / "logs.db"), size=2)
+                monkeypatch.setattr(db_utils, "db_pool", pool)
+                await db_utils.initialize_db()
+                store = SQLiteSessionStore()
+            else:
+                pool = None
+                store = RedisSessionStore(FakeRedis())
+            await store.open()
+            try:
+                await test(store)
+            finally:
+                await store.close()
+                if pool is not None:
+                    await pool.close()
+
+        asyncio.run(main())
+
+    return run
+
+
+def turn(session_id: str, idx: int) -> ChatTurn:
+    return ChatTurn(session_id, f"question {idx}", f"answer {idx}", "system", "model", [f"chunk-{idx}"])
+
+
+def test_append_keeps_turns_in_order(run_with_store):
+    async def test(store):
+        await store.append_turns([turn("a", 0), turn("b", 0), turn("a", 1)])
+        await store.append_turns([turn("a", 2)])
+        turns = await store.get_turns_range("a", 0, 2 ** 62)
+        assert [t["user_query"] for t in turns] == ["question 0", "question 1", "question 2"]
+        assert turns[0]["id"] < turns[1]["id"] < turns[2]["id"]
+        assert await store.get_chat_history("a") == [
+            message
+            for idx in range(3)
+            for message in ({"role": "user", "content": f"question {idx}"},
+                            {"role": "assistant", "content": f"answer {idx}"})
+        ]
+        assert len(await store.get_chat_history("b")) == 2
+
+    run_with_store(test)
+
+
+def test_recent_turns_page_backwards(run_with_store):
+    async def test(store):
+        await store.append_turns([turn("a", idx) for idx in range(10)])
+        page = await store.get_recent_turns("a", limit=4)
+        assert [t["user_query"] for t in page] == [f"question {idx}" for idx in (9, 8, 7, 6)]
+        older = await store.get_recent_turns("a", before_id=page[-1]["id"], limit=4)
+        assert [t["user_query"] for t in older] == [f"question {idx}" for idx in (5, 4, 3, 2)]
+        newer = await store.get_recent_turns("a", after_id=older[0]["id"], before_id=page[-1]["id"])
+        assert newer == []
+        rest = await store.get_recent_turns("a", after_id=page[1]["id"])
+        assert [t["user_query"] for t in rest] == ["question 9"]
+
+    run_with_store(test)
+
+
+def test_summaries_are_upserted(run_with_store):
+    async def test(store):
+        assert await store.get_summary("a") is None
+        await store.upsert_summary("a", "first", 3)
+        await store.upsert_summary("a", "second", 5)
+        assert await store.get_summary("a") == {"summary": "second", "summarized_until": 5}
+
+    run_with_store(test)
+
+
+def test_sessions_are_listed_with_their_first_message(run_with_store):
+    async def test(store):
+        assert await store.get_all_sessions() == []
+        await store.append_turns([turn("a", 0), turn("b", 5)])
+        await store.append_turns([turn("a", 1)])
+        sessions = await store.get_all_sessions()
+        assert {s["session_id"]: s["first_message"] for s in sessions} == {"a": "question 0", "b": "question 5"}
+        assert all(s["started_at"] for s in sessions)
+
+    run_with_store(test)
+
+
+def test_deleted_session_is_gone(run_with_store):
+    async def test(store):
+        await store.append_turns([turn("a", 0), turn("b", 0)])
+        await store.upsert_summary("a", "summary", 1)
+        assert await store.delete_session("a")
+        assert [s["session_id"] for s in await store.get_all_sessions()] == ["b"]
+        assert await store.get_chat_history("a") == []
+        assert await store.get_recent_turns("a") == []
+        assert await store.get_summary("a") is None
+        assert len(await store.get_chat_history("b")) == 2
+
+    run_with_store(test)
+
+
+def test_redis_store_keeps_the_newest_turns():
+    async def test():
+        store = RedisSessionStore(FakeRedis(), max_turns=3)
+        await store.append_turns([turn("a", idx) for idx in range(5)])
+        turns = await store.get_recent_turns("a", limit=10)
+        assert [t["user_query"] for t in turns] == [f"question {idx}" for idx in (4, 3, 2)]
+
+    asyncio.run(test())
@@ -0,0 +1,86 @@
+import asyncio
+import json
+from typing import List
+
+from core.answer_cache import ReplayedCompletion, ReplayedRequestOutput
+from core.fake_engine import FakeEngine
+from core.streaming import SSEStream
+
+
+class Outputs:
+    """Engine outputs carrying `deltas`, `delay` seconds apart, the last one finished."""
+
+    def __init__(self, deltas: List[str], delay: float = 0.0):
+        self.deltas = deltas
+        self.delay = delay
+        self.closed = False
+
+    async def generate(self):
+        try:
+            for idx, delta in enumerate(self.deltas):
+                await asyncio.sleep(self.delay)
+                yield ReplayedRequestOutput(
+                    outputs=[ReplayedCompletion(text=delta)], finished=idx == len(self.deltas) - 1
+                )
+        finally:
+            self.closed = True
+
+
+def tokens(frames: List[str]) -> List[str]:
+    return [json.loads(frame[len("data: "):])["token"] for frame in frames]
+
+
+async def collect(stream: SSEStream, outputs) -> List[str]:
+    return [frame async for frame in stream.frames(outputs)]
+
+
+def test_frames_match_json_dumps_of_the_token():
+    session_id = 'session "1"'
+    stream = SSEStream(session_id)
+    for token in ["plain", 'quote " and \\ backslash', "line\nbreak", "unicode é ✓"]:
+        assert stream.frame(token) == f"data: {json.dumps({'token': token, 'session_id': session_id})}\n\n"
+    assert stream.num_frames == 4
+
+
+def test_deltas_are_coalesced_up_to_coalesce_chars():
+    stream = SSEStream("s", coalesce_ms=10_000, coalesce_chars=10)
+    deltas = ["abc", "def", "ghij", "", "kl", "mnopqrstu", "vw"]
+    frames = asyncio.run(collect(stream, Outputs(deltas).generate()))
+    # Empty deltas add nothing, the tail is flushed when the generation ends
+    assert tokens(frames) == ["abcdefghij", "klmnopqrstu", "vw"]
+    assert stream.text == "".join(deltas)
+    assert stream.finished
+    assert stream.num_frames == 3
+
+
+def test_deltas_are_flushed_once_coalesce_ms_passed():
+    stream = SSEStream("s", coalesce_ms=30, coalesce_chars=1000)
+    frames = asyncio.run(collect(stream, Outputs(list("abcdefgh"), delay=0.02).generate()))
+    # Deltas are at least 20 ms apart, so a frame holds the first delta of the window and at most two more
+    assert "".join(tokens(frames)) == "abcdefgh"
+    assert all(len(token) <= 3 for token in tokens(frames))
+    assert len(frames) < 8
+
+
+def test_without_coalescing_every_delta_is_a_frame():
+    stream = SSEStream("s", coalesce_ms=0, coalesce_chars=0)
+    engine = FakeEngine(num_tokens=5, tokens_per_second=0)
+    frames = asyncio.run(collect(stream, engine.generate(prompt="")))
+    assert tokens(frames) == ["The ", "answer ", "is ", "in ", "the "]
+    assert stream.text == "The answer is in the "
+
+
+def test_closing_the_frames_early_closes_the_engine_stream():
+    outputs = Outputs(["a", "b", "c", "d"])
+    stream = SSEStream("s", coalesce_ms=0, coalesce_chars=0)
+
+    async def run():
+        frames = stream.frames(outputs.generate())
+        first = await frames.__anext__()
+        await frames.aclose()
+        return first
+
+    assert tokens([asyncio.run(run())]) == ["a"]
+    assert outputs.closed
+    assert not stream.finished
+    assert stream.text == "a"